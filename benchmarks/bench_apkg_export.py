@@ -0,0 +1,57 @@
+"""Measure .apkg export throughput.
+
+Usage: python -m benchmarks.bench_apkg_export [--notes 10000] [--audio-bytes 16384]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from kioku.models import CardItem
+from kioku.services.apkg_writer import write_apkg
+from kioku.utils import audio_filename
+
+
+def make_cards(count: int) -> list[CardItem]:
+    return [
+        CardItem(
+            japanese=f"単語{i}",
+            reading=f"たんご{i}",
+            meaning=f"word {i}",
+            example_sentence=f"これは単語{i}の例文です。",
+            example_translation=f"This is an example sentence for word {i}.",
+        )
+        for i in range(count)
+    ]
+
+
+def iter_media(cards: list[CardItem], audio_bytes: int):
+    payload = os.urandom(audio_bytes)
+    for card in cards:
+        yield audio_filename(card.japanese, "word"), payload
+        yield audio_filename(card.example_sentence, "sentence"), payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notes", type=int, default=10_000)
+    parser.add_argument("--audio-bytes", type=int, default=16 * 1024)
+    args = parser.parse_args()
+
+    cards = make_cards(args.notes)
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "bench.apkg")
+        started = time.perf_counter()
+        count = write_apkg(out, cards, iter_media(cards, args.audio_bytes), "Benchmark")
+        elapsed = time.perf_counter() - started
+        size_mb = os.path.getsize(out) / 1e6
+
+    print(
+        f"{count} notes, {2 * count} media files, {size_mb:.1f} MB in {elapsed:.2f}s "
+        f"-> {count / elapsed:,.0f} notes/sec"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Measure peak memory of a generate request as the number of cards grows.
+
+Usage: python -m benchmarks.bench_generate_memory [--cards 50 100 200] [--wav-bytes 204800]
+
+VOICEVOX's HTTP calls (``_synthesize``) and AnkiConnect are replaced by
+in-process fakes that return a fresh WAV per text and read every upload to
+the end. Everything above them runs for real, including the TTS cache, so
+what is measured is the audio Kioku itself holds between synthesis and the
+last storeMediaFile. Each size runs once with the default AUDIO_MEMORY_BYTES
+budget and once with the budget lifted, which is how the pipeline behaved
+before audio could spill to disk. Peak memory is reported as the traced
+Python allocation peak and as the rise in RSS over the run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+from benchmarks import fixtures
+from kioku import cache, pipeline
+from kioku.audio_spool import DEFAULT_AUDIO_MEMORY_BYTES
+from kioku.models import GenerateRequest
+from kioku.services import anki_builder, audio_generator
+
+UNBOUNDED = str(2**62)
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler:
+    """Samples RSS from a thread and keeps the highest value seen."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+class FakeResponse:
+    def __init__(self, result):
+        self._body = json.dumps({"result": result, "error": None}).encode()
+
+    def read(self) -> bytes:
+        return self._body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def fake_urlopen(request):
+    data = request.data
+    if isinstance(data, bytes):
+        body = json.loads(data)
+        action, params = body["action"], body["params"]
+    else:
+        # A streamed storeMediaFile: read it to the end like the socket would
+        for _ in data:
+            pass
+        action, params = "storeMediaFile", {}
+    results = {
+        "deckNames": ["Benchmark"],
+        "modelNames": [anki_builder.MODEL_NAME],
+        "getMediaFilesNames": [],
+        "canAddNotes": [True] * len(params.get("notes", [])),
+        "addNote": 1,
+    }
+    return FakeResponse(results.get(action))
+
+
+def measure(cards: int, wav_bytes: int, budget: str) -> dict:
+    template = fixtures.wav_bytes(wav_bytes)
+    request = GenerateRequest(cards=fixtures.make_cards(cards), deck_name="Benchmark")
+
+    async def fake_synthesize(text, base_url, speaker, speed):
+        # A new object per call, as a real VOICEVOX response would be
+        return bytes(bytearray(template))
+
+    os.environ["AUDIO_MEMORY_BYTES"] = budget
+    anki_builder.invalidate_cache()
+    anki_builder.clear_media_index()
+    cache.reset()
+    with mock.patch.object(audio_generator, "_synthesize", fake_synthesize), mock.patch(
+        "urllib.request.urlopen", fake_urlopen
+    ), mock.patch.object(pipeline.sync_scheduler, "request"):
+        tracemalloc.start()
+        before = rss_bytes()
+        started = time.perf_counter()
+        with RssSampler() as sampler:
+            result = asyncio.run(pipeline.run_generate(request))
+        elapsed = time.perf_counter() - started
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    assert result["added"] == cards, result
+    return {
+        "cards": cards,
+        "audio_mb": 2 * cards * wav_bytes / 1e6,
+        "traced_peak_mb": traced_peak / 1e6,
+        "rss_rise_mb": (sampler.peak - before) / 1e6,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--wav-bytes", type=int, default=200 * 1024)
+    args = parser.parse_args()
+
+    budget = os.environ.get("AUDIO_MEMORY_BYTES", DEFAULT_AUDIO_MEMORY_BYTES)
+    with tempfile.TemporaryDirectory() as data:
+        os.environ["KIOKU_DATA_DIR"] = data
+        print(
+            f"{'budget':<12}{'cards':>6}{'audio MB':>10}{'traced MB':>11}"
+            f"{'RSS rise MB':>13}{'seconds':>9}"
+        )
+        # Unbounded last, so its RSS growth does not hide the bounded runs'
+        for label, value in ((f"{int(budget) / 2**20:.0f} MiB", budget), ("unbounded", UNBOUNDED)):
+            for cards in args.cards:
+                row = measure(cards, args.wav_bytes, value)
+                print(
+                    f"{label:<12}{row['cards']:>6}{row['audio_mb']:>10.1f}"
+                    f"{row['traced_peak_mb']:>11.1f}{row['rss_rise_mb']:>13.1f}"
+                    f"{row['seconds']:>9.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
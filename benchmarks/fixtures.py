@@ -0,0 +1,71 @@
+"""Realistic, deterministic inputs for the hot-path benchmarks."""
+
+import io
+import json
+import random
+import struct
+
+from PIL import Image, ImageDraw
+
+from kioku.models import CardItem
+
+_WORDS = [
+    ("元気", "げんき", "healthy; energetic"),
+    ("勉強", "べんきょう", "study"),
+    ("電車", "でんしゃ", "train"),
+    ("約束", "やくそく", "promise"),
+    ("図書館", "としょかん", "library"),
+    ("天気", "てんき", "weather"),
+    ("友達", "ともだち", "friend"),
+    ("忘れる", "わすれる", "to forget"),
+]
+
+
+def screenshot_png(width: int = 2560, height: int = 1440, seed: int = 0) -> bytes:
+    """A large PNG shaped like a manga/anime screenshot: gradients, panels and noise."""
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(80, 600), rng.randrange(40, 300)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((x, y, x + w, y + h), fill=colour, outline=(0, 0, 0), width=4)
+    # A band of noise stands in for artwork, which is what keeps real screenshots large
+    noise = Image.effect_noise((width, height // 4), 90).convert("RGB")
+    image.paste(noise, (0, height // 2))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def make_cards(count: int, repeat_every: int = 0) -> list[CardItem]:
+    """Cards with realistic field lengths; every ``repeat_every``-th card repeats an earlier one."""
+    cards = []
+    for i in range(count):
+        n = i // 2 if repeat_every and i % repeat_every == 0 else i
+        word, reading, meaning = _WORDS[n % len(_WORDS)]
+        cards.append(
+            CardItem(
+                japanese=f"{word}{n}",
+                reading=f"{reading}{n}",
+                meaning=meaning,
+                example_sentence=f"今日は{word}について話しましょう。その{n}番目の例文です。",
+                example_translation=f"Let's talk about {meaning} today. This is example {n}.",
+            )
+        )
+    return cards
+
+
+def llm_response(count: int = 100) -> str:
+    """A Groq-style answer: a fenced JSON array of ``count`` entries, pretty-printed."""
+    entries = [card.model_dump() for card in make_cards(count)]
+    return "```json\n" + json.dumps(entries, ensure_ascii=False, indent=2) + "\n```"
+
+
+def wav_bytes(size: int, seed: int = 0) -> bytes:
+    """A mono 24 kHz 16-bit WAV (VOICEVOX's format) of about ``size`` bytes."""
+    data = random.Random(seed).randbytes(size - 44)
+    header = b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE"
+    fmt = b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, 24000, 48000, 2, 16)
+    return header + fmt + b"data" + struct.pack("<I", len(data)) + data
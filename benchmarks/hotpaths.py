@@ -0,0 +1,257 @@
+"""Microbenchmarks for Kioku's in-process hot paths, checked against a baseline.
+
+Usage:
+    python -m benchmarks.hotpaths [--json results.json] [--threshold 0.5]
+    python -m benchmarks.hotpaths --save-baseline
+
+Each benchmark is timed over several rounds and its median per-call time is
+compared with benchmarks/baseline.json; a single lucky or unlucky round moves
+the median far less than it moves the fastest time. A benchmark that looks
+slower than ``--threshold`` is measured again with ``RETRY_ROUNDS_FACTOR``
+times as many rounds, and the run exits 1 only if that longer run is still
+slow.
+Baselines are machine-specific, so record them on the machine that runs the
+check.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+from benchmarks import fixtures
+from kioku import pipeline
+from kioku.services import anki_builder
+from kioku.services.card_parser import parse_cards
+from kioku.utils import audio_filename
+
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+DEFAULT_THRESHOLD = 0.5
+MIN_ROUND_SECONDS = 0.1
+ROUNDS = 7
+RETRY_ROUNDS_FACTOR = 3
+
+# name -> setup; setup builds the fixtures and returns the callable to time
+BENCHMARKS: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@benchmark("image_decode_2560x1440_png")
+def bench_image_decode():
+    # Same decode ocr_image does before handing the image to Manga OCR
+    data = fixtures.screenshot_png()
+
+    def run():
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image.convert("RGB")
+
+    return run
+
+
+@benchmark("parse_llm_response_100_cards")
+def bench_parse_llm_response():
+    content = fixtures.llm_response(100)
+    return lambda: parse_cards(content)
+
+
+@benchmark("unique_cards_1000")
+def bench_unique_cards():
+    cards = fixtures.make_cards(1000, repeat_every=3)
+    return lambda: anki_builder.unique_cards(cards)
+
+
+@benchmark("audio_filename_1000")
+def bench_audio_filename():
+    texts = [card.example_sentence for card in fixtures.make_cards(1000)]
+    return lambda: [audio_filename(text, "sentence") for text in texts]
+
+
+@benchmark("build_audio_map_200_cards")
+def bench_build_audio_map():
+    cards = fixtures.make_cards(200)
+    wav = fixtures.wav_bytes(64 * 1024)
+
+    loop = asyncio.new_event_loop()
+
+    async def instant_tts(text):
+        return wav
+
+    def run():
+        # VOICEVOX is stubbed out: this measures Kioku's own fan-out overhead
+        with mock.patch.object(pipeline, "generate_audio", instant_tts):
+            loop.run_until_complete(pipeline.build_audio_map(cards)).close()
+
+    return run
+
+
+@benchmark("store_media_base64_10x2mb")
+def bench_store_media():
+    audio_map = {
+        f"{i}_sentence.wav": fixtures.wav_bytes(2 * 1024 * 1024, seed=i) for i in range(10)
+    }
+
+    def fake_post(action, data, length=None):
+        # Consume the body the way the HTTP connection would
+        if not isinstance(data, bytes):
+            for _ in data:
+                pass
+        return [] if action == "getMediaFilesNames" else None
+
+    def run():
+        anki_builder.clear_media_index()
+        with mock.patch.object(anki_builder, "_post", fake_post):
+            anki_builder._store_media(audio_map)
+
+    return run
+
+
+def measure(func: Callable[[], object], rounds: int = ROUNDS) -> dict:
+    """Time ``func`` and return per-call statistics in seconds."""
+    func()  # warm-up
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - started >= MIN_ROUND_SECONDS or number >= 1 << 16:
+            break
+        number *= 2
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "mean": statistics.fmean(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": number,
+    }
+
+
+def run_benchmarks(selected: list[str] | None = None, rounds: int = ROUNDS) -> dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if selected and not any(part in name for part in selected):
+            continue
+        results[name] = measure(setup(), rounds)
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[dict]:
+    """Compare median times with the baseline; each row says whether it regressed."""
+    rows = []
+    for name, stats in results["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        ratio = stats["median"] / base["median"] if base else None
+        rows.append(
+            {
+                "name": name,
+                "median": stats["median"],
+                "baseline": base["median"] if base else None,
+                "ratio": ratio,
+                "regressed": ratio is not None and ratio > 1 + threshold,
+            }
+        )
+    return rows
+
+
+def _format_row(row: dict) -> str:
+    median = f"{row['median'] * 1e3:10.3f} ms"
+    if row["baseline"] is None:
+        return f"{row['name']:<32}{median}   (no baseline)"
+    change = (row["ratio"] - 1) * 100
+    flag = "  REGRESSION" if row["regressed"] else ""
+    baseline = f"{row['baseline'] * 1e3:10.3f} ms"
+    return f"{row['name']:<32}{median}   baseline {baseline}   {change:+6.1f}%{flag}"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-k", dest="select", action="append", help="only run benchmarks whose name contains this"
+    )
+    parser.add_argument("--rounds", type=int, default=ROUNDS)
+    parser.add_argument("--json", type=Path, help="write machine-readable results here")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown (0.5 = 50%%)"
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="record these results as the baseline"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data:
+        # Keep the media index the benchmarks write out of the real data directory
+        os.environ["KIOKU_DATA_DIR"] = data
+        results = run_benchmarks(args.select, args.rounds)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    rows = compare(results, baseline, args.threshold)
+    if not args.save_baseline:
+        for row in rows:
+            if row["regressed"]:
+                # Re-measure over more rounds so one noisy stretch cannot fail the run
+                with tempfile.TemporaryDirectory() as data:
+                    os.environ["KIOKU_DATA_DIR"] = data
+                    rounds = args.rounds * RETRY_ROUNDS_FACTOR
+                    results["benchmarks"][row["name"]] = measure(BENCHMARKS[row["name"]](), rounds)
+        rows = compare(results, baseline, args.threshold)
+    for row in rows:
+        print(_format_row(row))
+
+    results["threshold"] = args.threshold
+    results["comparison"] = rows
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+    if args.save_baseline:
+        saved = {key: results[key] for key in ("created", "machine", "benchmarks")}
+        args.baseline.write_text(json.dumps(saved, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    regressed = [row["name"] for row in rows if row["regressed"]]
+    if regressed:
+        print(
+            f"{len(regressed)} benchmark(s) regressed beyond {args.threshold:.0%}: "
+            + ", ".join(regressed)
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
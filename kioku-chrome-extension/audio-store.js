@@ -0,0 +1,43 @@
+// Captured sentence audio, kept as a Blob in IndexedDB.
+// Runtime messages and chrome.storage only carry JSON, so the recording would
+// otherwise have to travel as base64. IndexedDB stores Blobs as-is and is shared
+// by every extension page (offscreen document, popup) and the service worker.
+// chrome.storage's `pendingAudio` flag marks that a recording is waiting here.
+
+const AUDIO_DB = 'kioku-audio';
+const AUDIO_STORE = 'recordings';
+const PENDING_AUDIO = 'pending';
+
+function openAudioDb() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(AUDIO_DB, 1);
+    request.onupgradeneeded = () => request.result.createObjectStore(AUDIO_STORE);
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+async function audioStoreRequest(mode, operation) {
+  const db = await openAudioDb();
+  try {
+    return await new Promise((resolve, reject) => {
+      const request = operation(db.transaction(AUDIO_STORE, mode).objectStore(AUDIO_STORE));
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
+    });
+  } finally {
+    db.close();
+  }
+}
+
+function savePendingAudio(blob) {
+  return audioStoreRequest('readwrite', store => store.put(blob, PENDING_AUDIO));
+}
+
+async function loadPendingAudio() {
+  return (await audioStoreRequest('readonly', store => store.get(PENDING_AUDIO))) || null;
+}
+
+function clearPendingAudio() {
+  return audioStoreRequest('readwrite', store => store.delete(PENDING_AUDIO));
+}
@@ -1,3 +1,5 @@
+importScripts("audio-store.js");
+
 let audioStreamTabId = null;
 let subtitleEndResolve = null;
 
@@ -10,6 +12,8 @@ chrome.commands.onCommand.addListener((command) => {
 async function handleCapture() {
   const [tab] = await chrome.tabs.query({ active: true, currentWindow: true });
   if (!tab) return;
+  // Open (or keep) the API connection while recording so the requests after it skip the handshake
+  connectSocket().catch(() => {});
 
   const ok = await initStream(tab.id);
   if (!ok) {
@@ -41,8 +45,10 @@ async function handleCapture() {
   const r = await chrome.runtime.sendMessage({ action: "stopRecording" });
   await chrome.tabs.sendMessage(tab.id, { action: "pauseVideo" }).catch(() => {});
 
-  console.log("[Kioku] Storing. audio =", r?.audio ? `${r.audio.length} chars` : "null");
-  await chrome.storage.local.set({ pendingText: text, pendingAudio: r?.audio || null });
+  // The offscreen document has already put the recording in IndexedDB
+  console.log("[Kioku] Storing. audio =", r?.audio ? `${r.size} bytes` : "null");
+  if (!r?.audio) await clearPendingAudio().catch(() => {});
+  await chrome.storage.local.set({ pendingText: text, pendingAudio: Boolean(r?.audio) });
   chrome.tabs.sendMessage(tab.id, { action: "showToast", text: "Captured", isError: false }).catch(() => {});
   chrome.action.openPopup().catch(e => console.log("[Kioku] openPopup:", e.message));
 }
@@ -86,36 +92,260 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
   }
 
   if (message.action === "sendToApi") {
-    getApiUrl().then(apiUrl =>
-      fetch(`${apiUrl}/api/extract-text`, {
-        method: "POST", headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ text: message.text }),
-      })
-      .then(r => r.ok ? r.json() : r.json().then(e => Promise.reject(e.detail || `HTTP ${r.status}`)))
-      .then(async data => {
-        await chrome.storage.local.set({ cards: data.cards || [], timestamp: Date.now() });
-        sendResponse({ cards: data.cards });
-      })
-      .catch(err => sendResponse({ error: String(err) }))
-    );
+    withSocket(
+      () => socketRequest("extract_text", { text: message.text }),
+      () => getApiUrl().then(apiUrl =>
+        fetch(`${apiUrl}/api/extract-text`, {
+          method: "POST", headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ text: message.text }),
+        })
+        .then(r => { logServerTiming("extract-text", r); return r; })
+        .then(r => r.ok ? r.json() : r.json().then(e => Promise.reject(e.detail || `HTTP ${r.status}`)))
+      ),
+    )
+    .then(async data => {
+      // One Idempotency-Key per extraction; resending the same cards reuses the first result
+      await chrome.storage.local.set({
+        cards: data.cards || [], timestamp: Date.now(), generateKey: crypto.randomUUID(),
+      });
+      sendResponse({ cards: data.cards });
+    })
+    .catch(err => sendResponse({ error: String(err) }));
     return true;
   }
 
   if (message.action === "generateCards") {
-    getApiUrl().then(apiUrl =>
-      fetch(`${apiUrl}/api/generate`, {
-        method: "POST", headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          cards: message.cards, deck_name: message.deckName,
-          sentence_audio_b64: message.sentenceAudioB64 || null,
-        }),
-      })
-      .then(r => r.ok ? r.json() : r.json().then(e => Promise.reject(e.detail || `HTTP ${r.status}`)))
-      .then(data => sendResponse({ added: data.added }))
-      .catch(err => sendResponse({ error: String(err) }))
-    );
+    withSocket(
+      () => generateOverSocket(message),
+      // Run as a server-side job so a service worker restart can't lose the work
+      () => Promise.all([getApiUrl(), generateRequestInit(message)]).then(([apiUrl, init]) =>
+        fetch(`${apiUrl}/api/jobs`, init)
+        .then(r => r.ok ? r.json() : r.json().then(e => Promise.reject(e.detail || `HTTP ${r.status}`)))
+        .then(job => waitForJob(apiUrl, job.id))
+      ),
+    )
+    .then(data => sendResponse({ added: data.added, queued: data.queued || 0, skipped: data.skipped || [] }))
+    .catch(err => sendResponse({ error: String(err) }));
     return true;
   }
 });
 
+// ── Persistent API connection ────────────────────────────────────────────────
+//
+// One WebSocket to /ws carries every request of a viewing session: replies are
+// matched to requests by id, generate streams its stage progress, heartbeats
+// keep the service worker alive, and the server pushes "cards_added" events
+// (including notes delivered later from its outbox). The HTTP endpoints remain
+// the fallback whenever the socket can't be opened.
+
+const SESSION_IDLE_MS = 30 * 60 * 1000;   // stop reconnecting after this long without a request
+const RECONNECT_MAX_MS = 30000;
+
+class SocketUnavailable extends Error {}
+
+const socket = {
+  ws: null,
+  ready: null,             // resolves once the server's hello arrives; null when closed
+  pending: new Map(),      // request id → { resolve, reject, onProgress, label }
+  lastUsed: 0,
+  retryDelay: 1000,
+  retryTimer: null,
+  watchdog: null,
+  heartbeatMs: 20000,
+};
+
+function connectSocket() {
+  socket.lastUsed = Date.now();
+  if (!socket.ready) {
+    clearTimeout(socket.retryTimer);
+    socket.ready = openSocket();
+    socket.ready.catch(() => {});
+  }
+  return socket.ready;
+}
+
+async function openSocket() {
+  const apiUrl = await getApiUrl();
+  let ws;
+  try {
+    ws = new WebSocket(`${apiUrl.replace(/^http/, "ws")}/ws`);
+  } catch (err) {
+    throw new SocketUnavailable(err.message);
+  }
+  ws.binaryType = "arraybuffer";
+  socket.ws = ws;
+  return new Promise((resolve, reject) => {
+    ws.addEventListener("message", event => {
+      const message = JSON.parse(event.data);
+      armWatchdog(ws);
+      if (message.type === "hello") {
+        socket.heartbeatMs = message.heartbeat_interval * 1000;
+        socket.retryDelay = 1000;
+        resolve();
+      }
+      onSocketMessage(message);
+    });
+    ws.addEventListener("close", () => {
+      reject(new SocketUnavailable("Kioku connection closed"));
+      onSocketClosed(ws);
+    });
+  });
+}
+
+// Close a connection that has gone quiet for more than two heartbeats
+function armWatchdog(ws) {
+  clearTimeout(socket.watchdog);
+  socket.watchdog = setTimeout(() => ws.close(), socket.heartbeatMs * 2.5);
+}
+
+function onSocketClosed(ws) {
+  if (socket.ws !== ws) return;
+  clearTimeout(socket.watchdog);
+  socket.ws = null;
+  socket.ready = null;
+  for (const request of socket.pending.values()) {
+    request.reject(new SocketUnavailable("Kioku connection lost"));
+  }
+  socket.pending.clear();
+  // Reconnect with backoff while the viewing session is still going
+  if (Date.now() - socket.lastUsed < SESSION_IDLE_MS) {
+    socket.retryTimer = setTimeout(() => connectSocket().catch(() => {}), socket.retryDelay);
+    socket.retryDelay = Math.min(socket.retryDelay * 2, RECONNECT_MAX_MS);
+  }
+}
+
+function onSocketMessage(message) {
+  if (message.type === "event") {
+    if (message.event === "cards_added") notifyCardsAdded(message);
+    return;
+  }
+  const request = socket.pending.get(message.id);
+  if (!request) return;
+  if (message.type === "progress") {
+    request.onProgress?.(message);
+    return;
+  }
+  socket.pending.delete(message.id);
+  if (message.type === "result") {
+    logTimings(request.label, message.trace_id, message.server_timing);
+    request.resolve(message.data);
+  } else if (message.type === "error") {
+    request.reject(typeof message.detail === "string" ? message.detail : JSON.stringify(message.detail));
+  } else {
+    request.reject("Request cancelled");
+  }
+}
+
+// Send one request; audio bytes go in a binary frame after the JSON header
+async function socketRequest(type, fields, { audio = null, onProgress = null } = {}) {
+  await connectSocket();
+  const id = crypto.randomUUID();
+  const header = { ...fields, type, id };
+  const reply = new Promise((resolve, reject) => {
+    socket.pending.set(id, { resolve, reject, onProgress, label: type });
+  });
+  socket.ws.send(audio ? packFrame(header, audio) : JSON.stringify(header));
+  return reply;
+}
+
+// 4-byte big-endian header length, the JSON header, then the raw bytes
+function packFrame(header, payload) {
+  const encoded = new TextEncoder().encode(JSON.stringify(header));
+  const frame = new Uint8Array(4 + encoded.length + payload.length);
+  new DataView(frame.buffer).setUint32(0, encoded.length);
+  frame.set(encoded, 4);
+  frame.set(payload, 4 + encoded.length);
+  return frame;
+}
+
+// Try the socket; if the connection dropped, resend once (generate carries an
+// idempotency key, so a resend attaches to the first run), then fall back to HTTP
+async function withSocket(viaSocket, viaHttp) {
+  for (let attempt = 0; attempt < 2; attempt++) {
+    try {
+      return await viaSocket();
+    } catch (err) {
+      if (!(err instanceof SocketUnavailable)) throw err;
+      console.log("[Kioku] socket unavailable:", err.message);
+    }
+  }
+  return viaHttp();
+}
+
+async function generateOverSocket(message) {
+  const fields = {
+    cards: message.cards, deck_name: message.deckName, idempotency_key: await currentGenerateKey(),
+  };
+  const recording = message.sentenceAudio ? await loadPendingAudio() : null;
+  const audio = recording ? new Uint8Array(await recording.arrayBuffer()) : null;
+  return socketRequest("generate", fields, {
+    audio,
+    onProgress: ({ stage, done, total }) =>
+      chrome.runtime.sendMessage({ action: "generateProgress", stage, done, total }).catch(() => {}),
+  });
+}
+
+function notifyCardsAdded({ added, source }) {
+  const text = source === "outbox"
+    ? `${added} queued card(s) reached Anki`
+    : `Added ${added} card(s) to Anki`;
+  if (audioStreamTabId !== null) {
+    chrome.tabs.sendMessage(audioStreamTabId, { action: "showToast", text, isError: false }).catch(() => {});
+  }
+}
+
+async function currentGenerateKey() {
+  let { generateKey } = await chrome.storage.local.get(["generateKey"]);
+  if (!generateKey) {
+    generateKey = crypto.randomUUID();
+    await chrome.storage.local.set({ generateKey });
+  }
+  return generateKey;
+}
+
+// Upload captured audio as a raw binary part, straight from the stored Blob
+async function generateRequestInit(message) {
+  const payload = { cards: message.cards, deck_name: message.deckName };
+  const headers = { "Idempotency-Key": await currentGenerateKey() };
+  const audio = message.sentenceAudio ? await loadPendingAudio() : null;
+  if (audio) {
+    const form = new FormData();
+    form.append("payload", new Blob([JSON.stringify(payload)], { type: "application/json" }));
+    form.append("sentence_audio", audio, "sentence.webm");
+    return { method: "POST", headers, body: form };
+  }
+  return {
+    method: "POST",
+    headers: { ...headers, "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  };
+}
+
+// Print the server's per-stage timings (OCR, Groq, VOICEVOX, Anki) for a response
+function logServerTiming(label, response) {
+  logTimings(label, response.headers.get("X-Trace-Id"), response.headers.get("Server-Timing"));
+}
+
+function logTimings(label, traceId, timing) {
+  if (!timing) return;
+  const stages = Object.fromEntries(timing.split(",").map(entry => {
+    const [name, ...params] = entry.trim().split(";");
+    const dur = params.find(p => p.startsWith("dur="));
+    return [name, dur ? Number(dur.slice(4)) : null];
+  }));
+  console.log(`[Kioku] ${label} trace ${traceId} timings (ms):`, stages);
+}
+
+async function waitForJob(apiUrl, jobId) {
+  while (true) {
+    const r = await fetch(`${apiUrl}/api/jobs/${jobId}`);
+    const job = await r.json();
+    if (!r.ok) throw job.detail || `HTTP ${r.status}`;
+    if (job.status === "succeeded") return job.result;
+    if (job.status === "failed") throw job.error;
+    if (job.status === "cancelled") throw "Job cancelled";
+    await new Promise(resolve => setTimeout(resolve, 500));
+  }
+}
+
 console.log("[Kioku] Background loaded");
@@ -67,11 +67,14 @@ async function stopRecording() {
       console.log('[Kioku offscreen] Stopped, chunks:', chunks.length);
       if (chunks.length === 0) { resolve({ audio: null }); return; }
       const blob = new Blob(chunks, { type: recorder.mimeType });
-      const buffer = await blob.arrayBuffer();
-      const bytes = new Uint8Array(buffer);
-      let binary = '';
-      for (let i = 0; i < bytes.length; i++) binary += String.fromCharCode(bytes[i]);
-      resolve({ audio: btoa(binary) });
+      // The Blob goes straight to IndexedDB; a runtime message would need it as base64
+      try {
+        await savePendingAudio(blob);
+        resolve({ audio: true, size: blob.size });
+      } catch (e) {
+        console.log('[Kioku offscreen] could not store audio:', e.message);
+        resolve({ audio: null });
+      }
     };
     recorder.stop();
   });
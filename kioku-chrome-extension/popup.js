@@ -87,13 +87,10 @@ async function showExtractionPanel(text) {
 // Update the audio preview element from storage
 async function refreshAudioPreview() {
   const { pendingAudio } = await chrome.storage.local.get(['pendingAudio']);
-  console.log('[Kioku] refreshAudioPreview: pendingAudio =', pendingAudio ? `<base64 string, length ${pendingAudio.length}>` : pendingAudio);
+  const blob = pendingAudio ? await loadPendingAudio() : null;
+  console.log('[Kioku] refreshAudioPreview: pendingAudio =', blob ? `<blob, ${blob.size} bytes>` : null);
   const preview = document.getElementById('audio-preview');
-  if (pendingAudio) {
-    const binary = atob(pendingAudio);
-    const bytes = new Uint8Array(binary.length);
-    for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
-    const blob = new Blob([bytes], { type: 'audio/webm' });
+  if (blob) {
     document.getElementById('preview-audio').src = URL.createObjectURL(blob);
     preview.style.display = 'flex';
   } else {
@@ -265,24 +262,33 @@ async function addToAnki() {
   status.textContent = 'Adding to Anki...';
   status.style.display = 'block';
 
+  // Stage progress streamed from the server while the cards are generated
+  const onProgress = (message) => {
+    if (message.action === "generateProgress" && message.total) {
+      status.textContent = `Adding to Anki... ${message.stage} ${message.done}/${message.total}`;
+    }
+  };
+  chrome.runtime.onMessage.addListener(onProgress);
+
   try {
     const storageData = await chrome.storage.local.get(['pendingAudio']);
     const response = await chrome.runtime.sendMessage({
       action: "generateCards",
       cards: currentCards,
       deckName: deckName,
-      sentenceAudioB64: storageData.pendingAudio || null,
+      sentenceAudio: Boolean(storageData.pendingAudio),
     });
 
     if (response.error) {
       throw new Error(response.error);
     }
 
-    status.textContent = `Successfully added ${response.added} card(s) to Anki!`;
+    status.textContent = `Successfully added ${response.added} card(s) to Anki!${response.skipped?.length ? ` Skipped ${response.skipped.length} duplicate(s).` : ""}${response.queued ? ` ${response.queued} queued until Anki is reachable.` : ""}`;
     status.className = 'status success';
 
     // Clear cards and captured audio after successful add
     await chrome.storage.local.remove('pendingAudio');
+    await clearPendingAudio();
     document.getElementById('audio-preview').style.display = 'none';
     setTimeout(() => {
       clearCards();
@@ -291,6 +297,8 @@ async function addToAnki() {
   } catch (err) {
     status.textContent = `Error: ${err.message}`;
     status.className = 'status error';
+  } finally {
+    chrome.runtime.onMessage.removeListener(onProgress);
   }
 }
 
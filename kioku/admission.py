@@ -0,0 +1,267 @@
+"""Admission control and priority classes for shared resources.
+
+Two layers use the same ``Gate``:
+
+* Endpoint gates run at most ``<NAME>_CONCURRENCY`` requests of an
+  expensive endpoint at once, with at most ``<NAME>_QUEUE`` waiting behind
+  them. A request that finds the queue full is rejected with ``Overloaded``,
+  which the API turns into 429 with a Retry-After estimate.
+* Resource gates bound the callers of the OCR model, Groq, VOICEVOX,
+  AnkiConnect writes and AnkiWeb syncs. Their queues are unbounded but ordered by priority
+  class, so an interactive capture overtakes a bulk job's backlog.
+
+The priority class travels in a context variable. Requests are interactive
+by default; background jobs and the outbox drainer run as bulk. Context
+variables follow ``asyncio.to_thread`` and new tasks, so the class reaches
+every stage of the pipeline without being passed around.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from kioku import metrics
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+_RANK = {INTERACTIVE: 0, BULK: 1}
+
+# name -> (default concurrency, default queue bound; None = unbounded)
+GATE_DEFAULTS: dict[str, tuple[int, int | None]] = {
+    # Endpoints
+    "extract": (2, 8),
+    "extract_text": (4, 16),
+    "generate": (2, 8),
+    "capture": (2, 8),
+    # Shared resources
+    "ocr": (1, None),
+    "groq": (4, None),
+    "voicevox": (4, None),
+    "anki_write": (1, None),
+    "anki_sync": (1, None),
+}
+
+# Smoothing factor for the moving average of how long a slot is held
+_HOLD_TIME_ALPHA = 0.2
+
+_priority: ContextVar[str] = ContextVar("kioku_priority", default=INTERACTIVE)
+
+metrics.describe("kioku_gate_active", "Callers holding a slot of an admission gate.")
+metrics.describe("kioku_gate_waiting", "Callers queued at an admission gate.")
+metrics.describe("kioku_gate_wait_seconds", "Time spent queued at an admission gate.")
+metrics.describe("kioku_admission_rejected_total", "Requests rejected because a queue was full.")
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+@contextmanager
+def priority(name: str):
+    """Run the block (and the tasks and threads it starts) in priority class ``name``."""
+    if name not in _RANK:
+        raise ValueError(f"Unknown priority class {name!r}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class Overloaded(Exception):
+    """A bounded queue is full; the caller should retry after ``retry_after`` seconds."""
+
+    def __init__(self, gate: str, retry_after: int):
+        super().__init__(f"{gate} is at capacity; retry in {retry_after}s")
+        self.gate = gate
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "granted", "cancelled", "_event", "_loop", "_future")
+
+    def __init__(self, priority: str, loop: asyncio.AbstractEventLoop | None = None):
+        self.priority = priority
+        self.granted = False
+        self.cancelled = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self._future = loop.create_future()
+
+    def wake(self):
+        self.granted = True
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self):
+        self._event.wait()
+
+    async def wait_async(self):
+        await self._future
+
+
+class Gate:
+    """Concurrency limit with a priority-ordered, optionally bounded, queue.
+
+    Usable from threads (``hold``) and coroutines (``hold_async``) at once:
+    AnkiConnect and Groq calls run in worker threads while VOICEVOX calls
+    are async. A ``limit`` of 0 disables the gate.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int | None = None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: list[tuple[int, int, _Waiter]] = []
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._hold_time: float | None = None
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the average hold time."""
+        hold = self._hold_time if self._hold_time is not None else 1.0
+        return max(1, math.ceil(hold * (self._waiting + 1) / max(self.limit, 1)))
+
+    def _enter(self, waiter: _Waiter) -> bool:
+        """Take a slot now (True) or queue ``waiter`` for one (False)."""
+        with self._lock:
+            if self._active < self.limit and not self._waiting:
+                self._active += 1
+                self._gauges()
+                return True
+            if self.max_queue is not None and self._waiting >= self.max_queue:
+                metrics.inc("kioku_admission_rejected_total", gate=self.name)
+                raise Overloaded(self.name, self.retry_after())
+            heapq.heappush(self._queue, (_RANK[waiter.priority], next(self._seq), waiter))
+            self._waiting += 1
+            self._gauges()
+            return False
+
+    def _release(self, held_for: float | None):
+        with self._lock:
+            if held_for is not None:
+                self._hold_time = (
+                    held_for
+                    if self._hold_time is None
+                    else self._hold_time + _HOLD_TIME_ALPHA * (held_for - self._hold_time)
+                )
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                # Hand the slot straight to the next waiter
+                self._waiting -= 1
+                waiter.wake()
+                break
+            else:
+                self._active -= 1
+            self._gauges()
+
+    def _abandon(self, waiter: _Waiter):
+        """A waiter gave up (cancelled); drop it or give back the slot it just got."""
+        with self._lock:
+            if not waiter.granted:
+                waiter.cancelled = True
+                self._waiting -= 1
+                self._gauges()
+                return
+        self._release(None)
+
+    def _gauges(self):
+        metrics.set_gauge("kioku_gate_active", self._active, gate=self.name)
+        metrics.set_gauge("kioku_gate_waiting", self._waiting, gate=self.name)
+
+    def _waited(self, waiter: _Waiter, started: float):
+        metrics.observe(
+            "kioku_gate_wait_seconds",
+            time.perf_counter() - started,
+            gate=self.name,
+            priority=waiter.priority,
+        )
+
+    @contextmanager
+    def hold(self):
+        """Hold a slot for the block, waiting in the calling thread if needed."""
+        if self.limit <= 0:
+            yield
+            return
+        waiter = _Waiter(current_priority())
+        started = time.perf_counter()
+        if not self._enter(waiter):
+            waiter.wait()
+        self._waited(waiter, started)
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - acquired)
+
+    @asynccontextmanager
+    async def hold_async(self):
+        """Hold a slot for the block, awaiting it without blocking the loop."""
+        if self.limit <= 0:
+            yield
+            return
+        waiter = _Waiter(current_priority(), asyncio.get_running_loop())
+        started = time.perf_counter()
+        if not self._enter(waiter):
+            try:
+                await waiter.wait_async()
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+        self._waited(waiter, started)
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - acquired)
+
+
+_gates: dict[str, Gate] = {}
+_gates_lock = threading.Lock()
+
+
+def gate(name: str) -> Gate:
+    """The process-wide gate ``name``, sized from the environment on first use."""
+    with _gates_lock:
+        found = _gates.get(name)
+        if found is None:
+            limit, max_queue = GATE_DEFAULTS[name]
+            prefix = name.upper()
+            limit = int(os.environ.get(f"{prefix}_CONCURRENCY", limit))
+            queue = os.environ.get(f"{prefix}_QUEUE")
+            if queue is not None:
+                max_queue = int(queue)
+            found = _gates[name] = Gate(name, limit, max_queue)
+        return found
+
+
+def reset():
+    """Forget every gate so the next use re-reads the environment (used by tests)."""
+    with _gates_lock:
+        _gates.clear()
@@ -0,0 +1,156 @@
+"""Audio for a batch of notes, held in memory only up to a byte budget.
+
+A generate request synthesizes two files per card. ``AudioSpool`` keeps
+them keyed by media filename like a ``dict[str, bytes]``, but once the
+bytes it holds in memory reach AUDIO_MEMORY_BYTES, further files are
+written to a temporary directory instead. Filenames with the same audio
+(a sentence card's word and sentence files, captured audio used for every
+sentence) share one copy. ``open`` streams a file without loading it, which
+is how the AnkiConnect upload and the .apkg writer read spilled files.
+Content digests are computed on first use, since only media uploads need
+them.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+DEFAULT_AUDIO_MEMORY_BYTES = "33554432"
+
+
+@dataclass(slots=True)
+class _Entry:
+    size: int
+    data: bytes | None = None
+    path: Path | None = None
+    digest: str | None = None
+
+
+class AudioSpool(Mapping[str, bytes]):
+    """Media files keyed by filename, spilling to disk past a memory budget.
+
+    Reading an item (``spool[name]``) loads spilled files back, so callers
+    that only need a stream should use ``open``. Call ``close`` (or use the
+    spool as a context manager) to delete the spilled files.
+    """
+
+    def __init__(self, max_memory: int | None = None):
+        if max_memory is None:
+            max_memory = int(os.environ.get("AUDIO_MEMORY_BYTES", DEFAULT_AUDIO_MEMORY_BYTES))
+        self.max_memory = max_memory
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self._spilled_files = 0
+        self._names: dict[str, _Entry] = {}
+        self._directory: Path | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def holding(cls, audio_map: Mapping[str, bytes]) -> "AudioSpool":
+        """A spool over audio already in memory, kept there whatever its size."""
+        spool = cls(max_memory=sys.maxsize)
+        for name, data in audio_map.items():
+            spool.add(name, data)
+        return spool
+
+    def __enter__(self) -> "AudioSpool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Delete the spilled files; in-memory audio is released as well."""
+        with self._lock:
+            self._names.clear()
+            self.memory_bytes = self.spilled_bytes = 0
+            if self._directory is not None:
+                shutil.rmtree(self._directory, ignore_errors=True)
+                self._directory = None
+
+    def _spill(self, data: bytes) -> Path:
+        if self._directory is None:
+            self._directory = Path(tempfile.mkdtemp(prefix="kioku-audio-"))
+        path = self._directory / f"{self._spilled_files}.wav"
+        path.write_bytes(data)
+        self._spilled_files += 1
+        return path
+
+    def fits(self, size: int) -> bool:
+        """Whether ``size`` more bytes would still be kept in memory (no disk write)."""
+        return self.memory_bytes + size <= self.max_memory
+
+    def add(self, name: str, data: bytes):
+        """Store ``data`` under ``name``, on disk if the memory budget is used up.
+
+        A spill writes a file while holding the spool's lock; async callers
+        check ``fits`` first and add from a thread when it is False.
+        """
+        entry = _Entry(len(data))
+        with self._lock:
+            if self.memory_bytes + entry.size <= self.max_memory:
+                entry.data = data
+                self.memory_bytes += entry.size
+            else:
+                entry.path = self._spill(data)
+                self.spilled_bytes += entry.size
+            self._names[name] = entry
+
+    def add_file(self, name: str, path: Path):
+        """Store the audio in the file at ``path`` under ``name`` without copying it.
+
+        The file is read when the audio is, and is not deleted by ``close``.
+        """
+        with self._lock:
+            self._names[name] = _Entry(path.stat().st_size, path=path)
+
+    def link(self, name: str, existing: str):
+        """Make ``name`` refer to the audio already stored as ``existing``."""
+        with self._lock:
+            self._names[name] = self._names[existing]
+
+    def size(self, name: str) -> int:
+        return self._names[name].size
+
+    def digest(self, name: str) -> str:
+        """SHA-256 of the file's bytes, computed on the first call for its audio."""
+        entry = self._names[name]
+        if entry.digest is None:
+            if entry.path is not None:
+                with entry.path.open("rb") as audio:
+                    entry.digest = hashlib.file_digest(audio, "sha256").hexdigest()
+            else:
+                entry.digest = hashlib.sha256(entry.data).hexdigest()
+        return entry.digest
+
+    def open(self, name: str) -> BinaryIO:
+        """A binary stream of the file, read from disk when it was spilled."""
+        entry = self._names[name]
+        if entry.path is not None:
+            return entry.path.open("rb")
+        return io.BytesIO(entry.data)
+
+    def media_items(self) -> Iterator[tuple[str, bytes | Path]]:
+        """``(filename, bytes or path)`` pairs, as ``write_apkg`` takes them."""
+        for name, entry in list(self._names.items()):
+            yield name, entry.path if entry.path is not None else entry.data
+
+    def __getitem__(self, name: str) -> bytes:
+        entry = self._names[name]
+        if entry.path is not None:
+            return entry.path.read_bytes()
+        return entry.data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._names))
+
+    def __len__(self) -> int:
+        return len(self._names)
@@ -0,0 +1,329 @@
+"""Offline batch runs: images or text lines to cards, audio and Anki, without the server.
+
+``kioku batch`` runs the same stages as the HTTP API (OCR, enrichment,
+VOICEVOX, AnkiConnect or an .apkg) over a whole directory, archive or text
+file. Each stage has its own worker count, and every finished item is
+recorded in a ``Journal``: pages and lines with their text and cards,
+synthesized audio (kept as files next to the journal rather than in
+memory) and notes added to Anki. Running the same command again after an
+interruption skips everything the journal already holds.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from kioku.audio_spool import AudioSpool
+from kioku.ingest import ingest_lines, ingest_pages
+from kioku.journal import Journal
+from kioku.models import CardItem
+from kioku.pipeline import ProgressCallback, no_progress
+from kioku.services.anki_builder import AnkiUnavailableError, add_cards, find_new_cards
+from kioku.services.apkg_writer import write_apkg
+from kioku.services.audio_generator import generate_audio
+from kioku.utils import audio_filename, data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_TTS_WORKERS = "4"
+# Cards checked with one canAddNotes call
+ANKI_CHECK_SIZE = 100
+
+
+@dataclass
+class StageThroughput:
+    done: int = 0
+    total: int = 0
+    started: float | None = None
+    finished: float | None = None
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class Throughput:
+    """A progress callback that times each stage from its first to its last report."""
+
+    def __init__(self, forward: ProgressCallback = no_progress):
+        self.forward = forward
+        self.stages: dict[str, StageThroughput] = {}
+
+    def __call__(self, stage: str, done: int, total: int):
+        now = time.perf_counter()
+        found = self.stages.setdefault(stage, StageThroughput())
+        if found.started is None:
+            found.started = now
+        found.done, found.total, found.finished = done, total, now
+        self.forward(stage, done, total)
+
+    def report(self) -> str:
+        """A table of items done, time taken and rate for each stage."""
+        lines = [f"{'stage':<8}{'done':>14}{'seconds':>10}{'per s':>10}"]
+        for name, stage in self.stages.items():
+            rate = stage.done / stage.seconds if stage.seconds > 0 else 0.0
+            lines.append(
+                f"{name:<8}{f'{stage.done}/{stage.total}':>14}{stage.seconds:>10.1f}{rate:>10.1f}"
+            )
+        return "\n".join(lines)
+
+
+def audio_texts(cards: list[CardItem]) -> dict[str, str]:
+    """Every audio file the cards' notes refer to, mapped to the text it speaks."""
+    texts: dict[str, str] = {}
+    for card in cards:
+        texts.setdefault(audio_filename(card.japanese, "word"), card.japanese)
+        texts.setdefault(audio_filename(card.example_sentence, "sentence"), card.example_sentence)
+    return texts
+
+
+def synthesize_to_files(
+    cards: list[CardItem],
+    audio_dir: Path,
+    journal: Journal,
+    workers: int | None = None,
+    progress: ProgressCallback = no_progress,
+) -> dict:
+    """Synthesize the cards' word and sentence audio into ``audio_dir``.
+
+    ``workers`` texts are sent to VOICEVOX at once. Each file is written as
+    soon as it is ready and recorded in ``journal``, so audio never piles
+    up in memory and a resumed run only synthesizes what is missing.
+    Returns counts of audio files made, resumed and failed.
+    """
+    if workers is None:
+        workers = int(os.environ.get("BATCH_TTS_WORKERS", DEFAULT_BATCH_TTS_WORKERS))
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    texts = audio_texts(cards)
+    stats = {"made": 0, "resumed": 0, "failed": 0}
+    # A word that is also a sentence has two files but is synthesized once
+    pending: dict[str, list[str]] = {}
+    for filename, text in texts.items():
+        if journal.done("tts", filename) and (audio_dir / filename).is_file():
+            stats["resumed"] += 1
+        else:
+            pending.setdefault(text, []).append(filename)
+    done = stats["resumed"]
+    progress("tts", done, len(texts))
+
+    async def run():
+        slots = asyncio.Semaphore(max(workers, 1))
+
+        async def synthesize(text: str, filenames: list[str]):
+            nonlocal done
+            async with slots:
+                try:
+                    audio = await generate_audio(text)
+                except RuntimeError as err:
+                    # Not recorded, so the next run tries this text again
+                    logger.warning("could not synthesize %r: %s", text, err)
+                    stats["failed"] += len(filenames)
+                else:
+                    for filename in filenames:
+                        await asyncio.to_thread((audio_dir / filename).write_bytes, audio)
+                        journal.record("tts", filename)
+                    stats["made"] += len(filenames)
+            done += len(filenames)
+            progress("tts", done, len(texts))
+
+        await asyncio.gather(*(synthesize(text, names) for text, names in pending.items()))
+
+    asyncio.run(run())
+    return stats
+
+
+def _card_audio(card: CardItem, audio_dir: Path) -> dict[str, Path] | None:
+    files = [
+        audio_filename(card.japanese, "word"),
+        audio_filename(card.example_sentence, "sentence"),
+    ]
+    paths = {name: audio_dir / name for name in files}
+    if not all(path.is_file() for path in paths.values()):
+        return None
+    return paths
+
+
+def add_to_anki(
+    cards: list[CardItem],
+    deck_name: str,
+    journal: Journal,
+    audio_dir: Path | None = None,
+    progress: ProgressCallback = no_progress,
+) -> dict:
+    """Add the cards Anki does not have yet, one addNotes call per chunk.
+
+    Cards are checked against the collection in chunks of ANKI_CHECK_SIZE,
+    and each chunk's new notes go to ``add_cards`` together, so the media
+    listing and deck checks run once per chunk. Every note added (or found
+    already present) is recorded in ``journal``. With ``audio_dir`` a card
+    is only added once both its audio files are there; cards missing audio
+    are left for the next run. Returns counts of cards added, resumed,
+    already in Anki and failed.
+    """
+    stats = {"added": 0, "resumed": 0, "existing": 0, "no_audio": 0, "failed": 0}
+    remaining = []
+    for card in cards:
+        if journal.done("anki", card.japanese):
+            stats["resumed"] += 1
+        else:
+            remaining.append(card)
+    done = stats["resumed"]
+    progress("anki", done, len(cards))
+
+    def add(batch: list[CardItem], files: dict[str, Path]):
+        with AudioSpool() as audio:
+            for name, path in files.items():
+                audio.add_file(name, path)
+            add_cards(batch, audio, deck_name)
+
+    def card_files(card: CardItem) -> dict[str, Path] | None:
+        return {} if audio_dir is None else _card_audio(card, audio_dir)
+
+    def add_each(batch: list[CardItem]) -> list[CardItem]:
+        # add_cards fails when Anki refuses any note, though it keeps the others;
+        # pick out the notes that landed and send the rest on their own so only
+        # the bad ones fail
+        still_new, landed = find_new_cards(batch, deck_name)
+        for card in still_new:
+            try:
+                add([card], card_files(card))
+            except AnkiUnavailableError:
+                raise
+            except RuntimeError as err:
+                logger.warning("could not add %r: %s", card.japanese, err)
+                stats["failed"] += 1
+            else:
+                landed.append(card)
+        return landed
+
+    try:
+        for start in range(0, len(remaining), ANKI_CHECK_SIZE):
+            chunk = remaining[start : start + ANKI_CHECK_SIZE]
+            new_cards, present = find_new_cards(chunk, deck_name)
+            journal.record_many("anki", [(card.japanese, "existing") for card in present])
+            stats["existing"] += len(present)
+            ready: list[CardItem] = []
+            files: dict[str, Path] = {}
+            for card in new_cards:
+                found = card_files(card)
+                if found is None:
+                    stats["no_audio"] += 1
+                    continue
+                ready.append(card)
+                files.update(found)
+            if ready:
+                try:
+                    add(ready, files)
+                    added = ready
+                except AnkiUnavailableError:
+                    raise
+                except RuntimeError as err:
+                    logger.warning("could not add the batch, retrying note by note: %s", err)
+                    added = add_each(ready)
+                journal.record_many("anki", [(card.japanese, "added") for card in added])
+                stats["added"] += len(added)
+            done += len(chunk)
+            progress("anki", done, len(cards))
+    except AnkiUnavailableError as err:
+        raise RuntimeError(f"{err} Run the command again once Anki is open to resume.") from err
+    return stats
+
+
+def write_package(
+    cards: list[CardItem],
+    output: str | Path,
+    deck_name: str,
+    audio_dir: Path | None = None,
+    progress: ProgressCallback = no_progress,
+) -> dict:
+    """Write the cards to an .apkg, streaming their audio files from ``audio_dir``."""
+    media: list[tuple[str, Path]] = []
+    if audio_dir is not None:
+        media = [
+            (name, audio_dir / name) for name in audio_texts(cards) if (audio_dir / name).is_file()
+        ]
+    progress("apkg", 0, len(cards))
+    count = write_apkg(output, cards, media, deck_name)
+    progress("apkg", count, len(cards))
+    return {"notes": count, "media": len(media)}
+
+
+def default_journal(source: str | Path, target: str) -> Path:
+    """Where a batch over ``source`` into ``target`` keeps its journal by default."""
+    key = f"{Path(source).resolve()}\0{target}".encode("utf-8")
+    path = data_dir() / "batch-journals"
+    path.mkdir(parents=True, exist_ok=True)
+    return path / f"{Path(source).name}-{hashlib.sha256(key).hexdigest()[:12]}.journal"
+
+
+def audio_dir_for(journal_path: Path) -> Path:
+    return journal_path.with_name(journal_path.name + ".audio")
+
+
+def remove_run(journal: Journal):
+    """Delete a finished run's journal and the audio files kept beside it."""
+    shutil.rmtree(audio_dir_for(journal.path), ignore_errors=True)
+    journal.remove()
+
+
+BATCH_KINDS = ("images", "text")
+
+
+def run_batch(
+    kind: str,
+    source: str | Path,
+    journal: Journal,
+    deck_name: str = "ankiGen",
+    output: str | Path | None = None,
+    audio: bool = True,
+    workers: dict[str, int | None] | None = None,
+    max_tokens: int | None = None,
+    progress: ProgressCallback = no_progress,
+) -> dict[str, dict]:
+    """Run every stage over ``source`` and return each stage's counts.
+
+    ``kind`` is ``images`` (a directory of images, an archive or a PDF) or
+    ``text`` (one sentence per line). Notes go to AnkiConnect, or to the
+    .apkg at ``output`` when given. ``workers`` sets the parallelism of the
+    ``ocr``, ``enrich`` and ``tts`` stages; unset stages use their
+    environment defaults. Anki notes go in one addNotes call per chunk.
+    """
+    workers = workers or {}
+    if kind == "images":
+        ingested = ingest_pages(
+            source,
+            progress,
+            journal,
+            max_tokens=max_tokens,
+            ocr_workers=workers.get("ocr"),
+            concurrency=workers.get("enrich"),
+        )
+    elif kind == "text":
+        ingested = ingest_lines(
+            source, progress, journal, max_tokens=max_tokens, concurrency=workers.get("enrich")
+        )
+    else:
+        raise ValueError(f"Unknown batch kind {kind!r}; choose from {', '.join(BATCH_KINDS)}")
+    cards = [CardItem(**card) for card in ingested.pop("cards")]
+    stats: dict[str, dict] = {kind: {**ingested, "cards": len(cards)}}
+
+    audio_dir = audio_dir_for(journal.path) if audio else None
+    if audio_dir is not None:
+        stats["tts"] = synthesize_to_files(cards, audio_dir, journal, workers.get("tts"), progress)
+    if output is not None:
+        stats["apkg"] = write_package(cards, output, deck_name, audio_dir, progress)
+    else:
+        stats["anki"] = add_to_anki(cards, deck_name, journal, audio_dir, progress)
+    return stats
+
+
+def is_complete(stats: dict[str, dict]) -> bool:
+    """Whether nothing in a run failed or was left for a later run."""
+    return not any(counts.get("failed") or counts.get("no_audio") for counts in stats.values())
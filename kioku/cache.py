@@ -0,0 +1,560 @@
+"""Byte caches that several workers (and processes on one host) can share.
+
+Three backends implement the same small interface:
+
+* ``MemoryCache`` — an LRU in this process; the default.
+* ``SqliteCache`` — one SQLite database in WAL mode, shared by every
+  process that opens it.
+* ``DirectoryCache`` — one file per entry under a shared directory, written
+  atomically with a rename.
+
+All of them take a TTL per entry, evict least recently used entries once
+their values exceed ``max_bytes``, and offer ``get_or_compute``: the first
+caller for a missing key computes it under a per-key lock while the others
+wait and then read the stored value. The file-backed caches take that lock
+with ``flock`` so it holds across processes, not just threads.
+
+``get_cache()`` builds the process-wide cache from CACHE_BACKEND
+(``memory``, ``sqlite``, ``directory`` or ``none``), CACHE_DIR,
+CACHE_MAX_BYTES and CACHE_TTL.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only exclude threads of this process
+    fcntl = None
+
+from kioku import metrics
+from kioku.utils import data_dir
+
+DEFAULT_CACHE_BACKEND = "memory"
+DEFAULT_CACHE_MAX_BYTES = str(256 * 1024 * 1024)
+LOCK_STRIPES = 256
+LOCK_POLL_MIN = 0.005
+LOCK_POLL_MAX = 0.1
+
+
+def _digest(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _expiry(ttl: float | None) -> float | None:
+    return time.time() + ttl if ttl is not None else None
+
+
+def _cache_label(key: str) -> str:
+    # Keys are namespaced like "tts:<hash>"; the namespace labels the metrics
+    return key.split(":", 1)[0]
+
+
+async def _call_now(func, *args):
+    return func(*args)
+
+
+class KeyLock:
+    """Exclusive lock for one key; ``acquire`` blocks until it is ours.
+
+    A thread lock per key orders callers in this process; backends that
+    share storage between processes add an ``flock`` on a lock file.
+    """
+
+    def __init__(self, owner: "Cache", key: str, path: Path | None = None):
+        self._owner = owner
+        self._key = key
+        self._path = path
+        self._file = None
+        self._thread_lock: threading.Lock | None = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        self._thread_lock = self._owner._checkout(self._key)
+        if not self._thread_lock.acquire(blocking):
+            self._owner._checkin(self._key)
+            return False
+        if self._path is not None and fcntl is not None:
+            try:
+                self._file = open(self._path, "a")
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(self._file, flags)
+            except BaseException as err:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                self._owner._checkin(self._key)
+                if not blocking and isinstance(err, BlockingIOError):
+                    return False
+                raise
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # drops the flock
+            self._file = None
+        self._thread_lock.release()
+        self._owner._checkin(self._key)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Cache:
+    """Interface shared by the backends; values are bytes."""
+
+    # Whether get/set touch the disk, so async callers should use a thread
+    blocking_io = True
+    # Whether values are held in this process's memory
+    in_process = False
+
+    def __init__(self, max_bytes: int, default_ttl: float | None = None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> [lock, users]; dropped when the last user checks it back in
+        self._key_locks: dict[str, list] = {}
+        self._key_locks_mutex = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def size(self) -> tuple[int, int]:
+        """``(entries, bytes)`` currently stored."""
+        raise NotImplementedError
+
+    def _lock_path(self, stripe: int) -> Path | None:
+        return None
+
+    def _checkout(self, key: str) -> threading.Lock:
+        with self._key_locks_mutex:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _checkin(self, key: str):
+        with self._key_locks_mutex:
+            entry = self._key_locks[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._key_locks[key]
+
+    def lock(self, key: str) -> KeyLock:
+        # Lock files are striped so their number stays bounded
+        stripe = int(_digest(key)[:8], 16) % LOCK_STRIPES
+        return KeyLock(self, key, self._lock_path(stripe))
+
+    def stats(self) -> dict:
+        entries, size = self.size()
+        return {
+            "backend": type(self).__name__,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _lookup(self, key: str) -> bytes | None:
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        metrics.record_cache(_cache_label(key), value is not None)
+        return value
+
+    def get_or_compute(
+        self, key: str, compute: Callable[[], bytes], ttl: float | None = None
+    ) -> bytes:
+        """Return the cached value, computing and storing it at most once per key."""
+        value = self._lookup(key)
+        if value is not None:
+            return value
+        with self.lock(key):
+            # Another worker may have finished computing while we waited
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                self.set(key, value, ttl)
+        return value
+
+    async def get_or_compute_async(
+        self, key: str, compute: Callable[[], Awaitable[bytes]], ttl: float | None = None
+    ) -> bytes:
+        """``get_or_compute`` for a coroutine; file I/O runs in threads."""
+        run = asyncio.to_thread if self.blocking_io else _call_now
+        value = await run(self._lookup, key)
+        if value is not None:
+            return value
+        lock = self.lock(key)
+        # Poll rather than block a thread: waiters parked in the default
+        # executor could starve the holder of threads for its own I/O
+        delay = LOCK_POLL_MIN
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_POLL_MAX)
+        try:
+            value = await run(self.get, key)
+            if value is None:
+                value = await compute()
+                await run(self.set, key, value, ttl)
+        finally:
+            lock.release()
+        return value
+
+
+class NullCache(Cache):
+    """Stores nothing; ``CACHE_BACKEND=none``."""
+
+    blocking_io = False
+
+    def __init__(self):
+        super().__init__(max_bytes=0)
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def size(self):
+        return 0, 0
+
+    def get_or_compute(self, key, compute, ttl=None):
+        self._lookup(key)
+        return compute()
+
+    async def get_or_compute_async(self, key, compute, ttl=None):
+        self._lookup(key)
+        return await compute()
+
+
+class MemoryCache(Cache):
+    """LRU dict in this process, bounded by the total size of its values."""
+
+    blocking_io = False
+    in_process = True
+
+    def __init__(self, max_bytes: int, default_ttl: float | None = None):
+        super().__init__(max_bytes, default_ttl)
+        self._entries: OrderedDict[str, tuple[bytes, float | None]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = _expiry(ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def size(self):
+        with self._lock:
+            return len(self._entries), self._bytes
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+"""
+
+
+class SqliteCache(Cache):
+    """Entries in one SQLite database (WAL), shared by every process opening it."""
+
+    def __init__(self, path: Path, max_bytes: int, default_ttl: float | None = None):
+        super().__init__(max_bytes, default_ttl)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_dir = self.path.with_name(self.path.name + ".locks")
+        self._lock_dir.mkdir(exist_ok=True)
+        conn = self._connect()
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SQLITE_SCHEMA)
+        return conn
+
+    def _lock_path(self, stripe):
+        return self._lock_dir / f"{stripe:02x}.lock"
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] is not None and row[1] <= now:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                return row[0]
+        finally:
+            conn.close()
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = _expiry(ttl if ttl is not None else self.default_ttl)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), expires_at, time.time()),
+                )
+                # Drop the least recently used entries beyond the byte budget
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    " SELECT key FROM (SELECT key, SUM(size) OVER"
+                    " (ORDER BY accessed_at DESC, rowid DESC) AS running FROM entries)"
+                    " WHERE running > ?)",
+                    (self.max_bytes,),
+                )
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM entries")
+        finally:
+            conn.close()
+
+    def size(self):
+        conn = self._connect()
+        try:
+            count, total = conn.execute("SELECT COUNT(*), SUM(size) FROM entries").fetchone()
+        finally:
+            conn.close()
+        return count, total or 0
+
+
+_HEADER = struct.Struct(">d")  # expires_at, 0 for never
+
+
+class DirectoryCache(Cache):
+    """One file per entry under ``root``, safe for concurrent processes.
+
+    Writes go to a temporary file that is renamed into place, so readers
+    never see a partial value. Reads bump the file's mtime, which orders
+    eviction; the directory is only rescanned when this process's running
+    total suggests the budget is exceeded.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, default_ttl: float | None = None):
+        super().__init__(max_bytes, default_ttl)
+        self.root = Path(root)
+        (self.root / "locks").mkdir(parents=True, exist_ok=True)
+        self._size_lock = threading.Lock()
+        self._estimate = self.size()[1]
+
+    def _path(self, key: str) -> Path:
+        digest = _digest(key)
+        return self.root / digest[:2] / f"{digest}.bin"
+
+    def _lock_path(self, stripe):
+        return self.root / "locks" / f"{stripe:02x}.lock"
+
+    def _files(self):
+        for sub in self.root.iterdir():
+            if sub.is_dir() and sub.name != "locks":
+                yield from sub.glob("*.bin")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        (expires_at,) = _HEADER.unpack_from(data)
+        if expires_at and expires_at <= time.time():
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another process since we read it
+        return data[_HEADER.size:]
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = _expiry(ttl if ttl is not None else self.default_ttl)
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(expires_at or 0.0))
+                f.write(value)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        with self._size_lock:
+            self._estimate += len(value) + _HEADER.size
+            over = self._estimate > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self):
+        files = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        files.sort(reverse=True)  # most recently used first
+        kept = 0
+        for _, size, path in files:
+            if kept + size <= self.max_bytes:
+                kept += size
+            else:
+                path.unlink(missing_ok=True)
+                total -= size
+        with self._size_lock:
+            self._estimate = total
+
+    def delete(self, key):
+        self._path(key).unlink(missing_ok=True)
+
+    def clear(self):
+        for path in self._files():
+            path.unlink(missing_ok=True)
+        with self._size_lock:
+            self._estimate = 0
+
+    def size(self):
+        count = total = 0
+        for path in self._files():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                continue
+            count += 1
+        return count, total
+
+
+_cache: Cache | None = None
+_cache_lock = threading.Lock()
+
+
+def build_cache(backend: str | None = None) -> Cache:
+    """Build the cache configured by the environment."""
+    backend = backend or os.environ.get("CACHE_BACKEND", DEFAULT_CACHE_BACKEND)
+    max_bytes = int(os.environ.get("CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+    ttl = os.environ.get("CACHE_TTL")
+    default_ttl = float(ttl) if ttl else None
+    root = Path(os.environ.get("CACHE_DIR") or data_dir() / "cache").expanduser()
+    if backend == "memory":
+        return MemoryCache(max_bytes, default_ttl)
+    if backend == "sqlite":
+        return SqliteCache(root / "cache.sqlite3", max_bytes, default_ttl)
+    if backend == "directory":
+        return DirectoryCache(root, max_bytes, default_ttl)
+    if backend == "none":
+        return NullCache()
+    raise RuntimeError(
+        f"Unknown CACHE_BACKEND {backend!r}; choose memory, sqlite, directory or none"
+    )
+
+
+def get_cache() -> Cache:
+    """The process-wide cache, built on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = build_cache()
+        return _cache
+
+
+def reset():
+    """Drop the process-wide cache so the next use re-reads the environment."""
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,410 @@
+"""Command line interface for the ``kioku`` console script."""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+from kioku.models import CardItem
+from kioku.serving import default_ocr_socket
+
+
+OCR_MODES = ("auto", "inline", "process")
+
+
+def serve(args: argparse.Namespace):
+    host = os.environ.get("HOST", "0.0.0.0")
+    port = int(os.environ.get("PORT", "8000"))
+    reload = os.environ.get("RELOAD", "").lower() in {"1", "true", "yes"}
+    workers = getattr(args, "workers", None) or int(os.environ.get("WORKERS", "1"))
+    ocr = getattr(args, "ocr", None) or os.environ.get("OCR_MODE", "auto")
+    if ocr not in OCR_MODES:
+        raise RuntimeError(f"Unknown OCR mode {ocr!r}; choose from {', '.join(OCR_MODES)}")
+    if reload and workers > 1:
+        raise RuntimeError("RELOAD cannot be combined with more than one worker.")
+    if ocr == "auto":
+        ocr = "process" if workers > 1 else "inline"
+
+    ocr_process = None
+    socket_path = None
+    if ocr == "process":
+        from kioku.services import ocr_service
+
+        socket_path = getattr(args, "ocr_socket", None) or default_ocr_socket()
+        ocr_process = ocr_service.start_process(socket_path)
+        # Inherited by the uvicorn workers, which send their images there
+        os.environ["OCR_SOCKET"] = str(socket_path)
+    else:
+        os.environ.pop("OCR_SOCKET", None)
+    try:
+        uvicorn.run("kioku.main:app", host=host, port=port, reload=reload, workers=workers)
+    finally:
+        if ocr_process is not None:
+            ocr_service.stop_process(ocr_process)
+            Path(socket_path).unlink(missing_ok=True)
+
+
+def ocr_server(args: argparse.Namespace):
+    from kioku.services import ocr_service
+
+    socket_path = args.socket or os.environ.get("OCR_SOCKET") or default_ocr_socket()
+    ocr_service.serve(socket_path)
+
+
+def load_cards(path: str) -> list[CardItem]:
+    """Read cards from a JSON file holding a list or an ``{"cards": [...]}`` object."""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        data = data.get("cards", [])
+    return [CardItem(**item) for item in data]
+
+
+def export(args: argparse.Namespace):
+    from kioku.audio_spool import AudioSpool
+    from kioku.batch import Throughput
+    from kioku.pipeline import build_audio_map
+    from kioku.services.apkg_writer import write_apkg
+
+    cards = load_cards(args.cards)
+    started = time.perf_counter()
+    throughput = Throughput(_print_progress)
+    clips = None
+    if args.media and not args.no_audio:
+        from kioku.services.audio_clipper import clip_cards
+
+        if not Path(args.media).is_file():
+            raise RuntimeError(f"Media file not found: {args.media}")
+        clips = clip_cards(args.media, cards, throughput, audio_stream=args.audio_stream)
+        print(file=sys.stderr)
+    audio_map = AudioSpool()
+    if not args.no_audio:
+        audio_map = asyncio.run(
+            build_audio_map(cards, sentence_clips=clips, progress=throughput)
+        )
+        print(file=sys.stderr)
+    with audio_map:
+        count = write_apkg(args.output, cards, audio_map.media_items(), args.deck)
+    elapsed = time.perf_counter() - started
+    clipped = f", {len(clips)} sentence clip(s) from {args.media}" if clips is not None else ""
+    print(f"Wrote {count} note(s) to {args.output} in {elapsed:.1f}s{clipped}")
+    if throughput.stages:
+        print(throughput.report())
+
+
+def _print_progress(stage: str, done: int, total: int):
+    if stage == "parse":
+        print(f"\rparsed {100 * done // max(total, 1)}% of the file", end="", file=sys.stderr)
+    else:
+        print(f"\r{stage} {done}/{total}          ", end="", file=sys.stderr)
+    sys.stderr.flush()
+
+
+def subtitles(args: argparse.Namespace):
+    from kioku.ingest import ingest_history, ingest_subtitles
+    from kioku.services.image_processor import GroqAuthenticationError
+
+    started = time.perf_counter()
+    written = 0
+    # Cards are streamed into the {"cards": [...]} file that `kioku export` reads
+    with open(args.output, "w", encoding="utf-8") as out:
+        out.write('{"cards": [\n')
+
+        def write(cards: list[CardItem]):
+            nonlocal written
+            for card in cards:
+                out.write(",\n" if written else "")
+                out.write(card.model_dump_json())
+                written += 1
+
+        try:
+            stats = ingest_subtitles(
+                args.file,
+                args.format,
+                progress=_print_progress,
+                on_cards=write,
+                history=None if args.no_history else ingest_history,
+                max_tokens=args.batch_tokens,
+            )
+        except GroqAuthenticationError as err:
+            raise RuntimeError("GROQ_API_KEY is invalid or not set.") from err
+        out.write("\n]}\n")
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+    print(
+        f"Wrote {written} card(s) to {args.output} from {stats['cues']} cue(s) in {elapsed:.1f}s"
+        f" ({stats['repeated']} repeated, {stats['known']} already ingested,"
+        f" {stats['failed']} failed)"
+    )
+
+
+def pages(args: argparse.Namespace):
+    from kioku.ingest import ingest_pages
+    from kioku.journal import Journal, remove_journal
+    from kioku.services.image_processor import GroqAuthenticationError
+
+    # Kept until the volume is done, so re-running the command resumes it
+    journal_path = args.journal or f"{args.output}.journal"
+    started = time.perf_counter()
+    journal = Journal(journal_path)
+    try:
+        stats = ingest_pages(
+            args.file,
+            _print_progress,
+            journal,
+            max_tokens=args.batch_tokens,
+            ocr_workers=args.ocr_workers,
+            prefetch=args.prefetch,
+        )
+    except GroqAuthenticationError as err:
+        raise RuntimeError("GROQ_API_KEY is invalid or not set.") from err
+    except ValueError as err:
+        journal.remove()
+        raise RuntimeError(str(err)) from err
+    finally:
+        journal.close()
+    with open(args.output, "w", encoding="utf-8") as out:
+        json.dump({"cards": stats["cards"]}, out, ensure_ascii=False)
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+    print(
+        f"Wrote {len(stats['cards'])} card(s) to {args.output} from {stats['pages']} page(s)"
+        f" in {elapsed:.1f}s ({stats['read']} read, {stats['resumed']} resumed,"
+        f" {stats['blank']} blank, {stats['failed']} failed)"
+    )
+    if stats["failed"]:
+        print(f"Run the command again to retry the failed pages (journal: {journal_path})")
+    else:
+        remove_journal(journal_path)
+
+
+def batch(args: argparse.Namespace):
+    from kioku.batch import Throughput, default_journal, is_complete, remove_run, run_batch
+    from kioku.journal import Journal
+    from kioku.services.image_processor import GroqAuthenticationError
+
+    source = Path(args.source)
+    if not source.exists():
+        raise RuntimeError(f"Not found: {args.source}")
+    target = f"apkg:{Path(args.apkg).resolve()}" if args.apkg else f"anki:{args.deck}"
+    journal_path = Path(args.journal) if args.journal else default_journal(source, target)
+    print(f"Journal: {journal_path}", file=sys.stderr)
+    throughput = Throughput(_print_progress)
+    started = time.perf_counter()
+    journal = Journal(journal_path)
+    try:
+        stats = run_batch(
+            args.kind,
+            source,
+            journal,
+            deck_name=args.deck,
+            output=args.apkg,
+            audio=not args.no_audio,
+            workers={
+                "ocr": args.ocr_workers,
+                "enrich": args.enrich_workers,
+                "tts": args.tts_workers,
+            },
+            max_tokens=args.batch_tokens,
+            progress=throughput,
+        )
+    except GroqAuthenticationError as err:
+        raise RuntimeError("GROQ_API_KEY is invalid or not set.") from err
+    except ValueError as err:
+        raise RuntimeError(str(err)) from err
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        journal.close()
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+    print(throughput.report())
+    for stage, counts in stats.items():
+        print(f"{stage}: " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+    print(f"Finished in {elapsed:.1f}s")
+    if is_complete(stats):
+        remove_run(journal)
+    else:
+        print("Some items did not finish; run the same command again to retry them.")
+
+
+def vocab(args: argparse.Namespace):
+    from kioku.services.vocab_index import vocab_index
+
+    stats = vocab_index.sync()
+    print(
+        f"{stats['words']} known word(s): {stats['added']} added, "
+        f"{stats['updated']} updated, {stats['removed']} removed"
+    )
+
+
+def importtime(args: argparse.Namespace):
+    from kioku import importtime as profiler
+
+    records = profiler.profile(args.module)
+    print(profiler.format_report(args.module, records, args.top))
+    heavy = profiler.heavy_imports(records)
+    if args.strict and heavy:
+        raise RuntimeError(f"{args.module} eagerly imports {', '.join(heavy)}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="kioku", description="Japanese Anki card generator")
+    sub = parser.add_subparsers(dest="command")
+
+    serve_parser = sub.add_parser("serve", help="run the web server (default)")
+    serve_parser.add_argument(
+        "-w", "--workers", type=int, help="API worker processes (default: $WORKERS or 1)"
+    )
+    serve_parser.add_argument(
+        "--ocr",
+        choices=OCR_MODES,
+        help="where Manga OCR runs: in each worker (inline) or in one shared process;"
+        " auto shares it when there is more than one worker (default: $OCR_MODE or auto)",
+    )
+    serve_parser.add_argument(
+        "--ocr-socket", help="Unix socket for the shared OCR process (default: a temp path)"
+    )
+    serve_parser.set_defaults(func=serve)
+
+    ocr_parser = sub.add_parser(
+        "ocr-server", help="run only the shared Manga OCR process on a Unix socket"
+    )
+    ocr_parser.add_argument("--socket", help="socket path (default: $OCR_SOCKET)")
+    ocr_parser.set_defaults(func=ocr_server)
+
+    export_parser = sub.add_parser("export", help="write cards from a JSON file to an .apkg")
+    export_parser.add_argument("cards", help='JSON file with a list of cards or {"cards": [...]}')
+    export_parser.add_argument("-o", "--output", default="kioku.apkg", help="output .apkg path")
+    export_parser.add_argument("--deck", default="ankiGen", help="deck name inside the package")
+    export_parser.add_argument(
+        "--no-audio", action="store_true", help="skip VOICEVOX and export text only"
+    )
+    export_parser.add_argument(
+        "--media",
+        help="video or audio file to clip sentence audio from, using the cards' cue times",
+    )
+    export_parser.add_argument(
+        "--audio-stream", type=int, default=0, help="audio track of --media to clip (default: 0)"
+    )
+    export_parser.set_defaults(func=export)
+
+    subtitles_parser = sub.add_parser(
+        "subtitles", help="turn a .srt, .vtt or .ass file into cards in a JSON file"
+    )
+    subtitles_parser.add_argument("file", help="subtitle file")
+    subtitles_parser.add_argument("-o", "--output", default="cards.json", help="output JSON path")
+    subtitles_parser.add_argument(
+        "--format", choices=("srt", "vtt", "ass"), help="subtitle format (default: from the name)"
+    )
+    subtitles_parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="keep lines that an earlier ingest already turned into cards",
+    )
+    subtitles_parser.add_argument(
+        "--batch-tokens",
+        type=int,
+        help="subtitle tokens per Groq call (default: $SUBTITLE_BATCH_TOKENS or 300)",
+    )
+    subtitles_parser.set_defaults(func=subtitles)
+
+    pages_parser = sub.add_parser(
+        "pages", help="OCR every page of a .zip/.cbz, .pdf or image directory into cards"
+    )
+    pages_parser.add_argument("file", help="archive, PDF or directory of page images")
+    pages_parser.add_argument("-o", "--output", default="cards.json", help="output JSON path")
+    pages_parser.add_argument(
+        "--journal",
+        help="checkpoint file an interrupted run resumes from (default: OUTPUT.journal)",
+    )
+    pages_parser.add_argument(
+        "--ocr-workers", type=int, help="pages OCR'd at once (default: $PAGE_OCR_WORKERS or 2)"
+    )
+    pages_parser.add_argument(
+        "--prefetch",
+        type=int,
+        help="pages read ahead of the OCR (default: $PAGE_PREFETCH or 4)",
+    )
+    pages_parser.add_argument(
+        "--batch-tokens",
+        type=int,
+        help="page text tokens per Groq call (default: $PAGE_BATCH_TOKENS or 300)",
+    )
+    pages_parser.set_defaults(func=pages)
+
+    batch_parser = sub.add_parser(
+        "batch",
+        help="run OCR/enrich → TTS → Anki or .apkg over a whole directory or text file,"
+        " resuming an interrupted run",
+    )
+    batch_parser.add_argument(
+        "kind",
+        choices=("images", "text"),
+        help="images: a directory of images, .zip/.cbz or .pdf; text: one sentence per line",
+    )
+    batch_parser.add_argument("source", help="directory, archive, PDF or text file")
+    batch_parser.add_argument("--deck", default="ankiGen", help="Anki deck name")
+    batch_parser.add_argument(
+        "--apkg", help="write an .apkg package here instead of adding notes through AnkiConnect"
+    )
+    batch_parser.add_argument(
+        "--no-audio", action="store_true", help="skip VOICEVOX and add text-only notes"
+    )
+    batch_parser.add_argument(
+        "--journal",
+        help="checkpoint file an interrupted run resumes from (default: one per source"
+        " and target in the data directory)",
+    )
+    batch_parser.add_argument(
+        "--ocr-workers", type=int, help="pages OCR'd at once (default: $PAGE_OCR_WORKERS or 2)"
+    )
+    batch_parser.add_argument(
+        "--enrich-workers",
+        type=int,
+        help="Groq calls at once (default: $PAGE_ENRICH_CONCURRENCY or"
+        " $SUBTITLE_ENRICH_CONCURRENCY, 2)",
+    )
+    batch_parser.add_argument(
+        "--tts-workers",
+        type=int,
+        help="VOICEVOX requests at once (default: $BATCH_TTS_WORKERS or 4)",
+    )
+    batch_parser.add_argument(
+        "--batch-tokens", type=int, help="text tokens per Groq call (default: 300)"
+    )
+    batch_parser.set_defaults(func=batch)
+
+    vocab_parser = sub.add_parser(
+        "vocab", help="sync the index of words already in Anki, so they are skipped"
+    )
+    vocab_parser.set_defaults(func=vocab)
+
+    importtime_parser = sub.add_parser(
+        "importtime", help="profile how long importing the app takes, by package"
+    )
+    importtime_parser.add_argument("module", nargs="?", default="kioku.main")
+    importtime_parser.add_argument("--top", type=int, default=15, help="packages to list")
+    importtime_parser.add_argument(
+        "--strict", action="store_true", help="exit 1 if a heavy dependency is imported"
+    )
+    importtime_parser.set_defaults(func=importtime)
+
+    parser.set_defaults(func=serve)
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except RuntimeError as err:
+        print(f"kioku: {err}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,334 @@
+"""Idempotency keys for requests that write to Anki.
+
+A client sends the same ``Idempotency-Key`` header with every retry of one
+generate request. The key is scoped to the deck and a hash of the cards and
+of any captured sentence audio, so reusing it for different cards or another
+recording starts a new execution instead of replaying an unrelated result.
+While the first execution runs, duplicates wait for it; once it succeeds its
+result is kept for IDEMPOTENCY_TTL seconds (at most IDEMPOTENCY_MAX_KEYS
+results) and replayed. Failures are not kept, so a retry after an error runs
+again.
+
+Keys live in SQLite in the data directory, so every worker of
+``kioku serve --workers N`` sees them: a retry that reaches another worker
+waits for the execution already running elsewhere, or replays its result.
+The worker running a key refreshes a heartbeat on it; a key whose heartbeat
+is older than RUNNING_STALE_AFTER lost its worker and runs again.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import BinaryIO
+
+from kioku import metrics
+from kioku.models import GenerateRequest
+from kioku.utils import data_dir
+
+DEFAULT_IDEMPOTENCY_MAX_KEYS = "1000"
+DEFAULT_IDEMPOTENCY_TTL = "86400"
+MAX_KEY_LENGTH = 255
+DIGEST_CHUNK_BYTES = 1024 * 1024
+# How often a request waiting on another worker's execution checks for its result
+IDEMPOTENCY_POLL_INTERVAL = 0.2
+RUNNING_HEARTBEAT_INTERVAL = 5.0
+RUNNING_STALE_AFTER = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    result TEXT,
+    stored_at REAL,
+    expires_at REAL,
+    heartbeat_at REAL
+);
+"""
+
+metrics.describe(
+    "kioku_idempotent_requests_total",
+    "Requests carrying an Idempotency-Key by endpoint and outcome (executed, attached, replayed).",
+)
+
+
+def audio_digest(audio: BinaryIO) -> str:
+    """SHA-256 of an uploaded recording, read in chunks; the file is rewound after."""
+    digest = hashlib.sha256()
+    while chunk := audio.read(DIGEST_CHUNK_BYTES):
+        digest.update(chunk)
+    audio.seek(0)
+    return digest.hexdigest()
+
+
+def scoped_key(key: str, req: GenerateRequest, audio: str | None = None) -> str:
+    """The client's key combined with the deck and a content hash of the cards.
+
+    ``audio`` is the ``audio_digest`` of sentence audio uploaded alongside
+    the request; audio sent as ``sentence_audio_b64`` is hashed from ``req``.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters.")
+    cards = json.dumps(
+        [card.model_dump() for card in req.cards], ensure_ascii=False, sort_keys=True
+    )
+    content = hashlib.sha256(cards.encode("utf-8")).hexdigest()
+    if audio is None and req.sentence_audio_b64:
+        audio = hashlib.sha256(req.sentence_audio_b64.encode("ascii")).hexdigest()
+    return hashlib.sha256(
+        f"{key}\0{req.deck_name}\0{content}\0{audio or ''}".encode("utf-8")
+    ).hexdigest()
+
+
+class IdempotencyStore:
+    """Executions in flight and a bounded, expiring store of their results.
+
+    Results and the claims of running executions are rows in SQLite; the
+    tasks running here and the requests waiting on them are tracked in
+    memory.
+    """
+
+    def __init__(
+        self,
+        max_keys: int | None = None,
+        ttl: float | None = None,
+        path: Path | None = None,
+    ):
+        self.max_keys = (
+            max_keys
+            if max_keys is not None
+            else int(os.environ.get("IDEMPOTENCY_MAX_KEYS", DEFAULT_IDEMPOTENCY_MAX_KEYS))
+        )
+        self.ttl = (
+            ttl
+            if ttl is not None
+            else float(os.environ.get("IDEMPOTENCY_TTL", DEFAULT_IDEMPOTENCY_TTL))
+        )
+        self._path = path
+        self._running: dict[str, asyncio.Task] = {}
+        # key -> set once the request here checking the store for it is done
+        self._claiming: dict[str, asyncio.Event] = {}
+        # execution -> requests currently waiting for it
+        self._waiters: dict[asyncio.Task, int] = {}
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "idempotency.sqlite3"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def __len__(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM idempotency_keys WHERE result IS NOT NULL AND expires_at > ?",
+                (time.time(),),
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def clear(self):
+        self._running.clear()
+        self._claiming.clear()
+        self._waiters.clear()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM idempotency_keys")
+        finally:
+            conn.close()
+
+    def _claim(self, key: str) -> tuple[str, dict | None]:
+        """``("stored", result)``, ``("running", None)`` if a live worker runs it, else claim it.
+
+        A successful claim returns ``("claimed", None)``; the caller must
+        then run the key and ``_save`` or ``_release`` it.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT result, expires_at, heartbeat_at FROM idempotency_keys WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and row["result"] is not None and row["expires_at"] > now:
+                    return "stored", json.loads(row["result"])
+                if row is not None and row["result"] is None:
+                    if row["heartbeat_at"] >= now - RUNNING_STALE_AFTER:
+                        return "running", None
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys (key, heartbeat_at) VALUES (?, ?)",
+                    (key, now),
+                )
+                return "claimed", None
+        finally:
+            conn.close()
+
+    def _heartbeat(self, key: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE idempotency_keys SET heartbeat_at = ? WHERE key = ? AND result IS NULL",
+                    (time.time(), key),
+                )
+        finally:
+            conn.close()
+
+    def _save(self, key: str, result: dict):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE idempotency_keys SET result = ?, stored_at = ?, expires_at = ?,"
+                    " heartbeat_at = NULL WHERE key = ?",
+                    (json.dumps(result), now, now + self.ttl, key),
+                )
+                conn.execute(
+                    "DELETE FROM idempotency_keys WHERE result IS NOT NULL AND expires_at <= ?",
+                    (now,),
+                )
+                conn.execute(
+                    "DELETE FROM idempotency_keys WHERE result IS NOT NULL AND key NOT IN"
+                    " (SELECT key FROM idempotency_keys WHERE result IS NOT NULL"
+                    " ORDER BY stored_at DESC LIMIT ?)",
+                    (self.max_keys,),
+                )
+        finally:
+            conn.close()
+
+    def _release(self, key: str):
+        """Drop the claim of an execution that failed, so a retry runs again."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND result IS NULL", (key,))
+        finally:
+            conn.close()
+
+    async def _keep_claim(self, key: str):
+        while True:
+            await asyncio.sleep(RUNNING_HEARTBEAT_INTERVAL)
+            await asyncio.to_thread(self._heartbeat, key)
+
+    async def _execute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        claim = asyncio.ensure_future(self._keep_claim(key))
+        try:
+            result = await compute()
+        except BaseException:
+            claim.cancel()
+            await asyncio.to_thread(self._release, key)
+            raise
+        claim.cancel()
+        await asyncio.to_thread(self._save, key, result)
+        return result
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[dict]],
+        endpoint: str = "generate",
+    ) -> tuple[dict, bool]:
+        """Return ``(result, replayed)`` for ``key``, running ``compute`` at most once.
+
+        ``replayed`` is True when the result came from an earlier request
+        rather than from this one's own execution. A cancelled caller stops
+        waiting but the execution carries on; see ``cancel``.
+        """
+        replayed = True
+        waited = False
+        task = self._running.get(key)
+        while task is None:
+            claiming = self._claiming.get(key)
+            if claiming is not None:
+                # Another request here is checking the store; see what it found
+                await claiming.wait()
+                task = self._running.get(key)
+                continue
+            self._claiming[key] = claiming = asyncio.Event()
+            claim = asyncio.ensure_future(asyncio.to_thread(self._claim, key))
+            cancelled = None
+            try:
+                try:
+                    state, stored = await asyncio.shield(claim)
+                except asyncio.CancelledError as e:
+                    # The claim goes through anyway; start what it claimed so a retry
+                    # attaches to it instead of waiting for the claim to go stale
+                    await asyncio.wait([claim])
+                    if claim.cancelled() or claim.exception() is not None:
+                        raise
+                    (state, stored), cancelled = claim.result(), e
+                if state == "claimed":
+                    # A task, so the execution outlives a client that disconnects
+                    # and its retry can attach to it
+                    task = asyncio.ensure_future(self._execute(key, compute))
+                    self._running[key] = task
+                    task.add_done_callback(lambda done: self._finished(key, done))
+                    replayed = False
+            finally:
+                self._claiming.pop(key, None)
+                claiming.set()
+            if cancelled is not None:
+                raise cancelled
+            if state == "stored":
+                outcome = "attached" if waited else "replayed"
+                metrics.inc("kioku_idempotent_requests_total", endpoint=endpoint, outcome=outcome)
+                return stored, True
+            if state == "running":
+                # Another worker runs it and stores the result for us
+                waited = True
+                await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+                task = self._running.get(key)
+        metrics.inc(
+            "kioku_idempotent_requests_total",
+            endpoint=endpoint,
+            outcome="attached" if replayed else "executed",
+        )
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            remaining = self._waiters.pop(task, 1) - 1
+            if remaining:
+                self._waiters[task] = remaining
+        return copy.deepcopy(result), replayed
+
+    def waiters(self, key: str) -> int:
+        """How many requests in this process are waiting for the execution of ``key``."""
+        return self._waiters.get(self._running.get(key), 0)
+
+    def cancel(self, key: str):
+        """Cancel the execution of ``key`` running in this process, if any."""
+        task = self._running.get(key)
+        if task is not None:
+            task.cancel()
+
+    def forget(self, key: str):
+        """Drop the stored result for ``key`` so its next request runs again."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM idempotency_keys WHERE key = ? AND result IS NOT NULL", (key,)
+                )
+        finally:
+            conn.close()
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._running.get(key) is task:
+            del self._running[key]
+
+
+idempotency = IdempotencyStore()
@@ -0,0 +1,75 @@
+"""Summarise ``python -X importtime`` for a Kioku module.
+
+``kioku importtime`` imports the module in a fresh interpreter, groups the
+per-module self times by top-level package and lists any of the heavy
+dependencies (Manga OCR, torch, Groq, Pillow) that were pulled in eagerly.
+"""
+
+import subprocess
+import sys
+from dataclasses import dataclass
+
+# Loaded at the point of use; importing them at startup costs seconds
+HEAVY_MODULES = ("manga_ocr", "torch", "transformers", "groq", "PIL")
+
+
+@dataclass
+class ImportRecord:
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse(stderr: str) -> list[ImportRecord]:
+    """Parse the ``import time:`` lines written by ``-X importtime``."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the column header
+        records.append(ImportRecord(fields[2].strip(), int(fields[0]), int(fields[1])))
+    return records
+
+
+def profile(module: str = "kioku.main") -> list[ImportRecord]:
+    """Import ``module`` in a new interpreter and return its import records."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr.strip()[-2000:]}")
+    return parse(result.stderr)
+
+
+def by_package(records: list[ImportRecord]) -> list[tuple[str, int, int]]:
+    """``(package, self_us, modules)`` rows, slowest package first."""
+    totals: dict[str, list[int]] = {}
+    for record in records:
+        row = totals.setdefault(record.module.split(".")[0], [0, 0])
+        row[0] += record.self_us
+        row[1] += 1
+    rows = [(name, total, count) for name, (total, count) in totals.items()]
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+def heavy_imports(records: list[ImportRecord]) -> list[str]:
+    loaded = {record.module.split(".")[0] for record in records}
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def format_report(module: str, records: list[ImportRecord], top: int = 15) -> str:
+    target = next((r for r in records if r.module == module), None)
+    total = target.cumulative_us if target else sum(r.self_us for r in records)
+    lines = [
+        f"import {module}: {total / 1e3:.0f} ms",
+        f"{'package':<24}{'self ms':>10}{'modules':>9}",
+    ]
+    for name, self_us, count in by_package(records)[:top]:
+        lines.append(f"{name:<24}{self_us / 1e3:>10.1f}{count:>9}")
+    heavy = heavy_imports(records)
+    lines.append(f"heavy modules imported: {', '.join(heavy) if heavy else 'none'}")
+    return "\n".join(lines)
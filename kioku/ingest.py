@@ -0,0 +1,583 @@
+"""Bulk ingestion: turn a whole subtitle file or manga volume into cards.
+
+A subtitle file is parsed as a stream of cues (see ``subtitle_parser``). Sentences
+split across cues are merged, and lines already seen in this file or in an
+earlier ingest are dropped. The remaining lines are sent to ``enrich_text``
+in batches that fit a token budget, with a few batches in flight at once.
+Each card records the start and end of the cue its example sentence came
+from.
+
+Only the current batch, the batches in flight and the digests of lines
+seen so far are held in memory. Cards are handed to ``on_cards`` as each
+batch completes, so a caller that writes them out stays flat too.
+
+A volume (ZIP/CBZ archive, PDF or image directory) is read page by page
+(see ``page_reader``); pages are OCR'd by a small pool and their text is
+enriched in the same kind of batches. Progress is checkpointed in a
+``Journal`` so an interrupted volume resumes where it stopped.
+"""
+
+import contextvars
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Protocol, TypeVar
+
+from kioku.journal import Journal
+from kioku.models import CardItem
+from kioku.pipeline import ProgressCallback, no_progress
+from kioku.services.anki_builder import unique_cards
+from kioku.services.image_processor import (
+    GroqAuthenticationError,
+    GroqError,
+    NoTextError,
+    enrich_text,
+    ocr_image,
+)
+from kioku.services.page_reader import Page, iter_pages, page_names
+from kioku.services.subtitle_parser import (
+    Cue,
+    detect_format,
+    line_key,
+    merge_split_cues,
+    open_text,
+    parse_cues,
+)
+from kioku.utils import data_dir
+
+logger = logging.getLogger(__name__)
+
+# Estimated prompt tokens of subtitle text per Groq call; the answer is
+# several times longer, since every line becomes a sentence card plus one
+# card per word
+DEFAULT_SUBTITLE_BATCH_TOKENS = "300"
+DEFAULT_SUBTITLE_ENRICH_CONCURRENCY = "2"
+DEFAULT_PAGE_BATCH_TOKENS = "300"
+DEFAULT_PAGE_ENRICH_CONCURRENCY = "2"
+DEFAULT_PAGE_OCR_WORKERS = "2"
+# Pages read ahead of the oldest one still being recognised
+DEFAULT_PAGE_PREFETCH = "4"
+# Lines checked against the ingest history per query
+HISTORY_LOOKUP_SIZE = 200
+
+
+class _HasText(Protocol):
+    text: str
+
+
+# A subtitle cue, a page's text, or anything else enriched by its text
+Line = TypeVar("Line", bound=_HasText)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingested_lines (
+    digest TEXT PRIMARY KEY,
+    source TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def line_digest(text: str) -> str:
+    """Compact identity of a line: repeats differing only in width or punctuation match."""
+    return hashlib.blake2b(line_key(text).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: a token per Japanese character, four Latin characters per token."""
+    wide = sum(1 for char in text if ord(char) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4 + 1
+
+
+class IngestHistory:
+    """Digests of subtitle lines already enriched, kept in SQLite across runs."""
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "ingest.sqlite3"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def known(self, digests: list[str]) -> set[str]:
+        """The subset of ``digests`` recorded by earlier ingests."""
+        if not digests:
+            return set()
+        conn = self._connect()
+        try:
+            placeholders = ", ".join("?" for _ in digests)
+            rows = conn.execute(
+                f"SELECT digest FROM ingested_lines WHERE digest IN ({placeholders})", digests
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    def record(self, digests: Iterable[str], source: str = ""):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO ingested_lines (digest, source, created_at)"
+                    " VALUES (?, ?, ?)",
+                    [(digest, source, now) for digest in digests],
+                )
+        finally:
+            conn.close()
+
+
+ingest_history = IngestHistory()
+
+
+def load_card_lines(path: str | Path) -> list[CardItem]:
+    """Read cards written one JSON object per line; a missing file has none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [CardItem.model_validate_json(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def batch_lines(lines: Iterable[Line], max_tokens: int) -> Iterator[list[Line]]:
+    """Group cues or pages into batches whose text fits ``max_tokens``; a longer one goes alone."""
+    batch: list[Line] = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line.text)
+        if batch and used + cost > max_tokens:
+            yield batch
+            batch, used = [], 0
+        batch.append(line)
+        used += cost
+    if batch:
+        yield batch
+
+
+def enrich_batches(
+    batches: Iterable[list[Line]],
+    concurrency: int,
+    stop: threading.Event | None = None,
+) -> Iterator[tuple[list[Line], list[CardItem] | None]]:
+    """Send each batch's text to ``enrich_text``, ``concurrency`` calls at a time.
+
+    Yields ``(batch, cards)`` in batch order, with ``cards`` None when the
+    call failed; a rejected API key is raised instead. Batches are pulled
+    from ``batches`` only as calls finish, so a lazy source stays lazy.
+    Setting ``stop`` abandons the run before its next batch.
+    """
+    concurrency = max(concurrency, 1)
+    in_flight: deque[tuple[list[Line], Future]] = deque()
+
+    def finish() -> tuple[list[Line], list[CardItem] | None]:
+        batch, future = in_flight.popleft()
+        try:
+            return batch, future.result()
+        except GroqAuthenticationError:
+            raise
+        except (GroqError, RuntimeError) as err:
+            logger.warning("could not enrich %d line(s): %s", len(batch), err)
+            return batch, None
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="kioku-ingest") as pool:
+        try:
+            pending = iter(batches)
+            while True:
+                if stop is not None and stop.is_set():
+                    return
+                batch = next(pending, None)
+                if batch is None:
+                    break
+                text = "\n".join(line.text for line in batch)
+                # Carry the caller's context (priority class, trace) into the pool
+                context = contextvars.copy_context()
+                in_flight.append((batch, pool.submit(context.run, enrich_text, text)))
+                while in_flight and (len(in_flight) >= concurrency or in_flight[0][1].done()):
+                    yield finish()
+            while in_flight:
+                yield finish()
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+
+def assign_timestamps(cards: list[CardItem], cues: list[Cue]) -> list[CardItem]:
+    """Set each card's cue times from the cue its example sentence (or word) came from."""
+    by_key = {line_key(cue.text): cue for cue in cues}
+    for card in cards:
+        cue = None
+        for text in (card.example_sentence, card.japanese):
+            key = line_key(text)
+            cue = by_key.get(key) or next(
+                (found for cue_key, found in by_key.items() if key and key in cue_key), None
+            )
+            if cue is not None:
+                break
+        if cue is not None:
+            card.cue_start, card.cue_end = cue.start, cue.end
+    return cards
+
+
+def ingest_subtitles(
+    path: str | Path,
+    fmt: str | None = None,
+    progress: ProgressCallback = no_progress,
+    on_cards: Callable[[list[CardItem]], None] | None = None,
+    history: IngestHistory | None = ingest_history,
+    source: str | None = None,
+    max_tokens: int | None = None,
+    concurrency: int | None = None,
+    stop: threading.Event | None = None,
+) -> dict:
+    """Parse a subtitle file and enrich its new lines into cards.
+
+    Progress is reported as ``parse`` (bytes read of the file) and
+    ``enrich`` (batches finished of those formed so far). Pass
+    ``history=None`` to ignore earlier ingests; setting ``stop`` abandons the
+    run before its next batch. Returns counts, plus the cards
+    themselves unless ``on_cards`` consumed them.
+    """
+    path = Path(path)
+    source = source or path.name
+    # Otherwise every batch would fail on its own
+    if not os.environ.get("GROQ_API_KEY", "").strip():
+        raise RuntimeError("GROQ_API_KEY is required.")
+    if max_tokens is None:
+        max_tokens = int(os.environ.get("SUBTITLE_BATCH_TOKENS", DEFAULT_SUBTITLE_BATCH_TOKENS))
+    if concurrency is None:
+        concurrency = int(
+            os.environ.get("SUBTITLE_ENRICH_CONCURRENCY", DEFAULT_SUBTITLE_ENRICH_CONCURRENCY)
+        )
+    size = path.stat().st_size
+    stats = {"cues": 0, "lines": 0, "repeated": 0, "known": 0, "failed": 0, "batches": 0}
+    collected: list[dict] = []
+    emitted: set[str] = set()
+    seen: set[str] = set()
+
+    def emit(cards: list[CardItem]):
+        # Words recur across batches; keep the first card for each
+        fresh = [card for card in cards if card.japanese not in emitted]
+        emitted.update(card.japanese for card in fresh)
+        if on_cards is not None:
+            on_cards(fresh)
+        else:
+            collected.extend(card.model_dump() for card in fresh)
+
+    with open_text(path) as f:
+        if fmt is None:
+            # The first line is a header or cue number in every format
+            fmt = detect_format(source, f.readline())
+
+        def counted(cues: Iterable[Cue]) -> Iterator[Cue]:
+            for cue in cues:
+                stats["cues"] += 1
+                yield cue
+
+        def new_lines(cues: Iterable[Cue]) -> Iterator[Cue]:
+            for cue in cues:
+                digest = line_digest(cue.text)
+                if digest in seen:
+                    stats["repeated"] += 1
+                    continue
+                seen.add(digest)
+                yield cue
+
+        def unknown(cues: Iterable[Cue]) -> Iterator[Cue]:
+            if history is None:
+                yield from cues
+                return
+            window: list[Cue] = []
+            for cue in cues:
+                window.append(cue)
+                if len(window) >= HISTORY_LOOKUP_SIZE:
+                    yield from drop_known(window)
+                    window = []
+            yield from drop_known(window)
+
+        def drop_known(window: list[Cue]) -> list[Cue]:
+            # One query per window keeps lookups cheap without holding the file
+            digests = [line_digest(cue.text) for cue in window]
+            known = history.known(digests)
+            stats["known"] += sum(1 for digest in digests if digest in known)
+            return [cue for cue, digest in zip(window, digests) if digest not in known]
+
+        def counted_batches(batches: Iterable[list[Cue]]) -> Iterator[list[Cue]]:
+            for batch in batches:
+                stats["batches"] += 1
+                stats["lines"] += len(batch)
+                progress("parse", f.buffer.tell(), size)
+                yield batch
+            progress("parse", size, size)
+
+        cues = unknown(new_lines(merge_split_cues(counted(parse_cues(f, fmt)))))
+        batches = counted_batches(batch_lines(cues, max_tokens))
+        finished = 0
+        for batch, cards in enrich_batches(batches, concurrency, stop):
+            if cards is None:
+                # Not recorded in the history, so a re-run retries these lines
+                stats["failed"] += len(batch)
+            else:
+                emit(assign_timestamps(cards, batch))
+                if history is not None:
+                    history.record((line_digest(cue.text) for cue in batch), source)
+            finished += 1
+            progress("enrich", finished, stats["batches"])
+
+    result = {**stats, "cards": len(emitted)}
+    if on_cards is None:
+        result["cards"] = collected
+    return result
+
+
+@dataclass
+class NumberedText:
+    """The text of one page or line, numbered in reading order."""
+
+    index: int
+    text: str
+
+
+def item_key(index: int) -> str:
+    """Journal key of a page or line; zero-padded so keys sort in reading order."""
+    return f"{index:06d}"
+
+
+def journal_cards(journal: Journal) -> list[CardItem]:
+    """Every card a journal holds, in reading order, first card per word."""
+    cards = [
+        CardItem(**card) for _, entry in journal.items("enrich") for card in entry["cards"]
+    ]
+    return unique_cards(cards)[0]
+
+
+def _enriched_items(journal: Journal) -> set[int]:
+    return {int(index) for _, entry in journal.items("enrich") for index in entry["items"]}
+
+
+def _enrich_into_journal(
+    texts: Iterable[NumberedText],
+    journal: Journal,
+    stats: dict,
+    progress: ProgressCallback,
+    max_tokens: int,
+    concurrency: int,
+    stop: threading.Event | None,
+):
+    """Enrich numbered texts in batches, recording each batch's cards in ``journal``."""
+
+    def counted(batches: Iterable[list[NumberedText]]) -> Iterator[list[NumberedText]]:
+        for batch in batches:
+            stats["batches"] += 1
+            yield batch
+
+    finished = 0
+    batches = counted(batch_lines(texts, max_tokens))
+    for batch, cards in enrich_batches(batches, concurrency, stop):
+        if cards is None:
+            # No cards recorded for these items, so a resumed run retries them
+            stats["failed"] += len(batch)
+        else:
+            journal.record(
+                "enrich",
+                item_key(batch[0].index),
+                {
+                    "items": [item.index for item in batch],
+                    "cards": [card.model_dump() for card in cards],
+                },
+            )
+        finished += 1
+        progress("enrich", finished, stats["batches"])
+
+
+def ingest_pages(
+    path: str | Path,
+    progress: ProgressCallback = no_progress,
+    journal: Journal | None = None,
+    max_tokens: int | None = None,
+    ocr_workers: int | None = None,
+    prefetch: int | None = None,
+    concurrency: int | None = None,
+    stop: threading.Event | None = None,
+) -> dict:
+    """OCR the pages of an archive, PDF or image directory and enrich them into cards.
+
+    Pages are read one at a time (see ``page_reader``) and OCR'd by
+    ``ocr_workers`` threads, with at most ``prefetch`` pages read ahead of
+    the oldest one still being recognised. Their text goes to Groq in
+    batches, as for subtitles. Each page's text and each batch's cards are
+    recorded in ``journal``, so a run resumed with the same journal OCRs
+    only pages without text and enriches only pages without cards; without
+    a journal a temporary one is used.
+
+    Progress is reported as ``ocr`` (pages done of the volume) and
+    ``enrich`` (batches finished of those formed so far). Returns counts
+    and every card in the journal.
+    """
+    if not os.environ.get("GROQ_API_KEY", "").strip():
+        raise RuntimeError("GROQ_API_KEY is required.")
+    if max_tokens is None:
+        max_tokens = int(os.environ.get("PAGE_BATCH_TOKENS", DEFAULT_PAGE_BATCH_TOKENS))
+    if ocr_workers is None:
+        ocr_workers = int(os.environ.get("PAGE_OCR_WORKERS", DEFAULT_PAGE_OCR_WORKERS))
+    if prefetch is None:
+        prefetch = int(os.environ.get("PAGE_PREFETCH", DEFAULT_PAGE_PREFETCH))
+    if concurrency is None:
+        concurrency = int(
+            os.environ.get("PAGE_ENRICH_CONCURRENCY", DEFAULT_PAGE_ENRICH_CONCURRENCY)
+        )
+    prefetch = max(prefetch, ocr_workers, 1)
+    total = len(page_names(path))
+
+    with ExitStack() as stack:
+        if journal is None:
+            scratch = stack.enter_context(tempfile.TemporaryDirectory(prefix="kioku-pages-"))
+            journal = stack.enter_context(Journal(Path(scratch) / "journal.sqlite3"))
+        enriched = _enriched_items(journal)
+        stats = {"pages": total, "read": 0, "resumed": 0, "blank": 0, "failed": 0, "batches": 0}
+        pages_done = 0
+
+        def finish_page(page: Page, future: Future | None) -> NumberedText | None:
+            nonlocal pages_done
+            key = item_key(page.index)
+            text: str | None
+            if page.index in enriched:
+                stats["resumed"] += 1
+                text = None
+            elif future is None:
+                stats["resumed"] += 1
+                text = journal.get("ocr", key)
+            else:
+                try:
+                    text = future.result()
+                    stats["read"] += 1
+                except NoTextError:
+                    text = ""
+                    stats["read"] += 1
+                except (RuntimeError, OSError) as err:
+                    # Not recorded, so a resumed run reads the page again
+                    logger.warning("could not OCR %s: %s", page.name, err)
+                    stats["failed"] += 1
+                    text = None
+                else:
+                    text = text.strip()
+                if text is not None:
+                    journal.record("ocr", key, text)
+            pages_done += 1
+            progress("ocr", pages_done, total)
+            if text == "":
+                stats["blank"] += 1
+            return NumberedText(page.index, text) if text else None
+
+        def page_texts(pool: ThreadPoolExecutor) -> Iterator[NumberedText]:
+            in_flight: deque[tuple[Page, Future | None]] = deque()
+
+            def skip(index: int) -> bool:
+                return index in enriched or journal.done("ocr", item_key(index))
+
+            try:
+                for page in iter_pages(path, skip):
+                    future = None
+                    if page.data is not None:
+                        context = contextvars.copy_context()
+                        future = pool.submit(context.run, ocr_image, page.data)
+                    in_flight.append((page, future))
+                    # Only the pages in flight hold image bytes
+                    while in_flight and (
+                        len(in_flight) >= prefetch
+                        or in_flight[0][1] is None
+                        or in_flight[0][1].done()
+                    ):
+                        found = finish_page(*in_flight.popleft())
+                        if found is not None:
+                            yield found
+                while in_flight:
+                    found = finish_page(*in_flight.popleft())
+                    if found is not None:
+                        yield found
+            finally:
+                # Stopped early: drop pages not started, keep text already read
+                for page, future in in_flight:
+                    if future is None or future.cancel() or future.exception() is not None:
+                        continue
+                    journal.record("ocr", item_key(page.index), future.result().strip())
+
+        with ThreadPoolExecutor(max(ocr_workers, 1), thread_name_prefix="kioku-ocr") as pool:
+            texts = stack.enter_context(closing(page_texts(pool)))
+            _enrich_into_journal(texts, journal, stats, progress, max_tokens, concurrency, stop)
+
+        cards = journal_cards(journal)
+    return {**stats, "cards": [card.model_dump() for card in cards]}
+
+
+def ingest_lines(
+    path: str | Path,
+    progress: ProgressCallback = no_progress,
+    journal: Journal | None = None,
+    max_tokens: int | None = None,
+    concurrency: int | None = None,
+    stop: threading.Event | None = None,
+) -> dict:
+    """Enrich a text file holding one sentence per line into cards.
+
+    The file is read as a stream; blank lines and repeats are skipped and
+    the rest batched as subtitle lines are. As in ``ingest_pages``, each
+    batch's cards are recorded in ``journal`` and a resumed run only sends
+    lines without cards. Progress is reported as ``parse`` (bytes read of
+    the file) and ``enrich``. Returns counts and every card in the journal.
+    """
+    path = Path(path)
+    if not os.environ.get("GROQ_API_KEY", "").strip():
+        raise RuntimeError("GROQ_API_KEY is required.")
+    if max_tokens is None:
+        max_tokens = int(os.environ.get("SUBTITLE_BATCH_TOKENS", DEFAULT_SUBTITLE_BATCH_TOKENS))
+    if concurrency is None:
+        concurrency = int(
+            os.environ.get("SUBTITLE_ENRICH_CONCURRENCY", DEFAULT_SUBTITLE_ENRICH_CONCURRENCY)
+        )
+    size = path.stat().st_size
+
+    with ExitStack() as stack:
+        if journal is None:
+            scratch = stack.enter_context(tempfile.TemporaryDirectory(prefix="kioku-lines-"))
+            journal = stack.enter_context(Journal(Path(scratch) / "journal.sqlite3"))
+        enriched = _enriched_items(journal)
+        stats = {"lines": 0, "resumed": 0, "repeated": 0, "failed": 0, "batches": 0}
+        f = stack.enter_context(open_text(path))
+
+        def texts() -> Iterator[NumberedText]:
+            seen: set[str] = set()
+            for index, line in enumerate(f):
+                text = line.strip()
+                if not text:
+                    continue
+                digest = line_digest(text)
+                if digest in seen:
+                    stats["repeated"] += 1
+                    continue
+                seen.add(digest)
+                stats["lines"] += 1
+                if index in enriched:
+                    stats["resumed"] += 1
+                    continue
+                progress("parse", f.buffer.tell(), size)
+                yield NumberedText(index, text)
+            progress("parse", size, size)
+
+        _enrich_into_journal(texts(), journal, stats, progress, max_tokens, concurrency, stop)
+        cards = journal_cards(journal)
+    return {**stats, "cards": [card.model_dump() for card in cards]}
@@ -0,0 +1,661 @@
+"""Background jobs for long-running card pipelines.
+
+Jobs are persisted in SQLite so their records survive restarts; jobs that
+were queued or running when the server stopped are picked up again on the
+next start. A running job carries its worker's id and a heartbeat, so a
+restarted primary leaves jobs that live workers are running alone and only
+requeues those whose heartbeat has gone stale. Progress is pushed to subscribers (the SSE endpoint) as each
+stage advances; jobs running in another worker process are followed by
+polling the store. A cancel that reaches a worker not running the job is
+recorded in the store, and the worker running it picks it up the same way.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from pathlib import Path
+
+from kioku import admission, metrics, tracing
+from kioku.ingest import ingest_history, ingest_pages, ingest_subtitles, load_card_lines
+from kioku.journal import Journal, remove_journal
+from kioku.models import CardItem, GenerateRequest
+from kioku.pipeline import COMMIT_STAGES, ProgressCallback, run_generate
+from kioku.services.anki_builder import unique_cards
+from kioku.utils import data_dir
+
+DEFAULT_JOB_WORKERS = "2"
+DEFAULT_JOB_QUEUE_LIMIT = "100"
+JOB_RETRY_AFTER = 30
+EVENTS_POLL_INTERVAL = 1.0
+# Workers refresh the heartbeat of the jobs they run this often; a running job
+# whose heartbeat is older than JOB_STALE_AFTER lost its worker and is requeued
+JOB_HEARTBEAT_INTERVAL = 5.0
+JOB_STALE_AFTER = 30.0
+TERMINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+
+# A handler receives the stored request payload and a progress callback and
+# returns the JSON-serialisable job result.
+JobHandler = Callable[[dict, ProgressCallback], Awaitable[dict]]
+# Removes the files a job's payload points at once it is cancelled; handlers
+# keep them when cancelled by a shutdown, so the job can resume on restart
+JobCleanup = Callable[[dict], None]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    heartbeat_at REAL
+);
+"""
+
+# Columns added after the first release, created on stores that predate them
+_COLUMNS = {
+    "cancel_requested": "ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0",
+    "owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+    "heartbeat_at": "ALTER TABLE jobs ADD COLUMN heartbeat_at REAL",
+}
+
+
+def job_audio_dir() -> Path:
+    """Where uploaded sentence audio waits until its generate job runs."""
+    path = data_dir() / "job-audio"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def job_upload_dir() -> Path:
+    """Where uploaded files (e.g. subtitles) wait until their ingest job runs."""
+    path = data_dir() / "job-uploads"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _subtitle_files(payload: dict) -> list[Path]:
+    path = Path(payload["path"])
+    return [path, path.with_name(path.name + ".cards.jsonl")]
+
+
+def _remove_subtitle_files(payload: dict):
+    for path in _subtitle_files(payload):
+        path.unlink(missing_ok=True)
+
+
+def _remove_page_files(payload: dict):
+    path = Path(payload["path"])
+    path.unlink(missing_ok=True)
+    remove_journal(path.with_name(path.name + ".journal.sqlite3"))
+
+
+def _remove_generate_files(payload: dict):
+    if payload.get("sentence_audio_path"):
+        Path(payload["sentence_audio_path"]).unlink(missing_ok=True)
+
+
+async def _run_until_stopped(run: Callable[[], dict], stop: threading.Event) -> dict:
+    """Run ``run`` in a thread; when cancelled, set ``stop`` and wait for it to return.
+
+    Waiting means nothing writes to the job's files once the cancellation
+    is seen, so a cancelled job's files can be deleted safely.
+    """
+    work = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        return await asyncio.shield(work)
+    except asyncio.CancelledError:
+        stop.set()
+        await asyncio.wait([work])
+        if not work.cancelled():
+            work.exception()
+        raise
+
+
+async def _subtitles_handler(payload: dict, progress: ProgressCallback) -> dict:
+    """Ingest an uploaded subtitle file; cards are kept on disk as batches finish.
+
+    If the server stops mid-file the job resumes on restart: lines already
+    enriched are in the ingest history, so only the rest go to Groq, and
+    the cards from before the restart are read back from the cards file.
+    """
+    path, cards_path = _subtitle_files(payload)
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+
+    def report(stage: str, done: int, total: int):
+        loop.call_soon_threadsafe(progress, stage, done, total)
+
+    def keep(cards: list[CardItem]):
+        with open(cards_path, "a", encoding="utf-8") as out:
+            for card in cards:
+                out.write(card.model_dump_json() + "\n")
+
+    def run() -> dict:
+        stats = ingest_subtitles(
+            path,
+            payload.get("format"),
+            report,
+            on_cards=keep,
+            history=ingest_history if payload.get("history", True) else None,
+            source=payload.get("name"),
+            stop=stop,
+        )
+        cards, _ = unique_cards(load_card_lines(cards_path))
+        return {**stats, "cards": [card.model_dump() for card in cards]}
+
+    try:
+        result = await _run_until_stopped(run, stop)
+    except asyncio.CancelledError:
+        raise  # kept for a restart; a user cancel deletes them in JobManager._cancelled
+    except BaseException:
+        _remove_subtitle_files(payload)
+        raise
+    _remove_subtitle_files(payload)
+    return result
+
+
+async def _pages_handler(payload: dict, progress: ProgressCallback) -> dict:
+    """OCR and enrich an uploaded archive or PDF, checkpointing every page.
+
+    The journal next to the upload holds each page's text and each batch's
+    cards, so a job resumed after a restart skips the pages already done.
+    """
+    path = Path(payload["path"])
+    journal_path = path.with_name(path.name + ".journal.sqlite3")
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+
+    def report(stage: str, done: int, total: int):
+        loop.call_soon_threadsafe(progress, stage, done, total)
+
+    def run() -> dict:
+        with Journal(journal_path) as journal:
+            return ingest_pages(path, report, journal, stop=stop)
+
+    try:
+        result = await _run_until_stopped(run, stop)
+    except asyncio.CancelledError:
+        raise  # kept for a restart; a user cancel deletes them in JobManager._cancelled
+    except BaseException:
+        _remove_page_files(payload)
+        raise
+    _remove_page_files(payload)
+    return result
+
+
+async def _generate_handler(payload: dict, progress: ProgressCallback) -> dict:
+    audio_path = payload.pop("sentence_audio_path", None)
+    req = GenerateRequest(**payload)
+    if audio_path is None:
+        return await run_generate(req, progress)
+    try:
+        with open(audio_path, "rb") as audio:
+            result = await run_generate(req, progress, sentence_audio=audio)
+    except asyncio.CancelledError:
+        raise  # kept for a restart; a user cancel deletes it in JobManager._cancelled
+    except BaseException:
+        Path(audio_path).unlink(missing_ok=True)
+        raise
+    Path(audio_path).unlink(missing_ok=True)
+    return result
+
+
+class JobStore:
+    """SQLite persistence for job records."""
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "jobs.sqlite3"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, ddl in _COLUMNS.items():
+            if column not in columns:
+                conn.execute(ddl)
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": json.loads(row["progress"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "cancel_requested": bool(row["cancel_requested"]),
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def create(self, kind: str, request: dict) -> dict:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, status, request, created_at, updated_at)"
+                    " VALUES (?, ?, 'queued', ?, ?, ?)",
+                    (job_id, kind, json.dumps(request), now, now),
+                )
+        finally:
+            conn.close()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(row) if row else None
+
+    def request(self, job_id: str) -> tuple[str, dict] | None:
+        """Return ``(kind, request_payload)`` for a job."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT kind, request FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return (row["kind"], json.loads(row["request"])) if row else None
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._to_dict(row) for row in rows]
+
+    def queued(self) -> list[str]:
+        """Ids of queued jobs, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row["id"] for row in rows]
+
+    def requeue_stale(self, stale_before: float) -> list[str]:
+        """Queue again the running jobs whose heartbeat predates ``stale_before``."""
+        stale = "status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE {stale} ORDER BY created_at", (stale_before,)
+            ).fetchall()
+            requeued = []
+            with conn:
+                for row in rows:
+                    # Checked again per job, in case its worker came back meanwhile
+                    cursor = conn.execute(
+                        "UPDATE jobs SET status = 'queued', owner = NULL, updated_at = ?"
+                        f" WHERE id = ? AND {stale}",
+                        (time.time(), row["id"], stale_before),
+                    )
+                    if cursor.rowcount == 1:
+                        requeued.append(row["id"])
+        finally:
+            conn.close()
+        return requeued
+
+    def heartbeat(self, owner: str):
+        """Mark the jobs ``owner`` is running as still alive."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                    (time.time(), owner),
+                )
+        finally:
+            conn.close()
+
+    def count_unfinished(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """Move a queued job to running under ``owner``; False if it was cancelled or taken."""
+        return self._transition(
+            "UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, updated_at = ?"
+            " WHERE id = ? AND status = 'queued' AND cancel_requested = 0",
+            job_id,
+            owner,
+            time.time(),
+        )
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Cancel a job no worker has started; False if one is running it."""
+        return self._transition(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ?"
+            " WHERE id = ? AND status = 'queued'",
+            job_id,
+        )
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Flag an unfinished job for the worker running it to cancel."""
+        return self._transition(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ?"
+            " WHERE id = ? AND status IN ('queued', 'running')",
+            job_id,
+        )
+
+    def _transition(self, sql: str, job_id: str, *values) -> bool:
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(sql, (*values, time.time(), job_id)).rowcount == 1
+        finally:
+            conn.close()
+
+    def update(self, job_id: str, **fields):
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"])
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id)
+                )
+        finally:
+            conn.close()
+
+
+class JobManager:
+    """Run jobs on a pool of asyncio workers and publish their progress.
+
+    Store reads and writes run in threads, so the event loop never waits on
+    SQLite; progress ticks are written behind the handler, latest first.
+    """
+
+    def __init__(self, store: JobStore, workers: int | None = None):
+        self.store = store
+        self._workers = workers
+        # Recorded on the jobs this manager runs, so other workers can tell
+        # whether they are still alive
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: dict[str, JobHandler] = {
+            "generate": _generate_handler,
+            "subtitles": _subtitles_handler,
+            "pages": _pages_handler,
+        }
+        self._cleanups: dict[str, JobCleanup] = {
+            "generate": _remove_generate_files,
+            "subtitles": _remove_subtitle_files,
+            "pages": _remove_page_files,
+        }
+        self._queue: asyncio.Queue[str] | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._running: dict[str, asyncio.Task] = {}
+        self._cancel_requested: set[str] = set()
+        self._committed: set[str] = set()
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+
+    def register(self, kind: str, handler: JobHandler, cleanup: JobCleanup | None = None):
+        """Register the coroutine that runs jobs of ``kind``.
+
+        ``cleanup`` is called with the payload when a job of this kind is
+        cancelled, to delete what it kept on disk for a restart.
+        """
+        self._handlers[kind] = handler
+        if cleanup is not None:
+            self._cleanups[kind] = cleanup
+
+    def start(self, resume: bool = True):
+        """Start the workers and resume jobs left unfinished by a previous run.
+
+        Only one process per store should resume; the others pass
+        ``resume=False`` and run just the jobs submitted to them. A job still
+        running in a live worker is not resumed; see ``_keep_alive``.
+        """
+        if self._worker_tasks:
+            return
+        count = self._workers or int(os.environ.get("JOB_WORKERS", DEFAULT_JOB_WORKERS))
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._worker_tasks = [loop.create_task(self._worker()) for _ in range(count)]
+        self._worker_tasks.append(loop.create_task(self._keep_alive(resume)))
+
+    async def stop(self):
+        """Stop the workers; running jobs are left queued for the next start."""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        self._queue = None
+
+    async def _keep_alive(self, resume: bool):
+        """Heartbeat the jobs running here; with ``resume``, requeue abandoned ones.
+
+        A running job is abandoned once its heartbeat is JOB_STALE_AFTER
+        seconds old: its worker went away without handing it back.
+        """
+        if resume:
+            await asyncio.to_thread(self.store.requeue_stale, time.time() - JOB_STALE_AFTER)
+            for job_id in await asyncio.to_thread(self.store.queued):
+                self._queue.put_nowait(job_id)
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            if self._running:
+                await asyncio.to_thread(self.store.heartbeat, self.owner)
+            if resume:
+                stale_before = time.time() - JOB_STALE_AFTER
+                for job_id in await asyncio.to_thread(self.store.requeue_stale, stale_before):
+                    self._queue.put_nowait(job_id)
+
+    async def submit(self, kind: str, request: dict) -> dict:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        limit = int(os.environ.get("JOB_QUEUE_LIMIT", DEFAULT_JOB_QUEUE_LIMIT))
+        if await asyncio.to_thread(self.store.count_unfinished) >= limit:
+            metrics.inc("kioku_admission_rejected_total", gate="jobs")
+            raise admission.Overloaded("jobs", JOB_RETRY_AFTER)
+        job = await asyncio.to_thread(self.store.create, kind, request)
+        if self._queue is not None:
+            self._queue.put_nowait(job["id"])
+        return job
+
+    def get(self, job_id: str) -> dict | None:
+        return self.store.get(job_id)
+
+    async def cancel(self, job_id: str) -> dict | None:
+        """Cancel a queued or running job. Returns the updated record.
+
+        A job that has started writing to Anki (see COMMIT_STAGES) is not
+        cancelled; it keeps running and finishes as usual. A job running in
+        another worker process is only flagged here: that worker sees the
+        flag within EVENTS_POLL_INTERVAL and cancels it, so the record stays
+        ``running`` until then.
+        """
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return job
+        if job_id in self._committed or job["stage"] in COMMIT_STAGES:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancel_requested.add(job_id)
+            task.cancel()
+        elif await asyncio.to_thread(self.store.cancel_queued, job_id):
+            await self._cancelled(job_id)
+        else:
+            await asyncio.to_thread(self.store.request_cancel, job_id)
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _publish(self, job_id: str):
+        if not self._subscribers.get(job_id):
+            return
+        job = await asyncio.to_thread(self.store.get, job_id)
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(job)
+
+    async def _finish(self, job_id: str, **fields):
+        await asyncio.to_thread(self.store.update, job_id, **fields)
+        await self._publish(job_id)
+
+    async def _cancelled(self, job_id: str):
+        """Publish a job's cancellation and delete the files it kept for a restart."""
+        await self._publish(job_id)
+        loaded = await asyncio.to_thread(self.store.request, job_id)
+        if loaded is None:
+            return
+        kind, payload = loaded
+        cleanup = self._cleanups.get(kind)
+        if cleanup is not None:
+            await asyncio.to_thread(cleanup, payload)
+
+    async def events(self, job_id: str) -> AsyncIterator[dict]:
+        """Yield the job record now and after every change until it finishes."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            while job is not None:
+                yield job
+                if job["status"] in TERMINAL_STATUSES:
+                    return
+                previous = job
+                while job == previous:
+                    try:
+                        job = await asyncio.wait_for(queue.get(), EVENTS_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        # The job may be running in another worker process
+                        job = await asyncio.to_thread(self.store.get, job_id)
+        finally:
+            self._subscribers[job_id].discard(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _call_handler(self, kind: str, job_id: str, payload: dict, progress):
+        # One trace per job, so its pipeline spans nest under it; jobs are bulk
+        # work and queue behind interactive requests at every shared resource
+        with tracing.span(f"job.{kind}", job_id=job_id), admission.priority(admission.BULK):
+            return await self._handlers[kind](payload, progress)
+
+    async def _watch_cancel(self, job_id: str, task: asyncio.Task):
+        """Cancel ``task`` once another worker flags its job in the store."""
+        while not task.done():
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job and job["cancel_requested"] and job_id not in self._committed:
+                self._cancel_requested.add(job_id)
+                task.cancel()
+                return
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        loaded = await asyncio.to_thread(self.store.request, job_id)
+        if job is None or loaded is None or job["status"] != "queued":
+            return
+        if not await asyncio.to_thread(self.store.claim, job_id, self.owner):
+            # Taken by another worker, or flagged for cancel before it started
+            if await asyncio.to_thread(self.store.cancel_queued, job_id):
+                await self._cancelled(job_id)
+            return
+        kind, payload = loaded
+        loop = asyncio.get_running_loop()
+        progress_state: dict[str, dict[str, int]] = {}
+        unsaved: dict = {}
+        saver: asyncio.Task | None = None
+
+        async def save():
+            # Only the latest state is written; ticks that arrive meanwhile merge
+            while unsaved:
+                fields = dict(unsaved)
+                unsaved.clear()
+                await asyncio.to_thread(self.store.update, job_id, **fields)
+                await self._publish(job_id)
+
+        def progress(stage: str, done: int, total: int):
+            nonlocal saver
+            if stage in COMMIT_STAGES:
+                self._committed.add(job_id)
+            progress_state[stage] = {"done": done, "total": total}
+            unsaved.update(stage=stage, progress=dict(progress_state))
+            if saver is None or saver.done():
+                saver = loop.create_task(save())
+
+        async def saved():
+            if saver is not None:
+                await saver
+
+        await self._publish(job_id)
+        task = loop.create_task(self._call_handler(kind, job_id, payload, progress))
+        self._running[job_id] = task
+        watcher = loop.create_task(self._watch_cancel(job_id, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            await saved()
+            if job_id in self._cancel_requested:
+                await asyncio.to_thread(self.store.update, job_id, status="cancelled")
+                await self._cancelled(job_id)
+            else:
+                # Server shutdown: leave the job queued so it resumes on restart
+                task.cancel()
+                await asyncio.to_thread(self.store.update, job_id, status="queued", owner=None)
+                raise
+        except Exception as err:
+            await saved()
+            await self._finish(job_id, status="failed", error=str(err))
+        else:
+            await saved()
+            await self._finish(job_id, status="succeeded", result=result)
+        finally:
+            watcher.cancel()
+            self._running.pop(job_id, None)
+            self._cancel_requested.discard(job_id)
+            self._committed.discard(job_id)
+
+
+job_manager = JobManager(JobStore())
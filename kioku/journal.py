@@ -0,0 +1,94 @@
+"""Checkpoint journal for long batch runs.
+
+A run records each item as it finishes a stage, together with whatever
+that stage produced (OCR text, cards). When an interrupted run starts
+again with the same journal it looks items up before doing any work, so
+only what had not finished is redone. The journal is one SQLite file, so a
+record that was committed survives the process being killed.
+"""
+
+import json
+import sqlite3
+import threading
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    stage TEXT NOT NULL,
+    item TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (stage, item)
+);
+"""
+
+_MISSING = object()
+
+
+def remove_journal(path: str | Path):
+    """Delete a journal's files, once the run it checkpointed is complete."""
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+class Journal:
+    """Per-stage results of a batch run, keyed by item, kept in SQLite."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # One connection for the run; stages may record from worker threads
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def remove(self):
+        self.close()
+        remove_journal(self.path)
+
+    def get(self, stage: str, item: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM checkpoints WHERE stage = ? AND item = ?", (stage, item)
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def done(self, stage: str, item: str) -> bool:
+        return self.get(stage, item, _MISSING) is not _MISSING
+
+    def record(self, stage: str, item: str, data: Any = None):
+        self.record_many(stage, [(item, data)])
+
+    def record_many(self, stage: str, items: Iterable[tuple[str, Any]]):
+        rows = [(stage, item, json.dumps(data, ensure_ascii=False)) for item, data in items]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (stage, item, data) VALUES (?, ?, ?)", rows
+            )
+
+    def count(self, stage: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM checkpoints WHERE stage = ?", (stage,)
+            ).fetchone()[0]
+
+    def items(self, stage: str) -> Iterator[tuple[str, Any]]:
+        """``(item, data)`` recorded for ``stage``, ordered by item."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item, data FROM checkpoints WHERE stage = ? ORDER BY item", (stage,)
+            ).fetchall()
+        for item, data in rows:
+            yield item, json.loads(data)
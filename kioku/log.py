@@ -0,0 +1,49 @@
+"""Structured JSON logging for the server.
+
+Every record is one JSON object per line carrying the current trace and span
+ids, so log lines can be joined with the spans of the request that produced
+them. Extra structured data goes in ``extra={"fields": {...}}``.
+"""
+
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from kioku import tracing
+
+DEFAULT_LOG_LEVEL = "INFO"
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = tracing.current_trace_id()
+        if trace_id:
+            entry["trace_id"] = trace_id
+            entry["span_id"] = tracing.current_span_id()
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(stream=None):
+    """Send ``kioku.*`` logs to stderr as JSON at ``LOG_LEVEL``."""
+    root = logging.getLogger("kioku")
+    root.setLevel(os.environ.get("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper())
+    for handler in root.handlers:
+        if isinstance(handler.formatter, JsonFormatter):
+            return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root.addHandler(handler)
+    root.propagate = False
@@ -1,143 +1,535 @@
 import asyncio
-import base64
-import subprocess
+import json
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+    WebSocket,
+)
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from groq import AuthenticationError, APIError
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
+from kioku import admission, metrics, tracing, ws
+from kioku.audio_spool import AudioSpool
+from kioku.idempotency import audio_digest, idempotency, scoped_key
+from kioku.jobs import job_audio_dir, job_manager, job_upload_dir
+from kioku.log import configure_logging
 from kioku.models import ExtractionResult, GenerateRequest, TextExtractionRequest
-from kioku.services.anki_builder import add_cards, sync_anki
-from kioku.services.audio_generator import generate_audio
-from kioku.services.image_processor import enrich_text, extract_cards
-from kioku.utils import audio_filename
+from kioku.pipeline import (
+    build_audio_map,
+    clip_sentences,
+    decode_captured_audio,
+    run_capture,
+    run_generate,
+)
+from kioku.services.anki_builder import warm_cache
+from kioku.services.apkg_writer import write_apkg
+from kioku.services.audio_clipper import resolve_media_path
+from kioku.services.image_processor import (
+    GroqAuthenticationError,
+    GroqError,
+    enrich_text,
+    extract_cards,
+)
+from kioku.services.outbox import OutboxDrainer, outbox
+from kioku.services.page_reader import VOLUME_SUFFIXES
+from kioku.services.subtitle_parser import SUBTITLE_SUFFIXES
+from kioku.services.sync_scheduler import sync_scheduler
+from kioku.services.vocab_index import vocab_index, vocab_syncer
+from kioku.serving import primary_lock
 
 load_dotenv()
+configure_logging()
 
+logger = logging.getLogger(__name__)
 
-def webm_to_wav(data: bytes) -> bytes:
-    """Convert WebM/Opus audio bytes to WAV using ffmpeg."""
-    result = subprocess.run(
-        ["ffmpeg", "-y", "-i", "pipe:0", "-f", "wav", "pipe:1"],
-        input=data,
-        capture_output=True,
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"ffmpeg conversion failed: {result.stderr.decode()}")
-    return result.stdout
+
+def _outbox_delivered():
+    # Only the primary drains the outbox, so only its /ws connections hear this
+    sync_scheduler.request()
+    ws.hub.publish("cards_added", added=outbox_drainer.last_result["added"], source="outbox")
+
+
+outbox_drainer = OutboxDrainer(outbox, on_added=_outbox_delivered)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the deck/note type cache so the first generate skips the lookups
+    try:
+        await asyncio.to_thread(warm_cache)
+    except (RuntimeError, OSError) as e:
+        logger.warning("could not warm Anki cache: %s", e)
+    tracing.configure_exporter()
+    # With several workers, only the primary drains the outbox, syncs the
+    # known-vocabulary index, runs AnkiWeb syncs and resumes jobs
+    primary = primary_lock.acquire()
+    if primary:
+        outbox_drainer.start()
+        vocab_syncer.start()
+    sync_scheduler.start(primary)
+    job_manager.start(resume=primary)
+    yield
+    await job_manager.stop()
+    await vocab_syncer.stop()
+    await outbox_drainer.stop()
+    await sync_scheduler.shutdown()
+    await asyncio.to_thread(tracing.shutdown_exporter)
+    primary_lock.release()
+
 
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(tracing.TracingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id", "Idempotent-Replayed"],
 )
 
 
-@app.post("/api/extract", response_model=ExtractionResult)
+@app.exception_handler(admission.Overloaded)
+async def overloaded_handler(request: Request, err: admission.Overloaded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(err)},
+        headers={"Retry-After": str(err.retry_after)},
+    )
+
+
+def admit(gate_name: str):
+    """Dependency that holds a slot of the endpoint's gate for the whole request."""
+
+    async def hold_slot():
+        async with admission.gate(gate_name).hold_async():
+            yield
+
+    return Depends(hold_slot)
+
+
+@app.post("/api/extract", response_model=ExtractionResult, dependencies=[admit("extract")])
 async def api_extract(file: UploadFile = File(...)):
     try:
         image_bytes = await file.read()
         mime_type = file.content_type or "image/jpeg"
-        cards = extract_cards(image_bytes, mime_type)
+        cards = await asyncio.to_thread(extract_cards, image_bytes, mime_type)
         return ExtractionResult(cards=cards)
-    except AuthenticationError as err:
+    except GroqAuthenticationError as err:
         raise HTTPException(
             status_code=401,
             detail="GROQ_API_KEY is invalid or not set. Please check your .env file.",
         ) from err
-    except APIError as err:
+    except GroqError as err:
         raise HTTPException(status_code=502, detail=f"Groq API error: {err}") from err
     except RuntimeError as err:
         raise HTTPException(status_code=500, detail=str(err)) from err
 
 
-@app.post("/api/extract-text", response_model=ExtractionResult)
+@app.post(
+    "/api/extract-text", response_model=ExtractionResult, dependencies=[admit("extract_text")]
+)
 async def api_extract_text(req: TextExtractionRequest):
     try:
-        cards = enrich_text(req.text)
+        cards = await asyncio.to_thread(enrich_text, req.text)
         return ExtractionResult(cards=cards)
-    except AuthenticationError as err:
+    except GroqAuthenticationError as err:
         raise HTTPException(
             status_code=401,
             detail="GROQ_API_KEY is invalid or not set. Please check your .env file.",
         ) from err
-    except APIError as err:
+    except GroqError as err:
         raise HTTPException(status_code=502, detail=f"Groq API error: {err}") from err
     except RuntimeError as err:
         raise HTTPException(status_code=500, detail=str(err)) from err
 
 
-@app.post("/api/generate")
-async def api_generate(req: GenerateRequest):
+async def _read_generate_request(request: Request) -> tuple[GenerateRequest, UploadFile | None]:
+    """Parse a generate request sent as JSON or as multipart form data.
+
+    The multipart variant carries the GenerateRequest JSON in a ``payload``
+    part and the captured WebM recording as a raw ``sentence_audio`` part,
+    which avoids the base64 round trip of the JSON body.
+    """
+    content_type = request.headers.get("content-type", "")
     try:
-        # Decode captured sentence audio if provided
-        captured_sentence_audio: bytes | None = None
-        print(f"[Kioku] sentence_audio_b64 present: {bool(req.sentence_audio_b64)}, len={len(req.sentence_audio_b64) if req.sentence_audio_b64 else 0}")
-        if req.sentence_audio_b64:
-            try:
-                raw = base64.b64decode(req.sentence_audio_b64)
-                print(f"[Kioku] decoded webm bytes: {len(raw)}")
-                captured_sentence_audio = webm_to_wav(raw)
-                print(f"[Kioku] converted to wav bytes: {len(captured_sentence_audio)}")
-            except Exception as e:
-                print(f"[Kioku] audio conversion failed: {e}")
-                captured_sentence_audio = None
-
-        # Collect unique texts needing TTS; skip when captured audio covers them
-        texts_needing_tts: dict[str, None] = {}
-        for card in req.cards:
-            is_sentence_card = card.japanese == card.example_sentence
-            if captured_sentence_audio is None or not is_sentence_card:
-                texts_needing_tts[card.japanese] = None
-            if captured_sentence_audio is None:
-                texts_needing_tts[card.example_sentence] = None
-
-        text_list = list(texts_needing_tts)
-        audio_results = await asyncio.gather(
-            *(generate_audio(t) for t in text_list)
-        )
-        audio_cache = dict(zip(text_list, audio_results))
-
-        audio_map: dict[str, bytes] = {}
-        for card in req.cards:
-            is_sentence_card = card.japanese == card.example_sentence
-            word_file = audio_filename(card.japanese, "word")
-            sentence_file = audio_filename(card.example_sentence, "sentence")
-            audio_map[word_file] = (
-                captured_sentence_audio
-                if captured_sentence_audio is not None and is_sentence_card
-                else audio_cache[card.japanese]
-            )
-            audio_map[sentence_file] = (
-                captured_sentence_audio
-                if captured_sentence_audio is not None
-                else audio_cache[card.example_sentence]
+        if not content_type.startswith("multipart/form-data"):
+            return _checked(GenerateRequest.model_validate_json(await request.body())), None
+        form = await request.form()
+        payload = form.get("payload")
+        if payload is None:
+            raise RequestValidationError(
+                [{"type": "missing", "loc": ("body", "payload"), "msg": "Field required"}]
             )
+        if isinstance(payload, StarletteUploadFile):
+            payload = await payload.read()
+        audio = form.get("sentence_audio")
+        return (
+            _checked(GenerateRequest.model_validate_json(payload)),
+            audio if isinstance(audio, StarletteUploadFile) else None,
+        )
+    except ValidationError as err:
+        raise RequestValidationError(err.errors()) from err
 
-        added = add_cards(req.cards, audio_map, req.deck_name)
 
-        # Trigger sync with AnkiWeb after adding cards
+def _checked(req: GenerateRequest) -> GenerateRequest:
+    """Reject a media_path outside MEDIA_DIR before any work is queued."""
+    if req.media_path:
         try:
-            sync_anki()
-        except RuntimeError:
-            # Sync failed, but cards were added successfully
-            pass
+            resolve_media_path(req.media_path)
+        except ValueError as err:
+            raise HTTPException(status_code=422, detail=str(err)) from err
+    return req
+
+
+async def _idempotency_key(
+    request: Request, req: GenerateRequest, sentence_audio: UploadFile | None
+) -> str | None:
+    """The request's Idempotency-Key scoped to its deck, cards and audio, if it sent one."""
+    key = request.headers.get("idempotency-key")
+    if key is None:
+        return None
+    audio = None
+    if sentence_audio is not None:
+        audio = await asyncio.to_thread(audio_digest, sentence_audio.file)
+    try:
+        return scoped_key(key, req, audio)
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
+
+
+@app.post("/api/generate", dependencies=[admit("generate")])
+async def api_generate(request: Request, response: Response):
+    """Generate cards from a JSON body or a multipart upload with raw audio.
+
+    Retries that send the same Idempotency-Key attach to the running
+    execution or replay its result instead of generating the cards again.
+    """
+    req, sentence_audio = await _read_generate_request(request)
+    key = await _idempotency_key(request, req, sentence_audio)
 
-        return {"added": added}
+    async def generate() -> dict:
+        if sentence_audio is None:
+            return await run_generate(req)
+        return await run_generate(req, sentence_audio=sentence_audio.file)
+
+    try:
+        if key is None:
+            return await generate()
+        result, replayed = await idempotency.run(f"generate:{key}", generate)
+    except RuntimeError as err:
+        raise HTTPException(status_code=502, detail=str(err)) from err
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@app.websocket("/ws")
+async def api_ws(websocket: WebSocket):
+    """Carry many extract-text and generate requests over one connection.
+
+    Replies stream stage progress, heartbeats keep the connection alive and
+    events such as ``cards_added`` are pushed unprompted; see ``kioku.ws``
+    for the message format.
+    """
+    await ws.serve(websocket)
+
+
+@app.post("/api/capture", dependencies=[admit("capture")])
+async def api_capture(
+    file: UploadFile | None = File(None),
+    text: str | None = Form(None),
+    sentence_audio: UploadFile | None = File(None),
+    deck_name: str = Form("ankiGen"),
+    authorization: str | None = Header(None),
+):
+    """One-shot OCR/enrich/TTS/Anki pipeline for trusted automation.
+
+    Skips the review step, so it is only enabled when CAPTURE_TOKEN is set
+    and the request carries it as a bearer token.
+    """
+    token = os.environ.get("CAPTURE_TOKEN", "")
+    if not token:
+        raise HTTPException(status_code=404, detail="Capture endpoint is disabled.")
+    if not secrets.compare_digest(authorization or "", f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing capture token.")
+
+    try:
+        return await run_capture(
+            text=text,
+            image_bytes=await file.read() if file else None,
+            sentence_audio_webm=await sentence_audio.read() if sentence_audio else None,
+            deck_name=deck_name,
+        )
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
+    except GroqAuthenticationError as err:
+        raise HTTPException(
+            status_code=401,
+            detail="GROQ_API_KEY is invalid or not set. Please check your .env file.",
+        ) from err
+    except GroqError as err:
+        raise HTTPException(status_code=502, detail=f"Groq API error: {err}") from err
     except RuntimeError as err:
         raise HTTPException(status_code=502, detail=str(err)) from err
 
 
+def _save_job_audio(upload: UploadFile) -> str:
+    path = job_audio_dir() / f"{uuid.uuid4().hex}.webm"
+    with open(path, "wb") as dest:
+        shutil.copyfileobj(upload.file, dest)
+    return str(path)
+
+
+@app.post("/api/jobs", status_code=202)
+async def api_create_job(request: Request, response: Response):
+    """Queue a generate job and return its id straight away.
+
+    Accepts the same JSON or multipart bodies as /api/generate; uploaded audio
+    is kept on disk until the job has run. A repeated Idempotency-Key returns
+    the job created for it instead of queueing another, unless that job failed
+    or was cancelled; then the retry queues a new one.
+    """
+    req, sentence_audio = await _read_generate_request(request)
+    key = await _idempotency_key(request, req, sentence_audio)
+
+    async def submit() -> dict:
+        payload = req.model_dump()
+        if sentence_audio is not None:
+            payload["sentence_audio_path"] = await asyncio.to_thread(
+                _save_job_audio, sentence_audio
+            )
+        try:
+            return await job_manager.submit("generate", payload)
+        except admission.Overloaded:
+            if sentence_audio is not None:
+                Path(payload["sentence_audio_path"]).unlink(missing_ok=True)
+            raise
+
+    if key is None:
+        return await submit()
+    job, replayed = await idempotency.run(f"jobs:{key}", submit, endpoint="jobs")
+    if replayed:
+        job = await asyncio.to_thread(job_manager.get, job["id"]) or job
+    if replayed and job["status"] in {"failed", "cancelled"}:
+        # A failed or cancelled job is not a result to replay; queue a new one
+        await asyncio.to_thread(idempotency.forget, f"jobs:{key}")
+        job, replayed = await idempotency.run(f"jobs:{key}", submit, endpoint="jobs")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return job
+
+
+@app.post("/api/ingest/subtitles", status_code=202)
+async def api_ingest_subtitles(file: UploadFile = File(...), history: bool = Form(True)):
+    """Queue a job that turns a whole .srt, .vtt or .ass file into cards.
+
+    Follow it like any other job; its result holds the cards (each with its
+    cue times) and counts of cues, repeated and already-ingested lines.
+    """
+    suffix = Path(file.filename or "").suffix.lower()
+    if suffix not in SUBTITLE_SUFFIXES:
+        raise HTTPException(
+            status_code=422, detail="Upload a subtitle file ending in .srt, .vtt, .ass or .ssa."
+        )
+    path = job_upload_dir() / f"{uuid.uuid4().hex}{suffix}"
+
+    def save():
+        with open(path, "wb") as dest:
+            shutil.copyfileobj(file.file, dest)
+
+    await asyncio.to_thread(save)
+    payload = {"path": str(path), "name": file.filename, "history": history}
+    try:
+        return await job_manager.submit("subtitles", payload)
+    except admission.Overloaded:
+        path.unlink(missing_ok=True)
+        raise
+
+
+@app.post("/api/ingest/pages", status_code=202)
+async def api_ingest_pages(file: UploadFile = File(...)):
+    """Queue a job that OCRs every page of a .zip/.cbz archive or a .pdf into cards.
+
+    Progress is reported per page (``ocr``) and per Groq batch (``enrich``);
+    the result holds the cards and counts of pages read, blank and failed.
+    """
+    suffix = Path(file.filename or "").suffix.lower()
+    if suffix not in VOLUME_SUFFIXES:
+        raise HTTPException(status_code=422, detail="Upload a .zip, .cbz or .pdf file.")
+    path = job_upload_dir() / f"{uuid.uuid4().hex}{suffix}"
+
+    def save():
+        with open(path, "wb") as dest:
+            shutil.copyfileobj(file.file, dest)
+
+    await asyncio.to_thread(save)
+    try:
+        return await job_manager.submit("pages", {"path": str(path), "name": file.filename})
+    except admission.Overloaded:
+        path.unlink(missing_ok=True)
+        raise
+
+
+@app.get("/api/jobs")
+async def api_list_jobs(limit: int = 50):
+    return {"jobs": await asyncio.to_thread(job_manager.store.recent, limit)}
+
+
+@app.get("/api/jobs/{job_id}")
+async def api_get_job(job_id: str):
+    job = await asyncio.to_thread(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def api_job_events(job_id: str):
+    """Stream the job record as server-sent events until it finishes."""
+    if await asyncio.to_thread(job_manager.get, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def stream():
+        async for job in job_manager.events(job_id):
+            yield f"data: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.delete("/api/jobs/{job_id}")
+async def api_cancel_job(job_id: str):
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.post("/api/export.apkg")
+async def api_export_apkg(req: GenerateRequest, audio: bool = True):
+    """Build an .apkg package offline, without AnkiConnect."""
+    _checked(req)
+    try:
+        audio_map = AudioSpool()
+        if audio:
+            captured_sentence_audio = decode_captured_audio(req.sentence_audio_b64)
+            sentence_clips = None
+            if req.media_path and captured_sentence_audio is None:
+                sentence_clips = await clip_sentences(req.media_path, req.cards)
+            audio_map = await build_audio_map(
+                req.cards, captured_sentence_audio, sentence_clips=sentence_clips
+            )
+
+    except RuntimeError as err:
+        raise HTTPException(status_code=502, detail=str(err)) from err
+
+    fd, path = tempfile.mkstemp(prefix="kioku-", suffix=".apkg")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(
+            write_apkg, path, req.cards, audio_map.media_items(), req.deck_name
+        )
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        audio_map.close()
+
+    return FileResponse(
+        path,
+        media_type="application/apkg",
+        filename=f"{req.deck_name}.apkg",
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@app.get("/api/outbox")
+async def api_outbox():
+    entries = await asyncio.to_thread(outbox.entries)
+    return {
+        "depth": sum(entry["status"] == "pending" for entry in entries),
+        "dead": sum(entry["status"] == "dead" for entry in entries),
+        "entries": entries,
+        "last_drain": outbox_drainer.last_result,
+    }
+
+
+@app.post("/api/outbox/flush")
+async def api_outbox_flush():
+    await asyncio.to_thread(outbox.retry)
+    result = await outbox_drainer.drain_now()
+    depth = await asyncio.to_thread(outbox.depth)
+    return {**result, "depth": depth}
+
+
+@app.post("/api/outbox/{entry_id}/retry")
+async def api_outbox_retry(entry_id: int):
+    if not await asyncio.to_thread(outbox.retry, entry_id):
+        raise HTTPException(status_code=404, detail=f"Outbox entry {entry_id} not found")
+    outbox_drainer.wake()
+    return {"retrying": entry_id}
+
+
+@app.delete("/api/outbox/{entry_id}")
+async def api_outbox_discard(entry_id: int):
+    """Drop an entry, e.g. a dead one, together with its audio."""
+    if not await asyncio.to_thread(outbox.remove, entry_id):
+        raise HTTPException(status_code=404, detail=f"Outbox entry {entry_id} not found")
+    return {"discarded": entry_id}
+
+
+@app.get("/api/vocab")
+async def api_vocab():
+    status = await asyncio.to_thread(vocab_index.status)
+    return {**status, "last_sync": vocab_syncer.last_result, "last_error": vocab_syncer.last_error}
+
+
+@app.post("/api/vocab/sync")
+async def api_vocab_sync():
+    try:
+        return await vocab_syncer.sync_now()
+    except RuntimeError as err:
+        raise HTTPException(status_code=503, detail=str(err)) from err
+
+
+@app.get("/api/sync/status")
+async def api_sync_status():
+    return sync_scheduler.status()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def api_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 _static_dir = Path(__file__).parent / "static"
 app.mount("/", StaticFiles(directory=_static_dir, html=True), name="static")
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("kioku.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,206 @@
+"""In-process metrics exported in the Prometheus text format.
+
+Counters, gauges and histograms live in plain dicts behind one lock, so
+recording a value is a dict lookup and an add. ``track`` wraps a pipeline
+stage or dependency call and records its latency, in-flight count and
+errors in one go.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from a cached AnkiConnect call
+# up to a slow Groq completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_Key = tuple[tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: dict[str, dict[_Key, float]] = {}
+_gauges: dict[str, dict[_Key, float]] = {}
+# Per series: [per-bucket counts (last is +Inf), sum, count]
+_histograms: dict[str, dict[_Key, list]] = {}
+_help: dict[str, str] = {}
+
+
+def describe(name: str, help_text: str):
+    """Register the HELP text shown for a metric."""
+    _help[name] = help_text
+
+
+def _key(labels: dict[str, str]) -> _Key:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: str):
+    """Add ``value`` to the counter ``name`` with the given labels."""
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + value
+
+
+def counter_value(name: str, **labels: str) -> float:
+    """Return the current value of a counter (0 if it was never incremented)."""
+    key = _key(labels)
+    with _lock:
+        return _counters.get(name, {}).get(key, 0.0)
+
+
+def set_gauge(name: str, value: float, **labels: str):
+    """Set the gauge ``name`` to ``value``."""
+    key = _key(labels)
+    with _lock:
+        _gauges.setdefault(name, {})[key] = value
+
+
+def add_gauge(name: str, delta: float, **labels: str):
+    """Move the gauge ``name`` up or down by ``delta``."""
+    key = _key(labels)
+    with _lock:
+        series = _gauges.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + delta
+
+
+def gauge_value(name: str, **labels: str) -> float:
+    """Return the current value of a gauge (0 if it was never set)."""
+    key = _key(labels)
+    with _lock:
+        return _gauges.get(name, {}).get(key, 0.0)
+
+
+def observe(name: str, value: float, **labels: str):
+    """Record ``value`` in the histogram ``name``."""
+    key = _key(labels)
+    index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [[0] * (len(DEFAULT_BUCKETS) + 1), 0.0, 0]
+        state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+
+def histogram_count(name: str, **labels: str) -> int:
+    """Return how many values a histogram series has recorded."""
+    key = _key(labels)
+    with _lock:
+        state = _histograms.get(name, {}).get(key)
+        return state[2] if state else 0
+
+
+describe("kioku_stage_duration_seconds", "Latency of pipeline stages and dependency calls.")
+describe("kioku_stage_in_flight", "Pipeline stages and dependency calls currently running.")
+describe("kioku_stage_errors_total", "Pipeline stages and dependency calls that raised.")
+describe("kioku_cache_requests_total", "Cache lookups by cache and result (hit or miss).")
+describe("kioku_cache_hit_ratio", "Share of cache lookups that were hits.")
+
+
+@contextmanager
+def track(stage: str, **labels: str):
+    """Time a block as ``stage``, counting it in flight and recording errors.
+
+    Works around ``await`` too, so the same helper covers thread-bound calls
+    (OCR, ffmpeg, AnkiConnect) and async ones (VOICEVOX).
+    """
+    labels["stage"] = stage
+    add_gauge("kioku_stage_in_flight", 1, **labels)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as err:
+        inc("kioku_stage_errors_total", error=type(err).__name__, **labels)
+        raise
+    finally:
+        observe("kioku_stage_duration_seconds", time.perf_counter() - start, **labels)
+        add_gauge("kioku_stage_in_flight", -1, **labels)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a lookup against ``cache`` as a hit or a miss."""
+    inc("kioku_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def reset():
+    """Drop every recorded value (used by tests)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: _Key) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _cache_ratios() -> dict[_Key, float]:
+    totals: dict[str, list[float]] = {}
+    for key, value in _counters.get("kioku_cache_requests_total", {}).items():
+        labels = dict(key)
+        hits_and_total = totals.setdefault(labels["cache"], [0.0, 0.0])
+        if labels["result"] == "hit":
+            hits_and_total[0] += value
+        hits_and_total[1] += value
+    return {
+        (("cache", cache),): hits / total for cache, (hits, total) in totals.items() if total
+    }
+
+
+def _render_histogram(name: str, key: _Key, state: list) -> list[str]:
+    counts, total, count = state
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip((*DEFAULT_BUCKETS, "+Inf"), counts):
+        cumulative += bucket_count
+        le = bound if bound == "+Inf" else _format_value(bound)
+        lines.append(f"{name}_bucket{_format_labels(key + (('le', str(le)),))} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+    lines.append(f"{name}_count{_format_labels(key)} {count}")
+    return lines
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    families: dict[str, tuple[str, list[str]]] = {}
+    with _lock:
+        gauges = dict(_gauges)
+        ratios = _cache_ratios()
+        if ratios:
+            gauges["kioku_cache_hit_ratio"] = ratios
+        for kind, store in (("counter", _counters), ("gauge", gauges)):
+            for name, series in store.items():
+                families[name] = (
+                    kind,
+                    [
+                        f"{name}{_format_labels(key)} {_format_value(value)}"
+                        for key, value in sorted(series.items())
+                    ],
+                )
+        for name, series in _histograms.items():
+            lines: list[str] = []
+            for key, state in sorted(series.items()):
+                lines.extend(_render_histogram(name, key, state))
+            families[name] = ("histogram", lines)
+
+    out: list[str] = []
+    for name in sorted(families):
+        kind, lines = families[name]
+        if name in _help:
+            out.append(f"# HELP {name} {_help[name]}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
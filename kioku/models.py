@@ -7,6 +7,9 @@ class CardItem(BaseModel):
     meaning: str
     example_sentence: str
     example_translation: str
+    # Start and end (seconds) of the subtitle cue the card was mined from
+    cue_start: float | None = None
+    cue_end: float | None = None
 
 
 class ExtractionResult(BaseModel):
@@ -17,6 +20,8 @@ class GenerateRequest(BaseModel):
     cards: list[CardItem]
     deck_name: str = "ankiGen"
     sentence_audio_b64: str | None = None
+    # Video or audio file under MEDIA_DIR to clip timed example sentences from
+    media_path: str | None = None
 
 
 class TextExtractionRequest(BaseModel):
@@ -0,0 +1,472 @@
+"""Card pipeline stages shared by the HTTP API and the command line."""
+
+import asyncio
+import base64
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from typing import BinaryIO
+
+from kioku import admission, metrics, tracing
+from kioku.audio_spool import AudioSpool
+from kioku.models import CardItem, GenerateRequest
+from kioku.services.anki_builder import (
+    AnkiUnavailableError,
+    add_cards,
+    find_new_cards,
+    unique_cards,
+)
+from kioku.services.audio_clipper import clip_cards, resolve_media_path
+from kioku.services.audio_generator import generate_audio
+from kioku.services.outbox import outbox
+from kioku.services.sync_scheduler import sync_scheduler
+from kioku.services.vocab_index import vocab_index, vocab_syncer
+from kioku.utils import audio_filename
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_TO_WAV = ["ffmpeg", "-y", "-i", "pipe:0", "-f", "wav", "pipe:1"]
+FFMPEG_CHUNK_SIZE = 64 * 1024
+DEFAULT_CAPTURE_TTS_CONCURRENCY = "4"
+DEFAULT_CAPTURE_ANKI_CONCURRENCY = "1"
+
+# progress(stage, done, total) is called as each pipeline stage advances
+ProgressCallback = Callable[[str, int, int], None]
+# Once a generate reports progress on one of these stages it writes to Anki,
+# which cannot be undone, so it is no longer cancelled and runs to the end
+COMMIT_STAGES = {"anki"}
+
+
+def no_progress(stage: str, done: int, total: int):
+    pass
+
+
+@tracing.traced("webm_to_wav")
+def webm_to_wav(data: bytes | BinaryIO) -> bytes:
+    """Convert WebM/Opus audio to WAV using ffmpeg.
+
+    ``data`` may be bytes or a binary file object. File objects are streamed
+    into ffmpeg in chunks rather than read into memory first.
+    """
+    with metrics.track("ffmpeg"):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            result = subprocess.run(FFMPEG_TO_WAV, input=data, capture_output=True)
+            returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
+        else:
+            returncode, stdout, stderr = _stream_through_ffmpeg(data)
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg conversion failed: {stderr.decode()}")
+        return stdout
+
+
+def _stream_through_ffmpeg(source: BinaryIO) -> tuple[int, bytes, bytes]:
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            FFMPEG_TO_WAV, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr
+        )
+
+        def feed():
+            try:
+                shutil.copyfileobj(source, proc.stdin, FFMPEG_CHUNK_SIZE)
+            except BrokenPipeError:
+                pass  # ffmpeg exited early; its return code reports why
+            finally:
+                proc.stdin.close()
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        stdout = proc.stdout.read()
+        proc.stdout.close()
+        returncode = proc.wait()
+        writer.join()
+        stderr.seek(0)
+        return returncode, stdout, stderr.read()
+
+
+def convert_captured_audio(source: BinaryIO) -> bytes | None:
+    """Convert an uploaded WebM sentence recording to WAV (None on failure)."""
+    try:
+        wav = webm_to_wav(source)
+        logger.info("converted uploaded audio", extra={"fields": {"wav_bytes": len(wav)}})
+        return wav
+    except RuntimeError as e:
+        logger.warning("audio conversion failed: %s", e)
+        return None
+
+
+def decode_captured_audio(sentence_audio_b64: str | None) -> bytes | None:
+    """Decode base64 WebM sentence audio and convert it to WAV.
+
+    Returns None when no audio was sent or it could not be converted, in
+    which case the caller falls back to TTS.
+    """
+    if not sentence_audio_b64:
+        return None
+    try:
+        raw = base64.b64decode(sentence_audio_b64)
+        wav = webm_to_wav(raw)
+        logger.info(
+            "converted captured audio",
+            extra={"fields": {"webm_bytes": len(raw), "wav_bytes": len(wav)}},
+        )
+        return wav
+    except Exception as e:
+        logger.warning("audio conversion failed: %s", e)
+        return None
+
+
+async def build_audio_map(
+    cards: list[CardItem],
+    captured_sentence_audio: bytes | None = None,
+    progress: ProgressCallback = no_progress,
+    sentence_clips: dict[str, bytes] | None = None,
+) -> AudioSpool:
+    """Synthesize the word and sentence audio for cards, keyed by media filename.
+
+    Captured sentence audio (if any) replaces TTS for every example sentence
+    and for sentence cards themselves. ``sentence_clips`` does the same per
+    example sentence, with audio clipped from the source video. Each unique
+    text is synthesized once, and each file goes into the returned
+    ``AudioSpool`` as soon as it is ready, so at most AUDIO_MEMORY_BYTES of
+    audio stays in memory. Close the spool once the notes are stored.
+    """
+    sentence_clips = sentence_clips or {}
+
+    def real_audio(card: CardItem) -> bytes | None:
+        if captured_sentence_audio is not None:
+            return captured_sentence_audio
+        return sentence_clips.get(card.example_sentence)
+
+    # Media filenames for each text needing TTS, and for each piece of real audio;
+    # texts are skipped when real audio covers them
+    tts_files: dict[str, list[str]] = {}
+    real_files: dict[int, tuple[bytes, list[str]]] = {}
+    for card in cards:
+        is_sentence_card = card.japanese == card.example_sentence
+        word_file = audio_filename(card.japanese, "word")
+        sentence_file = audio_filename(card.example_sentence, "sentence")
+        sentence_audio = real_audio(card)
+        if sentence_audio is not None:
+            _, names = real_files.setdefault(id(sentence_audio), (sentence_audio, []))
+            names.extend([sentence_file, word_file] if is_sentence_card else [sentence_file])
+        if sentence_audio is None or not is_sentence_card:
+            tts_files.setdefault(card.japanese, []).append(word_file)
+        if sentence_audio is None:
+            tts_files.setdefault(card.example_sentence, []).append(sentence_file)
+
+    spool = AudioSpool()
+
+    def add(audio: bytes, filenames: list[str]):
+        first, *others = dict.fromkeys(filenames)
+        spool.add(first, audio)
+        for name in others:
+            spool.link(name, first)
+
+    async def store(audio: bytes, filenames: list[str]):
+        # Audio past the memory budget is written to disk; keep that off the loop
+        if spool.fits(len(audio)):
+            add(audio, filenames)
+        else:
+            await asyncio.to_thread(add, audio, filenames)
+
+    done = 0
+    progress("tts", done, len(tts_files))
+    pending = iter(tts_files.items())
+
+    async def synthesize():
+        nonlocal done
+        for text, filenames in pending:
+            await store(await generate_audio(text), filenames)
+            done += 1
+            progress("tts", done, len(tts_files))
+
+    # Audio waiting for its spill is held in memory too, so keep no more texts
+    # in flight than VOICEVOX synthesizes at once
+    workers = min(admission.gate("voicevox").limit or len(tts_files), len(tts_files))
+    try:
+        for audio, filenames in real_files.values():
+            await store(audio, filenames)
+        await asyncio.gather(*(synthesize() for _ in range(workers)))
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+async def clip_sentences(
+    media_path: str, cards: list[CardItem], progress: ProgressCallback = no_progress
+) -> dict[str, bytes]:
+    """Clip the cards' timed example sentences from a file under MEDIA_DIR."""
+    source = resolve_media_path(media_path)
+    loop = asyncio.get_running_loop()
+
+    def report(stage: str, done: int, total: int):
+        loop.call_soon_threadsafe(progress, stage, done, total)
+
+    return await asyncio.to_thread(clip_cards, source, cards, report)
+
+
+async def run_generate(
+    req: GenerateRequest,
+    progress: ProgressCallback = no_progress,
+    sentence_audio: BinaryIO | None = None,
+) -> dict:
+    """Generate audio for the request's cards and add them to Anki.
+
+    Captured sentence audio comes either base64-encoded in the request or as
+    a raw ``sentence_audio`` file object, which is streamed into ffmpeg.
+    Without it, ``media_path`` clips each timed example sentence from a
+    local video instead.
+    Duplicates and word cards for words already in the collection (see
+    ``vocab_index``) are dropped before any TTS work. If AnkiConnect is
+    unreachable the notes and their audio are queued in the outbox instead.
+    Returns ``{"added", "queued", "skipped"}``.
+    """
+    # Drop cards Anki would reject as duplicates before spending TTS on them
+    progress("dedupe", 0, len(req.cards))
+    # Known words are checked locally, so Anki is not even asked about them
+    candidates, known = await asyncio.to_thread(vocab_index.prune, req.cards)
+    try:
+        cards, skipped = await asyncio.to_thread(find_new_cards, candidates, req.deck_name)
+    except AnkiUnavailableError:
+        # Anki is offline; the outbox drainer re-checks for duplicates later
+        cards, skipped = unique_cards(candidates)
+    progress("dedupe", len(req.cards), len(req.cards))
+    skipped = known + skipped
+    skipped_japanese = [card.japanese for card in skipped]
+    if skipped:
+        logger.info("skipping %d duplicate card(s)", len(skipped))
+    if not cards:
+        return {"added": 0, "queued": 0, "skipped": skipped_japanese}
+
+    # Convert captured sentence audio if provided
+    has_captured_audio = sentence_audio is not None or bool(req.sentence_audio_b64)
+    if has_captured_audio:
+        progress("ffmpeg", 0, 1)
+    if sentence_audio is not None:
+        captured_sentence_audio = await asyncio.to_thread(convert_captured_audio, sentence_audio)
+    else:
+        captured_sentence_audio = await asyncio.to_thread(
+            decode_captured_audio, req.sentence_audio_b64
+        )
+    if has_captured_audio:
+        progress("ffmpeg", 1, 1)
+    sentence_clips = None
+    # Clip from the episode unless captured audio was sent and converted
+    if req.media_path and captured_sentence_audio is None:
+        sentence_clips = await clip_sentences(req.media_path, cards, progress)
+    audio_map = await build_audio_map(cards, captured_sentence_audio, progress, sentence_clips)
+    # The spool holds this audio now, on disk past the budget
+    del captured_sentence_audio, sentence_clips
+
+    progress("anki", 0, len(cards))
+    adding = asyncio.ensure_future(asyncio.to_thread(add_cards, cards, audio_map, req.deck_name))
+    try:
+        added = await asyncio.shield(adding)
+    except asyncio.CancelledError:
+        # The thread cannot be stopped; wait for it, so the spool is not
+        # closed while it is still uploading the audio
+        await asyncio.wait([adding])
+        if not adding.cancelled():
+            adding.exception()
+        raise
+    except AnkiUnavailableError as err:
+        # Keep the generated audio and deliver the notes once Anki is back
+        entry_id = await asyncio.to_thread(outbox.enqueue, cards, audio_map, req.deck_name)
+        logger.warning(
+            "queued %d card(s) in outbox entry %s: %s",
+            len(cards),
+            entry_id,
+            err,
+            extra={"fields": {"outbox_entry": entry_id}},
+        )
+        return {"added": 0, "queued": len(cards), "skipped": skipped_japanese}
+    finally:
+        audio_map.close()
+    progress("anki", added, len(cards))
+
+    # Sync with AnkiWeb in the background once captures settle down
+    sync_scheduler.request()
+    vocab_syncer.wake()
+
+    return {"added": added, "queued": 0, "skipped": skipped_japanese}
+
+
+class StageTimings:
+    """Collect wall-clock timings for overlapping pipeline stages."""
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._stages: dict[str, dict] = {}
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            entry = self._stages.setdefault(
+                name, {"calls": 0, "busy": 0.0, "start": started, "end": ended}
+            )
+            entry["calls"] += 1
+            entry["busy"] += ended - started
+            entry["start"] = min(entry["start"], started)
+            entry["end"] = max(entry["end"], ended)
+
+    def report(self) -> dict:
+        """Per-stage call counts, summed busy time and first-start/last-end offsets."""
+        stages = {
+            name: {
+                "calls": entry["calls"],
+                "busy": round(entry["busy"], 4),
+                "start": round(entry["start"] - self._origin, 4),
+                "end": round(entry["end"] - self._origin, 4),
+            }
+            for name, entry in self._stages.items()
+        }
+        return {"elapsed": round(time.perf_counter() - self._origin, 4), "stages": stages}
+
+
+async def run_capture(
+    *,
+    text: str | None = None,
+    image_bytes: bytes | None = None,
+    sentence_audio_webm: bytes | None = None,
+    deck_name: str = "ankiGen",
+) -> dict:
+    """One-shot capture: OCR → enrich → TTS → Anki as a streaming pipeline.
+
+    Captured sentence audio is transcoded while OCR and enrichment run. Once
+    the cards are known, every card moves on independently: its word and
+    sentence audio are synthesized at once (sharing texts with other cards)
+    and the note is handed to an Anki writer as soon as both are ready. A
+    writer adds all the notes that became ready during its previous write in
+    one batch, bounded by per-stage concurrency limits.
+    """
+    if not text and not image_bytes:
+        raise ValueError("Provide either text or an image.")
+
+    from kioku.services.image_processor import enrich_text, ocr_image
+
+    timings = StageTimings()
+    tts_limit = asyncio.Semaphore(
+        int(os.environ.get("CAPTURE_TTS_CONCURRENCY", DEFAULT_CAPTURE_TTS_CONCURRENCY))
+    )
+    anki_writers = int(
+        os.environ.get("CAPTURE_ANKI_CONCURRENCY", DEFAULT_CAPTURE_ANKI_CONCURRENCY)
+    )
+
+    async def transcode() -> bytes | None:
+        if not sentence_audio_webm:
+            return None
+        async with timings.stage("ffmpeg"):
+            try:
+                return await asyncio.to_thread(webm_to_wav, sentence_audio_webm)
+            except RuntimeError as e:
+                logger.warning("audio conversion failed: %s", e)
+                return None
+
+    captured_task = asyncio.create_task(transcode())
+    try:
+        if image_bytes:
+            async with timings.stage("ocr"):
+                text = await asyncio.to_thread(ocr_image, image_bytes)
+        async with timings.stage("enrich"):
+            parsed = await asyncio.to_thread(enrich_text, text)
+        async with timings.stage("dedupe"):
+            candidates, known = await asyncio.to_thread(vocab_index.prune, parsed)
+            try:
+                cards, skipped = await asyncio.to_thread(find_new_cards, candidates, deck_name)
+            except AnkiUnavailableError:
+                cards, skipped = unique_cards(candidates)
+            skipped = known + skipped
+    except BaseException:
+        captured_task.cancel()
+        raise
+
+    tts_tasks: dict[str, asyncio.Task] = {}
+
+    async def synthesize(text_to_speak: str) -> bytes:
+        async with tts_limit, timings.stage("tts"):
+            return await generate_audio(text_to_speak)
+
+    def audio_for(text_to_speak: str) -> asyncio.Task:
+        # Word and sentence cards share texts; synthesize each one only once
+        if text_to_speak not in tts_tasks:
+            tts_tasks[text_to_speak] = asyncio.create_task(synthesize(text_to_speak))
+        return tts_tasks[text_to_speak]
+
+    # Cards whose audio is ready, waiting for a writer; None tells a writer to stop
+    ready: asyncio.Queue[tuple[CardItem, dict[str, bytes]] | None] = asyncio.Queue()
+    counts = {"added": 0, "queued": 0}
+
+    async def prepare(card: CardItem):
+        is_sentence_card = card.japanese == card.example_sentence
+        # Start the TTS captured audio cannot replace before waiting for the transcode
+        word_task = None if sentence_audio_webm and is_sentence_card else audio_for(card.japanese)
+        sentence_task = None if sentence_audio_webm else audio_for(card.example_sentence)
+        captured = await captured_task
+        if captured is None:
+            word_task = word_task or audio_for(card.japanese)
+            sentence_task = sentence_task or audio_for(card.example_sentence)
+        word_audio = captured if word_task is None else await word_task
+        sentence_audio = captured if sentence_task is None else await sentence_task
+        audio_map = {
+            audio_filename(card.japanese, "word"): word_audio,
+            audio_filename(card.example_sentence, "sentence"): sentence_audio,
+        }
+        ready.put_nowait((card, audio_map))
+
+    async def write():
+        # Each pass adds every card that became ready meanwhile with one
+        # add_cards call, so Anki's media folder is listed once per batch
+        while (item := await ready.get()) is not None:
+            batch = [item]
+            while not ready.empty():
+                item = ready.get_nowait()
+                if item is None:
+                    ready.put_nowait(None)
+                    break
+                batch.append(item)
+            batch_cards = [card for card, _ in batch]
+            audio_map = {name: data for _, files in batch for name, data in files.items()}
+            async with timings.stage("anki"):
+                try:
+                    counts["added"] += await asyncio.to_thread(
+                        add_cards, batch_cards, audio_map, deck_name
+                    )
+                except AnkiUnavailableError:
+                    await asyncio.to_thread(outbox.enqueue, batch_cards, audio_map, deck_name)
+                    counts["queued"] += len(batch_cards)
+
+    async def produce():
+        await asyncio.gather(*(prepare(card) for card in cards))
+        for _ in range(anki_writers):
+            ready.put_nowait(None)
+
+    tasks = [asyncio.create_task(produce())]
+    tasks += [asyncio.create_task(write()) for _ in range(anki_writers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        captured_task.cancel()
+        for task in [*tasks, *tts_tasks.values()]:
+            task.cancel()
+
+    if counts["added"]:
+        sync_scheduler.request()
+        vocab_syncer.wake()
+    return {
+        "added": counts["added"],
+        "queued": counts["queued"],
+        "skipped": [card.japanese for card in skipped],
+        "cards": cards,
+        "timings": timings.report(),
+    }
@@ -1,13 +1,40 @@
 import base64
 import json
 import os
+import threading
+import time
 import urllib.request
+from collections.abc import Iterable, Iterator, Mapping
+from contextlib import nullcontext
+from typing import BinaryIO
 
+from kioku import admission, metrics, tracing
+from kioku.audio_spool import AudioSpool
 from kioku.models import CardItem
+from kioku.services.media_index import media_index
 from kioku.utils import audio_filename
 
 DEFAULT_ANKI_CONNECT_URL = "http://localhost:8765"
+DEFAULT_ANKI_CACHE_TTL = "300"
 MODEL_NAME = "Japanese Vocab (ankiGen)"
+MODEL_FIELDS = [
+    "Japanese",
+    "Reading",
+    "Meaning",
+    "ExampleSentence",
+    "ExampleTranslation",
+    "WordAudio",
+    "SentenceAudio",
+]
+# Matches every name produced by kioku.utils.audio_filename
+MEDIA_PATTERN = "*_*.wav"
+# Larger media files are base64-encoded and sent this many bytes at a time; a
+# multiple of 3, so each piece encodes without padding
+MEDIA_CHUNK_BYTES = 3 * 64 * 1024
+# Actions that change the collection; they share the anki_write admission gate.
+# "sync" is left out: an AnkiWeb sync can take minutes and would hold the one
+# write slot the whole time, so the sync scheduler has its own anki_sync gate.
+WRITE_ACTIONS = frozenset({"addNote", "addNotes", "createDeck", "createModel", "storeMediaFile"})
 
 FRONT_TEMPLATE = (
     '<div style="font-size:48px;text-align:center;">{{Japanese}}</div>'
@@ -25,37 +52,109 @@ BACK_TEMPLATE = (
 )
 MODEL_CSS = ".card { font-family: 'Noto Sans JP', sans-serif; padding: 20px; }"
 
+# Process-wide cache of deck and note type names known to exist in Anki.
+# Entries expire after ANKI_CACHE_TTL seconds and are dropped whenever
+# AnkiConnect reports a missing deck or model.
+_known_decks: set[str] = set()
+_known_models: set[str] = set()
+_cache_refreshed_at: float | None = None
+_cache_lock = threading.Lock()
+
+metrics.describe("kioku_anki_media_uploaded_bytes_total", "Audio bytes uploaded to Anki.")
+metrics.describe(
+    "kioku_anki_media_skipped_bytes_total", "Audio bytes not uploaded because Anki had them."
+)
+metrics.describe("kioku_anki_media_uploaded_files_total", "Audio files uploaded to Anki.")
+metrics.describe(
+    "kioku_anki_media_skipped_files_total", "Audio files not uploaded because Anki had them."
+)
+
+
+class AnkiUnavailableError(RuntimeError):
+    """AnkiConnect could not be reached (Anki closed, host asleep, ...)."""
+
+
+def _post(action: str, data: bytes | Iterable[bytes], length: int | None = None):
+    """POST a JSON request body (bytes, or pieces of ``length`` bytes in all) to AnkiConnect."""
+    url = os.environ.get("ANKI_CONNECT_URL", DEFAULT_ANKI_CONNECT_URL)
+    req = urllib.request.Request(url, data=data)
+    req.add_header("Content-Type", "application/json")
+    if length is not None:
+        # Without it urllib would send the pieces chunked, which AnkiConnect does not read
+        req.add_header("Content-Length", str(length))
+    writes = admission.gate("anki_write").hold() if action in WRITE_ACTIONS else nullcontext()
+    with writes, tracing.span(f"anki.{action}"), metrics.track("anki", action=action):
+        try:
+            with urllib.request.urlopen(req) as resp:
+                body = json.loads(resp.read())
+        except OSError as err:
+            raise AnkiUnavailableError(
+                f"AnkiConnect is unreachable at {url}. Is Anki running? Error: {err}"
+            ) from err
+        if body.get("error"):
+            raise RuntimeError(f"AnkiConnect error: {body['error']}")
+        return body.get("result")
+
 
 def _anki_request(action: str, **params):
     """Send a request to AnkiConnect and return the result."""
     payload = json.dumps({"action": action, "version": 6, "params": params}).encode()
-    url = os.environ.get("ANKI_CONNECT_URL", DEFAULT_ANKI_CONNECT_URL)
-    req = urllib.request.Request(url, data=payload)
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req) as resp:
-        body = json.loads(resp.read())
-    if body.get("error"):
-        raise RuntimeError(f"AnkiConnect error: {body['error']}")
-    return body.get("result")
+    return _post(action, payload)
+
+
+def _cache_ttl() -> float:
+    return float(os.environ.get("ANKI_CACHE_TTL", DEFAULT_ANKI_CACHE_TTL))
+
+
+def _cache_is_fresh() -> bool:
+    return _cache_refreshed_at is not None and (
+        time.monotonic() - _cache_refreshed_at < _cache_ttl()
+    )
+
+
+def invalidate_cache():
+    """Forget every cached deck and note type name."""
+    global _cache_refreshed_at
+    with _cache_lock:
+        _known_decks.clear()
+        _known_models.clear()
+        _cache_refreshed_at = None
+
+
+def warm_cache():
+    """Load the current deck and note type names from AnkiConnect."""
+    global _cache_refreshed_at
+    decks = _anki_request("deckNames") or []
+    models = _anki_request("modelNames") or []
+    with _cache_lock:
+        _known_decks.clear()
+        _known_decks.update(decks)
+        _known_models.clear()
+        _known_models.update(models)
+        _cache_refreshed_at = time.monotonic()
+
+
+def _refresh_cache_if_stale():
+    fresh = _cache_is_fresh()
+    metrics.record_cache("anki_metadata", fresh)
+    if not fresh:
+        warm_cache()
 
 
 def _ensure_model(model_name: str):
     """Create the note type if it doesn't already exist."""
-    existing = _anki_request("modelNames")
+    _refresh_cache_if_stale()
+    if model_name in _known_models:
+        return
+    existing = _anki_request("modelNames") or []
+    with _cache_lock:
+        _known_models.update(existing)
     if model_name in existing:
         return
     _anki_request(
         "createModel",
         modelName=model_name,
-        inOrderFields=[
-            "Japanese",
-            "Reading",
-            "Meaning",
-            "ExampleSentence",
-            "ExampleTranslation",
-            "WordAudio",
-            "SentenceAudio",
-        ],
+        inOrderFields=MODEL_FIELDS,
         css=MODEL_CSS,
         cardTemplates=[
             {
@@ -65,11 +164,86 @@ def _ensure_model(model_name: str):
             }
         ],
     )
+    with _cache_lock:
+        _known_models.add(model_name)
 
 
 def _ensure_deck(deck_name: str):
     """Create the deck (no-op if it already exists)."""
+    _refresh_cache_if_stale()
+    if deck_name in _known_decks:
+        return
     _anki_request("createDeck", deck=deck_name)
+    with _cache_lock:
+        _known_decks.add(deck_name)
+
+
+def _is_missing_deck_or_model(err: RuntimeError) -> bool:
+    message = str(err).lower()
+    return "deck was not found" in message or "model was not found" in message
+
+
+def _encoded_pieces(prefix: bytes, source: BinaryIO, suffix: bytes) -> Iterator[bytes]:
+    yield prefix
+    while chunk := source.read(MEDIA_CHUNK_BYTES):
+        yield base64.b64encode(chunk)
+    yield suffix
+
+
+def _upload_media(spool: AudioSpool, filename: str):
+    """storeMediaFile one file, base64-encoding it piece by piece as it is sent.
+
+    Only one piece of the file and its encoding are in memory at a time,
+    instead of the whole file, its base64 text and the JSON body holding it.
+    """
+    size = spool.size(filename)
+    if size <= MEDIA_CHUNK_BYTES:
+        _anki_request(
+            "storeMediaFile", filename=filename, data=base64.b64encode(spool[filename]).decode()
+        )
+        return
+    prefix = (
+        '{"action": "storeMediaFile", "version": 6, "params": {"filename": '
+        f'{json.dumps(filename)}, "data": "'
+    ).encode()
+    suffix = b'"}}'
+    length = len(prefix) + 4 * ((size + 2) // 3) + len(suffix)
+    with spool.open(filename) as source:
+        _post("storeMediaFile", _encoded_pieces(prefix, source, suffix), length)
+
+
+def _store_media(audio_map: Mapping[str, bytes]):
+    """Upload the media files Anki doesn't already hold with identical content."""
+    if not audio_map:
+        return
+    spool = audio_map if isinstance(audio_map, AudioSpool) else AudioSpool.holding(audio_map)
+    present = set(_anki_request("getMediaFilesNames", pattern=MEDIA_PATTERN) or [])
+    # Digests from earlier uploads, by any worker and across restarts
+    recorded = media_index.digests(name for name in spool if name in present)
+
+    uploaded: list[tuple[str, str]] = []
+    try:
+        for filename in spool:
+            digest = spool.digest(filename)
+            size = spool.size(filename)
+            skip = recorded.get(filename) == digest
+            metrics.record_cache("anki_media", skip)
+            if skip:
+                metrics.inc("kioku_anki_media_skipped_files_total")
+                metrics.inc("kioku_anki_media_skipped_bytes_total", size)
+                continue
+
+            _upload_media(spool, filename)
+            uploaded.append((filename, digest))
+            metrics.inc("kioku_anki_media_uploaded_files_total")
+            metrics.inc("kioku_anki_media_uploaded_bytes_total", size)
+    finally:
+        media_index.record(uploaded)
+
+
+def clear_media_index():
+    """Forget which media files have been uploaded."""
+    media_index.clear()
 
 
 def sync_anki():
@@ -77,47 +251,116 @@ def sync_anki():
     _anki_request("sync")
 
 
+def note_fields(card: CardItem) -> dict[str, str]:
+    """Return the note type's field values for a card, in MODEL_FIELDS order."""
+    word_audio_file = audio_filename(card.japanese, "word")
+    sentence_audio_file = audio_filename(card.example_sentence, "sentence")
+    return {
+        "Japanese": card.japanese,
+        "Reading": card.reading,
+        "Meaning": card.meaning,
+        "ExampleSentence": card.example_sentence,
+        "ExampleTranslation": card.example_translation,
+        "WordAudio": f"[sound:{word_audio_file}]",
+        "SentenceAudio": f"[sound:{sentence_audio_file}]",
+    }
+
+
+def _build_note(card: CardItem, deck_name: str) -> dict:
+    """Build the AnkiConnect note payload for a card."""
+    return {
+        "deckName": deck_name,
+        "modelName": MODEL_NAME,
+        "fields": note_fields(card),
+        "options": {"allowDuplicate": False},
+        "tags": ["ankiGen"],
+    }
+
+
+def unique_cards(cards: list[CardItem]) -> tuple[list[CardItem], list[CardItem]]:
+    """Split cards into first occurrences and repeats of the same first field."""
+    unique: list[CardItem] = []
+    repeats: list[CardItem] = []
+    seen: set[str] = set()
+    for card in cards:
+        if card.japanese in seen:
+            repeats.append(card)
+            continue
+        seen.add(card.japanese)
+        unique.append(card)
+    return unique, repeats
+
+
+def find_new_cards(
+    cards: list[CardItem],
+    deck_name: str = "ankiGen",
+) -> tuple[list[CardItem], list[CardItem]]:
+    """Split cards into those Anki would accept and those it would reject.
+
+    Uses a single canAddNotes call so that duplicates already in the
+    collection (and repeats within the batch) are dropped before any audio
+    is generated for them. Returns ``(new_cards, skipped_cards)``.
+    """
+    unique, skipped = unique_cards(cards)
+    if not unique:
+        return [], skipped
+
+    _ensure_deck(deck_name)
+    _ensure_model(MODEL_NAME)
+
+    notes = [_build_note(card, deck_name) for card in unique]
+    can_add = _anki_request("canAddNotes", notes=notes)
+    if not isinstance(can_add, list) or len(can_add) != len(unique):
+        raise RuntimeError(
+            f"AnkiConnect canAddNotes returned {can_add!r} for {len(unique)} notes."
+        )
+
+    new_cards: list[CardItem] = []
+    for card, ok in zip(unique, can_add):
+        (new_cards if ok else skipped).append(card)
+    return new_cards, skipped
+
+
+def _add_notes(notes: list[dict]) -> list[int | None]:
+    """One addNotes call; the new note ids, None where Anki refused a note."""
+    note_ids = _anki_request("addNotes", notes=notes)
+    if not isinstance(note_ids, list) or len(note_ids) != len(notes):
+        raise RuntimeError(f"AnkiConnect addNotes returned {note_ids!r} for {len(notes)} notes.")
+    return note_ids
+
+
 def add_cards(
     cards: list[CardItem],
-    audio_map: dict[str, bytes],
+    audio_map: Mapping[str, bytes],
     deck_name: str = "ankiGen",
 ) -> int:
-    """Push cards into Anki via AnkiConnect. Returns count of cards added."""
+    """Push cards into Anki with one addNotes call. Returns count of cards added.
+
+    If Anki refuses any note, the ones it accepted stay added and a
+    RuntimeError names the rest; ``find_new_cards`` tells them apart.
+    """
+    if not cards:
+        return 0
     _ensure_deck(deck_name)
     _ensure_model(MODEL_NAME)
 
-    # Store all audio files
-    for filename, audio_bytes in audio_map.items():
-        _anki_request(
-            "storeMediaFile",
-            filename=filename,
-            data=base64.b64encode(audio_bytes).decode(),
-        )
+    _store_media(audio_map)
 
-    # Add notes
-    added = 0
-    for card in cards:
-        word_audio_file = audio_filename(card.japanese, "word")
-        sentence_audio_file = audio_filename(card.example_sentence, "sentence")
+    notes = [_build_note(card, deck_name) for card in cards]
+    try:
+        note_ids = _add_notes(notes)
+    except RuntimeError as err:
+        if not _is_missing_deck_or_model(err):
+            raise
+        # The deck or note type was removed behind our back; the cache is stale.
+        invalidate_cache()
+        _ensure_deck(deck_name)
+        _ensure_model(MODEL_NAME)
+        note_ids = _add_notes(notes)
 
-        _anki_request(
-            "addNote",
-            note={
-                "deckName": deck_name,
-                "modelName": MODEL_NAME,
-                "fields": {
-                    "Japanese": card.japanese,
-                    "Reading": card.reading,
-                    "Meaning": card.meaning,
-                    "ExampleSentence": card.example_sentence,
-                    "ExampleTranslation": card.example_translation,
-                    "WordAudio": f"[sound:{word_audio_file}]",
-                    "SentenceAudio": f"[sound:{sentence_audio_file}]",
-                },
-                "options": {"allowDuplicate": False},
-                "tags": ["ankiGen"],
-            },
+    refused = [card.japanese for card, note_id in zip(cards, note_ids) if note_id is None]
+    if refused:
+        raise RuntimeError(
+            f"Anki refused {len(refused)} of {len(cards)} notes: {', '.join(refused)}"
         )
-        added += 1
-
-    return added
+    return len(cards)
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from collections.abc import Iterable
+from pathlib import Path
+from typing import BinaryIO
+
+from kioku.models import CardItem
+from kioku.services.anki_builder import (
+    BACK_TEMPLATE,
+    FRONT_TEMPLATE,
+    MODEL_CSS,
+    MODEL_FIELDS,
+    MODEL_NAME,
+    note_fields,
+)
+
+# Characters Anki itself uses for base91 note GUIDs
+_BASE91_TABLE = (
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_COPY_CHUNK = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+_DECK_CONFIG = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "maxTaken": 60,
+    "autoplay": True,
+    "timer": 0,
+    "replayq": True,
+    "dyn": False,
+    "new": {
+        "bury": True,
+        "delays": [1, 10],
+        "initialFactor": 2500,
+        "ints": [1, 4, 7],
+        "order": 1,
+        "perDay": 20,
+        "separate": True,
+    },
+    "rev": {
+        "bury": True,
+        "ease4": 1.3,
+        "fuzz": 0.05,
+        "ivlFct": 1,
+        "maxIvl": 36500,
+        "minSpace": 1,
+        "perDay": 200,
+    },
+    "lapse": {"delays": [10], "leechAction": 0, "leechFails": 8, "minInt": 1, "mult": 0},
+}
+
+
+def stable_id(name: str) -> int:
+    """Derive a stable positive 48-bit id (model/deck) from a name."""
+    return int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def note_guid(card: CardItem) -> str:
+    """Stable note GUID so re-importing the same card updates instead of duplicating."""
+    digest = hashlib.sha256(f"{MODEL_NAME}\x1f{card.japanese}".encode("utf-8")).digest()
+    value = int.from_bytes(digest[:8], "big")
+    chars = []
+    while value:
+        value, rem = divmod(value, len(_BASE91_TABLE))
+        chars.append(_BASE91_TABLE[rem])
+    return "".join(reversed(chars)) or _BASE91_TABLE[0]
+
+
+def _field_checksum(text: str) -> int:
+    stripped = _HTML_TAG.sub("", text)
+    return int(hashlib.sha1(stripped.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _model_json(model_id: int, deck_id: int, now: int) -> dict:
+    return {
+        "id": model_id,
+        "name": MODEL_NAME,
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [
+            {
+                "name": "Card 1",
+                "ord": 0,
+                "qfmt": FRONT_TEMPLATE,
+                "afmt": BACK_TEMPLATE,
+                "did": None,
+                "bqfmt": "",
+                "bafmt": "",
+            }
+        ],
+        "flds": [
+            {
+                "name": name,
+                "ord": i,
+                "sticky": False,
+                "rtl": False,
+                "font": "Arial",
+                "size": 20,
+                "media": [],
+            }
+            for i, name in enumerate(MODEL_FIELDS)
+        ],
+        "css": MODEL_CSS,
+        "latexPre": (
+            "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+            "\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n"
+            "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n"
+        ),
+        "latexPost": "\\end{document}",
+        "tags": [],
+        "vers": [],
+        # Card 1 is generated whenever Japanese or WordAudio is non-empty
+        "req": [[0, "any", [0, MODEL_FIELDS.index("WordAudio")]]],
+    }
+
+
+def _deck_json(deck_id: int, name: str, now: int) -> dict:
+    return {
+        "id": deck_id,
+        "name": name,
+        "mod": now,
+        "usn": -1,
+        "desc": "",
+        "dyn": 0,
+        "conf": 1,
+        "collapsed": False,
+        "extendNew": 10,
+        "extendRev": 50,
+        "newToday": [0, 0],
+        "revToday": [0, 0],
+        "lrnToday": [0, 0],
+        "timeToday": [0, 0],
+    }
+
+
+def _write_collection(path: Path, cards: Iterable[CardItem], deck_name: str) -> int:
+    now = int(time.time())
+    model_id = stable_id(MODEL_NAME)
+    deck_id = stable_id(f"deck:{deck_name}")
+    decks = {"1": _deck_json(1, "Default", now), str(deck_id): _deck_json(deck_id, deck_name, now)}
+    conf = {
+        "activeDecks": [deck_id],
+        "curDeck": deck_id,
+        "curModel": model_id,
+        "nextPos": 1,
+        "newSpread": 0,
+        "collapseTime": 1200,
+        "timeLim": 0,
+        "estTimes": True,
+        "dueCounts": True,
+        "sortType": "noteFld",
+        "sortBackwards": False,
+        "addToCur": True,
+    }
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(_SCHEMA)
+        # Note and card ids are millisecond timestamps; keep them unique per export
+        base_id = now * 1000
+        count = 0
+        seen: set[str] = set()
+        note_rows = []
+        card_rows = []
+        for card in cards:
+            if card.japanese in seen:
+                continue
+            seen.add(card.japanese)
+            fields = note_fields(card)
+            note_id = base_id + count
+            note_rows.append(
+                (
+                    note_id,
+                    note_guid(card),
+                    model_id,
+                    now,
+                    -1,
+                    " ankiGen ",
+                    "\x1f".join(fields[name] for name in MODEL_FIELDS),
+                    card.japanese,
+                    _field_checksum(card.japanese),
+                    0,
+                    "",
+                )
+            )
+            card_rows.append(
+                (note_id, note_id, deck_id, 0, now, -1, 0, 0, count + 1, 0, 0, 0, 0, 0, 0, 0, 0, "")
+            )
+            count += 1
+        conn.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", note_rows)
+        conn.executemany(
+            "INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", card_rows
+        )
+        conn.execute(
+            "INSERT INTO col VALUES (1,?,?,?,11,0,0,0,?,?,?,?,?)",
+            (
+                now // 86400 * 86400,
+                now * 1000,
+                now * 1000,
+                json.dumps(conf),
+                json.dumps({str(model_id): _model_json(model_id, deck_id, now)}),
+                json.dumps(decks),
+                json.dumps({"1": _DECK_CONFIG}),
+                "{}",
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+
+def write_apkg(
+    out: str | os.PathLike | BinaryIO,
+    cards: Iterable[CardItem],
+    media: Iterable[tuple[str, bytes | str | os.PathLike]] = (),
+    deck_name: str = "ankiGen",
+) -> int:
+    """Write an Anki package containing ``cards`` and ``media``.
+
+    ``media`` yields ``(filename, data)`` pairs where data is either bytes or
+    a path to a file; each file is streamed into the archive as it is
+    produced, so the whole media set never has to be held in memory.
+    Returns the number of notes written.
+    """
+    with tempfile.TemporaryDirectory(prefix="kioku-apkg-") as tmp:
+        collection = Path(tmp) / "collection.anki2"
+        count = _write_collection(collection, cards, deck_name)
+
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+            zf.write(collection, "collection.anki2", compress_type=zipfile.ZIP_DEFLATED)
+            media_index: dict[str, str] = {}
+            written: set[str] = set()
+            for filename, data in media:
+                if filename in written:
+                    continue
+                written.add(filename)
+                entry = str(len(media_index))
+                with zf.open(entry, "w") as dest:
+                    if isinstance(data, (bytes, bytearray, memoryview)):
+                        dest.write(data)
+                    else:
+                        with open(data, "rb") as src:
+                            shutil.copyfileobj(src, dest, _COPY_CHUNK)
+                media_index[entry] = filename
+            zf.writestr("media", json.dumps(media_index))
+    return count
@@ -0,0 +1,149 @@
+"""Cut sentence audio out of a local video or audio file by subtitle timing.
+
+Each cue becomes one ffmpeg run: ``-ss`` before ``-i`` seeks the input to
+the keyframe before the cue and decodes only from there, so a clip near
+the end of a two-hour film costs the same as one at the start.
+The clip is padded slightly, faded at both ends and loudness-normalised,
+then written as WAV for the same audio map the captured-audio path fills.
+
+Runs are independent processes, so they are started from a thread pool
+(CLIP_CONCURRENCY at a time, default one per CPU) and scale across cores
+without pickling anything. Cues in subtitle files are sparse, so seeking
+per cue reads far less of the file than one pass through the segment
+muxer would.
+"""
+
+import contextvars
+import logging
+import os
+import subprocess
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from kioku import metrics, tracing
+from kioku.models import CardItem
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = ["ffmpeg"]
+# Seconds kept before and after the cue, since subtitle timing is loose
+DEFAULT_CLIP_PADDING = "0.25"
+FADE_SECONDS = 0.02
+# EBU R128 loudness normalisation; -16 LUFS is a common target for speech
+LOUDNORM = "loudnorm=I=-16:TP=-1.5:LRA=11"
+SAMPLE_RATE = "44100"
+
+
+def resolve_media_path(path: str) -> Path:
+    """Check that a media path sent to the API lies inside MEDIA_DIR.
+
+    The server reads these files itself, so requests may only name files
+    under the directory the operator shared. Raises ValueError otherwise.
+    """
+    root = os.environ.get("MEDIA_DIR", "").strip()
+    if not root:
+        raise ValueError("Clipping from media files is disabled; set MEDIA_DIR to enable it.")
+    root_path = Path(root).expanduser().resolve()
+    resolved = (root_path / path).resolve()
+    if not resolved.is_relative_to(root_path):
+        raise ValueError("media_path must be inside MEDIA_DIR.")
+    if not resolved.is_file():
+        raise ValueError(f"Media file not found: {path}")
+    return resolved
+
+
+def clip_command(
+    source: str | Path, start: float, end: float, padding: float, audio_stream: int = 0
+) -> list[str]:
+    """The ffmpeg invocation writing one padded, normalised WAV clip to stdout."""
+    begin = max(start - padding, 0.0)
+    duration = max(end + padding - begin, FADE_SECONDS * 2)
+    fades = (
+        f"afade=t=in:d={FADE_SECONDS},"
+        f"afade=t=out:st={duration - FADE_SECONDS:.3f}:d={FADE_SECONDS}"
+    )
+    return [
+        *FFMPEG,
+        "-nostdin",
+        "-v", "error",
+        "-ss", f"{begin:.3f}",
+        "-i", str(source),
+        "-t", f"{duration:.3f}",
+        "-map", f"0:a:{audio_stream}",
+        "-vn",
+        "-ac", "1",
+        "-ar", SAMPLE_RATE,
+        "-af", f"{fades},{LOUDNORM}",
+        "-f", "wav",
+        "pipe:1",
+    ]
+
+
+@tracing.traced("clip_audio")
+def clip_audio(
+    source: str | Path,
+    start: float,
+    end: float,
+    padding: float | None = None,
+    audio_stream: int = 0,
+) -> bytes:
+    """Cut ``start``–``end`` (seconds) out of ``source`` as WAV."""
+    if padding is None:
+        padding = float(os.environ.get("CLIP_PADDING", DEFAULT_CLIP_PADDING))
+    command = clip_command(source, start, end, padding, audio_stream)
+    with metrics.track("ffmpeg"):
+        result = subprocess.run(command, capture_output=True)
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(f"ffmpeg clipping failed: {result.stderr.decode(errors='replace')}")
+    return result.stdout
+
+
+def clip_cards(
+    source: str | Path,
+    cards: list[CardItem],
+    progress: Callable[[str, int, int], None] | None = None,
+    concurrency: int | None = None,
+    audio_stream: int = 0,
+) -> dict[str, bytes]:
+    """Clip every timed example sentence of ``cards`` from ``source`` in parallel.
+
+    Returns ``{example_sentence: wav}``. Cards without cue times, and clips
+    ffmpeg could not cut, are left out so their sentences fall back to TTS.
+    """
+    spans: dict[str, tuple[float, float]] = {}
+    for card in cards:
+        if card.cue_start is not None and card.cue_end is not None:
+            spans.setdefault(card.example_sentence, (card.cue_start, card.cue_end))
+    if concurrency is None:
+        concurrency = int(os.environ.get("CLIP_CONCURRENCY", os.cpu_count() or 1))
+
+    clips: dict[str, bytes] = {}
+    done = 0
+    if progress is not None:
+        progress("clip", done, len(spans))
+    if not spans:
+        return clips
+    with ThreadPoolExecutor(max(concurrency, 1), thread_name_prefix="kioku-clip") as pool:
+        # Each run carries the caller's context, so its span joins the trace
+        futures = {
+            pool.submit(
+                contextvars.copy_context().run,
+                clip_audio,
+                source,
+                start,
+                end,
+                audio_stream=audio_stream,
+            ): sentence
+            for sentence, (start, end) in spans.items()
+        }
+        for future in as_completed(futures):
+            sentence = futures[future]
+            try:
+                clips[sentence] = future.result()
+            except (RuntimeError, OSError) as err:
+                logger.warning("could not clip %r, using TTS: %s", sentence, err)
+            done += 1
+            if progress is not None:
+                progress("clip", done, len(spans))
+    return clips
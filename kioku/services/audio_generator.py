@@ -1,41 +1,65 @@
+import hashlib
 import os
 
 import httpx
 
+from kioku import admission, metrics, tracing
+from kioku.cache import get_cache
+
 DEFAULT_VOICEVOX_URL = "http://localhost:50021"
 DEFAULT_VOICEVOX_SPEAKER = "0"
 
 
+@tracing.traced("generate_audio")
 async def generate_audio(text: str) -> bytes:
-    """Generate WAV audio for Japanese text using VOICEVOX."""
+    """Generate WAV audio for Japanese text using VOICEVOX.
+
+    Audio is cached per text, speaker and speed, so workers sharing a cache
+    backend synthesize each sentence once. The in-process ``memory`` backend
+    does not keep audio: it would sit outside the AUDIO_MEMORY_BYTES budget
+    of the requests that made it.
+    """
     if not text or not text.strip():
         raise RuntimeError("Cannot generate audio for empty text.")
 
     base_url = os.environ.get("VOICEVOX_URL", DEFAULT_VOICEVOX_URL).rstrip("/")
     speaker = os.environ.get("VOICEVOX_SPEAKER", DEFAULT_VOICEVOX_SPEAKER)
+    speed = float(os.environ.get("VOICEVOX_SPEED", "0.8"))
+    cache = get_cache()
+    if cache.in_process:
+        return await _synthesize(text, base_url, speaker, speed)
+    digest = hashlib.sha256(f"{speaker}\0{speed}\0{text}".encode("utf-8")).hexdigest()
+    return await cache.get_or_compute_async(
+        f"tts:{digest}", lambda: _synthesize(text, base_url, speaker, speed)
+    )
+
 
+async def _synthesize(text: str, base_url: str, speaker: str, speed: float) -> bytes:
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        async with admission.gate("voicevox").hold_async(), httpx.AsyncClient(
+            timeout=30.0
+        ) as client:
             # Step 1: Get audio query
-            query_response = await client.post(
-                f"{base_url}/audio_query",
-                params={"text": text, "speaker": speaker},
-            )
-            query_response.raise_for_status()
-            audio_query = query_response.json()
+            with metrics.track("voicevox_audio_query"):
+                query_response = await client.post(
+                    f"{base_url}/audio_query",
+                    params={"text": text, "speaker": speaker},
+                )
+                query_response.raise_for_status()
+                audio_query = query_response.json()
 
             # Apply speed adjustment
-            speed = float(os.environ.get("VOICEVOX_SPEED", "0.8"))
             audio_query["speedScale"] = speed
 
             # Step 2: Synthesize audio
-            synthesis_response = await client.post(
-                f"{base_url}/synthesis",
-                params={"speaker": speaker},
-                json=audio_query,
-            )
-            synthesis_response.raise_for_status()
-            audio_bytes = synthesis_response.content
+            with metrics.track("voicevox_synthesis"):
+                synthesis_response = await client.post(
+                    f"{base_url}/synthesis",
+                    params={"speaker": speaker},
+                    json=audio_query,
+                )
+                synthesis_response.raise_for_status()
+                audio_bytes = synthesis_response.content
 
     except httpx.HTTPStatusError as err:
         raise RuntimeError(
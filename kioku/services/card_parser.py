@@ -0,0 +1,56 @@
+import json
+
+from kioku import metrics
+from kioku.models import CardItem
+
+
+def strip_code_fences(text: str) -> str:
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.split("\n", 1)[1]
+        cleaned = cleaned.rsplit("```", 1)[0].strip()
+    return cleaned
+
+
+def parse_cards(content: str) -> list[CardItem]:
+    """Turn the LLM's JSON answer into cards, dropping incomplete and repeated entries."""
+    clean_text = strip_code_fences(content)
+
+    try:
+        with metrics.track("json_parse"):
+            parsed = json.loads(clean_text)
+    except json.JSONDecodeError as err:
+        raise RuntimeError(f"Groq returned invalid JSON: {err}\nRaw: {content}") from err
+
+    if not isinstance(parsed, list):
+        raise RuntimeError(f"Groq returned non-list JSON: {content}")
+
+    cards: list[CardItem] = []
+    seen: set[str] = set()
+    for obj in parsed:
+        if not isinstance(obj, dict):
+            continue
+
+        jp = str(obj.get("japanese", "")).strip()
+        if not jp or jp in seen:
+            continue
+
+        reading = str(obj.get("reading", "")).strip()
+        meaning = str(obj.get("meaning", "")).strip()
+        example_sentence = str(obj.get("example_sentence", "")).strip() or jp
+        example_translation = str(obj.get("example_translation", "")).strip()
+
+        if not reading:
+            continue
+
+        seen.add(jp)
+        cards.append(
+            CardItem(
+                japanese=jp,
+                reading=reading,
+                meaning=meaning,
+                example_sentence=example_sentence,
+                example_translation=example_translation,
+            )
+        )
+    return cards
@@ -1,29 +1,55 @@
+import hashlib
 import io
-import json
 import logging
 import os
+import threading
 
-from groq import Groq
-from manga_ocr import MangaOcr
-from PIL import Image
-
+# groq, PIL and manga_ocr are imported where they are used: a worker that
+# only serves the UI or the text path never pays for loading them.
+from kioku import admission, metrics, tracing
+from kioku.cache import get_cache
 from kioku.models import CardItem
+from kioku.services.card_parser import parse_cards
+from kioku.services.ocr_service import OcrClient
+from kioku.services.vocab_index import vocab_index
 
 logger = logging.getLogger(__name__)
 
-_mocr = MangaOcr()
+# Loaded on first use; with OCR_SOCKET set this process never loads it
+_mocr = None
+_mocr_lock = threading.Lock()
+
+
+def load_ocr_model():
+    """Return the Manga OCR model, loading it on first call."""
+    global _mocr
+    with _mocr_lock:
+        if _mocr is None:
+            from manga_ocr import MangaOcr
+
+            _mocr = MangaOcr()
+    return _mocr
+
+
+class GroqError(Exception):
+    """The Groq API failed an enrichment request."""
+
+
+class GroqAuthenticationError(GroqError):
+    """Groq rejected GROQ_API_KEY."""
 
 
-def _strip_code_fences(text: str) -> str:
-    cleaned = text.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.split("\n", 1)[1]
-        cleaned = cleaned.rsplit("```", 1)[0].strip()
-    return cleaned
+class NoTextError(RuntimeError):
+    """Manga OCR found no text in the image."""
 
 
+@tracing.traced("enrich_text")
 def enrich_text(text: str) -> list[CardItem]:
-    """Enrich Japanese text with readings, meanings, and examples via Groq."""
+    """Enrich Japanese text with readings, meanings, and examples via Groq.
+
+    Words already in the collection are named in the prompt so Groq leaves
+    them out, and any word card for one that comes back anyway is dropped.
+    """
     if not text or not text.strip():
         raise RuntimeError("No text provided for enrichment.")
 
@@ -36,7 +62,13 @@ def enrich_text(text: str) -> list[CardItem]:
     if not api_key:
         raise RuntimeError("GROQ_API_KEY is required.")
 
-    client = Groq(api_key=api_key)
+    known = vocab_index.known_in(text)
+    known_words = (
+        "The learner already knows these words; do NOT create word entries for them: "
+        f"{'、'.join(known)}\n\n"
+        if known
+        else ""
+    )
 
     prompt = (
         "I will give you Japanese text. "
@@ -57,61 +89,34 @@ def enrich_text(text: str) -> list[CardItem]:
         "IMPORTANT: Every field must be filled in. Never leave any field empty. "
         "Even if the text is incomplete or partial, provide your best translation.\n\n"
         "Return ONLY valid JSON. No other text.\n\n"
+        f"{known_words}"
         f"Japanese text:\n{text}"
     )
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a JSON API. Return only valid JSON.",
-            },
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2,
-    )
-
-    content = (response.choices[0].message.content or "").strip()
-    logger.info("Groq raw response: %s", content)
-    clean_text = _strip_code_fences(content)
+    import groq
 
     try:
-        parsed = json.loads(clean_text)
-    except json.JSONDecodeError as err:
-        raise RuntimeError(f"Groq returned invalid JSON: {err}\nRaw: {content}") from err
-
-    if not isinstance(parsed, list):
-        raise RuntimeError(f"Groq returned non-list JSON: {content}")
-
-    cards: list[CardItem] = []
-    seen: set[str] = set()
-    for obj in parsed:
-        if not isinstance(obj, dict):
-            continue
-
-        jp = str(obj.get("japanese", "")).strip()
-        if not jp or jp in seen:
-            continue
-
-        reading = str(obj.get("reading", "")).strip()
-        meaning = str(obj.get("meaning", "")).strip()
-        example_sentence = str(obj.get("example_sentence", "")).strip() or jp
-        example_translation = str(obj.get("example_translation", "")).strip()
-
-        if not reading:
-            continue
-
-        seen.add(jp)
-        cards.append(
-            CardItem(
-                japanese=jp,
-                reading=reading,
-                meaning=meaning,
-                example_sentence=example_sentence,
-                example_translation=example_translation,
+        client = groq.Groq(api_key=api_key)
+        with admission.gate("groq").hold(), metrics.track("groq"):
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a JSON API. Return only valid JSON.",
+                    },
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0.2,
             )
-        )
+    except groq.AuthenticationError as err:
+        raise GroqAuthenticationError(str(err)) from err
+    except groq.APIError as err:
+        raise GroqError(str(err)) from err
+
+    content = (response.choices[0].message.content or "").strip()
+    logger.info("Groq raw response: %s", content)
+    cards = parse_cards(content)
 
     if not cards:
         raise RuntimeError(
@@ -120,19 +125,56 @@ def enrich_text(text: str) -> list[CardItem]:
             f"Groq response: {content}"
         )
 
+    cards, skipped = vocab_index.prune(cards)
+    if skipped:
+        logger.info("dropped %d card(s) for known words", len(skipped))
     return cards
 
 
-def extract_cards(image_bytes: bytes, mime_type: str) -> list[CardItem]:
-    """OCR with Manga OCR, then enrich with a single Groq call."""
-    # --- OCR via Manga OCR (local, no API call) ---
-    image = Image.open(io.BytesIO(image_bytes))
-    ocr_text = _mocr(image)
+def recognize(image_bytes: bytes) -> str:
+    """Run Manga OCR on an image in this process."""
+    from PIL import Image
+
+    model = load_ocr_model()
+    with metrics.track("image_decode"):
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    with metrics.track("ocr", mode="inline"):
+        return model(image)
+
+
+def _run_ocr(image_bytes: bytes) -> bytes:
+    socket_path = os.environ.get("OCR_SOCKET", "").strip()
+    with admission.gate("ocr").hold():
+        if socket_path:
+            with metrics.track("ocr", mode="shared"):
+                ocr_text = OcrClient(socket_path).recognize(image_bytes)
+        else:
+            ocr_text = recognize(image_bytes)
 
     if not ocr_text or not ocr_text.strip():
-        raise RuntimeError("Manga OCR returned no text.")
+        raise NoTextError("Manga OCR returned no text.")
+    return ocr_text.encode("utf-8")
+
+
+def ocr_image(image_bytes: bytes) -> str:
+    """Read the Japanese text in an image with Manga OCR (local, no API call).
+
+    When ``OCR_SOCKET`` is set the image goes to the shared OCR process
+    instead of a model loaded in this worker. Results are cached by image
+    hash, so a screenshot sent twice is only read once.
+    """
+    key = f"ocr:{hashlib.sha256(image_bytes).hexdigest()}"
+    ocr_text = get_cache().get_or_compute(key, lambda: _run_ocr(image_bytes)).decode("utf-8")
 
     logger.info("Manga OCR text: %s", ocr_text)
+    return ocr_text
+
+
+@tracing.traced("extract_cards")
+def extract_cards(image_bytes: bytes, mime_type: str) -> list[CardItem]:
+    """OCR with Manga OCR, then enrich with a single Groq call."""
+    ocr_text = ocr_image(image_bytes)
 
     # Delegate to enrich_text
     return enrich_text(ocr_text)
@@ -0,0 +1,83 @@
+"""Content hashes of the media files uploaded to Anki, kept across restarts.
+
+``_store_media`` skips a file when Anki still lists it and the SHA-256 of
+its bytes matches the one recorded at its last upload. The index lives in
+SQLite in the data directory, so it survives restarts and is shared by
+every worker of ``kioku serve --workers N``.
+"""
+
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+
+from kioku.utils import data_dir
+
+# Names per SELECT, below SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_files (
+    filename TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+"""
+
+
+class MediaIndex:
+    """SQLite table of ``filename -> sha256`` for media this install has uploaded."""
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "media.sqlite3"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def digests(self, filenames: Iterable[str]) -> dict[str, str]:
+        """The recorded digest of each of ``filenames`` that has one."""
+        names = list(filenames)
+        found: dict[str, str] = {}
+        if not names:
+            return found
+        conn = self._connect()
+        try:
+            for start in range(0, len(names), LOOKUP_CHUNK):
+                chunk = names[start : start + LOOKUP_CHUNK]
+                rows = conn.execute(
+                    "SELECT filename, digest FROM media_files WHERE filename IN"
+                    f" ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                found.update(rows.fetchall())
+        finally:
+            conn.close()
+        return found
+
+    def record(self, uploads: Iterable[tuple[str, str]]):
+        """Remember the digests of ``(filename, digest)`` pairs just uploaded."""
+        uploads = list(uploads)
+        if not uploads:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO media_files VALUES (?, ?)", uploads)
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM media_files")
+        finally:
+            conn.close()
+
+
+media_index = MediaIndex()
@@ -0,0 +1,182 @@
+"""Shared Manga OCR inference process, reached over a Unix domain socket.
+
+Each uvicorn worker would otherwise load its own copy of the Manga OCR model
+and the torch runtime behind it. ``kioku serve --workers N`` instead starts
+one OCR process that holds the model, and the API workers send it images
+through the socket named by ``OCR_SOCKET``.
+
+Wire format, in both directions: a 4-byte big-endian length, then the
+payload. A request payload is the raw image bytes. A response payload is a
+status byte (0 = OCR text, 1 = error message) followed by UTF-8 text.
+"""
+
+import logging
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OCR_TIMEOUT = "120"
+DEFAULT_OCR_STARTUP_TIMEOUT = "600"
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+_HEADER = struct.Struct(">I")
+_OK = 0
+_ERROR = 1
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes | None:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def recv_frame(sock: socket.socket) -> bytes | None:
+    """Read one frame; ``None`` if the peer closed the connection first."""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_FRAME_BYTES:
+        raise ValueError(f"OCR frame of {size} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    return _recv_exact(sock, size)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "OcrServer"
+
+    def handle(self):
+        while True:
+            try:
+                image_bytes = recv_frame(self.request)
+            except (OSError, ValueError) as e:
+                logger.warning("dropping OCR connection: %s", e)
+                return
+            if image_bytes is None:
+                return
+            try:
+                # One inference at a time: the model is not shared between threads
+                with self.server.model_lock:
+                    text = self.server.recognize(image_bytes)
+                reply = bytes([_OK]) + text.encode("utf-8")
+            except Exception as e:
+                reply = bytes([_ERROR]) + str(e).encode("utf-8")
+            send_frame(self.request, reply)
+
+
+class OcrServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answer OCR requests on ``socket_path`` with ``recognize(image_bytes)``."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str | os.PathLike, recognize: Callable[[bytes], str]):
+        self.recognize = recognize
+        self.model_lock = threading.Lock()
+        Path(socket_path).unlink(missing_ok=True)
+        super().__init__(os.fspath(socket_path), _Handler)
+
+    def server_close(self):
+        super().server_close()
+        Path(self.server_address).unlink(missing_ok=True)
+
+
+class OcrClient:
+    """Send images to the shared OCR process."""
+
+    def __init__(self, socket_path: str | os.PathLike, timeout: float | None = None):
+        self.socket_path = os.fspath(socket_path)
+        self.timeout = timeout or float(os.environ.get("OCR_TIMEOUT", DEFAULT_OCR_TIMEOUT))
+
+    def recognize(self, image_bytes: bytes) -> str:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                send_frame(sock, image_bytes)
+                reply = recv_frame(sock)
+        except OSError as e:
+            raise RuntimeError(f"OCR process at {self.socket_path} is unavailable: {e}") from e
+        if not reply:
+            raise RuntimeError(f"OCR process at {self.socket_path} closed the connection.")
+        text = reply[1:].decode("utf-8")
+        if reply[0] != _OK:
+            raise RuntimeError(f"OCR failed: {text}")
+        return text
+
+
+def serve(socket_path: str | os.PathLike):
+    """Load Manga OCR once, then answer requests until interrupted."""
+    from kioku.log import configure_logging
+    from kioku.services import image_processor
+
+    configure_logging()
+    started = time.perf_counter()
+    image_processor.load_ocr_model()
+    logger.info(
+        "OCR model loaded",
+        extra={"fields": {"seconds": round(time.perf_counter() - started, 1)}},
+    )
+    # Bind only once the model is in memory, so a connectable socket means ready
+    with OcrServer(socket_path, image_processor.recognize) as server:
+        logger.info("OCR process listening", extra={"fields": {"socket": str(socket_path)}})
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def _connectable(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def start_process(socket_path: str | os.PathLike, timeout: float | None = None) -> subprocess.Popen:
+    """Start ``kioku ocr-server`` and wait until it accepts connections."""
+    socket_path = os.fspath(socket_path)
+    if timeout is None:
+        timeout = float(os.environ.get("OCR_STARTUP_TIMEOUT", DEFAULT_OCR_STARTUP_TIMEOUT))
+    env = {name: value for name, value in os.environ.items() if name != "OCR_SOCKET"}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "kioku", "ocr-server", "--socket", socket_path], env=env
+    )
+    deadline = time.monotonic() + timeout
+    while not _connectable(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError(f"OCR process exited with status {process.returncode}")
+        if time.monotonic() > deadline:
+            stop_process(process)
+            raise RuntimeError(f"OCR process did not start within {timeout:.0f}s")
+        time.sleep(0.2)
+    return process
+
+
+def stop_process(process: subprocess.Popen, timeout: float = 10.0):
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
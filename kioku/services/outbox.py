@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+
+from kioku import admission
+from kioku.audio_spool import AudioSpool
+from kioku.models import CardItem
+from kioku.services.anki_builder import AnkiUnavailableError, add_cards, find_new_cards
+from kioku.utils import data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_BATCH_SIZE = "20"
+DEFAULT_OUTBOX_POLL_INTERVAL = "5"
+DEFAULT_OUTBOX_MAX_ATTEMPTS = "8"
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    deck_name TEXT NOT NULL,
+    cards TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    failures INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS media (
+    entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (entry_id, filename)
+);
+"""
+# Columns added after the first release, for outboxes created before them
+_COLUMNS = {
+    "status": "ALTER TABLE entries ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'",
+    "failures": "ALTER TABLE entries ADD COLUMN failures INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def max_attempts() -> int:
+    return int(os.environ.get("OUTBOX_MAX_ATTEMPTS", DEFAULT_OUTBOX_MAX_ATTEMPTS))
+
+
+def backoff_delay(attempts: int) -> float:
+    """Seconds to wait before the next attempt after ``attempts`` failures."""
+    return min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+
+
+class Outbox:
+    """SQLite-backed queue of notes (and their audio) waiting for AnkiConnect.
+
+    Entries are ``pending`` until delivered. One that Anki rejects
+    OUTBOX_MAX_ATTEMPTS times for a reason other than being unreachable
+    (a bad note type, a refused note) becomes ``dead``: it is no longer
+    retried on its own, but stays listed until retried or discarded.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "outbox.sqlite3"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(entries)")}
+        for column, ddl in _COLUMNS.items():
+            if column not in columns:
+                conn.execute(ddl)
+        return conn
+
+    def enqueue(
+        self, cards: list[CardItem], audio_map: Mapping[str, bytes], deck_name: str
+    ) -> int:
+        """Store a batch of notes and return its entry id."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO entries (deck_name, cards, created_at, next_attempt_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (deck_name, json.dumps([c.model_dump() for c in cards]), now, now),
+                )
+                entry_id = cur.lastrowid
+                # One file at a time, so spilled audio is not all loaded at once
+                conn.executemany(
+                    "INSERT INTO media (entry_id, filename, data) VALUES (?, ?, ?)",
+                    ((entry_id, name, data) for name, data in audio_map.items()),
+                )
+        finally:
+            conn.close()
+        return entry_id
+
+    def depth(self) -> int:
+        """Number of entries still waiting to be delivered (dead ones excluded)."""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE status = 'pending'"
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def entries(self) -> list[dict]:
+        """Summaries of every queued entry, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, deck_name, cards, created_at, attempts, next_attempt_at, last_error,"
+                " status, failures FROM entries ORDER BY id"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "id": row["id"],
+                "deck_name": row["deck_name"],
+                "cards": len(json.loads(row["cards"])),
+                "created_at": row["created_at"],
+                "attempts": row["attempts"],
+                "next_attempt_at": row["next_attempt_at"],
+                "last_error": row["last_error"],
+                "status": row["status"],
+                "failures": row["failures"],
+            }
+            for row in rows
+        ]
+
+    def due(self, limit: int, now: float | None = None) -> list[int]:
+        """Ids of entries whose backoff has elapsed, oldest first."""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id FROM entries WHERE status = 'pending' AND next_attempt_at <= ?"
+                " ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row["id"] for row in rows]
+
+    def load(self, entry_id: int) -> tuple[list[CardItem], AudioSpool, str] | None:
+        """Return ``(cards, audio_map, deck_name)`` for an entry, or None.
+
+        The audio is read into an ``AudioSpool`` row by row; close it when done.
+        """
+        conn = self._connect()
+        audio_map = AudioSpool()
+        try:
+            row = conn.execute(
+                "SELECT deck_name, cards FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            for media in conn.execute(
+                "SELECT filename, data FROM media WHERE entry_id = ?", (entry_id,)
+            ):
+                audio_map.add(media["filename"], bytes(media["data"]))
+        except BaseException:
+            audio_map.close()
+            raise
+        finally:
+            conn.close()
+        cards = [CardItem(**c) for c in json.loads(row["cards"])]
+        return cards, audio_map, row["deck_name"]
+
+    def remove(self, entry_id: int) -> int:
+        """Delete an entry and its audio. Returns the number of entries deleted."""
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,)).rowcount
+        finally:
+            conn.close()
+
+    def record_failure(self, entry_id: int, error: str, rejected: bool = False) -> bool:
+        """Count a failed attempt and push the entry back with exponential backoff.
+
+        ``rejected`` marks a failure other than Anki being unreachable; after
+        OUTBOX_MAX_ATTEMPTS of those the entry is marked dead. Returns True
+        when it was.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT attempts, failures FROM entries WHERE id = ?", (entry_id,)
+                ).fetchone()
+                if row is None:
+                    return False
+                attempts = row["attempts"] + 1
+                failures = row["failures"] + int(rejected)
+                status = "dead" if failures >= max_attempts() else "pending"
+                conn.execute(
+                    "UPDATE entries SET attempts = ?, failures = ?, status = ?,"
+                    " next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (
+                        attempts,
+                        failures,
+                        status,
+                        time.time() + backoff_delay(attempts),
+                        error,
+                        entry_id,
+                    ),
+                )
+                return status == "dead"
+        finally:
+            conn.close()
+
+    def retry(self, entry_id: int | None = None) -> int:
+        """Make one entry (or every pending one) due now. Returns the number affected.
+
+        Retrying a single dead entry revives it with a fresh attempt budget.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                if entry_id is None:
+                    cur = conn.execute(
+                        "UPDATE entries SET next_attempt_at = ? WHERE status = 'pending'",
+                        (time.time(),),
+                    )
+                else:
+                    cur = conn.execute(
+                        "UPDATE entries SET next_attempt_at = ?, status = 'pending', failures = 0"
+                        " WHERE id = ?",
+                        (time.time(), entry_id),
+                    )
+                return cur.rowcount
+        finally:
+            conn.close()
+
+
+def drain(outbox: Outbox, limit: int | None = None) -> dict:
+    """Push due outbox entries to AnkiConnect.
+
+    Stops at the first entry that fails because Anki is unreachable; other
+    failures are backed off individually until the entry is marked dead.
+    Returns counts of what happened.
+    """
+    if limit is None:
+        limit = int(os.environ.get("OUTBOX_BATCH_SIZE", DEFAULT_OUTBOX_BATCH_SIZE))
+    result = {"entries": 0, "added": 0, "skipped": 0, "failed": 0, "dead": 0}
+    for entry_id in outbox.due(limit):
+        loaded = outbox.load(entry_id)
+        if loaded is None:
+            continue
+        cards, audio_map, deck_name = loaded
+        try:
+            # Anki may have received these notes another way while we waited
+            new_cards, skipped = find_new_cards(cards, deck_name)
+            if new_cards:
+                result["added"] += add_cards(new_cards, audio_map, deck_name)
+            result["skipped"] += len(skipped)
+        except AnkiUnavailableError as err:
+            outbox.record_failure(entry_id, str(err))
+            result["failed"] += 1
+            break
+        except RuntimeError as err:
+            if outbox.record_failure(entry_id, str(err), rejected=True):
+                logger.warning("outbox entry %s marked dead after: %s", entry_id, err)
+                result["dead"] += 1
+            result["failed"] += 1
+            continue
+        finally:
+            audio_map.close()
+        outbox.remove(entry_id)
+        result["entries"] += 1
+    return result
+
+
+class OutboxDrainer:
+    """Background task that periodically drains the outbox."""
+
+    def __init__(self, outbox: Outbox, on_added=None):
+        self.outbox = outbox
+        self._on_added = on_added
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._lock = threading.Lock()
+        self.last_result: dict | None = None
+
+    def _drain_locked(self) -> dict:
+        with self._lock:
+            return drain(self.outbox)
+
+    async def drain_now(self) -> dict:
+        """Drain due entries immediately, serialised with the background loop."""
+        result = await asyncio.to_thread(self._drain_locked)
+        self.last_result = result
+        if result["added"] and self._on_added is not None:
+            self._on_added()
+        return result
+
+    def wake(self):
+        """Ask the background loop to drain without waiting for the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        interval = float(os.environ.get("OUTBOX_POLL_INTERVAL", DEFAULT_OUTBOX_POLL_INTERVAL))
+        while True:
+            try:
+                # Background retries must not hold up interactive AnkiConnect writes
+                with admission.priority(admission.BULK):
+                    await self.drain_now()
+            except (RuntimeError, OSError, sqlite3.Error) as e:
+                logger.warning("outbox drain failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+outbox = Outbox()
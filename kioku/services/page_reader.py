@@ -0,0 +1,158 @@
+"""Read the pages of a manga volume one at a time.
+
+A volume may be a ZIP/CBZ archive of images, a PDF or a directory of
+images. ``iter_pages`` yields one page at a time in reading order: archive
+entries are decompressed as they are reached and PDF pages are rasterized
+on demand, so neither the archive nor the document is ever unpacked to disk
+or held in memory whole.
+
+PDFs are rasterized with pypdfium2, which is optional: install it
+(``pip install pypdfium2``) to ingest PDFs.
+"""
+
+import io
+import logging
+import os
+import re
+import zipfile
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+ARCHIVE_SUFFIXES = (".zip", ".cbz")
+PDF_SUFFIXES = (".pdf",)
+VOLUME_SUFFIXES = ARCHIVE_SUFFIXES + PDF_SUFFIXES
+
+DEFAULT_PDF_RENDER_DPI = "200"
+# Archive entries larger than this are left out rather than decompressed
+MAX_PAGE_BYTES = 64 * 1024 * 1024
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+@dataclass
+class Page:
+    index: int
+    name: str
+    # None for pages the caller asked to skip
+    data: bytes | None
+
+
+def _natural_key(name: str) -> list:
+    """Sort key putting page2 before page10."""
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(name)]
+
+
+def _is_page_name(name: str) -> bool:
+    parts = Path(name).parts
+    # macOS resource forks and hidden files ride along in many archives
+    if any(part.startswith(".") or part == "__MACOSX" for part in parts):
+        return False
+    return name.lower().endswith(IMAGE_SUFFIXES)
+
+
+def _open_pdf(path: Path):
+    try:
+        import pypdfium2
+    except ImportError as err:
+        raise RuntimeError("Reading PDFs needs pypdfium2: pip install pypdfium2") from err
+    return pypdfium2.PdfDocument(str(path))
+
+
+def _archive_entries(archive: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    entries = []
+    for info in archive.infolist():
+        if info.is_dir() or not _is_page_name(info.filename):
+            continue
+        if info.file_size > MAX_PAGE_BYTES:
+            logger.warning("skipping %s: %d bytes uncompressed", info.filename, info.file_size)
+            continue
+        entries.append(info)
+    return sorted(entries, key=lambda info: _natural_key(info.filename))
+
+
+def _directory_files(path: Path) -> list[Path]:
+    files = [
+        file
+        for file in path.rglob("*")
+        if file.is_file() and _is_page_name(str(file.relative_to(path)))
+    ]
+    return sorted(files, key=lambda file: _natural_key(str(file.relative_to(path))))
+
+
+def page_names(path: str | Path) -> list[str]:
+    """Names of the pages of a volume, in reading order."""
+    path = Path(path)
+    if path.is_dir():
+        return [str(file.relative_to(path)) for file in _directory_files(path)]
+    suffix = path.suffix.lower()
+    if suffix in ARCHIVE_SUFFIXES:
+        try:
+            with zipfile.ZipFile(path) as archive:
+                return [info.filename for info in _archive_entries(archive)]
+        except zipfile.BadZipFile as err:
+            raise ValueError(f"Not a readable ZIP archive: {path.name}") from err
+    if suffix in PDF_SUFFIXES:
+        pdf = _open_pdf(path)
+        try:
+            return [f"page {number}" for number in range(1, len(pdf) + 1)]
+        finally:
+            pdf.close()
+    if suffix in IMAGE_SUFFIXES:
+        return [path.name]
+    raise ValueError(f"Not a page archive, PDF or image: {path.name}")
+
+
+def _render_pdf_page(pdf, index: int, dpi: float) -> bytes:
+    page = pdf[index]
+    try:
+        # Greyscale keeps the PNG small; OCR does not use colour
+        bitmap = page.render(scale=dpi / 72, grayscale=True)
+        image = bitmap.to_pil()
+    finally:
+        page.close()
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def iter_pages(
+    path: str | Path, skip: Callable[[int], bool] | None = None
+) -> Iterator[Page]:
+    """Yield the pages of a volume in reading order, reading each only when reached.
+
+    Pages for which ``skip(index)`` is true are still yielded, without
+    data, so a resumed run keeps its numbering without reading or
+    rasterizing them again.
+    """
+    path = Path(path)
+    skip = skip or (lambda index: False)
+    if path.is_dir():
+        for index, file in enumerate(_directory_files(path)):
+            name = str(file.relative_to(path))
+            yield Page(index, name, None if skip(index) else file.read_bytes())
+        return
+    suffix = path.suffix.lower()
+    if suffix in ARCHIVE_SUFFIXES:
+        with zipfile.ZipFile(path) as archive:
+            for index, info in enumerate(_archive_entries(archive)):
+                data = None if skip(index) else archive.read(info)
+                yield Page(index, info.filename, data)
+        return
+    if suffix in PDF_SUFFIXES:
+        dpi = float(os.environ.get("PDF_RENDER_DPI", DEFAULT_PDF_RENDER_DPI))
+        pdf = _open_pdf(path)
+        try:
+            for index in range(len(pdf)):
+                data = None if skip(index) else _render_pdf_page(pdf, index, dpi)
+                yield Page(index, f"page {index + 1}", data)
+        finally:
+            pdf.close()
+        return
+    if suffix in IMAGE_SUFFIXES:
+        yield Page(0, path.name, None if skip(0) else path.read_bytes())
+        return
+    raise ValueError(f"Not a page archive, PDF or image: {path.name}")
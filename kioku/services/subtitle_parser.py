@@ -0,0 +1,231 @@
+"""Streaming parsers for SRT, WebVTT and ASS/SSA subtitle files.
+
+``parse_cues`` reads a text stream line by line and yields one ``Cue`` at a
+time, so a file with thousands of cues never has to be held in memory.
+Styling (HTML-like tags, ASS override blocks, ruby readings) and hearing-
+impaired annotations are stripped; a cue with no Japanese left is dropped.
+``merge_split_cues`` then joins sentences that continue from one cue into
+the next.
+"""
+
+import html
+import io
+import re
+import unicodedata
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+FORMATS = ("srt", "vtt", "ass")
+SUBTITLE_SUFFIXES = (".srt", ".vtt", ".ass", ".ssa")
+
+# Gap (seconds) across which a line ending in a continuation mark is joined
+MERGE_MAX_GAP = 1.5
+# Stop joining once a sentence spans this many characters
+MERGE_MAX_CHARS = 120
+
+_TIMING = re.compile(
+    r"(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})"
+)
+_ASS_TIME = re.compile(r"(\d+):(\d{2}):(\d{2})[.](\d{1,3})")
+_RUBY_TEXT = re.compile(r"<rt>.*?</rt>|<rp>.*?</rp>", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]*>")
+_ASS_OVERRIDE = re.compile(r"\{[^}]*\}")
+# Sound and speaker annotations: （笑）, [拍手], (ドアの音)
+_ANNOTATION = re.compile(r"（[^）]*）|\([^)]*\)|［[^］]*］|\[[^\]]*\]|〔[^〕]*〕")
+_MUSIC = re.compile(r"[♪♫]")
+_SPEAKER_DASH = re.compile(r"^[-－‐—]\s*")
+_JAPANESE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff66-\uff9f]")
+# Marks that say the sentence carries on in the next cue
+_CONTINUES = ("、", "…", "‥", "→", "➡", ",", "，")
+_CONTINUED = ("…", "‥", "→", "➡")
+_NOT_KEY = re.compile(r"[\s\W_]+")
+
+
+@dataclass
+class Cue:
+    start: float
+    end: float
+    text: str
+
+
+def detect_format(name: str, first_line: str = "") -> str:
+    """Guess the format from a file name, falling back to the first line."""
+    suffix = Path(name).suffix.lower().lstrip(".")
+    if suffix in ("ass", "ssa"):
+        return "ass"
+    if suffix in FORMATS:
+        return suffix
+    head = first_line.lstrip("﻿").strip()
+    if head.startswith("WEBVTT"):
+        return "vtt"
+    if head.startswith("[Script Info]"):
+        return "ass"
+    return "srt"
+
+
+def open_text(path: str | Path) -> io.TextIOWrapper:
+    """Open a subtitle file as text, choosing UTF-8/16 or Shift_JIS from its head."""
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        encoding = "utf-16"
+    else:
+        try:
+            # A multi-byte character may be cut at the end of the sample
+            head.decode("utf-8", errors="strict")
+            encoding = "utf-8-sig"
+        except UnicodeDecodeError as err:
+            encoding = "utf-8-sig" if err.start >= len(head) - 3 else "cp932"
+    return open(path, encoding=encoding, errors="replace", newline=None)
+
+
+def clean_text(text: str) -> list[str]:
+    """Strip styling and annotations from cue text and join its lines.
+
+    Lines opening with a dash belong to different speakers and come back as
+    separate utterances; the other line breaks are joined.
+    """
+    text = _RUBY_TEXT.sub("", text)
+    text = _TAG.sub("", text)
+    text = _ASS_OVERRIDE.sub("", text)
+    text = text.replace("\\N", "\n").replace("\\n", "\n").replace("\\h", " ")
+    text = html.unescape(text).replace("\xa0", " ")
+    utterances: list[str] = []
+    joined = ""
+    for line in text.splitlines():
+        line = _MUSIC.sub("", _ANNOTATION.sub("", line)).strip()
+        new_speaker = bool(_SPEAKER_DASH.match(line))
+        line = _SPEAKER_DASH.sub("", line).strip()
+        if not line:
+            continue
+        if new_speaker and joined:
+            utterances.append(joined)
+            joined = ""
+        # Japanese lines break without spaces; keep a space between Latin words
+        if joined and joined[-1].isascii() and line[0].isascii():
+            joined += " "
+        joined += line
+    if joined:
+        utterances.append(joined)
+    return utterances
+
+
+def line_key(text: str) -> str:
+    """Normalised form of a line used to spot repeats (width, punctuation, spaces)."""
+    return _NOT_KEY.sub("", unicodedata.normalize("NFKC", text))
+
+
+def has_japanese(text: str) -> bool:
+    return bool(_JAPANESE.search(text))
+
+
+def _seconds(hours, minutes, seconds, fraction) -> float:
+    return (
+        int(hours or 0) * 3600
+        + int(minutes) * 60
+        + int(seconds)
+        + int(fraction.ljust(3, "0")[:3]) / 1000
+    )
+
+
+def _parse_blocks(lines: Iterable[str]) -> Iterator[Cue]:
+    """SRT and WebVTT: a timing line followed by text lines up to a blank line."""
+    timing = None
+    text: list[str] = []
+    for line in lines:
+        line = line.rstrip("\r\n").lstrip("﻿")
+        if not line.strip():
+            if timing is not None and text:
+                yield Cue(timing[0], timing[1], "\n".join(text))
+            timing, text = None, []
+            continue
+        match = _TIMING.search(line)
+        if match:
+            if timing is not None and text:
+                # No blank line before this cue; its number ended up as text
+                if text[-1].strip().isdigit():
+                    text.pop()
+                if text:
+                    yield Cue(timing[0], timing[1], "\n".join(text))
+            groups = match.groups()
+            timing, text = (_seconds(*groups[:4]), _seconds(*groups[4:])), []
+        elif timing is not None:
+            text.append(line)
+        # Anything else before the timing is a cue number, an id or a
+        # WEBVTT/NOTE/STYLE header, none of which are spoken text
+    if timing is not None and text:
+        yield Cue(timing[0], timing[1], "\n".join(text))
+
+
+def _ass_time(value: str) -> float:
+    match = _ASS_TIME.match(value.strip())
+    if not match:
+        raise ValueError(f"Bad ASS timestamp {value!r}")
+    return _seconds(*match.groups())
+
+
+def _parse_ass(lines: Iterable[str]) -> Iterator[Cue]:
+    """ASS/SSA: ``Dialogue:`` lines of the [Events] section, laid out by its ``Format:``."""
+    in_events = False
+    fields = ["layer", "start", "end", "style", "name", "marginl", "marginr", "marginv", "effect", "text"]
+    for line in lines:
+        line = line.strip().lstrip("﻿")
+        if line.startswith("["):
+            in_events = line.lower() == "[events]"
+            continue
+        if not in_events:
+            continue
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if key == "format":
+            fields = [name.strip().lower() for name in value.split(",")]
+        elif key == "dialogue":
+            # Only the last field (the text) may itself contain commas
+            values = value.split(",", len(fields) - 1)
+            if len(values) != len(fields):
+                continue
+            row = dict(zip(fields, values))
+            try:
+                yield Cue(_ass_time(row["start"]), _ass_time(row["end"]), row["text"])
+            except (KeyError, ValueError):
+                continue
+
+
+def parse_cues(lines: Iterable[str], fmt: str = "srt") -> Iterator[Cue]:
+    """Yield cleaned cues with Japanese text from an iterable of lines."""
+    raw = _parse_ass(lines) if fmt == "ass" else _parse_blocks(lines)
+    for cue in raw:
+        for text in clean_text(cue.text):
+            if has_japanese(text):
+                yield Cue(cue.start, cue.end, text)
+
+
+def merge_split_cues(
+    cues: Iterable[Cue],
+    max_gap: float = MERGE_MAX_GAP,
+    max_chars: int = MERGE_MAX_CHARS,
+) -> Iterator[Cue]:
+    """Join cues whose sentence runs on into the next one.
+
+    A cue continues when it ends with a comma or ellipsis/arrow, or when the
+    next cue opens with one, and the pause between them is short. Only the
+    sentence being built is held, so memory stays flat.
+    """
+    pending: Cue | None = None
+    for cue in cues:
+        if (
+            pending is not None
+            and (pending.text.endswith(_CONTINUES) or cue.text.startswith(_CONTINUED))
+            and cue.start - pending.end <= max_gap
+            and len(pending.text) + len(cue.text) <= max_chars
+        ):
+            head = pending.text.rstrip("…‥→➡")
+            tail = cue.text.lstrip("…‥→➡")
+            pending = Cue(pending.start, cue.end, head + tail)
+            continue
+        if pending is not None:
+            yield pending
+        pending = cue
+    if pending is not None:
+        yield pending
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from kioku import admission, metrics
+from kioku.services.anki_builder import sync_anki
+from kioku.utils import data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYNC_DEBOUNCE = "15"
+DEFAULT_SYNC_MIN_INTERVAL = "120"
+DEFAULT_SYNC_REQUEST_POLL_INTERVAL = "2"
+
+
+class SyncScheduler:
+    """Run AnkiWeb syncs in the background, debounced and rate limited.
+
+    ``request()`` never blocks: a sync starts ``SYNC_DEBOUNCE`` seconds after
+    the most recent request, at most once every ``SYNC_MIN_INTERVAL`` seconds.
+    Requests that arrive while a sync is pending or running are merged into
+    the next one. Syncs run as bulk work behind the ``anki_sync`` gate, not
+    the ``anki_write`` one, so note writes are not held up while one runs.
+
+    With several workers only the primary schedules syncs. After
+    ``start(primary=False)`` a worker's ``request()`` leaves a marker file in
+    the data directory instead, and the primary picks it up within
+    ``SYNC_REQUEST_POLL_INTERVAL`` seconds. ``shutdown()`` runs a pending
+    sync at once rather than dropping it.
+    """
+
+    def __init__(self, sync=None, request_path: Path | None = None):
+        self._sync = sync
+        self._request_path = request_path
+        self._forward = False
+        self._watcher: asyncio.Task | None = None
+        self._forwarding: set[asyncio.Task] = set()
+        self._wake: asyncio.Event | None = None
+        self._flushing = False
+        self._task: asyncio.Task | None = None
+        self._pending = False
+        self._first_requested_at: float | None = None
+        self._last_requested_at: float | None = None
+        self._last_finished_at: float | None = None
+        self.running = False
+        self.sync_count = 0
+        self.last_status: str | None = None
+        self.last_error: str | None = None
+        self.last_started_at: datetime | None = None
+        self.last_duration: float | None = None
+
+    @property
+    def request_path(self) -> Path:
+        return self._request_path or data_dir() / "sync.requested"
+
+    def request(self):
+        """Ask for a sync soon; overlapping requests collapse into one."""
+        if self._forward:
+            # The primary worker runs the sync; leave it a marker
+            task = asyncio.get_running_loop().create_task(
+                asyncio.to_thread(self.request_path.touch)
+            )
+            self._forwarding.add(task)
+            task.add_done_callback(self._forwarding.discard)
+            return
+        now = time.monotonic()
+        if not self._pending:
+            self._first_requested_at = now
+        self._pending = True
+        self._last_requested_at = now
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    def _due_at(self) -> float:
+        debounce = float(os.environ.get("SYNC_DEBOUNCE", DEFAULT_SYNC_DEBOUNCE))
+        min_interval = float(os.environ.get("SYNC_MIN_INTERVAL", DEFAULT_SYNC_MIN_INTERVAL))
+        # A steady stream of adds must not postpone the sync forever
+        due = min(
+            self._last_requested_at + debounce,
+            self._first_requested_at + max(debounce, min_interval),
+        )
+        if self._last_finished_at is not None:
+            due = max(due, self._last_finished_at + min_interval)
+        return due
+
+    def _take_request(self) -> bool:
+        try:
+            self.request_path.unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def _watch(self):
+        interval = float(
+            os.environ.get("SYNC_REQUEST_POLL_INTERVAL", DEFAULT_SYNC_REQUEST_POLL_INTERVAL)
+        )
+        while True:
+            try:
+                if await asyncio.to_thread(self._take_request):
+                    self.request()
+            except OSError as e:
+                logger.warning("could not read sync requests from other workers: %s", e)
+            await asyncio.sleep(interval)
+
+    def start(self, primary: bool):
+        """Schedule syncs here if ``primary``; otherwise hand requests to the primary."""
+        self._forward = not primary
+        if primary and (self._watcher is None or self._watcher.done()):
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _run(self):
+        self._wake = asyncio.Event()
+        while self._pending:
+            delay = 0 if self._flushing else self._due_at() - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pending = False
+            await self._sync_once()
+
+    async def _sync_once(self):
+        self.running = True
+        self.last_started_at = datetime.now(timezone.utc)
+        started = time.monotonic()
+        try:
+            with metrics.track("sync"), admission.priority(admission.BULK):
+                async with admission.gate("anki_sync").hold_async():
+                    await asyncio.to_thread(self._sync or sync_anki)
+            self.last_status = "ok"
+            self.last_error = None
+        except (RuntimeError, OSError) as err:
+            self.last_status = "error"
+            self.last_error = str(err)
+        finally:
+            self._last_finished_at = time.monotonic()
+            self.last_duration = self._last_finished_at - started
+            self.sync_count += 1
+            self.running = False
+
+    def status(self) -> dict:
+        """Return a JSON-serialisable snapshot of the scheduler state."""
+        return {
+            "pending": self._pending,
+            "running": self.running,
+            "sync_count": self.sync_count,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "last_started_at": self.last_started_at.isoformat() if self.last_started_at else None,
+            "last_duration": self.last_duration,
+        }
+
+    async def shutdown(self):
+        """Stop scheduling, running a pending sync now instead of dropping it."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        await asyncio.gather(*self._forwarding, return_exceptions=True)
+        task = self._task
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            self._flushing = True
+            if self._wake is not None:
+                self._wake.set()
+            try:
+                await task
+            finally:
+                self._flushing = False
+        self._task = None
+        self._pending = False
+        self._forward = False
+
+
+sync_scheduler = SyncScheduler()
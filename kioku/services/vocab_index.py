@@ -0,0 +1,366 @@
+"""Index of the words already in the user's Anki collection.
+
+The ``Japanese`` field of every "Japanese Vocab (ankiGen)" note, plus any
+deck and field listed in KNOWN_VOCAB_DECKS, is mirrored into SQLite. A sync
+only fetches what changed: ``findNotes`` lists the notes of each source,
+notes not seen before or edited since the last sync (``edited:N``) are read
+with ``notesInfo`` and kept when their ``mod`` time moved, and notes that
+disappeared are dropped.
+
+Lookups use a ``CompactSet`` of 64-bit hashes of the normalised words,
+eight bytes per word, rebuilt only when a sync changed something. The
+prompt builder lists the known words found in a text so Groq skips them,
+and the card pipeline drops word cards for them before any TTS or
+AnkiConnect work. Sentence cards are always kept.
+"""
+
+import asyncio
+import hashlib
+import html
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from kioku.models import CardItem
+from kioku.services.anki_builder import MODEL_NAME, _anki_request
+from kioku.services.subtitle_parser import line_key
+from kioku.utils import data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KNOWN_VOCAB_SYNC_INTERVAL = "900"
+# Notes read per notesInfo call
+NOTES_INFO_CHUNK = 500
+# Longest substring of a text looked up as a word
+MAX_WORD_CHARS = 8
+# Known words named in one prompt
+MAX_PROMPT_WORDS = 40
+
+_FURIGANA = re.compile(r"\[[^\]]*\]")
+_TAG = re.compile(r"<[^>]*>")
+_KANJI = re.compile(r"[㐀-䶿一-鿿]")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vocab_notes (
+    note_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    mod INTEGER NOT NULL,
+    word TEXT NOT NULL,
+    PRIMARY KEY (note_id, field)
+);
+CREATE TABLE IF NOT EXISTS vocab_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def enabled() -> bool:
+    return os.environ.get("KNOWN_VOCAB", "true").lower() not in {"0", "false", "no"}
+
+
+def word_key(value: str) -> str:
+    """Normalised form of a field value or word: no HTML, furigana, width or punctuation."""
+    value = _TAG.sub("", html.unescape(value))
+    return line_key(_FURIGANA.sub("", value))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class CompactSet:
+    """A read-only set of strings stored as a sorted array of 64-bit hashes.
+
+    A few hundred thousand words fit in a few megabytes, against tens of
+    bytes per entry for a set of str. A false positive needs a 64-bit hash
+    collision.
+    """
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self._hashes = array("Q", sorted({_hash(key) for key in keys if key}))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, key: str) -> bool:
+        value = _hash(key)
+        index = bisect_left(self._hashes, value)
+        return index < len(self._hashes) and self._hashes[index] == value
+
+    @property
+    def nbytes(self) -> int:
+        return self._hashes.itemsize * len(self._hashes)
+
+
+@dataclass(frozen=True)
+class VocabSource:
+    query: str
+    field: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.query}\0{self.field}"
+
+
+def configured_sources() -> list[VocabSource]:
+    """The ankiGen note type, plus each ``Deck:Field`` in KNOWN_VOCAB_DECKS (``;``-separated)."""
+    sources = [VocabSource(f'"note:{MODEL_NAME}"', "Japanese")]
+    for entry in os.environ.get("KNOWN_VOCAB_DECKS", "").split(";"):
+        deck, _, field = entry.strip().rpartition(":")
+        if not deck:
+            deck, field = field, "Japanese"
+        if deck.strip():
+            sources.append(VocabSource(f'"deck:{deck.strip()}"', field.strip() or "Japanese"))
+    return sources
+
+
+class VocabIndex:
+    """Known words mirrored from Anki into SQLite, with an in-memory CompactSet for lookups."""
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._words: CompactSet | None = None
+        self._generation: str | None = None
+        self._data_version: int | None = None
+        self._reader: sqlite3.Connection | None = None
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "vocab.sqlite3"
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def reset(self):
+        """Drop the cached set and lookup connection, e.g. after the data directory changed."""
+        with self._lock:
+            self._words = None
+            self._generation = None
+            self._data_version = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    @staticmethod
+    def _meta(conn: sqlite3.Connection, name: str) -> str | None:
+        row = conn.execute("SELECT value FROM vocab_meta WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def status(self) -> dict:
+        conn = self._connect()
+        try:
+            words = conn.execute("SELECT COUNT(DISTINCT word) FROM vocab_notes").fetchone()[0]
+            synced_at = self._meta(conn, "synced_at")
+        finally:
+            conn.close()
+        return {
+            "enabled": enabled(),
+            "words": words,
+            "synced_at": float(synced_at) if synced_at else None,
+            "sources": [
+                {"query": source.query, "field": source.field} for source in configured_sources()
+            ],
+        }
+
+    def words(self) -> CompactSet:
+        """The known words, reloaded from SQLite only when a sync has changed them.
+
+        One connection is kept open for lookups; ``PRAGMA data_version`` on it
+        changes only when another connection commits, so the stored
+        generation is read again only after a write.
+        """
+        with self._lock:
+            if self._reader is None:
+                self._reader = self._connect(check_same_thread=False)
+            version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+            if self._words is not None and version == self._data_version:
+                return self._words
+            generation = self._meta(self._reader, "generation")
+            if self._words is None or generation != self._generation:
+                rows = self._reader.execute("SELECT word FROM vocab_notes")
+                self._words = CompactSet(row[0] for row in rows)
+                self._generation = generation
+            self._data_version = version
+            return self._words
+
+    def sync(self, sources: list[VocabSource] | None = None) -> dict:
+        """Bring the index up to date with Anki, reading only notes that changed."""
+        sources = sources if sources is not None else configured_sources()
+        stats = {"added": 0, "updated": 0, "removed": 0}
+        with self._sync_lock:
+            conn = self._connect()
+            try:
+                for source in sources:
+                    self._sync_source(conn, source, stats)
+                now = time.time()
+                with conn:
+                    if any(stats.values()):
+                        conn.execute(
+                            "INSERT OR REPLACE INTO vocab_meta VALUES ('generation', ?)",
+                            (str(now),),
+                        )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO vocab_meta VALUES ('synced_at', ?)", (str(now),)
+                    )
+                stats["words"] = conn.execute(
+                    "SELECT COUNT(DISTINCT word) FROM vocab_notes"
+                ).fetchone()[0]
+            finally:
+                conn.close()
+        return stats
+
+    def _sync_source(self, conn: sqlite3.Connection, source: VocabSource, stats: dict):
+        started = time.time()
+        note_ids = set(_anki_request("findNotes", query=source.query) or [])
+        stored = dict(
+            conn.execute(
+                "SELECT note_id, mod FROM vocab_notes WHERE field = ?", (source.field,)
+            ).fetchall()
+        )
+        gone = stored.keys() - note_ids
+        to_read = note_ids - stored.keys()
+        last = self._meta(conn, f"synced:{source.name}")
+        if last is not None and stored:
+            # edited:N counts whole days back from now; one extra covers the boundary
+            days = math.ceil((started - float(last)) / 86400) + 1
+            edited = _anki_request("findNotes", query=f"{source.query} edited:{days}") or []
+            to_read |= stored.keys() & set(edited)
+
+        ordered = sorted(to_read)
+        for start in range(0, len(ordered), NOTES_INFO_CHUNK):
+            infos = _anki_request("notesInfo", notes=ordered[start : start + NOTES_INFO_CHUNK])
+            rows = []
+            for info in infos or []:
+                note_id = info.get("noteId")
+                field = (info.get("fields") or {}).get(source.field)
+                if note_id is None or field is None:
+                    continue
+                mod = int(info.get("mod") or 0)
+                if note_id in stored and stored[note_id] == mod:
+                    continue
+                word = word_key(field.get("value", ""))
+                if not word:
+                    continue
+                stats["updated" if note_id in stored else "added"] += 1
+                rows.append((note_id, source.field, mod, word))
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO vocab_notes VALUES (?, ?, ?, ?)", rows)
+        with conn:
+            conn.executemany(
+                "DELETE FROM vocab_notes WHERE note_id = ? AND field = ?",
+                [(note_id, source.field) for note_id in gone],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO vocab_meta VALUES (?, ?)",
+                (f"synced:{source.name}", str(started)),
+            )
+        stats["removed"] += len(gone)
+
+    def known_in(self, text: str, limit: int = MAX_PROMPT_WORDS) -> list[str]:
+        """Known words in ``text``: the longest one starting at each character."""
+        if not enabled():
+            return []
+        words = self.words()
+        if not len(words):
+            return []
+        key = word_key(text)
+        found: dict[str, None] = {}
+        for start in range(len(key)):
+            for length in range(min(MAX_WORD_CHARS, len(key) - start), 0, -1):
+                candidate = key[start : start + length]
+                # Single kana are particles and endings far more often than words
+                if length == 1 and not _KANJI.match(candidate):
+                    continue
+                if candidate in words:
+                    found.setdefault(candidate)
+                    break
+        return list(found)[:limit]
+
+    def prune(self, cards: list[CardItem]) -> tuple[list[CardItem], list[CardItem]]:
+        """Split cards into those to keep and word cards for words already known."""
+        if not enabled():
+            return cards, []
+        words = self.words()
+        if not len(words):
+            return cards, []
+        kept: list[CardItem] = []
+        known: list[CardItem] = []
+        for card in cards:
+            is_sentence_card = card.japanese == card.example_sentence
+            if not is_sentence_card and word_key(card.japanese) in words:
+                known.append(card)
+            else:
+                kept.append(card)
+        return kept, known
+
+
+vocab_index = VocabIndex()
+
+
+class VocabSyncer:
+    """Background task that syncs the index every KNOWN_VOCAB_SYNC_INTERVAL seconds."""
+
+    def __init__(self, index: VocabIndex):
+        self.index = index
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self.last_result: dict | None = None
+        self.last_error: str | None = None
+
+    async def sync_now(self) -> dict:
+        result = await asyncio.to_thread(self.index.sync)
+        self.last_result, self.last_error = result, None
+        return result
+
+    def wake(self):
+        """Ask the background loop to sync now, e.g. after notes were added."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        interval = float(
+            os.environ.get("KNOWN_VOCAB_SYNC_INTERVAL", DEFAULT_KNOWN_VOCAB_SYNC_INTERVAL)
+        )
+        while True:
+            try:
+                await self.sync_now()
+            except (RuntimeError, OSError, sqlite3.Error) as e:
+                self.last_error = str(e)
+                logger.warning("known vocabulary sync failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if enabled() and (self._task is None or self._task.done()):
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+vocab_syncer = VocabSyncer(vocab_index)
@@ -0,0 +1,61 @@
+"""Process layout for ``kioku serve``.
+
+With ``--workers N`` uvicorn runs N API processes. Background work that
+must happen once per data directory — resuming interrupted jobs,
+draining the outbox and AnkiWeb syncs — runs only in the worker holding
+the primary lock.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker is the only supported layout
+    fcntl = None
+
+from kioku.utils import data_dir
+
+
+def default_ocr_socket() -> Path:
+    return Path(tempfile.gettempdir()) / f"kioku-ocr-{os.getpid()}.sock"
+
+
+class PrimaryLock:
+    """Non-blocking file lock electing one worker per data directory."""
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+        self._file = None
+
+    @property
+    def path(self) -> Path:
+        return self._path or data_dir() / "primary.lock"
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """Take the lock if no other process holds it; returns whether we hold it."""
+        if self._file is not None:
+            return True
+        handle = open(self.path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+        self._file = handle
+        return True
+
+    def release(self):
+        if self._file is not None:
+            # Closing the descriptor drops the flock
+            self._file.close()
+            self._file = None
+
+
+primary_lock = PrimaryLock()
@@ -0,0 +1,352 @@
+"""Request-scoped tracing with Server-Timing headers and an optional OTLP exporter.
+
+Each HTTP request starts a trace; ``span()`` opens a child of whatever span
+is current, so nested pipeline stages form a tree. Context travels through
+``contextvars``, which ``asyncio`` tasks and ``asyncio.to_thread`` copy, so
+spans opened in worker threads still land in the right trace.
+
+Finished spans are written as structured log records, summed per name into
+the response's ``Server-Timing`` header and, when
+``OTEL_EXPORTER_OTLP_ENDPOINT`` is set, shipped in batches as OTLP/HTTP JSON.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger("kioku.trace")
+
+DEFAULT_SERVICE_NAME = "kioku"
+DEFAULT_EXPORT_INTERVAL = "5"
+EXPORT_BATCH_SIZE = 256
+# Wakes the export thread when the flush interval passes with nothing queued
+_TICK = object()
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error"
+    )
+
+    def __init__(
+        self,
+        trace_id: str,
+        parent_id: str | None,
+        name: str,
+        attributes: dict,
+        span_id: str | None = None,
+    ):
+        self.trace_id = trace_id
+        self.span_id = span_id or secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.error: str | None = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """The spans finished so far for one request."""
+
+    def __init__(self, trace_id: str | None = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans: list[Span] = []
+
+    def server_timing(self) -> str:
+        """Summarise finished spans as a ``Server-Timing`` header value."""
+        totals: dict[str, list[float]] = {}
+        for finished in self.spans:
+            total = totals.setdefault(_timing_name(finished.name), [0.0, 0])
+            total[0] += finished.duration_ms
+            total[1] += 1
+        return ", ".join(
+            f'{name};dur={duration:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+            for name, (duration, count) in totals.items()
+        )
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("kioku_trace", default=None)
+_current_span: ContextVar[Span | None] = ContextVar("kioku_span", default=None)
+
+
+def _timing_name(name: str) -> str:
+    # Server-Timing names are HTTP tokens
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", "_", name)
+
+
+def current_trace_id() -> str | None:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def current_span_id() -> str | None:
+    current = _current_span.get()
+    return current.span_id if current else None
+
+
+@contextmanager
+def start_trace(traceparent: str | None = None):
+    """Make a new trace current, continuing a W3C ``traceparent`` if given."""
+    trace_id = parent_id = None
+    match = _TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_id = match.groups()
+    trace = Trace(trace_id)
+    trace_token = _current_trace.set(trace)
+    # A remote parent is only referenced by id; it is never finished here
+    remote = Span(trace.trace_id, None, "remote", {}, span_id=parent_id) if parent_id else None
+    span_token = _current_span.set(remote)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span.
+
+    Outside a request (CLI runs, background jobs) a trace is started on the
+    fly so the span is still logged and exported.
+    """
+    trace = _current_trace.get()
+    trace_token = None
+    if trace is None:
+        trace = Trace()
+        trace_token = _current_trace.set(trace)
+    parent = _current_span.get()
+    current = Span(trace.trace_id, parent.span_id if parent else None, name, attributes)
+    span_token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as err:
+        current.error = f"{type(err).__name__}: {err}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(span_token)
+        if trace_token is not None:
+            _current_trace.reset(trace_token)
+        trace.spans.append(current)
+        _finish(current)
+
+
+def traced(name: str):
+    """Decorator wrapping every call of a sync or async function in a span."""
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _finish(finished: Span):
+    logger.info(
+        "span %s finished in %.1fms",
+        finished.name,
+        finished.duration_ms,
+        extra={"fields": {"span": finished.to_dict()}},
+    )
+    exporter = _exporter
+    if exporter is not None:
+        exporter.submit(finished)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans: list[Span], service_name: str) -> dict:
+    """Encode spans as an OTLP/HTTP JSON ``ExportTraceServiceRequest``."""
+    encoded = []
+    for item in spans:
+        record = {
+            "traceId": item.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 1,
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns or item.start_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)} for key, value in item.attributes.items()
+            ],
+            "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+        }
+        if item.parent_id:
+            record["parentSpanId"] = item.parent_id
+        encoded.append(record)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": service_name}}
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "kioku"}, "spans": encoded}],
+            }
+        ]
+    }
+
+
+class OtlpExporter:
+    """Ship finished spans to an OTLP/HTTP collector from a background thread."""
+
+    def __init__(self, endpoint: str, service_name: str = DEFAULT_SERVICE_NAME, interval: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.interval = interval
+        self.exported = 0
+        self.failed = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="kioku-otlp", daemon=True)
+        self._thread.start()
+
+    def submit(self, finished: Span):
+        self._queue.put(finished)
+
+    def _post(self, batch: list[Span]):
+        body = json.dumps(otlp_payload(batch, self.service_name)).encode()
+        req = urllib.request.Request(self.url, data=body)
+        req.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                resp.read()
+            self.exported += len(batch)
+        except OSError as err:
+            self.failed += len(batch)
+            logger.warning("OTLP export to %s failed: %s", self.url, err)
+
+    def _run(self):
+        batch: list[Span] = []
+        deadline = time.monotonic() + self.interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = _TICK
+            if item is None:
+                if batch:
+                    self._post(batch)
+                return
+            if item is not _TICK:
+                batch.append(item)
+            if len(batch) >= EXPORT_BATCH_SIZE or time.monotonic() >= deadline:
+                if batch:
+                    self._post(batch)
+                    batch = []
+                deadline = time.monotonic() + self.interval
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush queued spans and stop the export thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_exporter: OtlpExporter | None = None
+
+
+def configure_exporter() -> OtlpExporter | None:
+    """Start the OTLP exporter if ``OTEL_EXPORTER_OTLP_ENDPOINT`` is set."""
+    global _exporter
+    endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "").strip()
+    if _exporter is None and endpoint:
+        _exporter = OtlpExporter(
+            endpoint,
+            os.environ.get("OTEL_SERVICE_NAME", DEFAULT_SERVICE_NAME),
+            float(os.environ.get("OTEL_EXPORT_INTERVAL", DEFAULT_EXPORT_INTERVAL)),
+        )
+    return _exporter
+
+
+def shutdown_exporter():
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
+
+
+class TracingMiddleware:
+    """ASGI middleware that traces each HTTP request.
+
+    Adds ``Server-Timing`` (one entry per span name plus ``total``) and
+    ``X-Trace-Id`` to the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        with start_trace(traceparent) as trace:
+            with span(f"{scope['method']} {scope['path']}", **{"http.method": scope["method"]}) as root:
+
+                async def send_with_timing(message):
+                    if message["type"] == "http.response.start":
+                        root.attributes["http.status_code"] = message["status"]
+                        timing = trace.server_timing()
+                        total = f"total;dur={root.duration_ms:.1f}"
+                        extra = [
+                            (b"server-timing", (f"{timing}, {total}" if timing else total).encode()),
+                            (b"timing-allow-origin", b"*"),
+                            (b"x-trace-id", trace.trace_id.encode()),
+                        ]
+                        message = {**message, "headers": [*message.get("headers", []), *extra]}
+                    await send(message)
+
+                await self.app(scope, receive, send_with_timing)
@@ -1,4 +1,15 @@
 import hashlib
+import os
+from pathlib import Path
+
+DEFAULT_DATA_DIR = "~/.local/share/kioku"
+
+
+def data_dir() -> Path:
+    """Return the directory for Kioku's local state, creating it if needed."""
+    path = Path(os.environ.get("KIOKU_DATA_DIR", DEFAULT_DATA_DIR)).expanduser()
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
 
 def audio_filename(text: str, prefix: str) -> str:
@@ -0,0 +1,331 @@
+"""WebSocket API: one long-lived connection carrying many requests.
+
+The browser extension keeps a single ``/ws`` connection open for a viewing
+session instead of paying for a new HTTP request per capture. Messages are
+JSON text frames:
+
+- Requests carry a client-chosen ``id`` and a ``type``: ``extract_text``
+  (the ``/api/extract-text`` body) or ``generate`` (the ``/api/generate``
+  body, plus an optional ``idempotency_key``). Requests run concurrently;
+  ``{"type": "cancel", "id": ...}`` cancels one and ``{"type": "ping"}`` is
+  answered with ``pong``.
+- Replies carry the request's ``id``: ``progress`` (``stage``, ``done``,
+  ``total``) while a generate runs, then exactly one ``result`` (``data``,
+  ``trace_id``, ``server_timing``, and ``replayed`` when an idempotent
+  generate returned an earlier result), ``error`` (``status``, ``detail``, the
+  HTTP status the endpoint would have returned) or ``cancelled``. A
+  generate that has started adding notes to Anki (see COMMIT_STAGES) is not
+  cancelled and sends its result as usual. Cancelling an idempotent generate
+  stops its execution unless another request (say, a retry from another
+  connection) is waiting for it or it is already adding notes; the reply is
+  then ``cancelled`` with ``detached: true`` and the notes are still added.
+- Unprompted messages have no ``id``: ``hello`` on connect, a
+  ``heartbeat`` every WS_HEARTBEAT_INTERVAL seconds, which also keeps an
+  extension service worker alive, and ``event`` messages pushed to every
+  connection, e.g. ``cards_added`` when notes land in Anki (including
+  notes delivered later from the outbox). Connections are tracked per
+  worker process: with ``--workers`` > 1 an event only reaches sockets on
+  the worker that raised it, and outbox deliveries happen on the primary.
+
+Captured audio travels as a binary frame instead of base64: a 4-byte
+big-endian header length, the request's JSON header, then the raw bytes.
+A ``generate`` sent that way uses the bytes as its sentence audio.
+
+Requests still running when the connection drops finish anyway; resend a
+generate with the same ``idempotency_key`` after reconnecting to get its
+result.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import time
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from kioku import admission, metrics, tracing
+from kioku.idempotency import idempotency, scoped_key
+from kioku.models import ExtractionResult, GenerateRequest, TextExtractionRequest
+from kioku.pipeline import COMMIT_STAGES, ProgressCallback, run_generate
+from kioku.services.audio_clipper import resolve_media_path
+from kioku.services.image_processor import GroqAuthenticationError, GroqError, enrich_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WS_HEARTBEAT_INTERVAL = "20"
+FRAME_HEADER = struct.Struct(">I")
+
+metrics.describe("kioku_ws_connections", "Open /ws connections.")
+metrics.describe("kioku_ws_requests_total", "Requests received over /ws, by type.")
+
+
+class Detached(asyncio.CancelledError):
+    """A cancelled request whose idempotent execution goes on without it."""
+
+
+# Idempotency keys of executions that have started adding notes to Anki
+_committed_keys: set[str] = set()
+
+
+def pack_frame(header: dict, payload: bytes) -> bytes:
+    """A binary frame: header length, JSON header, then the raw payload."""
+    encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    return FRAME_HEADER.pack(len(encoded)) + encoded + payload
+
+
+def unpack_frame(frame: bytes) -> tuple[dict, bytes]:
+    """Split a binary frame into its JSON header and payload."""
+    if len(frame) < FRAME_HEADER.size:
+        raise ValueError("Binary frame is shorter than its header length.")
+    (length,) = FRAME_HEADER.unpack_from(frame)
+    start = FRAME_HEADER.size
+    if start + length > len(frame):
+        raise ValueError("Binary frame header runs past the end of the frame.")
+    return json.loads(frame[start : start + length]), frame[start + length :]
+
+
+def _groq_failure(err: Exception) -> HTTPException:
+    if isinstance(err, GroqAuthenticationError):
+        return HTTPException(
+            status_code=401,
+            detail="GROQ_API_KEY is invalid or not set. Please check your .env file.",
+        )
+    if isinstance(err, GroqError):
+        return HTTPException(status_code=502, detail=f"Groq API error: {err}")
+    return HTTPException(status_code=500, detail=str(err))
+
+
+def _validated(model, header: dict):
+    try:
+        return model.model_validate(header)
+    except ValidationError as err:
+        raise HTTPException(
+            status_code=422, detail=err.errors(include_url=False, include_context=False)
+        ) from err
+
+
+async def _extract_text(
+    header: dict, payload: bytes | None, progress: ProgressCallback
+) -> tuple[dict, dict]:
+    req = _validated(TextExtractionRequest, header)
+    async with admission.gate("extract_text").hold_async():
+        try:
+            cards = await asyncio.to_thread(enrich_text, req.text)
+        except RuntimeError as err:
+            raise _groq_failure(err) from err
+    return ExtractionResult(cards=cards).model_dump(), {}
+
+
+async def _generate(
+    header: dict, payload: bytes | None, progress: ProgressCallback
+) -> tuple[dict, dict]:
+    req = _validated(GenerateRequest, header)
+    try:
+        if req.media_path:
+            resolve_media_path(req.media_path)
+        key = header.get("idempotency_key")
+        if key is not None:
+            audio = hashlib.sha256(payload).hexdigest() if payload else None
+            key = scoped_key(key, req, audio)
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
+
+    def report(stage: str, done: int, total: int):
+        if key is not None and stage in COMMIT_STAGES:
+            _committed_keys.add(key)
+        progress(stage, done, total)
+
+    async def generate() -> dict:
+        audio = io.BytesIO(payload) if payload else None
+        try:
+            return await run_generate(req, report, sentence_audio=audio)
+        finally:
+            _committed_keys.discard(key)
+
+    async with admission.gate("generate").hold_async():
+        try:
+            if key is None:
+                result, replayed = await generate(), False
+            else:
+                result, replayed = await idempotency.run(f"generate:{key}", generate)
+        except asyncio.CancelledError:
+            if key is None:
+                raise
+            # Stop the execution only if nothing else depends on it
+            if key in _committed_keys or idempotency.waiters(f"generate:{key}"):
+                raise Detached from None
+            idempotency.cancel(f"generate:{key}")
+            raise
+        except RuntimeError as err:
+            raise HTTPException(status_code=502, detail=str(err)) from err
+    if replayed:
+        return result, {"replayed": True}
+    if result["added"]:
+        hub.publish("cards_added", added=result["added"], deck_name=req.deck_name)
+    return result, {}
+
+
+# Each takes the request header, the binary payload (if any) and a progress
+# callback, and returns the result data plus extra fields for the reply
+HANDLERS = {"extract_text": _extract_text, "generate": _generate}
+
+
+class Hub:
+    """This process's open connections, for events pushed to all of them."""
+
+    def __init__(self):
+        self._sessions: set["Session"] = set()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session: "Session"):
+        self._sessions.add(session)
+        metrics.set_gauge("kioku_ws_connections", len(self._sessions))
+
+    def discard(self, session: "Session"):
+        self._sessions.discard(session)
+        metrics.set_gauge("kioku_ws_connections", len(self._sessions))
+
+    def publish(self, event: str, **fields):
+        """Send ``{"type": "event", "event": event, ...}`` to every connection."""
+        for session in list(self._sessions):
+            session.push({"type": "event", "event": event, **fields})
+
+
+hub = Hub()
+
+
+class Session:
+    """One /ws connection: reads requests, runs them as tasks, writes replies in order."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self._loop = asyncio.get_running_loop()
+        # A single writer task sends everything, so frames never interleave
+        self._outgoing: asyncio.Queue[dict] = asyncio.Queue()
+        self._requests: dict[str, asyncio.Task] = {}
+        # Requests that have started adding notes to Anki, so are not cancelled
+        self._committed: set[str] = set()
+        self._closed = False
+
+    def push(self, message: dict):
+        """Queue a message for the client; safe to call from any thread."""
+        if not self._closed:
+            self._loop.call_soon_threadsafe(self._outgoing.put_nowait, message)
+
+    async def _write(self):
+        while True:
+            message = await self._outgoing.get()
+            await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+
+    async def _heartbeat(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.push({"type": "heartbeat", "time": time.time()})
+
+    async def run(self):
+        interval = float(os.environ.get("WS_HEARTBEAT_INTERVAL", DEFAULT_WS_HEARTBEAT_INTERVAL))
+        await self.websocket.accept()
+        hub.add(self)
+        self.push({"type": "hello", "heartbeat_interval": interval})
+        background = [
+            asyncio.create_task(self._write()),
+            asyncio.create_task(self._heartbeat(interval)),
+        ]
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                self._dispatch(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._closed = True
+            hub.discard(self)
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+
+    def _error(self, request_id, status: int, detail, **fields):
+        self.push({"id": request_id, "type": "error", "status": status, "detail": detail, **fields})
+
+    def _dispatch(self, message: dict):
+        try:
+            if message.get("bytes") is not None:
+                header, payload = unpack_frame(message["bytes"])
+            else:
+                header, payload = json.loads(message.get("text") or ""), None
+        except ValueError as err:
+            self._error(None, 400, f"Unreadable message: {err}")
+            return
+        if not isinstance(header, dict):
+            self._error(None, 400, "Messages must be JSON objects.")
+            return
+        kind, request_id = header.get("type"), header.get("id")
+        if kind == "ping":
+            self.push({"id": request_id, "type": "pong", "time": time.time()})
+            return
+        if kind == "cancel":
+            task = self._requests.get(request_id)
+            if task is not None and request_id not in self._committed:
+                task.cancel()
+            return
+        handler = HANDLERS.get(kind)
+        if handler is None:
+            self._error(request_id, 400, f"Unknown message type {kind!r}.")
+            return
+        if not isinstance(request_id, str) or not request_id or request_id in self._requests:
+            self._error(request_id, 400, "Each request needs an id not already in use.")
+            return
+        metrics.inc("kioku_ws_requests_total", type=kind)
+        self._requests[request_id] = asyncio.create_task(
+            self._handle(request_id, kind, handler, header, payload)
+        )
+
+    async def _handle(self, request_id: str, kind: str, handler, header: dict, payload):
+        def progress(stage: str, done: int, total: int):
+            if stage in COMMIT_STAGES:
+                self._committed.add(request_id)
+            self.push(
+                {"id": request_id, "type": "progress", "stage": stage, "done": done, "total": total}
+            )
+
+        try:
+            with tracing.start_trace(header.get("traceparent")) as trace:
+                with tracing.span(f"WS {kind}"):
+                    data, fields = await handler(header, payload, progress)
+            self.push(
+                {
+                    "id": request_id,
+                    "type": "result",
+                    "data": data,
+                    "trace_id": trace.trace_id,
+                    "server_timing": trace.server_timing(),
+                    **fields,
+                }
+            )
+        except asyncio.CancelledError as err:
+            detached = {"detached": True} if isinstance(err, Detached) else {}
+            self.push({"id": request_id, "type": "cancelled", **detached})
+        except admission.Overloaded as err:
+            self._error(request_id, 429, str(err), retry_after=err.retry_after)
+        except HTTPException as err:
+            self._error(request_id, err.status_code, err.detail)
+        except Exception as err:
+            logger.exception("/ws %s request failed", kind)
+            self._error(request_id, 500, str(err))
+        finally:
+            self._requests.pop(request_id, None)
+            self._committed.discard(request_id)
+
+
+async def serve(websocket: WebSocket):
+    """Handle one /ws connection until the client goes away."""
+    await Session(websocket).run()
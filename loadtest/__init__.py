@@ -0,0 +1,8 @@
+"""Load-testing harness: local stub dependencies and a load driver.
+
+``python -m loadtest.stubs`` serves fake Groq, VOICEVOX and AnkiConnect APIs
+with configurable latency, error rates and rate limits; point Kioku at them
+with GROQ_BASE_URL, VOICEVOX_URL and ANKI_CONNECT_URL. ``python -m
+loadtest.driver`` then replays an extract/generate mix against the app and
+reports throughput and latency percentiles per endpoint.
+"""
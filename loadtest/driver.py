@@ -0,0 +1,231 @@
+"""Replay an extract/generate mix against a running Kioku and report latency.
+
+Usage:
+    python -m loadtest.driver --url http://127.0.0.1:8000 --duration 60 \\
+        --concurrency 8 --mix extract-text=6,generate=3,extract=1 [--json out.json]
+
+Each virtual user loops: pick an endpoint by weight, send a realistic
+request, record the latency and status. The report lists requests,
+failures, throughput and p50/p95/p99 per endpoint.
+"""
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from collections.abc import Callable
+
+import httpx
+
+SENTENCES = [
+    "今日は天気がいいから、公園で散歩しましょう。",
+    "明日までにこの本を図書館に返さなければならない。",
+    "電車が遅れたので、約束の時間に間に合わなかった。",
+    "友達と一緒に新しいラーメン屋に行ってみた。",
+    "日本語の勉強は難しいけど、とても楽しいです。",
+    "雨が降りそうだから、傘を持って行ったほうがいい。",
+    "週末は家でゆっくり映画を見るつもりです。",
+    "駅の近くに新しいコンビニができたらしい。",
+]
+
+_COLUMNS = (
+    f"{'endpoint':<14}{'requests':>9}{'failed':>8}{'req/s':>9}"
+    f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+)
+
+
+def percentile(samples: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile of ``samples`` (``None`` when empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown endpoint {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+_counter = itertools.count()
+
+
+def _card(sentence: str, n: int) -> dict:
+    word = sentence[:2]
+    return {
+        "japanese": f"{word}{n}",
+        "reading": f"よみ{n}",
+        "meaning": f"meaning {n}",
+        "example_sentence": sentence,
+        "example_translation": f"translation {n}",
+    }
+
+
+def extract_text_request(rng: random.Random) -> dict:
+    text = "".join(rng.sample(SENTENCES, rng.randint(1, 3)))
+    return {"method": "POST", "url": "/api/extract-text", "json": {"text": text}}
+
+
+def generate_request(rng: random.Random) -> dict:
+    # Unique first fields so Anki dedupe doesn't short-circuit the pipeline
+    base = next(_counter) * 100
+    cards = [_card(rng.choice(SENTENCES), base + i) for i in range(rng.randint(3, 10))]
+    return {
+        "method": "POST",
+        "url": "/api/generate",
+        "json": {"cards": cards, "deck_name": "LoadTest"},
+    }
+
+
+_screenshot: bytes | None = None
+
+
+def extract_request(rng: random.Random) -> dict:
+    global _screenshot
+    if _screenshot is None:
+        from benchmarks.fixtures import screenshot_png
+
+        _screenshot = screenshot_png(1280, 720)
+    return {
+        "method": "POST",
+        "url": "/api/extract",
+        "files": {"file": ("screenshot.png", io.BytesIO(_screenshot), "image/png")},
+    }
+
+
+SCENARIOS: dict[str, Callable[[random.Random], dict]] = {
+    "extract-text": extract_text_request,
+    "generate": generate_request,
+    "extract": extract_request,
+}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.failures: dict[str, int] = {}
+        self.statuses: dict[str, dict[int, int]] = {}
+
+    def record(self, name: str, seconds: float, status: int | None):
+        self.latencies.setdefault(name, []).append(seconds)
+        codes = self.statuses.setdefault(name, {})
+        codes[status or 0] = codes.get(status or 0, 0) + 1
+        if status is None or status >= 400:
+            self.failures[name] = self.failures.get(name, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for name, samples in sorted(self.latencies.items()):
+            endpoints[name] = {
+                "requests": len(samples),
+                "failed": self.failures.get(name, 0),
+                "throughput": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50) * 1e3,
+                "p95_ms": percentile(samples, 95) * 1e3,
+                "p99_ms": percentile(samples, 99) * 1e3,
+                "statuses": {
+                    str(code): count for code, count in sorted(self.statuses[name].items())
+                },
+            }
+        total = sum(len(s) for s in self.latencies.values())
+        return {
+            "elapsed": elapsed,
+            "requests": total,
+            "throughput": total / elapsed,
+            "endpoints": endpoints,
+        }
+
+
+async def _user(
+    client: httpx.AsyncClient,
+    mix: dict[str, float],
+    deadline: float,
+    rng: random.Random,
+    stats: Stats,
+):
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        request = SCENARIOS[name](rng)
+        started = time.perf_counter()
+        try:
+            response = await client.request(**request)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        stats.record(name, time.perf_counter() - started, status)
+
+
+async def run_load(
+    url: str,
+    mix: dict[str, float],
+    duration: float,
+    concurrency: int,
+    seed: int | None = None,
+    timeout: float = 120.0,
+) -> dict:
+    """Drive ``concurrency`` virtual users for ``duration`` seconds; return the report."""
+    stats = Stats()
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        started = time.monotonic()
+        deadline = started + duration
+        await asyncio.gather(
+            *(
+                _user(client, mix, deadline, random.Random(rng.random()), stats)
+                for _ in range(concurrency)
+            )
+        )
+        elapsed = time.monotonic() - started
+    return stats.report(elapsed)
+
+
+def format_report(report: dict) -> str:
+    lines = [_COLUMNS]
+    for name, row in report["endpoints"].items():
+        lines.append(
+            f"{name:<14}{row['requests']:>9}{row['failed']:>8}{row['throughput']:>9.2f}"
+            f"{row['p50_ms']:>10.0f}{row['p95_ms']:>10.0f}{row['p99_ms']:>10.0f}"
+        )
+    lines.append(
+        f"{report['requests']} requests in {report['elapsed']:.1f}s -> {report['throughput']:.2f} req/s"
+    )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default="extract-text=6,generate=3,extract=1")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="write the report as JSON here")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(
+        run_load(args.url, parse_mix(args.mix), args.duration, args.concurrency, args.seed)
+    )
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,515 @@
+"""Stub Groq, VOICEVOX and AnkiConnect servers for load tests.
+
+Usage:
+    python -m loadtest.stubs [--groq-latency lognormal:800,0.4] [--voicevox-error-rate 0.01]
+                             [--anki-rate-limit 20/40] ...
+
+Then start Kioku with:
+    GROQ_BASE_URL=http://127.0.0.1:18080 GROQ_API_KEY=stub
+    VOICEVOX_URL=http://127.0.0.1:18081 ANKI_CONNECT_URL=http://127.0.0.1:18082
+
+Latency specs are ``fixed:MS``, ``uniform:LOW-HIGH`` (ms) or
+``lognormal:MEDIAN,SIGMA`` (ms). Rate limits are ``RATE/BURST`` requests per
+second; requests beyond them get 429 with Retry-After. A failed request
+gets 500 (503 for VOICEVOX, which is what its engine returns when busy).
+"""
+
+import argparse
+import fnmatch
+import io
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zipfile
+from collections.abc import Callable
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PORTS = {"groq": 18080, "voicevox": 18081, "anki": 18082}
+SAMPLE_RATE = 24000
+# VOICEVOX at speedScale 1.0 speaks roughly eight morae per second
+SECONDS_PER_CHAR = 0.12
+
+
+class Latency:
+    """A latency distribution parsed from a spec string; samples are in seconds."""
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        if kind == "fixed":
+            value = float(args or 0) / 1000
+            self._sample = lambda rng: value
+        elif kind == "uniform":
+            low, high = (float(part) / 1000 for part in args.split("-"))
+            self._sample = lambda rng: rng.uniform(low, high)
+        elif kind == "lognormal":
+            median, sigma = (float(part) for part in args.split(","))
+            mu = math.log(median / 1000)
+            self._sample = lambda rng: rng.lognormvariate(mu, sigma)
+        else:
+            raise ValueError(f"Unknown latency spec: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        return self._sample(rng)
+
+
+class RateLimiter:
+    """Token bucket; ``acquire`` returns 0 when allowed or seconds to wait."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str | None) -> "RateLimiter | None":
+        if not spec:
+            return None
+        rate, _, burst = spec.partition("/")
+        return cls(float(rate), float(burst or rate))
+
+    def acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class StubBehaviour:
+    """Latency, failures and rate limiting shared by every request to one stub."""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        error_rate: float = 0.0,
+        rate_limit: str | None = None,
+        seed: int | None = None,
+    ):
+        self.latency = Latency(latency)
+        self.error_rate = error_rate
+        self.limiter = RateLimiter.parse(rate_limit)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+
+    def admit(self) -> tuple[int, float] | None:
+        """Decide a request's fate: ``None`` to serve it or ``(status, retry_after)``."""
+        with self._rng_lock:
+            self.requests += 1
+            delay = self.latency.sample(self._rng)
+            fail = self._rng.random() < self.error_rate
+        if self.limiter is not None:
+            wait = self.limiter.acquire()
+            if wait:
+                self.throttled += 1
+                return 429, wait
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self.failures += 1
+            return 500, 0.0
+        return None
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behaviour: StubBehaviour
+    error_status = 500
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload, headers: dict | None = None):
+        self._send(
+            status, json.dumps(payload, ensure_ascii=False).encode(), "application/json", headers
+        )
+
+    def _admit(self) -> bool:
+        verdict = self.behaviour.admit()
+        if verdict is None:
+            return True
+        status, retry_after = verdict
+        if status == 429:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                {"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+        else:
+            self._send_json(self.error_status, {"error": {"message": "Injected failure"}})
+        return False
+
+
+def _split_text(text: str) -> list[str]:
+    """Sentence and word-ish chunks of Japanese text, for fake enrichment."""
+    sentences = [s for s in re.split(r"(?<=[。！？!?])\s*|\n+", text) if s.strip()]
+    entries = []
+    for sentence in sentences:
+        entries.append(sentence.strip())
+        entries.extend(
+            w for w in re.split(r"[はがをにでとのもへ、。！？!?\s]+", sentence) if len(w) > 1
+        )
+    return list(dict.fromkeys(entries))
+
+
+def fake_cards(text: str) -> list[dict]:
+    cards = []
+    for i, chunk in enumerate(_split_text(text)):
+        cards.append(
+            {
+                "japanese": chunk,
+                "reading": chunk,
+                "meaning": f"meaning of entry {i}",
+                "example_sentence": chunk,
+                "example_translation": f"translation of entry {i}",
+            }
+        )
+    return cards
+
+
+class GroqHandler(_StubHandler):
+    """OpenAI-compatible chat completions (``/openai/v1`` is Groq's prefix)."""
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        if path not in ("/openai/v1/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+            return
+        if not self._admit():
+            return
+        request = json.loads(body or b"{}")
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        text = prompt.rsplit("Japanese text:\n", 1)[-1]
+        content = "```json\n" + json.dumps(fake_cards(text), ensure_ascii=False) + "\n```"
+        prompt_tokens = len(prompt) // 2
+        completion_tokens = len(content) // 2
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+            {"x-ratelimit-remaining-requests": "1000"},
+        )
+
+
+def fake_wav(text: str, speed: float = 1.0) -> bytes:
+    """A silent 16-bit mono WAV about as long as VOICEVOX would make for ``text``."""
+    frames = int(SAMPLE_RATE * max(0.3, len(text) * SECONDS_PER_CHAR / max(speed, 0.1)))
+    data = bytes(frames * 2)
+    header = b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE"
+    fmt = b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+    return header + fmt + b"data" + struct.pack("<I", len(data)) + data
+
+
+class VoicevoxHandler(_StubHandler):
+    """VOICEVOX engine endpoints: audio_query, synthesis and multi_synthesis."""
+
+    error_status = 503
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/version":
+            self._send_json(200, "0.0.0-stub")
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        body = self._body()
+        if url.path not in ("/audio_query", "/synthesis", "/multi_synthesis"):
+            self._send_json(404, {"detail": "Not Found"})
+            return
+        if "speaker" not in params:
+            self._send_json(
+                422, {"detail": [{"loc": ["query", "speaker"], "msg": "field required"}]}
+            )
+            return
+        if not self._admit():
+            return
+        if url.path == "/audio_query":
+            text = params.get("text", [""])[0]
+            self._send_json(
+                200,
+                {
+                    "accent_phrases": [],
+                    "speedScale": 1.0,
+                    "pitchScale": 0.0,
+                    "intonationScale": 1.0,
+                    "volumeScale": 1.0,
+                    "prePhonemeLength": 0.1,
+                    "postPhonemeLength": 0.1,
+                    "outputSamplingRate": SAMPLE_RATE,
+                    "outputStereo": False,
+                    "kana": text,
+                },
+            )
+        elif url.path == "/synthesis":
+            query = json.loads(body or b"{}")
+            self._send(
+                200, fake_wav(query.get("kana", ""), query.get("speedScale", 1.0)), "audio/wav"
+            )
+        else:
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, "w") as zf:
+                for i, query in enumerate(json.loads(body or b"[]")):
+                    zf.writestr(
+                        f"{i + 1:03}.wav",
+                        fake_wav(query.get("kana", ""), query.get("speedScale", 1.0)),
+                    )
+            self._send(200, buf.getvalue(), "application/zip")
+
+
+class AnkiCollection:
+    """Just enough of an Anki collection to answer AnkiConnect's actions."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.decks: set[str] = {"Default"}
+        self.models: set[str] = {"Basic"}
+        self.notes: dict[int, dict] = {}
+        self.media: dict[str, int] = {}
+        self.syncs = 0
+        self._next_id = int(time.time() * 1000)
+
+    def _first_field(self, note: dict) -> str:
+        fields = note.get("fields", {})
+        return next(iter(fields.values()), "")
+
+    def _is_duplicate(self, note: dict) -> bool:
+        first = self._first_field(note)
+        return any(
+            n["modelName"] == note.get("modelName") and self._first_field(n) == first
+            for n in self.notes.values()
+        )
+
+    def _add(self, note: dict) -> int:
+        if note.get("deckName") not in self.decks:
+            raise ValueError(f"deck was not found: {note.get('deckName')}")
+        if note.get("modelName") not in self.models:
+            raise ValueError(f"model was not found: {note.get('modelName')}")
+        if not note.get("options", {}).get("allowDuplicate") and self._is_duplicate(note):
+            raise ValueError("cannot create note because it is a duplicate")
+        self._next_id += 1
+        self.notes[self._next_id] = {**note, "noteId": self._next_id, "mod": int(time.time())}
+        return self._next_id
+
+    def call(self, action: str, params: dict):
+        with self.lock:
+            if action == "version":
+                return 6
+            if action == "deckNames":
+                return sorted(self.decks)
+            if action == "modelNames":
+                return sorted(self.models)
+            if action == "createDeck":
+                self.decks.add(params["deck"])
+                return 1
+            if action == "createModel":
+                self.models.add(params["modelName"])
+                return {"name": params["modelName"]}
+            if action == "canAddNotes":
+                return [
+                    n.get("deckName") in self.decks
+                    and n.get("modelName") in self.models
+                    and not self._is_duplicate(n)
+                    for n in params["notes"]
+                ]
+            if action == "addNote":
+                return self._add(params["note"])
+            if action == "addNotes":
+                results = []
+                for note in params["notes"]:
+                    try:
+                        results.append(self._add(note))
+                    except ValueError:
+                        results.append(None)
+                return results
+            if action == "getMediaFilesNames":
+                pattern = params.get("pattern", "*")
+                return [name for name in self.media if fnmatch.fnmatch(name, pattern)]
+            if action == "storeMediaFile":
+                self.media[params["filename"]] = len(params.get("data", ""))
+                return params["filename"]
+            if action == "findNotes":
+                return list(self.notes)
+            if action == "notesInfo":
+                return [
+                    {
+                        "noteId": nid,
+                        "modelName": self.notes[nid]["modelName"],
+                        "tags": self.notes[nid].get("tags", []),
+                        "fields": {
+                            name: {"value": value, "order": i}
+                            for i, (name, value) in enumerate(self.notes[nid]["fields"].items())
+                        },
+                        "mod": self.notes[nid]["mod"],
+                    }
+                    for nid in params.get("notes", [])
+                    if nid in self.notes
+                ]
+            if action == "sync":
+                self.syncs += 1
+                return None
+            raise ValueError("unsupported action")
+
+
+class AnkiConnectHandler(_StubHandler):
+    """AnkiConnect's JSON-RPC endpoint (API version 6)."""
+
+    collection: AnkiCollection
+
+    def do_POST(self):
+        request = json.loads(self._body() or b"{}")
+        if not self._admit():
+            return
+        try:
+            result = self.collection.call(request.get("action", ""), request.get("params", {}))
+        except (KeyError, ValueError) as err:
+            self._send_json(200, {"result": None, "error": str(err).strip("'")})
+            return
+        self._send_json(200, {"result": result, "error": None})
+
+
+def make_server(
+    kind: str, behaviour: StubBehaviour, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """Build (but don't start) the stub server for ``kind``."""
+    handlers: dict[str, type[_StubHandler]] = {
+        "groq": GroqHandler,
+        "voicevox": VoicevoxHandler,
+        "anki": AnkiConnectHandler,
+    }
+    attrs: dict = {"behaviour": behaviour}
+    if kind == "anki":
+        attrs["collection"] = AnkiCollection()
+    handler = type(f"{handlers[kind].__name__}Bound", (handlers[kind],), attrs)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+@contextmanager
+def running_stubs(
+    behaviours: dict[str, StubBehaviour] | None = None,
+    ports: dict[str, int] | None = None,
+    host: str = "127.0.0.1",
+):
+    """Run all three stubs in background threads; yields ``{kind: server}``."""
+    behaviours = behaviours or {}
+    ports = ports or {}
+    servers = {
+        kind: make_server(kind, behaviours.get(kind) or StubBehaviour(), host, ports.get(kind, 0))
+        for kind in DEFAULT_PORTS
+    }
+    threads = [threading.Thread(target=s.serve_forever, daemon=True) for s in servers.values()]
+    for thread in threads:
+        thread.start()
+    try:
+        yield servers
+    finally:
+        for server in servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+def stub_env(servers: dict[str, ThreadingHTTPServer]) -> dict[str, str]:
+    """Environment that points Kioku at running stubs."""
+    return {
+        "GROQ_BASE_URL": server_url(servers["groq"]),
+        "GROQ_API_KEY": "stub",
+        "VOICEVOX_URL": server_url(servers["voicevox"]),
+        "ANKI_CONNECT_URL": server_url(servers["anki"]),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--seed", type=int, default=None)
+    defaults = {"groq": "lognormal:800,0.4", "voicevox": "lognormal:250,0.3", "anki": "fixed:5"}
+    for kind, port in DEFAULT_PORTS.items():
+        parser.add_argument(f"--{kind}-port", type=int, default=port)
+        parser.add_argument(f"--{kind}-latency", default=defaults[kind])
+        parser.add_argument(f"--{kind}-error-rate", type=float, default=0.0)
+        parser.add_argument(f"--{kind}-rate-limit", default=None, help="RATE/BURST per second")
+    return parser
+
+
+def main(argv: list[str] | None = None, wait: Callable[[], None] | None = None):
+    args = build_parser().parse_args(argv)
+    behaviours = {
+        kind: StubBehaviour(
+            getattr(args, f"{kind}_latency"),
+            getattr(args, f"{kind}_error_rate"),
+            getattr(args, f"{kind}_rate_limit"),
+            args.seed,
+        )
+        for kind in DEFAULT_PORTS
+    }
+    ports = {kind: getattr(args, f"{kind}_port") for kind in DEFAULT_PORTS}
+    with running_stubs(behaviours, ports, args.host) as servers:
+        for name, value in stub_env(servers).items():
+            print(f"{name}={value}")
+        try:
+            (wait or threading.Event().wait)()
+        except KeyboardInterrupt:
+            pass
+        for kind, behaviour in behaviours.items():
+            print(
+                f"{kind}: {behaviour.requests} requests, {behaviour.failures} failed, "
+                f"{behaviour.throttled} throttled"
+            )
+
+
+if __name__ == "__main__":
+    main()
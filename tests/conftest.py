@@ -8,12 +8,17 @@ import pytest
 from fastapi.testclient import TestClient
 from PIL import Image
 
+from kioku import admission, cache, metrics
+from kioku.idempotency import idempotency
 from kioku.models import CardItem
+from kioku.services import anki_builder
+from kioku.services.vocab_index import vocab_index
 
 
 @pytest.fixture(autouse=True)
-def set_test_env(monkeypatch):
+def set_test_env(monkeypatch, tmp_path):
     """Set test environment variables for all tests."""
+    monkeypatch.setenv("KIOKU_DATA_DIR", str(tmp_path / "kioku-data"))
     monkeypatch.setenv("GROQ_API_KEY", "test-groq-key")
     monkeypatch.setenv("GROQ_MODEL", "test-model")
     monkeypatch.setenv("ANKI_CONNECT_URL", "http://test-anki:8765")
@@ -21,6 +26,22 @@ def set_test_env(monkeypatch):
     monkeypatch.setenv("VOICEVOX_SPEAKER", "0")
 
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Start every test with empty caches, metrics, admission gates and idempotency keys.
+
+    The media index needs no reset: it lives in the per-test KIOKU_DATA_DIR.
+    """
+    anki_builder.invalidate_cache()
+    metrics.reset()
+    admission.reset()
+    cache.reset()
+    idempotency.clear()
+    vocab_index.reset()
+    yield
+    anki_builder.invalidate_cache()
+
+
 @pytest.fixture
 def sample_card_item():
     """Single CardItem for testing."""
@@ -94,7 +115,7 @@ def mock_groq_client(monkeypatch):
 
     # Mock Groq class
     mock_groq_class = Mock(return_value=mock_client)
-    monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+    monkeypatch.setattr("groq.Groq", mock_groq_class)
 
     return mock_client
 
@@ -159,11 +180,14 @@ def mock_voicevox(monkeypatch):
 def mock_anki_connect(monkeypatch):
     """Mock AnkiConnect HTTP requests."""
     responses = {
+        "deckNames": ["Default"],
         "modelNames": ["Japanese Vocab (ankiGen)"],
         "createDeck": None,
         "createModel": None,
+        "getMediaFilesNames": [],
         "storeMediaFile": None,
-        "addNote": 1234567890,
+        "addNotes": lambda params: [1234567890 + i for i in range(len(params["notes"]))],
+        "canAddNotes": lambda params: [True] * len(params["notes"]),
     }
 
     def mock_urlopen(request):
@@ -171,6 +195,8 @@ def mock_anki_connect(monkeypatch):
         body = json.loads(request.data.decode())
         action = body.get("action")
         result = responses.get(action)
+        if callable(result):
+            result = result(body.get("params", {}))
 
         mock_response = Mock()
         mock_response.read.return_value = json.dumps(
@@ -186,9 +212,29 @@ def mock_anki_connect(monkeypatch):
     return responses
 
 
+@pytest.fixture
+def anki_unreachable(monkeypatch):
+    """Make every AnkiConnect request fail as if Anki were closed."""
+    import urllib.error
+
+    def mock_urlopen_refused(request):
+        raise urllib.error.URLError("Connection refused")
+
+    monkeypatch.setattr("urllib.request.urlopen", mock_urlopen_refused)
+
+
 @pytest.fixture
 def test_client():
     """FastAPI TestClient for integration tests."""
     from kioku.main import app
 
     return TestClient(app)
+
+
+@pytest.fixture
+def live_client():
+    """TestClient that runs the app lifespan (background workers included)."""
+    from kioku.main import app
+
+    with TestClient(app) as client:
+        yield client
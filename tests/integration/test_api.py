@@ -1,7 +1,9 @@
 """Integration tests for FastAPI endpoints."""
 
+import asyncio
 import io
 import json
+import threading
 
 import pytest
 
@@ -51,7 +53,7 @@ class TestExtractEndpoint:
         def mock_groq_class(api_key):
             raise auth_error
 
-        monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+        monkeypatch.setattr("groq.Groq", mock_groq_class)
 
         files = {"file": ("test.png", io.BytesIO(sample_image_bytes), "image/png")}
         response = test_client.post("/api/extract", files=files)
@@ -125,6 +127,145 @@ class TestGenerateEndpoint:
         assert "added" in data
         assert data["added"] == 2
 
+    def test_generate_multipart_with_audio(self, test_client, sample_cards, monkeypatch):
+        """Test that the multipart variant passes the raw audio part to the pipeline."""
+        seen = {}
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            seen["deck"] = req.deck_name
+            seen["audio"] = sentence_audio.read()
+            return {"added": len(req.cards), "queued": 0, "skipped": []}
+
+        monkeypatch.setattr("kioku.main.run_generate", fake_run_generate)
+        payload = {"cards": [card.model_dump() for card in sample_cards], "deck_name": "TestDeck"}
+        response = test_client.post(
+            "/api/generate",
+            files={
+                "payload": ("payload.json", json.dumps(payload), "application/json"),
+                "sentence_audio": ("sentence.webm", b"\x1aE\xdf\xa3webm", "audio/webm"),
+            },
+        )
+
+        assert response.status_code == 200
+        assert response.json()["added"] == 2
+        assert seen == {"deck": "TestDeck", "audio": b"\x1aE\xdf\xa3webm"}
+
+    def test_generate_idempotency_key_replays(self, test_client, sample_cards, monkeypatch):
+        """Test that a retry with the same Idempotency-Key replays the first result."""
+        calls = []
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            calls.append(req.deck_name)
+            return {"added": len(req.cards), "queued": 0, "skipped": []}
+
+        monkeypatch.setattr("kioku.main.run_generate", fake_run_generate)
+        payload = {"cards": [card.model_dump() for card in sample_cards], "deck_name": "TestDeck"}
+        headers = {"Idempotency-Key": "capture-1"}
+
+        first = test_client.post("/api/generate", json=payload, headers=headers)
+        retry = test_client.post("/api/generate", json=payload, headers=headers)
+        other_deck = test_client.post(
+            "/api/generate", json={**payload, "deck_name": "Other"}, headers=headers
+        )
+
+        assert first.json() == retry.json() == {"added": 2, "queued": 0, "skipped": []}
+        assert "Idempotent-Replayed" not in first.headers
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert other_deck.status_code == 200
+        assert calls == ["TestDeck", "Other"]
+
+    def test_generate_failure_is_not_replayed(self, test_client, sample_cards, monkeypatch):
+        """Test that a retry after a failed generate runs again."""
+        outcomes = [RuntimeError("VOICEVOX down"), {"added": 2, "queued": 0, "skipped": []}]
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        monkeypatch.setattr("kioku.main.run_generate", fake_run_generate)
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        headers = {"Idempotency-Key": "capture-2"}
+
+        assert test_client.post("/api/generate", json=payload, headers=headers).status_code == 502
+        retry = test_client.post("/api/generate", json=payload, headers=headers)
+
+        assert retry.status_code == 200
+        assert retry.json()["added"] == 2
+
+    def test_generate_clips_sentences_from_media(
+        self, test_client, sample_cards, mock_voicevox, mock_anki_connect, monkeypatch, tmp_path
+    ):
+        """Test that timed cards get sentence audio clipped from a file under MEDIA_DIR."""
+        (tmp_path / "ep01.mkv").write_bytes(b"video")
+        monkeypatch.setenv("MEDIA_DIR", str(tmp_path))
+        clipped = {}
+
+        def fake_clip_cards(source, cards, progress=None, **kwargs):
+            clipped["source"] = source
+            return {card.example_sentence: b"clip" for card in cards}
+
+        monkeypatch.setattr("kioku.pipeline.clip_cards", fake_clip_cards)
+        cards = [
+            {**card.model_dump(), "cue_start": 1.0, "cue_end": 2.0} for card in sample_cards
+        ]
+        response = test_client.post(
+            "/api/generate", json={"cards": cards, "media_path": "ep01.mkv"}
+        )
+
+        assert response.status_code == 200
+        assert clipped["source"] == (tmp_path / "ep01.mkv").resolve()
+
+    def test_generate_clips_when_captured_audio_fails(
+        self, test_client, sample_cards, mock_voicevox, mock_anki_connect, monkeypatch, tmp_path
+    ):
+        """Test that captured audio ffmpeg cannot convert falls back to clipping, not TTS."""
+        (tmp_path / "ep01.mkv").write_bytes(b"video")
+        monkeypatch.setenv("MEDIA_DIR", str(tmp_path))
+        monkeypatch.setattr("kioku.pipeline.decode_captured_audio", lambda audio: None)
+        clipped = []
+        monkeypatch.setattr(
+            "kioku.pipeline.clip_cards",
+            lambda source, cards, progress=None, **kwargs: clipped.extend(cards) or {},
+        )
+        cards = [
+            {**card.model_dump(), "cue_start": 1.0, "cue_end": 2.0} for card in sample_cards
+        ]
+        payload = {"cards": cards, "media_path": "ep01.mkv", "sentence_audio_b64": "bm90IHdlYm0="}
+
+        response = test_client.post("/api/generate", json=payload)
+
+        assert response.status_code == 200
+        assert len(clipped) == len(cards)
+
+    def test_generate_rejects_media_outside_media_dir(self, test_client, sample_cards, monkeypatch, tmp_path):
+        """Test that media_path cannot point outside MEDIA_DIR."""
+        monkeypatch.setenv("MEDIA_DIR", str(tmp_path))
+        payload = {
+            "cards": [card.model_dump() for card in sample_cards],
+            "media_path": "/etc/passwd",
+        }
+
+        response = test_client.post("/api/generate", json=payload)
+
+        assert response.status_code == 422
+        assert "MEDIA_DIR" in response.json()["detail"]
+
+    def test_generate_multipart_requires_payload(self, test_client):
+        """Test that a multipart body without a payload part is rejected."""
+        response = test_client.post(
+            "/api/generate", files={"sentence_audio": ("a.webm", b"data", "audio/webm")}
+        )
+
+        assert response.status_code == 422
+
+    def test_generate_invalid_json(self, test_client):
+        """Test that an invalid JSON body is still a validation error."""
+        response = test_client.post("/api/generate", json={"deck_name": "x"})
+
+        assert response.status_code == 422
+
     @pytest.mark.asyncio
     async def test_generate_empty_cards(self, test_client, mock_voicevox, mock_anki_connect):
         """Test generation with empty cards list."""
@@ -146,7 +287,9 @@ class TestGenerateEndpoint:
         assert "added" in data
 
     @pytest.mark.asyncio
-    async def test_generate_voicevox_failure(self, test_client, sample_cards, monkeypatch):
+    async def test_generate_voicevox_failure(
+        self, test_client, sample_cards, mock_anki_connect, monkeypatch
+    ):
         """Test generation handles VOICEVOX failures."""
 
         class MockAsyncClientFail:
@@ -219,3 +362,638 @@ class TestGenerateEndpoint:
 
         assert response.status_code == 200
         # Should successfully handle duplicates without generating audio twice
+        assert response.json()["added"] == 1
+        assert response.json()["skipped"] == ["こんにちは"]
+
+    def test_generate_skips_existing_notes_before_tts(self, test_client, sample_cards, mock_anki_connect, monkeypatch):
+        """Test that notes already in Anki are dropped before any audio is generated."""
+        synthesized = []
+
+        async def fake_generate_audio(text):
+            synthesized.append(text)
+            return b"wav"
+
+        monkeypatch.setattr("kioku.pipeline.generate_audio", fake_generate_audio)
+        mock_anki_connect["canAddNotes"] = lambda params: [False] * len(params["notes"])
+
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        response = test_client.post("/api/generate", json=payload)
+
+        assert response.status_code == 200
+        assert response.json() == {"added": 0, "queued": 0, "skipped": ["こんにちは", "元気"]}
+        assert synthesized == []
+
+
+class TestMetricsEndpoint:
+    """Tests for GET /metrics endpoint."""
+
+    def test_metrics_reports_media_bytes(self, test_client, sample_cards, mock_voicevox, mock_anki_connect):
+        """Test that media upload counters are exported after a generate."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        test_client.post("/api/generate", json=payload)
+
+        response = test_client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "kioku_anki_media_uploaded_bytes_total" in response.text
+
+    def test_metrics_reports_stage_latency(self, test_client, sample_cards, mock_voicevox, mock_anki_connect):
+        """Test that dependency latency histograms are exported after a generate."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        test_client.post("/api/generate", json=payload)
+
+        text = test_client.get("/metrics").text
+
+        assert "# TYPE kioku_stage_duration_seconds histogram" in text
+        assert 'kioku_stage_duration_seconds_count{action="addNotes",stage="anki"} 1' in text
+        assert 'kioku_stage_duration_seconds_count{stage="voicevox_synthesis"} 4' in text
+        assert 'kioku_stage_in_flight{stage="voicevox_synthesis"} 0' in text
+
+
+class TestTracing:
+    """Tests for request tracing headers."""
+
+    def test_generate_reports_server_timing(self, test_client, sample_cards, mock_voicevox, mock_anki_connect):
+        """Test that each stage's time is reported in Server-Timing."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        response = test_client.post(
+            "/api/generate",
+            json=payload,
+            headers={"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"},
+        )
+
+        timing = response.headers["server-timing"]
+        assert "generate_audio;dur=" in timing
+        assert 'anki.addNotes;dur=' in timing
+        assert "total;dur=" in timing
+        assert response.headers["x-trace-id"] == "0af7651916cd43dd8448eb211c80319c"
+
+
+class TestAdmissionControl:
+    """Tests for endpoint concurrency limits and bounded queues."""
+
+    def test_full_endpoint_returns_429(self, test_client, mock_groq_client, monkeypatch):
+        """Test that a request finding the endpoint and its queue full is turned away."""
+        from kioku import admission
+
+        monkeypatch.setenv("EXTRACT_TEXT_CONCURRENCY", "1")
+        monkeypatch.setenv("EXTRACT_TEXT_QUEUE", "0")
+
+        with admission.gate("extract_text").hold():
+            response = test_client.post("/api/extract-text", json={"text": "こんにちは"})
+
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        assert test_client.post("/api/extract-text", json={"text": "こんにちは"}).status_code == 200
+        assert 'kioku_admission_rejected_total{gate="extract_text"} 1' in test_client.get("/metrics").text
+
+    def test_job_queue_is_bounded(self, test_client, sample_cards, monkeypatch):
+        """Test that /api/jobs rejects new jobs once JOB_QUEUE_LIMIT are unfinished."""
+        monkeypatch.setenv("JOB_QUEUE_LIMIT", "1")
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+
+        assert test_client.post("/api/jobs", json=payload).status_code == 202
+        response = test_client.post("/api/jobs", json=payload)
+
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "30"
+
+
+class TestSyncStatusEndpoint:
+    """Tests for GET /api/sync/status endpoint."""
+
+    def test_generate_does_not_sync_inline(self, test_client, sample_cards, mock_voicevox, mock_anki_connect, monkeypatch):
+        """Test that generate schedules a sync instead of running it in the request."""
+        requested = []
+        monkeypatch.setattr("kioku.main.sync_scheduler.request", lambda: requested.append(1))
+
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        response = test_client.post("/api/generate", json=payload)
+
+        assert response.status_code == 200
+        assert requested == [1]
+
+    def test_sync_status_fields(self, test_client):
+        """Test that the sync status endpoint reports the last sync."""
+        response = test_client.get("/api/sync/status")
+
+        assert response.status_code == 200
+        data = response.json()
+        for key in ("pending", "running", "last_status", "last_duration", "last_started_at"):
+            assert key in data
+
+
+class TestOutboxEndpoints:
+    """Tests for the Anki outbox endpoints."""
+
+    def test_generate_queues_when_anki_unreachable(self, test_client, sample_cards, mock_voicevox, anki_unreachable):
+        """Test that generate succeeds and queues notes while Anki is offline."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        response = test_client.post("/api/generate", json=payload)
+
+        assert response.status_code == 200
+        assert response.json()["queued"] == 2
+        assert response.json()["added"] == 0
+
+        outbox = test_client.get("/api/outbox").json()
+        assert outbox["depth"] == 1
+        assert outbox["entries"][0]["cards"] == 2
+
+    def test_flush_delivers_queued_notes(self, test_client, sample_cards, mock_voicevox, anki_unreachable, monkeypatch):
+        """Test that a manual flush pushes queued notes once Anki is back."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        test_client.post("/api/generate", json=payload)
+
+        from unittest.mock import Mock
+
+        def mock_urlopen(request):
+            body = json.loads(request.data.decode())
+            action = body["action"]
+            result = {
+                "modelNames": ["Japanese Vocab (ankiGen)"],
+                "canAddNotes": [True] * len(body["params"].get("notes", [])),
+                "addNotes": [1] * len(body["params"].get("notes", [])),
+            }.get(action)
+            response = Mock()
+            response.read.return_value = json.dumps({"result": result, "error": None}).encode()
+            response.__enter__ = Mock(return_value=response)
+            response.__exit__ = Mock(return_value=False)
+            return response
+
+        monkeypatch.setattr("urllib.request.urlopen", mock_urlopen)
+        monkeypatch.setattr("kioku.main.sync_scheduler.request", lambda: None)
+
+        response = test_client.post("/api/outbox/flush")
+
+        assert response.status_code == 200
+        assert response.json()["added"] == 2
+        assert response.json()["depth"] == 0
+
+    def test_retry_unknown_entry(self, test_client):
+        """Test that retrying a missing entry returns 404."""
+        response = test_client.post("/api/outbox/999/retry")
+        assert response.status_code == 404
+
+    def test_dead_entries_are_reported_and_discarded(self, test_client, sample_cards, monkeypatch):
+        """Test that dead entries are counted apart from the queue and can be deleted."""
+        from kioku.services.outbox import outbox
+
+        monkeypatch.setenv("OUTBOX_MAX_ATTEMPTS", "1")
+        entry_id = outbox.enqueue(sample_cards, {"word_a.wav": b"abc"}, "Mining")
+        outbox.record_failure(entry_id, "model was not found", rejected=True)
+
+        listed = test_client.get("/api/outbox").json()
+        deleted = test_client.delete(f"/api/outbox/{entry_id}")
+
+        assert (listed["depth"], listed["dead"]) == (0, 1)
+        assert listed["entries"][0]["status"] == "dead"
+        assert deleted.status_code == 200
+        assert test_client.get("/api/outbox").json()["entries"] == []
+        assert test_client.delete(f"/api/outbox/{entry_id}").status_code == 404
+
+
+class TestVocabEndpoints:
+    """Tests for the known-vocabulary index endpoints."""
+
+    def test_sync_then_status(self, test_client, mock_anki_connect):
+        """Test that a manual sync reads the collection and the status counts its words."""
+        mock_anki_connect["findNotes"] = [1, 2]
+        mock_anki_connect["notesInfo"] = lambda params: [
+            {"noteId": note_id, "mod": 1, "fields": {"Japanese": {"value": word}}}
+            for note_id, word in zip(params["notes"], ["元気", "猫"])
+        ]
+
+        synced = test_client.post("/api/vocab/sync")
+        status = test_client.get("/api/vocab").json()
+
+        assert synced.status_code == 200
+        assert synced.json()["added"] == 2
+        assert status["words"] == 2 and status["enabled"]
+        assert status["last_sync"]["words"] == 2
+
+    def test_sync_with_anki_closed(self, test_client, anki_unreachable):
+        """Test that a manual sync reports 503 while Anki is unreachable."""
+        response = test_client.post("/api/vocab/sync")
+        assert response.status_code == 503
+
+
+class TestExportApkgEndpoint:
+    """Tests for POST /api/export.apkg endpoint."""
+
+    def test_export_returns_package(self, test_client, sample_cards, mock_voicevox):
+        """Test that the endpoint returns an .apkg with audio and no AnkiConnect calls."""
+        import zipfile
+
+        payload = {"cards": [card.model_dump() for card in sample_cards], "deck_name": "Mining"}
+        response = test_client.post("/api/export.apkg", json=payload)
+
+        assert response.status_code == 200
+        assert "Mining.apkg" in response.headers["content-disposition"]
+        with zipfile.ZipFile(io.BytesIO(response.content)) as package:
+            assert len(json.loads(package.read("media"))) == 4
+
+    def test_export_without_audio(self, test_client, sample_cards):
+        """Test that audio=false skips VOICEVOX entirely."""
+        import zipfile
+
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        response = test_client.post("/api/export.apkg?audio=false", json=payload)
+
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.content)) as package:
+            assert json.loads(package.read("media")) == {}
+
+
+class TestJobEndpoints:
+    """Tests for the /api/jobs endpoints."""
+
+    def _wait_for(self, client, job_id, timeout=5.0):
+        import time
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = client.get(f"/api/jobs/{job_id}").json()
+            if job["status"] in {"succeeded", "failed", "cancelled"}:
+                return job
+            time.sleep(0.02)
+        raise AssertionError("job did not finish")
+
+    def test_job_runs_generate_pipeline(self, live_client, sample_cards, mock_voicevox, mock_anki_connect):
+        """Test that a job returns an id immediately and then completes."""
+        payload = {"cards": [card.model_dump() for card in sample_cards], "deck_name": "TestDeck"}
+        response = live_client.post("/api/jobs", json=payload)
+
+        assert response.status_code == 202
+        job = self._wait_for(live_client, response.json()["id"])
+        assert job["status"] == "succeeded"
+        assert job["result"]["added"] == 2
+        assert job["progress"]["tts"] == {"done": 4, "total": 4}
+
+    def test_job_events_stream(self, live_client, sample_cards, mock_voicevox, mock_anki_connect):
+        """Test that the SSE stream ends with the finished job."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        job_id = live_client.post("/api/jobs", json=payload).json()["id"]
+
+        response = live_client.get(f"/api/jobs/{job_id}/events")
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: ")]
+        assert events[-1]["status"] == "succeeded"
+
+    def test_job_keeps_uploaded_audio_until_run(self, test_client, sample_cards):
+        """Test that a multipart job stores its audio on disk for the worker."""
+        from kioku.jobs import job_manager
+
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        response = test_client.post(
+            "/api/jobs",
+            files={
+                "payload": ("payload.json", json.dumps(payload), "application/json"),
+                "sentence_audio": ("sentence.webm", b"webm-bytes", "audio/webm"),
+            },
+        )
+
+        assert response.status_code == 202
+        _, request = job_manager.store.request(response.json()["id"])
+        with open(request["sentence_audio_path"], "rb") as f:
+            assert f.read() == b"webm-bytes"
+
+    def test_job_idempotency_key_returns_same_job(self, test_client, sample_cards):
+        """Test that resubmitting with the same Idempotency-Key does not queue a second job."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        headers = {"Idempotency-Key": "job-1"}
+
+        first = test_client.post("/api/jobs", json=payload, headers=headers)
+        retry = test_client.post("/api/jobs", json=payload, headers=headers)
+
+        assert first.json()["id"] == retry.json()["id"]
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert len(test_client.get("/api/jobs").json()["jobs"]) == 1
+
+    def test_job_idempotency_key_requeues_cancelled_job(self, test_client, sample_cards):
+        """Test that retrying a cancelled job's key queues a new job instead of replaying it."""
+        payload = {"cards": [card.model_dump() for card in sample_cards]}
+        headers = {"Idempotency-Key": "job-2"}
+
+        first = test_client.post("/api/jobs", json=payload, headers=headers).json()
+        test_client.delete(f"/api/jobs/{first['id']}")
+        retry = test_client.post("/api/jobs", json=payload, headers=headers)
+
+        assert retry.json()["id"] != first["id"]
+        assert retry.json()["status"] == "queued"
+        assert "Idempotent-Replayed" not in retry.headers
+
+    def test_unknown_job(self, test_client):
+        """Test that unknown job ids return 404."""
+        assert test_client.get("/api/jobs/missing").status_code == 404
+        assert test_client.delete("/api/jobs/missing").status_code == 404
+
+
+class TestIngestSubtitlesEndpoint:
+    """Tests for POST /api/ingest/subtitles."""
+
+    def test_ingest_job_returns_timed_cards(self, live_client, monkeypatch):
+        """Test that an uploaded .srt becomes a job whose result has cards with cue times."""
+        from kioku.models import CardItem
+
+        def fake_enrich(text):
+            return [
+                CardItem(
+                    japanese=line,
+                    reading="よみ",
+                    meaning="meaning",
+                    example_sentence=line,
+                    example_translation="translation",
+                )
+                for line in text.splitlines()
+            ]
+
+        monkeypatch.setattr("kioku.ingest.enrich_text", fake_enrich)
+        srt = "1\n00:00:01,000 --> 00:00:02,500\nこんにちは\n\n2\n00:00:03,000 --> 00:00:04,000\nこんにちは\n"
+        response = live_client.post(
+            "/api/ingest/subtitles",
+            files={"file": ("ep01.srt", srt.encode("utf-8"), "application/x-subrip")},
+        )
+
+        assert response.status_code == 202
+        job = TestJobEndpoints()._wait_for(live_client, response.json()["id"])
+        assert job["status"] == "succeeded"
+        assert job["result"]["repeated"] == 1
+        assert [(c["japanese"], c["cue_start"], c["cue_end"]) for c in job["result"]["cards"]] == [
+            ("こんにちは", 1.0, 2.5)
+        ]
+        assert job["progress"]["parse"]["done"] == job["progress"]["parse"]["total"]
+
+    def test_rejects_other_files(self, test_client):
+        """Test that only subtitle files are accepted."""
+        response = test_client.post(
+            "/api/ingest/subtitles", files={"file": ("notes.txt", b"hello", "text/plain")}
+        )
+
+        assert response.status_code == 422
+
+
+class TestIngestPagesEndpoint:
+    """Tests for POST /api/ingest/pages."""
+
+    def test_archive_job_returns_cards(self, live_client, monkeypatch, sample_cards):
+        """Test that an uploaded .cbz becomes a job reporting per-page progress."""
+        import zipfile
+
+        from kioku.jobs import job_upload_dir
+
+        volume = io.BytesIO()
+        with zipfile.ZipFile(volume, "w") as archive:
+            archive.writestr("page1.png", b"one")
+            archive.writestr("page2.png", b"two")
+        monkeypatch.setattr("kioku.ingest.ocr_image", lambda data: data.decode())
+        monkeypatch.setattr("kioku.ingest.enrich_text", lambda text: sample_cards)
+
+        response = live_client.post(
+            "/api/ingest/pages",
+            files={"file": ("vol01.cbz", volume.getvalue(), "application/vnd.comicbook+zip")},
+        )
+
+        assert response.status_code == 202
+        job = TestJobEndpoints()._wait_for(live_client, response.json()["id"])
+        assert job["status"] == "succeeded"
+        assert job["result"]["pages"] == 2
+        assert len(job["result"]["cards"]) == len(sample_cards)
+        assert job["progress"]["ocr"] == {"done": 2, "total": 2}
+        assert list(job_upload_dir().iterdir()) == []
+
+    def test_rejects_other_files(self, test_client):
+        """Test that only archives and PDFs are accepted."""
+        response = test_client.post(
+            "/api/ingest/pages", files={"file": ("page.png", b"png", "image/png")}
+        )
+
+        assert response.status_code == 422
+
+
+class TestCaptureEndpoint:
+    """Tests for POST /api/capture endpoint."""
+
+    def test_capture_disabled_without_token(self, test_client, monkeypatch):
+        """Test that capture is off unless CAPTURE_TOKEN is configured."""
+        monkeypatch.delenv("CAPTURE_TOKEN", raising=False)
+        response = test_client.post("/api/capture", data={"text": "こんにちは"})
+        assert response.status_code == 404
+
+    def test_capture_rejects_wrong_token(self, test_client, monkeypatch):
+        """Test that a wrong bearer token is rejected."""
+        monkeypatch.setenv("CAPTURE_TOKEN", "secret")
+        response = test_client.post(
+            "/api/capture", data={"text": "こんにちは"}, headers={"Authorization": "Bearer nope"}
+        )
+        assert response.status_code == 401
+
+    def test_capture_text(self, test_client, mock_groq_client, mock_voicevox, mock_anki_connect, monkeypatch):
+        """Test a one-shot text capture reports added cards and stage timings."""
+        monkeypatch.setenv("CAPTURE_TOKEN", "secret")
+        monkeypatch.setattr("kioku.main.sync_scheduler.request", lambda: None)
+
+        response = test_client.post(
+            "/api/capture",
+            data={"text": "こんにちは", "deck_name": "TestDeck"},
+            headers={"Authorization": "Bearer secret"},
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["added"] == 1
+        assert "tts" in data["timings"]["stages"]
+
+    def test_capture_needs_input(self, test_client, monkeypatch):
+        """Test that a capture with neither text nor image returns 422."""
+        monkeypatch.setenv("CAPTURE_TOKEN", "secret")
+        response = test_client.post(
+            "/api/capture", data={"deck_name": "x"}, headers={"Authorization": "Bearer secret"}
+        )
+        assert response.status_code == 422
+
+
+def _ws_reply(websocket, request_id):
+    """Read messages until the final reply to ``request_id``; returns it and those before it."""
+    seen = []
+    while True:
+        message = websocket.receive_json()
+        seen.append(message)
+        if message.get("id") == request_id and message["type"] != "progress":
+            return message, seen
+
+
+class TestWebSocket:
+    """Tests for the /ws endpoint."""
+
+    def test_hello_and_ping(self, test_client):
+        """Test that a connection is greeted with the heartbeat interval and answers pings."""
+        with test_client.websocket_connect("/ws") as websocket:
+            hello = websocket.receive_json()
+            websocket.send_json({"type": "ping", "id": "p1"})
+            pong = websocket.receive_json()
+
+        assert hello["type"] == "hello" and hello["heartbeat_interval"] == 20
+        assert pong["type"] == "pong" and pong["id"] == "p1"
+
+    def test_heartbeat(self, test_client, monkeypatch):
+        """Test that heartbeats arrive every WS_HEARTBEAT_INTERVAL seconds."""
+        monkeypatch.setenv("WS_HEARTBEAT_INTERVAL", "0.01")
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            assert websocket.receive_json()["type"] == "heartbeat"
+
+    def test_extract_text(self, test_client, mock_groq_client):
+        """Test that an extract_text request gets its cards back under its id."""
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "extract_text", "id": "e1", "text": "こんにちは"})
+            reply, _ = _ws_reply(websocket, "e1")
+
+        assert reply["type"] == "result"
+        assert len(reply["data"]["cards"]) > 0
+        assert reply["trace_id"]
+
+    def test_generate_streams_progress_and_pushes_event(
+        self, test_client, sample_cards, mock_voicevox, mock_anki_connect
+    ):
+        """Test that a generate reports stage progress, its result and a cards_added event."""
+        payload = {"cards": [card.model_dump() for card in sample_cards], "deck_name": "TestDeck"}
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "generate", "id": "g1", **payload})
+            reply, seen = _ws_reply(websocket, "g1")
+
+        assert reply["type"] == "result" and reply["data"]["added"] == 2
+        assert "generate_audio" in reply["server_timing"]
+        stages = {m["stage"] for m in seen if m["type"] == "progress"}
+        assert {"tts", "anki"} <= stages
+        event = {"type": "event", "event": "cards_added", "added": 2, "deck_name": "TestDeck"}
+        assert event in seen
+
+    def test_generate_binary_frame_audio(self, test_client, sample_cards, monkeypatch):
+        """Test that the payload of a binary frame is the generate's sentence audio."""
+        from kioku.ws import pack_frame
+
+        seen = {}
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            seen["audio"] = sentence_audio.read()
+            return {"added": 0, "queued": 0, "skipped": []}
+
+        monkeypatch.setattr("kioku.ws.run_generate", fake_run_generate)
+        header = {"type": "generate", "id": "g2", "cards": [sample_cards[0].model_dump()]}
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_bytes(pack_frame(header, b"\x1aE\xdf\xa3webm"))
+            reply, _ = _ws_reply(websocket, "g2")
+
+        assert reply["type"] == "result"
+        assert seen == {"audio": b"\x1aE\xdf\xa3webm"}
+
+    def test_generate_idempotency_key_replays(self, test_client, sample_cards, monkeypatch):
+        """Test that a resent generate with the same idempotency_key replays its result."""
+        calls = []
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            calls.append(req.deck_name)
+            return {"added": len(req.cards), "queued": 0, "skipped": []}
+
+        monkeypatch.setattr("kioku.ws.run_generate", fake_run_generate)
+        message = {
+            "type": "generate",
+            "cards": [card.model_dump() for card in sample_cards],
+            "idempotency_key": "capture-ws",
+        }
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json({**message, "id": "a"})
+            first, _ = _ws_reply(websocket, "a")
+            websocket.send_json({**message, "id": "b"})
+            retry, _ = _ws_reply(websocket, "b")
+
+        assert first["data"] == retry["data"]
+        assert "replayed" not in first and retry["replayed"] is True
+        assert calls == ["ankiGen"]
+
+    def test_cancel_idempotent_generate_stops_it(self, test_client, sample_cards, monkeypatch):
+        """Test that cancelling the only request for an idempotency_key stops its execution."""
+        stopped = threading.Event()
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            progress("tts", 0, 1)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+            return {"added": len(req.cards), "queued": 0, "skipped": []}
+
+        monkeypatch.setattr("kioku.ws.run_generate", fake_run_generate)
+        message = {
+            "type": "generate",
+            "id": "g",
+            "cards": [card.model_dump() for card in sample_cards],
+            "idempotency_key": "capture-cancel",
+        }
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json(message)
+            assert websocket.receive_json()["type"] == "progress"
+            websocket.send_json({"type": "cancel", "id": "g"})
+            reply, _ = _ws_reply(websocket, "g")
+
+        assert reply == {"id": "g", "type": "cancelled"}
+        assert stopped.wait(1)
+
+    def test_cancel_after_anki_stage_is_ignored(self, test_client, sample_cards, monkeypatch):
+        """Test that a generate already adding notes to Anki finishes and sends its result."""
+
+        async def fake_run_generate(req, progress=None, sentence_audio=None):
+            progress("anki", 0, len(req.cards))
+            await asyncio.sleep(0.1)
+            return {"added": len(req.cards), "queued": 0, "skipped": []}
+
+        monkeypatch.setattr("kioku.ws.run_generate", fake_run_generate)
+        message = {"type": "generate", "id": "g", "cards": [sample_cards[0].model_dump()]}
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json(message)
+            assert websocket.receive_json()["stage"] == "anki"
+            websocket.send_json({"type": "cancel", "id": "g"})
+            reply, _ = _ws_reply(websocket, "g")
+
+        assert reply["type"] == "result" and reply["data"]["added"] == 1
+
+    def test_errors_carry_http_status(self, test_client):
+        """Test that invalid requests get error replies and leave the connection open."""
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "nope", "id": "x"})
+            unknown, _ = _ws_reply(websocket, "x")
+            websocket.send_json({"type": "extract_text", "id": "y"})
+            invalid, _ = _ws_reply(websocket, "y")
+            websocket.send_json({"type": "extract_text", "text": "hi"})
+            no_id = websocket.receive_json()
+            websocket.send_text("not json")
+            unreadable = websocket.receive_json()
+
+        assert (unknown["type"], unknown["status"]) == ("error", 400)
+        assert (invalid["type"], invalid["status"]) == ("error", 422)
+        assert no_id["status"] == 400 and unreadable["status"] == 400
+
+    def test_outbox_delivery_is_pushed(self, test_client, monkeypatch):
+        """Test that notes delivered from the outbox are announced to open connections."""
+        from kioku.main import _outbox_delivered, outbox_drainer
+        from kioku.ws import hub
+
+        monkeypatch.setattr("kioku.main.sync_scheduler.request", lambda: None)
+        monkeypatch.setattr(outbox_drainer, "last_result", {"added": 3})
+        with test_client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            assert len(hub) == 1
+            _outbox_delivered()
+            event = websocket.receive_json()
+
+        assert event == {"type": "event", "event": "cards_added", "added": 3, "source": "outbox"}
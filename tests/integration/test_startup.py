@@ -0,0 +1,85 @@
+"""Cold-start regression tests: imports stay light and the server answers fast."""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from kioku.importtime import heavy_imports, profile
+from loadtest.stubs import running_stubs, stub_env
+
+# Generous for slow CI; loading torch and the OCR model alone takes longer
+STARTUP_BUDGET = float(os.environ.get("KIOKU_STARTUP_BUDGET", "8"))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(tmp_path):
+    """`kioku serve` in a subprocess, with stubbed Groq and AnkiConnect."""
+    port = _free_port()
+    with running_stubs() as stubs:
+        env = {
+            **os.environ,
+            **stub_env(stubs),
+            "HOST": "127.0.0.1",
+            "PORT": str(port),
+            "WORKERS": "1",
+            "OCR_MODE": "inline",
+            "KIOKU_DATA_DIR": str(tmp_path / "kioku-data"),
+            "LOG_LEVEL": "WARNING",
+        }
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "kioku", "serve"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            yield f"http://127.0.0.1:{port}", started, process
+        finally:
+            process.terminate()
+            process.wait(10)
+
+
+class TestStartup:
+    """Tests for import cost and time to first response."""
+
+    def test_app_import_skips_heavy_modules(self):
+        """Test that importing the app loads none of manga_ocr, torch, groq or PIL."""
+        assert heavy_imports(profile("kioku.main")) == []
+
+    def test_time_to_first_response(self, server):
+        """Test that / and /api/extract-text answer within the startup budget."""
+        url, started, process = server
+        deadline = started + STARTUP_BUDGET
+        while True:
+            assert process.poll() is None, "server exited during startup"
+            try:
+                index = httpx.get(f"{url}/", timeout=1)
+                break
+            except httpx.TransportError:
+                if time.perf_counter() > deadline:
+                    pytest.fail(f"/ did not answer within {STARTUP_BUDGET}s")
+                time.sleep(0.05)
+        first_index = time.perf_counter() - started
+
+        response = httpx.post(
+            f"{url}/api/extract-text", json={"text": "今日は天気がいい。"}, timeout=STARTUP_BUDGET
+        )
+        first_extract = time.perf_counter() - started
+
+        assert index.status_code == 200
+        assert response.status_code == 200
+        assert response.json()["cards"]
+        assert first_index < STARTUP_BUDGET
+        assert first_extract < STARTUP_BUDGET
@@ -0,0 +1,112 @@
+"""Unit tests for admission gates and priority classes."""
+
+import asyncio
+import threading
+
+import pytest
+
+from kioku import admission
+from kioku.admission import BULK, INTERACTIVE, Gate, Overloaded
+
+
+async def _queued(gate, count, timeout=1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while gate.waiting < count:
+        assert asyncio.get_running_loop().time() < deadline, "waiters never queued"
+        await asyncio.sleep(0.005)
+
+
+class TestGate:
+    """Tests for Gate."""
+
+    @pytest.mark.asyncio
+    async def test_interactive_overtakes_bulk(self):
+        """Test that a freed slot goes to interactive waiters before earlier bulk ones."""
+        gate = Gate("test", limit=1)
+        order = []
+
+        async def worker(name, klass):
+            with admission.priority(klass):
+                async with gate.hold_async():
+                    order.append(name)
+
+        async with gate.hold_async():
+            tasks = [asyncio.create_task(worker(f"bulk{i}", BULK)) for i in range(3)]
+            await _queued(gate, 3)
+            tasks.append(asyncio.create_task(worker("capture", INTERACTIVE)))
+            await _queued(gate, 4)
+        await asyncio.gather(*tasks)
+
+        assert order == ["capture", "bulk0", "bulk1", "bulk2"]
+        assert gate.active == 0
+
+    @pytest.mark.asyncio
+    async def test_full_queue_is_rejected(self):
+        """Test that a bounded gate rejects callers beyond its queue with a retry hint."""
+        gate = Gate("test", limit=1, max_queue=1)
+
+        async with gate.hold_async():
+            waiter = asyncio.create_task(gate.hold_async().__aenter__())
+            await _queued(gate, 1)
+            with pytest.raises(Overloaded) as err:
+                async with gate.hold_async():
+                    pass
+            waiter.cancel()
+
+        assert err.value.gate == "test"
+        assert err.value.retry_after >= 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        """Test that a cancelled waiter neither blocks nor leaks a slot."""
+        gate = Gate("test", limit=1)
+
+        async with gate.hold_async():
+            waiter = asyncio.create_task(gate.hold_async().__aenter__())
+            await _queued(gate, 1)
+            waiter.cancel()
+            await asyncio.sleep(0)
+
+        assert gate.waiting == 0
+        async with gate.hold_async():
+            assert gate.active == 1
+        assert gate.active == 0
+
+    @pytest.mark.asyncio
+    async def test_threads_and_coroutines_share_slots(self):
+        """Test that a thread blocked in hold() is woken when a coroutine releases."""
+        gate = Gate("test", limit=1)
+        entered = threading.Event()
+
+        def in_thread():
+            with gate.hold():
+                entered.set()
+
+        async with gate.hold_async():
+            thread = threading.Thread(target=in_thread)
+            thread.start()
+            await _queued(gate, 1)
+            assert not entered.is_set()
+        await asyncio.to_thread(thread.join, 2)
+
+        assert entered.is_set()
+
+    @pytest.mark.asyncio
+    async def test_priority_follows_to_thread(self):
+        """Test that the priority class reaches worker threads."""
+        with admission.priority(BULK):
+            seen = await asyncio.to_thread(admission.current_priority)
+
+        assert seen == BULK
+        assert admission.current_priority() == INTERACTIVE
+
+    def test_gate_sized_from_environment(self, monkeypatch):
+        """Test that <NAME>_CONCURRENCY and <NAME>_QUEUE override the defaults."""
+        monkeypatch.setenv("GENERATE_CONCURRENCY", "5")
+        monkeypatch.setenv("GENERATE_QUEUE", "0")
+
+        gate = admission.gate("generate")
+
+        assert (gate.limit, gate.max_queue) == (5, 0)
+        assert admission.gate("generate") is gate
+        assert admission.gate("voicevox").max_queue is None
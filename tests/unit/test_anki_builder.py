@@ -1,11 +1,48 @@
 """Unit tests for anki_builder service."""
 
+import base64
 import json
 from unittest.mock import Mock
 
 import pytest
 
-from kioku.services.anki_builder import _anki_request, _ensure_deck, _ensure_model, add_cards
+from kioku import metrics
+from kioku.audio_spool import AudioSpool
+from kioku.services.anki_builder import (
+    AnkiUnavailableError,
+    _anki_request,
+    _ensure_deck,
+    _ensure_model,
+    add_cards,
+    find_new_cards,
+    invalidate_cache,
+    warm_cache,
+)
+from kioku.services.media_index import MediaIndex, media_index
+
+
+def _tracking_urlopen(actions, responses, errors=None):
+    """Build a urlopen mock that records every AnkiConnect action."""
+    errors = errors if errors is not None else {}
+
+    def mock_urlopen(request):
+        body = json.loads(request.data.decode())
+        action = body.get("action")
+        actions.append(action)
+        error = errors.pop(action, None)
+        result = responses.get(action)
+        if callable(result):
+            result = result(body.get("params", {}))
+
+        mock_response = Mock()
+        mock_response.read.return_value = json.dumps(
+            {"result": result, "error": error}
+        ).encode()
+        mock_response.__enter__ = Mock(return_value=mock_response)
+        mock_response.__exit__ = Mock(return_value=False)
+        return mock_response
+
+    return mock_urlopen
 
 
 class TestAnkiRequest:
@@ -38,6 +75,21 @@ class TestAnkiRequest:
         with pytest.raises(RuntimeError, match="AnkiConnect error: Deck not found"):
             _anki_request("someAction")
 
+    def test_anki_request_unreachable(self, anki_unreachable):
+        """Test that connection failures raise AnkiUnavailableError."""
+        with pytest.raises(AnkiUnavailableError, match="AnkiConnect is unreachable"):
+            _anki_request("deckNames")
+
+    def test_anki_request_metrics(self, anki_unreachable):
+        """Test that each action's latency and failures are recorded."""
+        with pytest.raises(AnkiUnavailableError):
+            _anki_request("deckNames")
+
+        assert metrics.histogram_count("kioku_stage_duration_seconds", stage="anki", action="deckNames") == 1
+        assert metrics.counter_value(
+            "kioku_stage_errors_total", stage="anki", action="deckNames", error="AnkiUnavailableError"
+        ) == 1
+
 
 class TestEnsureModel:
     """Tests for _ensure_model function."""
@@ -130,7 +182,7 @@ class TestAddCards:
                 "modelNames": ["Japanese Vocab (ankiGen)"],
                 "createDeck": None,
                 "storeMediaFile": None,
-                "addNote": 1234567890,
+                "addNotes": [1234567890],
             }.get(action)
 
             mock_response = Mock()
@@ -168,8 +220,299 @@ class TestAddCards:
         with pytest.raises(RuntimeError, match="AnkiConnect error"):
             add_cards(sample_cards, audio_map)
 
+    def test_add_cards_sends_one_add_notes(self, sample_cards, mock_anki_connect):
+        """Test that every card goes to Anki in a single addNotes call."""
+        sent = []
+        mock_anki_connect["addNotes"] = lambda params: sent.append(params["notes"]) or [1, 2]
+
+        assert add_cards(sample_cards, {}) == 2
+        assert [[note["fields"]["Japanese"] for note in notes] for notes in sent] == [
+            [card.japanese for card in sample_cards]
+        ]
+
+    def test_add_cards_names_refused_notes(self, sample_cards, mock_anki_connect):
+        """Test that notes Anki refuses are reported after the others are added."""
+        mock_anki_connect["addNotes"] = [1, None]
+
+        with pytest.raises(RuntimeError, match=f"refused 1 of 2 notes: {sample_cards[1].japanese}"):
+            add_cards(sample_cards, {})
+
     def test_add_cards_empty_list(self, mock_anki_connect):
         """Test adding empty card list."""
         audio_map = {}
         count = add_cards([], audio_map)
         assert count == 0
+
+
+class TestAnkiCache:
+    """Tests for the deck/note type existence cache."""
+
+    responses = {
+        "deckNames": ["TestDeck"],
+        "modelNames": ["Japanese Vocab (ankiGen)"],
+        "addNotes": lambda params: list(range(1, len(params["notes"]) + 1)),
+    }
+
+    def test_warm_cache_skips_lookups(self, sample_cards, monkeypatch):
+        """Test that a warm cache avoids createDeck and modelNames round trips."""
+        actions = []
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, self.responses))
+
+        warm_cache()
+        actions.clear()
+        add_cards(sample_cards, {}, deck_name="TestDeck")
+
+        assert actions == ["addNotes"]
+
+    def test_cold_cache_warms_once(self, sample_cards, monkeypatch):
+        """Test that the first call loads the cache and later calls reuse it."""
+        actions = []
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, self.responses))
+
+        add_cards(sample_cards[:1], {}, deck_name="TestDeck")
+        add_cards(sample_cards[1:], {}, deck_name="TestDeck")
+
+        assert actions.count("deckNames") == 1
+        assert actions.count("modelNames") == 1
+        assert "createDeck" not in actions
+
+    def test_unknown_deck_is_created_and_cached(self, sample_card_item, monkeypatch):
+        """Test that a deck missing from the cache is created only once."""
+        actions = []
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, self.responses))
+
+        add_cards([sample_card_item], {}, deck_name="NewDeck")
+        add_cards([sample_card_item], {}, deck_name="NewDeck")
+
+        assert actions.count("createDeck") == 1
+
+    def test_cache_expires_after_ttl(self, sample_card_item, monkeypatch):
+        """Test that the cache is refreshed once the TTL has elapsed."""
+        actions = []
+        clock = [1000.0]
+        monkeypatch.setenv("ANKI_CACHE_TTL", "60")
+        monkeypatch.setattr("kioku.services.anki_builder.time.monotonic", lambda: clock[0])
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, self.responses))
+
+        add_cards([sample_card_item], {}, deck_name="TestDeck")
+        clock[0] += 61
+        add_cards([sample_card_item], {}, deck_name="TestDeck")
+
+        assert actions.count("deckNames") == 2
+
+    def test_missing_deck_invalidates_cache(self, sample_card_item, monkeypatch):
+        """Test that a missing deck error drops the cache and retries the note."""
+        actions = []
+        errors = {"addNotes": "deck was not found: TestDeck"}
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self.responses, errors)
+        )
+
+        count = add_cards([sample_card_item], {}, deck_name="TestDeck")
+
+        assert count == 1
+        assert actions.count("deckNames") == 2
+        assert actions.count("addNotes") == 2
+
+    def test_invalidate_cache(self, sample_card_item, monkeypatch):
+        """Test that invalidate_cache forces a fresh lookup."""
+        actions = []
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, self.responses))
+
+        warm_cache()
+        invalidate_cache()
+        _ensure_deck("TestDeck")
+
+        assert actions.count("deckNames") == 2
+
+
+class TestMediaUpload:
+    """Tests for skipping media uploads Anki already has."""
+
+    def _responses(self, present):
+        return {
+            "deckNames": ["ankiGen"],
+            "modelNames": ["Japanese Vocab (ankiGen)"],
+            "getMediaFilesNames": present,
+            "addNotes": lambda params: list(range(1, len(params["notes"]) + 1)),
+        }
+
+    def test_first_upload_sends_everything(self, sample_card_item, monkeypatch):
+        """Test that unknown media is uploaded and counted."""
+        actions = []
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self._responses([]))
+        )
+
+        add_cards([sample_card_item], {"word_a.wav": b"abc", "sentence_b.wav": b"defg"})
+
+        assert actions.count("getMediaFilesNames") == 1
+        assert actions.count("storeMediaFile") == 2
+        assert metrics.counter_value("kioku_anki_media_uploaded_bytes_total") == 7
+        assert metrics.counter_value("kioku_anki_media_skipped_bytes_total") == 0
+
+    def test_unchanged_media_is_skipped(self, sample_card_item, monkeypatch):
+        """Test that media already in Anki with the same content is not re-sent."""
+        actions = []
+        audio_map = {"word_a.wav": b"abc", "sentence_b.wav": b"defg"}
+        present = ["word_a.wav", "sentence_b.wav"]
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self._responses(present))
+        )
+
+        add_cards([sample_card_item], audio_map)
+        actions.clear()
+        add_cards([sample_card_item], audio_map)
+
+        assert "storeMediaFile" not in actions
+        assert metrics.counter_value("kioku_anki_media_skipped_bytes_total") == 7
+        assert metrics.counter_value("kioku_anki_media_skipped_files_total") == 2
+
+    def test_changed_content_is_uploaded(self, sample_card_item, monkeypatch):
+        """Test that a file whose bytes changed is uploaded again."""
+        actions = []
+        present = ["sentence_b.wav"]
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self._responses(present))
+        )
+
+        add_cards([sample_card_item], {"sentence_b.wav": b"tts"})
+        actions.clear()
+        add_cards([sample_card_item], {"sentence_b.wav": b"captured"})
+
+        assert actions.count("storeMediaFile") == 1
+
+    def test_media_missing_from_anki_is_uploaded(self, sample_card_item, monkeypatch):
+        """Test that media deleted from Anki is uploaded again."""
+        actions = []
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self._responses([]))
+        )
+
+        add_cards([sample_card_item], {"word_a.wav": b"abc"})
+        actions.clear()
+        add_cards([sample_card_item], {"word_a.wav": b"abc"})
+
+        assert actions.count("storeMediaFile") == 1
+
+    def test_index_survives_a_restart(self, sample_card_item, monkeypatch):
+        """Test that uploads recorded by one process are skipped by the next."""
+        actions = []
+        audio_map = {"word_a.wav": b"abc"}
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self._responses(["word_a.wav"]))
+        )
+        add_cards([sample_card_item], audio_map)
+        # A new process (or another worker) only has what is on disk
+        monkeypatch.setattr(
+            "kioku.services.anki_builder.media_index", MediaIndex(media_index.path)
+        )
+        actions.clear()
+
+        add_cards([sample_card_item], audio_map)
+
+        assert "storeMediaFile" not in actions
+
+    def test_large_media_is_streamed(self, sample_card_item, monkeypatch):
+        """Test that a file over one chunk is sent as base64 pieces with its full length."""
+        monkeypatch.setattr("kioku.services.anki_builder.MEDIA_CHUNK_BYTES", 6)
+        actions = []
+        tracking = _tracking_urlopen(actions, self._responses([]))
+        streamed = []
+
+        def mock_urlopen(request):
+            if isinstance(request.data, bytes):
+                return tracking(request)
+            pieces = list(request.data)
+            streamed.append((pieces, int(request.get_header("Content-length"))))
+            request.data = b"".join(pieces)
+            return tracking(request)
+
+        monkeypatch.setattr("urllib.request.urlopen", mock_urlopen)
+        audio = bytes(range(20))
+
+        with AudioSpool(max_memory=0) as spool:
+            spool.add("word_a.wav", audio)
+            spool.add("sentence_b.wav", b"small")
+            add_cards([sample_card_item], spool)
+
+        pieces, length = streamed[0]
+        body = json.loads(b"".join(pieces))
+        assert len(streamed) == 1 and len(b"".join(pieces)) == length
+        assert body["action"] == "storeMediaFile"
+        assert body["params"] == {"filename": "word_a.wav", "data": base64.b64encode(audio).decode()}
+        # Prefix, four pieces of six bytes or less, suffix
+        assert len(pieces) == 6
+        assert actions.count("storeMediaFile") == 2
+
+    def test_no_media_skips_presence_check(self, sample_card_item, monkeypatch):
+        """Test that an empty audio map does not list Anki's media folder."""
+        actions = []
+        monkeypatch.setattr(
+            "urllib.request.urlopen", _tracking_urlopen(actions, self._responses([]))
+        )
+
+        add_cards([sample_card_item], {})
+
+        assert "getMediaFilesNames" not in actions
+
+
+class TestFindNewCards:
+    """Tests for the pre-flight duplicate check."""
+
+    def test_existing_notes_are_skipped(self, sample_cards, monkeypatch):
+        """Test that cards canAddNotes rejects are reported as skipped."""
+        actions = []
+        responses = {
+            "deckNames": ["ankiGen"],
+            "modelNames": ["Japanese Vocab (ankiGen)"],
+            "canAddNotes": [False, True],
+        }
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, responses))
+
+        new_cards, skipped = find_new_cards(sample_cards)
+
+        assert [c.japanese for c in new_cards] == ["元気"]
+        assert [c.japanese for c in skipped] == ["こんにちは"]
+        assert actions.count("canAddNotes") == 1
+
+    @pytest.mark.parametrize("reply", [None, [True]])
+    def test_short_reply_raises(self, sample_cards, monkeypatch, reply):
+        """Test that a canAddNotes reply not covering every note is an error, not a drop."""
+        responses = {"modelNames": ["Japanese Vocab (ankiGen)"], "canAddNotes": reply}
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen([], responses))
+
+        with pytest.raises(RuntimeError, match="canAddNotes"):
+            find_new_cards(sample_cards)
+
+    def test_batch_repeats_are_skipped(self, sample_card_item, mock_anki_connect):
+        """Test that repeats within the batch are skipped without asking Anki twice."""
+        new_cards, skipped = find_new_cards([sample_card_item, sample_card_item])
+
+        assert new_cards == [sample_card_item]
+        assert skipped == [sample_card_item]
+
+    def test_empty_batch_skips_anki(self, monkeypatch):
+        """Test that an empty batch makes no AnkiConnect calls."""
+        actions = []
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen(actions, {}))
+
+        assert find_new_cards([]) == ([], [])
+        assert actions == []
+
+    def test_notes_target_deck_and_model(self, sample_card_item, monkeypatch):
+        """Test that the checked notes carry the target deck and model."""
+        checked = []
+
+        def can_add(params):
+            checked.extend(params["notes"])
+            return [True] * len(params["notes"])
+
+        responses = {"modelNames": ["Japanese Vocab (ankiGen)"], "canAddNotes": can_add}
+        monkeypatch.setattr("urllib.request.urlopen", _tracking_urlopen([], responses))
+
+        find_new_cards([sample_card_item], deck_name="Mining")
+
+        assert checked[0]["deckName"] == "Mining"
+        assert checked[0]["modelName"] == "Japanese Vocab (ankiGen)"
+        assert checked[0]["fields"]["Japanese"] == "こんにちは"
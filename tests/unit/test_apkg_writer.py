@@ -0,0 +1,91 @@
+"""Unit tests for the offline .apkg writer."""
+
+import io
+import json
+import sqlite3
+import zipfile
+
+from kioku.services.anki_builder import MODEL_NAME
+from kioku.services.apkg_writer import note_guid, stable_id, write_apkg
+
+
+def _open_collection(package: zipfile.ZipFile, tmp_path) -> sqlite3.Connection:
+    path = tmp_path / "collection.anki2"
+    path.write_bytes(package.read("collection.anki2"))
+    return sqlite3.connect(path)
+
+
+class TestWriteApkg:
+    """Tests for write_apkg."""
+
+    def test_package_layout(self, sample_cards, tmp_path):
+        """Test that the package holds the collection, media and media index."""
+        out = tmp_path / "deck.apkg"
+        count = write_apkg(out, sample_cards, [("word_a.wav", b"abc")], deck_name="Mining")
+
+        assert count == 2
+        with zipfile.ZipFile(out) as package:
+            assert set(package.namelist()) == {"collection.anki2", "0", "media"}
+            assert json.loads(package.read("media")) == {"0": "word_a.wav"}
+            assert package.read("0") == b"abc"
+
+    def test_collection_contents(self, sample_cards, tmp_path):
+        """Test that notes, cards, model and deck are written."""
+        buf = io.BytesIO()
+        write_apkg(buf, sample_cards, deck_name="Mining")
+
+        with zipfile.ZipFile(buf) as package:
+            conn = _open_collection(package, tmp_path)
+        notes = conn.execute("SELECT guid, flds, sfld FROM notes ORDER BY id").fetchall()
+        cards = conn.execute("SELECT nid, did, ord FROM cards").fetchall()
+        models, decks = conn.execute("SELECT models, decks FROM col").fetchone()
+
+        assert [n[2] for n in notes] == ["こんにちは", "元気"]
+        assert notes[0][1].split("\x1f")[:3] == ["こんにちは", "こんにちは", "Hello"]
+        assert len(cards) == 2
+        assert {c[1] for c in cards} == {stable_id("deck:Mining")}
+        assert json.loads(models)[str(stable_id(MODEL_NAME))]["name"] == MODEL_NAME
+        assert "Mining" in {d["name"] for d in json.loads(decks).values()}
+
+    def test_media_from_path_is_streamed(self, sample_card_item, tmp_path):
+        """Test that media given as a file path is copied into the package."""
+        wav = tmp_path / "clip.wav"
+        wav.write_bytes(b"RIFF" + b"\0" * 4096)
+        out = tmp_path / "deck.apkg"
+
+        write_apkg(out, [sample_card_item], [("sentence_x.wav", wav)])
+
+        with zipfile.ZipFile(out) as package:
+            assert package.read("0") == wav.read_bytes()
+
+    def test_duplicates_are_written_once(self, sample_card_item, tmp_path):
+        """Test that repeated cards and media filenames are only written once."""
+        out = tmp_path / "deck.apkg"
+
+        count = write_apkg(
+            out,
+            [sample_card_item, sample_card_item],
+            [("word_a.wav", b"1"), ("word_a.wav", b"1")],
+        )
+
+        assert count == 1
+        with zipfile.ZipFile(out) as package:
+            assert json.loads(package.read("media")) == {"0": "word_a.wav"}
+
+
+class TestNoteGuid:
+    """Tests for stable note GUIDs."""
+
+    def test_guid_is_stable(self, sample_card_item):
+        """Test that the same card always gets the same GUID."""
+        assert note_guid(sample_card_item) == note_guid(sample_card_item.model_copy())
+
+    def test_guid_depends_on_first_field(self, sample_card_item):
+        """Test that different words get different GUIDs."""
+        other = sample_card_item.model_copy(update={"japanese": "元気"})
+        assert note_guid(sample_card_item) != note_guid(other)
+
+    def test_guid_ignores_other_fields(self, sample_card_item):
+        """Test that editing the meaning keeps the GUID so re-imports update the note."""
+        edited = sample_card_item.model_copy(update={"meaning": "Hi"})
+        assert note_guid(sample_card_item) == note_guid(edited)
@@ -0,0 +1,106 @@
+"""Unit tests for clipping sentence audio from media files."""
+
+import sys
+import time
+
+import pytest
+
+from kioku.models import CardItem
+from kioku.services.audio_clipper import clip_cards, clip_command, resolve_media_path
+
+# Stands in for ffmpeg: sleeps briefly and prints the seek position it was given
+FAKE_FFMPEG = [
+    sys.executable,
+    "-c",
+    "import sys, time; time.sleep(0.2); args = sys.argv[1:];"
+    " sys.stdout.write('clip@' + args[args.index('-ss') + 1])",
+]
+FAILING_FFMPEG = [sys.executable, "-c", "import sys; sys.stderr.write('no audio'); sys.exit(1)"]
+
+
+def _card(sentence: str, start: float | None, end: float | None) -> CardItem:
+    return CardItem(
+        japanese=sentence,
+        reading="よみ",
+        meaning="meaning",
+        example_sentence=sentence,
+        example_translation="translation",
+        cue_start=start,
+        cue_end=end,
+    )
+
+
+class TestClipCommand:
+    """Tests for clip_command."""
+
+    def test_fast_seek_with_padding(self):
+        """Test that -ss comes before -i and the cue is padded on both sides."""
+        command = clip_command("ep01.mkv", 10.0, 12.5, padding=0.25, audio_stream=1)
+
+        assert command.index("-ss") < command.index("-i")
+        assert command[command.index("-ss") + 1] == "9.750"
+        assert command[command.index("-t") + 1] == "3.000"
+        assert command[command.index("-map") + 1] == "0:a:1"
+        assert "loudnorm" in command[command.index("-af") + 1]
+
+    def test_padding_stops_at_zero(self):
+        """Test that a cue at the very start does not seek before zero."""
+        command = clip_command("ep01.mkv", 0.1, 1.0, padding=0.25)
+
+        assert command[command.index("-ss") + 1] == "0.000"
+
+
+class TestClipCards:
+    """Tests for clip_cards."""
+
+    def test_clips_in_parallel(self, monkeypatch):
+        """Test that each timed sentence is clipped once, several at a time."""
+        monkeypatch.setattr("kioku.services.audio_clipper.FFMPEG", FAKE_FFMPEG)
+        cards = [_card(f"文{i}", 10.0 * i + 1, 10.0 * i + 2) for i in range(4)]
+        cards.append(_card("文0", 1.0, 2.0))
+        cards.append(_card("字幕なし", None, None))
+        progress = []
+
+        started = time.perf_counter()
+        clips = clip_cards(
+            "ep01.mkv", cards, lambda *p: progress.append(p), concurrency=4
+        )
+        elapsed = time.perf_counter() - started
+
+        assert clips == {f"文{i}": f"clip@{10.0 * i + 0.75:.3f}".encode() for i in range(4)}
+        assert progress[0] == ("clip", 0, 4)
+        assert progress[-1] == ("clip", 4, 4)
+        # Four 0.2s runs in parallel, not one after another
+        assert elapsed < 0.8
+
+    def test_failed_clip_is_left_out(self, monkeypatch):
+        """Test that a clip ffmpeg cannot cut falls back to TTS."""
+        monkeypatch.setattr("kioku.services.audio_clipper.FFMPEG", FAILING_FFMPEG)
+
+        assert clip_cards("ep01.mkv", [_card("文", 1.0, 2.0)]) == {}
+
+
+class TestResolveMediaPath:
+    """Tests for resolve_media_path."""
+
+    def test_disabled_without_media_dir(self, monkeypatch):
+        """Test that the API cannot read media files unless MEDIA_DIR is set."""
+        monkeypatch.delenv("MEDIA_DIR", raising=False)
+
+        with pytest.raises(ValueError, match="MEDIA_DIR"):
+            resolve_media_path("ep01.mkv")
+
+    def test_only_inside_media_dir(self, monkeypatch, tmp_path):
+        """Test that relative and absolute paths must stay inside MEDIA_DIR."""
+        media = tmp_path / "media"
+        media.mkdir()
+        (media / "ep01.mkv").write_bytes(b"video")
+        (tmp_path / "secret.txt").write_text("no")
+        monkeypatch.setenv("MEDIA_DIR", str(media))
+
+        assert resolve_media_path("ep01.mkv") == (media / "ep01.mkv").resolve()
+        assert resolve_media_path(str(media / "ep01.mkv")) == (media / "ep01.mkv").resolve()
+        with pytest.raises(ValueError, match="inside MEDIA_DIR"):
+            resolve_media_path("../secret.txt")
+        with pytest.raises(ValueError, match="not found"):
+            resolve_media_path("ep02.mkv")
@@ -163,3 +163,45 @@ class TestGenerateAudio:
         assert len(post_calls) == 2
         assert "audio_query" in post_calls[0]["url"]
         assert "synthesis" in post_calls[1]["url"]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("backend, synthesized", [("sqlite", 2), ("memory", 3)])
+    async def test_generate_audio_is_cached(self, monkeypatch, backend, synthesized):
+        """Test that repeating a sentence reuses audio cached on disk, but not in memory."""
+        monkeypatch.setenv("CACHE_BACKEND", backend)
+
+        posts = []
+
+        class MockResponse:
+            content = b"wav_data"
+
+            def json(self):
+                return {}
+
+            def raise_for_status(self):
+                pass
+
+        class MockAsyncClientCounting:
+            def __init__(self, **kwargs):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+            async def post(self, url, **kwargs):
+                posts.append(url)
+                return MockResponse()
+
+        monkeypatch.setattr("httpx.AsyncClient", MockAsyncClientCounting)
+
+        first = await generate_audio("テスト")
+        second = await generate_audio("テスト")
+        monkeypatch.setenv("VOICEVOX_SPEED", "1.0")
+        await generate_audio("テスト")
+
+        assert first == second == b"wav_data"
+        # One query and one synthesis per synthesized (text, speed)
+        assert len(posts) == 2 * synthesized
@@ -0,0 +1,54 @@
+"""Unit tests for the bounded-memory audio spool."""
+
+from kioku.audio_spool import AudioSpool
+
+
+class TestAudioSpool:
+    """Tests for AudioSpool."""
+
+    def test_spills_past_the_budget(self):
+        """Test that files beyond the memory budget go to disk and read back the same."""
+        with AudioSpool(max_memory=10) as spool:
+            spool.add("a.wav", b"12345678")
+            spool.add("b.wav", b"abcdef")
+
+            assert spool.memory_bytes == 8 and spool.spilled_bytes == 6
+            assert dict(spool.media_items())["a.wav"] == b"12345678"
+            spilled = dict(spool.media_items())["b.wav"]
+            assert spilled.read_bytes() == b"abcdef"
+            assert spool == {"a.wav": b"12345678", "b.wav": b"abcdef"}
+            with spool.open("b.wav") as stream:
+                assert stream.read() == b"abcdef"
+
+        assert not spilled.exists()
+        assert len(spool) == 0
+
+    def test_links_share_one_copy(self):
+        """Test that a linked filename reuses the stored audio instead of adding bytes."""
+        spool = AudioSpool(max_memory=100)
+        spool.add("word_x.wav", b"same")
+        spool.link("sentence_x.wav", "word_x.wav")
+
+        assert spool["sentence_x.wav"] == b"same"
+        assert spool.digest("sentence_x.wav") == spool.digest("word_x.wav")
+        assert spool.memory_bytes == 4 and len(spool) == 2
+        spool.close()
+
+    def test_added_file_is_read_in_place(self, tmp_path):
+        """Test that an existing file is served from its path and outlives the spool."""
+        path = tmp_path / "word_x.wav"
+        path.write_bytes(b"RIFF")
+
+        with AudioSpool(max_memory=0) as spool:
+            spool.add_file("word_x.wav", path)
+            assert spool["word_x.wav"] == b"RIFF"
+            assert spool.memory_bytes == spool.spilled_bytes == 0
+
+        assert path.read_bytes() == b"RIFF"
+
+    def test_budget_from_environment(self, monkeypatch):
+        """Test that AUDIO_MEMORY_BYTES sets the default budget."""
+        monkeypatch.setenv("AUDIO_MEMORY_BYTES", "0")
+        with AudioSpool() as spool:
+            spool.add("a.wav", b"x")
+            assert spool.spilled_bytes == 1
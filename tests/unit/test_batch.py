@@ -0,0 +1,191 @@
+"""Unit tests for offline batch runs."""
+
+import json
+import zipfile
+
+import pytest
+
+from kioku.batch import Throughput, add_to_anki, audio_texts, is_complete, run_batch
+from kioku.journal import Journal
+from kioku.models import CardItem
+
+
+def _card(text: str) -> CardItem:
+    return CardItem(
+        japanese=text,
+        reading="よみ",
+        meaning="meaning",
+        example_sentence=text,
+        example_translation="translation",
+    )
+
+
+@pytest.fixture
+def enriched(monkeypatch):
+    """Fake enrich_text: one sentence card per line, recording each call's text."""
+    calls = []
+
+    def fake_enrich(text):
+        calls.append(text)
+        return [_card(line) for line in text.splitlines()]
+
+    monkeypatch.setattr("kioku.ingest.enrich_text", fake_enrich)
+    return calls
+
+
+@pytest.fixture
+def voiced(monkeypatch):
+    """Fake generate_audio recording each text; texts in `failing` raise."""
+    calls = []
+    failing = set()
+
+    async def fake_audio(text):
+        calls.append(text)
+        if text in failing:
+            raise RuntimeError("VOICEVOX request failed.")
+        return f"RIFF{text}".encode("utf-8")
+
+    monkeypatch.setattr("kioku.batch.generate_audio", fake_audio)
+    return calls, failing
+
+
+class TestRunBatch:
+    """Tests for run_batch."""
+
+    def test_text_to_package(self, tmp_path, enriched, voiced):
+        """Test that every line becomes a note with its audio in the package."""
+        lines = tmp_path / "lines.txt"
+        lines.write_text("おはよう\n\n元気？\nおはよう\n", encoding="utf-8")
+        out = tmp_path / "out.apkg"
+
+        with Journal(tmp_path / "run.journal") as journal:
+            stats = run_batch("text", lines, journal, output=out)
+
+        assert stats["text"]["cards"] == 2 and stats["text"]["repeated"] == 1
+        # A word and a sentence file per line, synthesized once each
+        assert stats["apkg"] == {"notes": 2, "media": 4}
+        assert len(voiced[0]) == 2
+        assert is_complete(stats)
+        with zipfile.ZipFile(out) as package:
+            assert len(json.loads(package.read("media"))) == 4
+
+    def test_resume_only_redoes_failures(self, tmp_path, enriched, voiced):
+        """Test that a second run with the journal only retries the audio that failed."""
+        calls, failing = voiced
+        lines = tmp_path / "lines.txt"
+        lines.write_text("おはよう\n元気？\n", encoding="utf-8")
+        failing.add("元気？")
+
+        with Journal(tmp_path / "run.journal") as journal:
+            first = run_batch("text", lines, journal, output=tmp_path / "out.apkg")
+            failing.clear()
+            second = run_batch("text", lines, journal, output=tmp_path / "out.apkg")
+
+        assert first["tts"]["failed"] == 2 and not is_complete(first)
+        assert second["tts"] == {"made": 2, "resumed": 2, "failed": 0}
+        assert second["text"]["resumed"] == 2
+        assert len(enriched) == 1
+        assert calls == ["おはよう", "元気？", "元気？"]
+
+    def test_images_to_anki(self, tmp_path, monkeypatch, enriched, voiced, mock_anki_connect):
+        """Test that a directory of images ends up as notes added through AnkiConnect."""
+        (tmp_path / "pages").mkdir()
+        for i, text in enumerate(["一ページ", "二ページ"]):
+            (tmp_path / "pages" / f"{i}.png").write_bytes(text.encode("utf-8"))
+        monkeypatch.setattr("kioku.ingest.ocr_image", lambda data: data.decode("utf-8"))
+        events = []
+
+        with Journal(tmp_path / "run.journal") as journal:
+            stats = run_batch(
+                "images",
+                tmp_path / "pages",
+                journal,
+                deck_name="Mining",
+                workers={"ocr": 1, "enrich": 1, "tts": 2},
+                progress=lambda *event: events.append(event),
+            )
+
+        assert stats["anki"]["added"] == 2
+        assert [event[0] for event in events][-1] == "anki"
+        assert {event[0] for event in events} == {"ocr", "enrich", "tts", "anki"}
+
+    def test_unknown_kind(self, tmp_path):
+        """Test that only images and text are accepted."""
+        with Journal(tmp_path / "run.journal") as journal, pytest.raises(ValueError):
+            run_batch("video", tmp_path, journal)
+
+
+class TestAddToAnki:
+    """Tests for the AnkiConnect stage."""
+
+    def test_chunk_added_in_one_call(self, tmp_path, monkeypatch):
+        """Test that the new notes of a chunk go to AnkiConnect together, with their audio."""
+        cards = [_card("一"), _card("二"), _card("三")]
+        audio_dir = tmp_path / "audio"
+        audio_dir.mkdir()
+        for name in audio_texts(cards):
+            (audio_dir / name).write_bytes(b"RIFF")
+        calls = []
+
+        def fake_add(batch, audio, deck_name):
+            calls.append((len(batch), len(audio)))
+            return len(batch)
+
+        monkeypatch.setattr("kioku.batch.find_new_cards", lambda chunk, deck: (chunk, []))
+        monkeypatch.setattr("kioku.batch.add_cards", fake_add)
+
+        with Journal(tmp_path / "run.journal") as journal:
+            stats = add_to_anki(cards, "Mining", journal, audio_dir)
+
+        assert stats["added"] == 3
+        assert calls == [(3, len(audio_texts(cards)))]
+
+    def test_failed_notes_are_retried(self, tmp_path, monkeypatch):
+        """Test that only the notes a run could not add are sent again."""
+        cards = [_card("一"), _card("二"), _card("三")]
+        added = []
+        failing = {"二"}
+
+        def fake_add(batch, audio, deck_name):
+            if any(card.japanese in failing for card in batch):
+                raise RuntimeError("AnkiConnect error: busy")
+            added.extend(card.japanese for card in batch)
+            return len(batch)
+
+        monkeypatch.setattr("kioku.batch.find_new_cards", lambda chunk, deck: (chunk, []))
+        monkeypatch.setattr("kioku.batch.add_cards", fake_add)
+
+        with Journal(tmp_path / "run.journal") as journal:
+            first = add_to_anki(cards, "Mining", journal)
+            failing.clear()
+            second = add_to_anki(cards, "Mining", journal)
+
+        assert first["failed"] == 1 and first["added"] == 2
+        assert sorted(added) == sorted(["一", "三", "二"])
+        assert second == {"added": 1, "resumed": 2, "existing": 0, "no_audio": 0, "failed": 0}
+
+    def test_closed_anki_stops_with_hint(self, tmp_path, anki_unreachable):
+        """Test that a closed Anki ends the run with a message to resume later."""
+        with Journal(tmp_path / "run.journal") as journal, pytest.raises(
+            RuntimeError, match="again once Anki is open"
+        ):
+            add_to_anki([_card("一")], "Mining", journal)
+
+
+class TestThroughput:
+    """Tests for the per-stage throughput report."""
+
+    def test_report_rates(self, monkeypatch):
+        """Test that each stage is timed from its first to its last report."""
+        clock = iter([0.0, 2.0, 2.0, 3.0])
+        monkeypatch.setattr("kioku.batch.time.perf_counter", lambda: next(clock))
+        throughput = Throughput()
+
+        throughput("ocr", 0, 10)
+        throughput("ocr", 10, 10)
+        throughput("tts", 0, 4)
+        throughput("tts", 4, 4)
+
+        lines = throughput.report().splitlines()
+        assert lines[1].split() == ["ocr", "10/10", "2.0", "5.0"]
+        assert lines[2].split() == ["tts", "4/4", "1.0", "4.0"]
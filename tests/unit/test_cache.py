@@ -0,0 +1,189 @@
+"""Unit tests for the shared cache backends."""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from kioku.cache import DirectoryCache, MemoryCache, NullCache, SqliteCache, build_cache
+
+
+def _make(kind, tmp_path, max_bytes=100):
+    if kind == "memory":
+        return MemoryCache(max_bytes)
+    if kind == "sqlite":
+        return SqliteCache(tmp_path / "cache.sqlite3", max_bytes)
+    return DirectoryCache(tmp_path / "cache", max_bytes)
+
+
+@pytest.fixture(params=["memory", "sqlite", "directory"])
+def cache(request, tmp_path):
+    """Each backend with a 100-byte budget."""
+    return _make(request.param, tmp_path)
+
+
+def _compute_in_child(kind, root, counter, result_queue):
+    cache = _make(kind, root, max_bytes=1024)
+
+    def compute():
+        with open(counter, "a") as f:
+            f.write("x")
+        time.sleep(0.3)
+        return b"shared"
+
+    result_queue.put(cache.get_or_compute("k", compute))
+
+
+class TestBackends:
+    """Behaviour every backend shares."""
+
+    def test_round_trip(self, cache):
+        """Test set, get, delete and clear."""
+        cache.set("a", b"1")
+        cache.set("b", b"2")
+        assert cache.get("a") == b"1"
+
+        cache.delete("a")
+        assert cache.get("a") is None
+        cache.clear()
+        assert cache.get("b") is None
+
+    def test_ttl(self, cache):
+        """Test that entries expire after their TTL."""
+        cache.set("short", b"v", ttl=0.05)
+        cache.set("long", b"v", ttl=60)
+        time.sleep(0.1)
+
+        assert cache.get("short") is None
+        assert cache.get("long") == b"v"
+
+    def test_evicts_least_recently_used(self, cache):
+        """Test that the byte budget evicts the entry read longest ago."""
+        cache.set("a", b"a" * 40)
+        time.sleep(0.01)
+        cache.set("b", b"b" * 40)
+        time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.set("c", b"c" * 40)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+
+    def test_oversized_value_is_not_stored(self, cache):
+        """Test that a value larger than the whole budget is skipped."""
+        cache.set("big", b"x" * 500)
+
+        assert cache.get("big") is None
+
+    def test_size_accounting(self, cache):
+        """Test that entries and stored bytes are reported."""
+        cache.set("a", b"x" * 10)
+        cache.set("b", b"x" * 20)
+
+        entries, size = cache.size()
+        assert entries == 2
+        assert size >= 30
+        assert cache.stats()["entries"] == 2
+
+    def test_get_or_compute_once_across_threads(self, cache):
+        """Test that concurrent callers share one computation."""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return b"value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert results == [b"value"] * 8
+        assert cache.hits + cache.misses == 8
+
+    @pytest.mark.asyncio
+    async def test_get_or_compute_async_once(self, cache):
+        """Test that concurrent coroutines share one computation."""
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return b"value"
+
+        results = await asyncio.gather(
+            *(cache.get_or_compute_async("k", compute) for _ in range(8))
+        )
+
+        assert calls == [1]
+        assert results == [b"value"] * 8
+
+    @pytest.mark.asyncio
+    async def test_failed_compute_is_not_cached(self, cache):
+        """Test that an exception leaves the key empty and the lock free."""
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute_async("k", fail)
+
+        async def succeed():
+            return b"ok"
+
+        assert await cache.get_or_compute_async("k", succeed) == b"ok"
+
+
+class TestSharedBackends:
+    """Tests for sharing one cache between processes."""
+
+    @pytest.mark.parametrize("kind", ["sqlite", "directory"])
+    def test_one_process_computes(self, kind, tmp_path):
+        """Test that only one of several processes computes a missing key."""
+        ctx = multiprocessing.get_context("spawn")
+        counter = tmp_path / "computed"
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(target=_compute_in_child, args=(kind, tmp_path, counter, results))
+            for _ in range(3)
+        ]
+        for process in processes:
+            process.start()
+        values = [results.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join(10)
+
+        assert values == [b"shared"] * 3
+        assert counter.read_text() == "x"
+
+
+class TestBuildCache:
+    """Tests for choosing a backend from the environment."""
+
+    def test_backends_from_environment(self, monkeypatch, tmp_path):
+        """Test CACHE_BACKEND, CACHE_DIR and CACHE_MAX_BYTES."""
+        monkeypatch.setenv("CACHE_DIR", str(tmp_path / "shared"))
+        monkeypatch.setenv("CACHE_MAX_BYTES", "1000")
+
+        assert isinstance(build_cache("memory"), MemoryCache)
+        assert isinstance(build_cache("none"), NullCache)
+        sqlite_cache = build_cache("sqlite")
+        assert sqlite_cache.path == tmp_path / "shared" / "cache.sqlite3"
+        assert sqlite_cache.max_bytes == 1000
+        assert build_cache("directory").root == tmp_path / "shared"
+
+    def test_unknown_backend(self):
+        """Test that a typo in CACHE_BACKEND is reported."""
+        with pytest.raises(RuntimeError, match="Unknown CACHE_BACKEND"):
+            build_cache("redis")
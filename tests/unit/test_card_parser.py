@@ -0,0 +1,36 @@
+"""Unit tests for parsing LLM responses into cards."""
+
+import json
+
+import pytest
+
+from kioku.services.card_parser import parse_cards
+
+
+class TestParseCards:
+    """Tests for parse_cards."""
+
+    def test_fenced_response(self):
+        """Test that a fenced JSON array becomes cards, skipping repeats and entries without a reading."""
+        entries = [
+            {"japanese": "元気", "reading": "げんき", "meaning": "healthy"},
+            {"japanese": "元気", "reading": "げんき", "meaning": "again"},
+            {"japanese": "猫", "reading": ""},
+            "not an object",
+        ]
+        content = "```json\n" + json.dumps(entries, ensure_ascii=False) + "\n```"
+
+        cards = parse_cards(content)
+
+        assert [card.japanese for card in cards] == ["元気"]
+        assert cards[0].example_sentence == "元気"
+
+    def test_invalid_json(self):
+        """Test that invalid JSON is reported with the raw response."""
+        with pytest.raises(RuntimeError, match="Groq returned invalid JSON"):
+            parse_cards("not json")
+
+    def test_non_list(self):
+        """Test that a JSON object instead of an array is rejected."""
+        with pytest.raises(RuntimeError, match="non-list JSON"):
+            parse_cards('{"japanese": "元気"}')
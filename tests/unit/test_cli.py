@@ -0,0 +1,251 @@
+"""Unit tests for the kioku command line."""
+
+import json
+import os
+import sys
+import zipfile
+
+import pytest
+
+from kioku.cli import build_parser, load_cards, main
+
+
+class TestLoadCards:
+    """Tests for reading card JSON files."""
+
+    def test_load_list(self, sample_cards, tmp_path):
+        """Test loading a bare list of cards."""
+        path = tmp_path / "cards.json"
+        path.write_text(json.dumps([c.model_dump() for c in sample_cards]), encoding="utf-8")
+
+        assert load_cards(str(path)) == sample_cards
+
+    def test_load_extraction_result(self, sample_cards, tmp_path):
+        """Test loading the {"cards": [...]} shape returned by the API."""
+        path = tmp_path / "cards.json"
+        path.write_text(
+            json.dumps({"cards": [c.model_dump() for c in sample_cards]}), encoding="utf-8"
+        )
+
+        assert load_cards(str(path)) == sample_cards
+
+
+class TestParser:
+    """Tests for subcommand parsing."""
+
+    def test_default_is_serve(self):
+        """Test that running without a subcommand serves the web app."""
+        args = build_parser().parse_args([])
+        assert args.func.__name__ == "serve"
+
+
+class TestServeCommand:
+    """Tests for the `kioku serve` process layout."""
+
+    @pytest.fixture
+    def launched(self, monkeypatch):
+        """Record the uvicorn call and any OCR process start/stop."""
+        calls = {}
+
+        def fake_run(app, **kwargs):
+            calls["uvicorn"] = kwargs
+            calls["ocr_socket_env"] = os.environ.get("OCR_SOCKET")
+
+        def fake_start(socket_path):
+            calls["ocr_started"] = str(socket_path)
+            return "ocr-process"
+
+        monkeypatch.setattr("kioku.cli.uvicorn.run", fake_run)
+        monkeypatch.setattr("kioku.services.ocr_service.start_process", fake_start)
+        monkeypatch.setattr(
+            "kioku.services.ocr_service.stop_process",
+            lambda process: calls.setdefault("ocr_stopped", process),
+        )
+        # serve() exports OCR_SOCKET for its workers; restore it afterwards
+        for name in ("OCR_SOCKET", "WORKERS", "OCR_MODE"):
+            monkeypatch.setenv(name, "")
+            monkeypatch.delenv(name)
+        return calls
+
+    def test_single_worker_runs_ocr_inline(self, launched):
+        """Test that the default layout is one process with the model in it."""
+        main(["serve"])
+
+        assert launched["uvicorn"]["workers"] == 1
+        assert "ocr_started" not in launched
+        assert launched["ocr_socket_env"] is None
+
+    def test_workers_share_one_ocr_process(self, launched, tmp_path):
+        """Test that several workers get one shared OCR process via OCR_SOCKET."""
+        socket_path = str(tmp_path / "ocr.sock")
+
+        main(["serve", "--workers", "4", "--ocr-socket", socket_path])
+
+        assert launched["uvicorn"]["workers"] == 4
+        assert launched["ocr_started"] == socket_path
+        assert launched["ocr_socket_env"] == socket_path
+        assert launched["ocr_stopped"] == "ocr-process"
+
+    def test_layout_from_environment(self, launched, monkeypatch):
+        """Test that WORKERS and OCR_MODE configure the default entry point."""
+        monkeypatch.setenv("WORKERS", "3")
+        monkeypatch.setenv("OCR_MODE", "inline")
+
+        main([])
+
+        assert launched["uvicorn"]["workers"] == 3
+        assert "ocr_started" not in launched
+
+    def test_invalid_ocr_mode(self, launched, monkeypatch, capsys):
+        """Test that a bad OCR_MODE is a clean CLI error."""
+        monkeypatch.setenv("OCR_MODE", "gpu")
+
+        with pytest.raises(SystemExit):
+            main([])
+
+        assert "Unknown OCR mode" in capsys.readouterr().err
+
+
+class TestExportCommand:
+    """Tests for `kioku export`."""
+
+    def test_export_without_audio(self, sample_cards, tmp_path, capsys):
+        """Test exporting a text-only package."""
+        cards_path = tmp_path / "cards.json"
+        cards_path.write_text(json.dumps([c.model_dump() for c in sample_cards]), encoding="utf-8")
+        out = tmp_path / "out.apkg"
+
+        main(["export", str(cards_path), "-o", str(out), "--no-audio", "--deck", "Mining"])
+
+        assert "Wrote 2 note(s)" in capsys.readouterr().out
+        with zipfile.ZipFile(out) as package:
+            assert "collection.anki2" in package.namelist()
+
+    def test_export_with_audio(self, sample_cards, tmp_path, mock_voicevox):
+        """Test exporting with VOICEVOX audio for every card."""
+        cards_path = tmp_path / "cards.json"
+        cards_path.write_text(json.dumps([c.model_dump() for c in sample_cards]), encoding="utf-8")
+        out = tmp_path / "out.apkg"
+
+        main(["export", str(cards_path), "-o", str(out)])
+
+        with zipfile.ZipFile(out) as package:
+            assert len(json.loads(package.read("media"))) == 4
+
+    def test_export_with_media_clips(self, sample_cards, tmp_path, mock_voicevox, monkeypatch, capsys):
+        """Test that --media clips timed sentences instead of synthesizing them."""
+        monkeypatch.setattr(
+            "kioku.services.audio_clipper.FFMPEG",
+            [sys.executable, "-c", "import sys; sys.stdout.write('clip')"],
+        )
+        cards = [{**c.model_dump(), "cue_start": 1.0, "cue_end": 2.0} for c in sample_cards]
+        cards_path = tmp_path / "cards.json"
+        cards_path.write_text(json.dumps(cards), encoding="utf-8")
+        media = tmp_path / "ep01.mkv"
+        media.write_bytes(b"video")
+
+        main(["export", str(cards_path), "-o", str(tmp_path / "out.apkg"), "--media", str(media)])
+
+        assert "2 sentence clip(s)" in capsys.readouterr().out
+
+
+class TestSubtitlesCommand:
+    """Tests for `kioku subtitles`."""
+
+    def test_writes_cards_for_export(self, tmp_path, monkeypatch, sample_cards, capsys):
+        """Test that the streamed output file loads back as cards."""
+        subs = tmp_path / "ep01.srt"
+        subs.write_text("1\n00:00:01,000 --> 00:00:02,500\nこんにちは\n", encoding="utf-8")
+        monkeypatch.setattr("kioku.ingest.enrich_text", lambda text: sample_cards)
+        out = tmp_path / "cards.json"
+
+        main(["subtitles", str(subs), "-o", str(out)])
+
+        cards = load_cards(str(out))
+        assert [card.japanese for card in cards] == [card.japanese for card in sample_cards]
+        assert "Wrote 2 card(s)" in capsys.readouterr().out
+
+
+class TestPagesCommand:
+    """Tests for `kioku pages`."""
+
+    def test_volume_to_cards(self, tmp_path, monkeypatch, sample_cards, capsys):
+        """Test that an archive becomes a cards file and the finished journal is removed."""
+        volume = tmp_path / "vol01.cbz"
+        with zipfile.ZipFile(volume, "w") as archive:
+            archive.writestr("page1.png", b"image")
+        monkeypatch.setattr("kioku.ingest.ocr_image", lambda data: "こんにちは")
+        monkeypatch.setattr("kioku.ingest.enrich_text", lambda text: sample_cards)
+        out = tmp_path / "cards.json"
+
+        main(["pages", str(volume), "-o", str(out)])
+
+        assert [card.japanese for card in load_cards(str(out))] == [
+            card.japanese for card in sample_cards
+        ]
+        assert "from 1 page(s)" in capsys.readouterr().out
+        assert not (tmp_path / "cards.json.journal").exists()
+
+    def test_rejects_other_files(self, tmp_path, capsys):
+        """Test that a file that is not a volume is reported, not raised."""
+        notes = tmp_path / "notes.txt"
+        notes.write_text("hello")
+
+        with pytest.raises(SystemExit):
+            main(["pages", str(notes), "-o", str(tmp_path / "cards.json")])
+
+        assert "Not a page archive" in capsys.readouterr().err
+        assert not (tmp_path / "cards.json.journal").exists()
+
+
+class TestBatchCommand:
+    """Tests for `kioku batch`."""
+
+    def test_text_batch_reports_throughput(self, tmp_path, monkeypatch, sample_cards, capsys):
+        """Test that a finished run prints per-stage stats and removes its journal."""
+        lines = tmp_path / "lines.txt"
+        lines.write_text("こんにちは\n元気です。\n", encoding="utf-8")
+        monkeypatch.setattr("kioku.ingest.enrich_text", lambda text: sample_cards)
+        journal = tmp_path / "run.journal"
+        out = tmp_path / "out.apkg"
+
+        main(
+            [
+                "batch", "text", str(lines), "--apkg", str(out), "--no-audio",
+                "--journal", str(journal), "--enrich-workers", "1",
+            ]
+        )
+
+        output = capsys.readouterr().out
+        assert "enrich" in output and "per s" in output
+        assert "apkg: 2 notes" in output
+        assert out.exists() and not journal.exists()
+
+    def test_missing_source(self, tmp_path, capsys):
+        """Test that a missing source is reported, not raised."""
+        with pytest.raises(SystemExit):
+            main(["batch", "images", str(tmp_path / "missing")])
+
+        assert "Not found" in capsys.readouterr().err
+
+
+class TestVocabCommand:
+    """Tests for `kioku vocab`."""
+
+    def test_sync_prints_counts(self, mock_anki_connect, capsys):
+        """Test that the command syncs the index and reports what changed."""
+        mock_anki_connect["findNotes"] = [1]
+        mock_anki_connect["notesInfo"] = lambda params: [
+            {"noteId": 1, "mod": 1, "fields": {"Japanese": {"value": "元気"}}}
+        ]
+
+        main(["vocab"])
+
+        assert "1 known word(s): 1 added" in capsys.readouterr().out
+
+    def test_anki_closed(self, anki_unreachable, capsys):
+        """Test that an unreachable Anki is reported, not raised."""
+        with pytest.raises(SystemExit):
+            main(["vocab"])
+
+        assert "kioku:" in capsys.readouterr().err
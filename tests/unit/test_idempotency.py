@@ -0,0 +1,215 @@
+"""Unit tests for idempotency keys."""
+
+import asyncio
+import io
+import time
+
+import pytest
+
+from kioku import idempotency
+from kioku.idempotency import IdempotencyStore, audio_digest, scoped_key
+from kioku.models import GenerateRequest
+
+
+class TestScopedKey:
+    """Tests for scoped_key."""
+
+    def test_scoped_to_deck_and_cards(self, sample_cards):
+        """Test that the same client key maps apart for other decks or cards."""
+        req = GenerateRequest(cards=sample_cards, deck_name="A")
+
+        assert scoped_key("k", req) == scoped_key("k", GenerateRequest(cards=sample_cards, deck_name="A"))
+        assert scoped_key("k", req) != scoped_key("k", GenerateRequest(cards=sample_cards, deck_name="B"))
+        assert scoped_key("k", req) != scoped_key("k", GenerateRequest(cards=sample_cards[:1], deck_name="A"))
+        assert scoped_key("k", req) != scoped_key("other", req)
+
+    def test_scoped_to_sentence_audio(self, sample_cards):
+        """Test that another recording with the same cards gets its own key."""
+        req = GenerateRequest(cards=sample_cards)
+        upload = io.BytesIO(b"webm-bytes")
+
+        assert scoped_key("k", req, audio_digest(upload)) != scoped_key("k", req)
+        assert upload.read() == b"webm-bytes"
+        assert scoped_key("k", req.model_copy(update={"sentence_audio_b64": "YQ=="})) != (
+            scoped_key("k", req.model_copy(update={"sentence_audio_b64": "Yg=="}))
+        )
+
+    def test_rejects_empty_and_long_keys(self, sample_cards):
+        """Test that unusable keys are refused."""
+        req = GenerateRequest(cards=sample_cards)
+
+        with pytest.raises(ValueError):
+            scoped_key("", req)
+        with pytest.raises(ValueError):
+            scoped_key("x" * 256, req)
+
+
+class TestIdempotencyStore:
+    """Tests for IdempotencyStore."""
+
+    @pytest.mark.asyncio
+    async def test_duplicates_attach_then_replay(self):
+        """Test that concurrent duplicates share one run and later ones replay it."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"added": 1}
+
+        first, second = await asyncio.gather(store.run("k", compute), store.run("k", compute))
+        third = await store.run("k", compute)
+
+        assert calls == [1]
+        assert first == ({"added": 1}, False)
+        assert second == ({"added": 1}, True)
+        assert third == ({"added": 1}, True)
+
+    @pytest.mark.asyncio
+    async def test_execution_survives_cancelled_caller(self):
+        """Test that a retry attaches to a run whose original caller went away."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"added": 2}
+
+        original = asyncio.create_task(store.run("k", compute))
+        await asyncio.sleep(0.01)
+        original.cancel()
+
+        assert await store.run("k", compute) == ({"added": 2}, True)
+        assert calls == [1]
+
+    @pytest.mark.asyncio
+    async def test_cancel_while_claiming_starts_the_execution(self, monkeypatch):
+        """Test that a caller cancelled mid-claim does not leave a claim nobody runs."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+        claim = store._claim
+        monkeypatch.setattr(store, "_claim", lambda key: time.sleep(0.05) or claim(key))
+
+        original = asyncio.create_task(store.run("k", lambda: asyncio.sleep(0, {"added": 1})))
+        await asyncio.sleep(0.01)
+        original.cancel()
+        await asyncio.gather(original, return_exceptions=True)
+
+        assert await asyncio.wait_for(store.run("k", None), timeout=1) == ({"added": 1}, True)
+
+    @pytest.mark.asyncio
+    async def test_cancel_stops_the_execution(self):
+        """Test that cancel stops a running execution whose waiter went away."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+        stopped = []
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.append(1)
+                raise
+            return {"added": 1}
+
+        alone = asyncio.create_task(store.run("alone", compute))
+        await started.wait()
+        alone.cancel()
+        await asyncio.gather(alone, return_exceptions=True)
+        store.cancel("alone")
+        await asyncio.sleep(0)
+
+        assert stopped == [1]
+        assert store.waiters("alone") == 0
+
+    @pytest.mark.asyncio
+    async def test_waiters_count_attached_requests(self):
+        """Test that a cancelled waiter leaves the execution to the request still waiting."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+
+        async def compute():
+            await asyncio.sleep(0.2)
+            return {"added": 1}
+
+        async def both_attached():
+            while store.waiters("k") < 2:
+                await asyncio.sleep(0.005)
+
+        first = asyncio.create_task(store.run("k", compute))
+        second = asyncio.create_task(store.run("k", compute))
+        await asyncio.wait_for(both_attached(), timeout=5)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+
+        assert store.waiters("k") == 1
+        assert await second == ({"added": 1}, True)
+
+    @pytest.mark.asyncio
+    async def test_shared_between_workers(self, tmp_path, monkeypatch):
+        """Test that a duplicate reaching another worker waits for the first one's result."""
+        monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_INTERVAL", 0.01)
+        path = tmp_path / "keys.sqlite3"
+        first = IdempotencyStore(max_keys=10, ttl=60, path=path)
+        second = IdempotencyStore(max_keys=10, ttl=60, path=path)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"added": 1}
+
+        results = await asyncio.gather(first.run("k", compute), second.run("k", compute))
+
+        assert calls == [1]
+        assert sorted(replayed for _, replayed in results) == [False, True]
+        assert await second.run("k", compute) == ({"added": 1}, True)
+
+    @pytest.mark.asyncio
+    async def test_stale_claim_runs_again(self, monkeypatch):
+        """Test that a key claimed by a worker that went away is run by the next request."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+        assert store._claim("k") == ("claimed", None)
+        monkeypatch.setattr(idempotency, "RUNNING_STALE_AFTER", 0)
+
+        assert await store.run("k", lambda: asyncio.sleep(0, {"added": 1})) == ({"added": 1}, False)
+
+    @pytest.mark.asyncio
+    async def test_failures_are_not_stored(self):
+        """Test that a failed run is retried by the next request."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+
+        async def fail():
+            raise RuntimeError("VOICEVOX down")
+
+        async def succeed():
+            return {"added": 1}
+
+        with pytest.raises(RuntimeError):
+            await store.run("k", fail)
+
+        assert await store.run("k", succeed) == ({"added": 1}, False)
+
+    @pytest.mark.asyncio
+    async def test_bounded_and_expiring(self):
+        """Test that the oldest results are dropped past max_keys and after the TTL."""
+        store = IdempotencyStore(max_keys=2, ttl=60)
+        for key in ("a", "b", "c"):
+            await store.run(key, lambda key=key: asyncio.sleep(0, {"key": key}))
+
+        assert len(store) == 2
+        assert (await store.run("a", lambda: asyncio.sleep(0, {"key": "new"})))[1] is False
+
+        store.ttl = 0
+        await store.run("d", lambda: asyncio.sleep(0, {}))
+        assert (await store.run("d", lambda: asyncio.sleep(0, {"again": True})))[1] is False
+
+    @pytest.mark.asyncio
+    async def test_replays_are_copies(self):
+        """Test that a caller mutating its result does not change later replays."""
+        store = IdempotencyStore(max_keys=10, ttl=60)
+        result, _ = await store.run("k", lambda: asyncio.sleep(0, {"skipped": []}))
+        result["skipped"].append("x")
+
+        assert (await store.run("k", lambda: asyncio.sleep(0, {})))[0] == {"skipped": []}
@@ -5,8 +5,27 @@ from unittest.mock import Mock
 
 import pytest
 
+from kioku import metrics
 from kioku.models import CardItem
-from kioku.services.image_processor import _strip_code_fences, enrich_text, extract_cards
+from kioku.services.card_parser import strip_code_fences as _strip_code_fences
+from kioku.services.image_processor import enrich_text, extract_cards
+from kioku.services.vocab_index import vocab_index
+
+
+def _know(monkeypatch, *words):
+    """Sync the known-vocabulary index from a fake collection holding ``words``."""
+    notes = {note_id: word for note_id, word in enumerate(words, 1)}
+
+    def fake_anki(action, **params):
+        if action == "findNotes":
+            return list(notes)
+        return [
+            {"noteId": note_id, "mod": 1, "fields": {"Japanese": {"value": notes[note_id]}}}
+            for note_id in params["notes"]
+        ]
+
+    monkeypatch.setattr("kioku.services.vocab_index._anki_request", fake_anki)
+    vocab_index.sync()
 
 
 class TestStripCodeFences:
@@ -51,6 +70,16 @@ class TestEnrichText:
         assert cards[0].reading == "こんにちは"
         assert cards[0].meaning == "Hello"
 
+    def test_enrich_text_skips_known_words(self, mock_groq_client, monkeypatch):
+        """Test that known words are named in the prompt and their word cards dropped."""
+        _know(monkeypatch, "こんにちは", "猫")
+
+        cards = enrich_text("こんにちは")
+
+        prompt = mock_groq_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        assert "do NOT create word entries for them: こんにちは\n" in prompt
+        assert cards == []
+
     def test_enrich_text_empty_text(self):
         """Test enrichment with empty text raises error."""
         with pytest.raises(RuntimeError, match="No text provided"):
@@ -75,7 +104,7 @@ class TestEnrichText:
         mock_client = Mock()
         mock_client.chat.completions.create.return_value = mock_response
         mock_groq_class = Mock(return_value=mock_client)
-        monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+        monkeypatch.setattr("groq.Groq", mock_groq_class)
 
         with pytest.raises(RuntimeError, match="invalid JSON"):
             enrich_text("こんにちは")
@@ -88,7 +117,7 @@ class TestEnrichText:
         mock_client = Mock()
         mock_client.chat.completions.create.return_value = mock_response
         mock_groq_class = Mock(return_value=mock_client)
-        monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+        monkeypatch.setattr("groq.Groq", mock_groq_class)
 
         with pytest.raises(RuntimeError, match="non-list JSON"):
             enrich_text("こんにちは")
@@ -124,7 +153,7 @@ class TestEnrichText:
         mock_client = Mock()
         mock_client.chat.completions.create.return_value = mock_response
         mock_groq_class = Mock(return_value=mock_client)
-        monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+        monkeypatch.setattr("groq.Groq", mock_groq_class)
 
         cards = enrich_text("こんにちは")
         assert len(cards) == 1
@@ -153,7 +182,7 @@ class TestEnrichText:
         mock_client = Mock()
         mock_client.chat.completions.create.return_value = mock_response
         mock_groq_class = Mock(return_value=mock_client)
-        monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+        monkeypatch.setattr("groq.Groq", mock_groq_class)
 
         with pytest.raises(RuntimeError, match="No valid cards extracted"):
             enrich_text("test")
@@ -172,7 +201,7 @@ class TestEnrichText:
         mock_client = Mock()
         mock_client.chat.completions.create.return_value = mock_response
         mock_groq_class = Mock(return_value=mock_client)
-        monkeypatch.setattr("kioku.services.image_processor.Groq", mock_groq_class)
+        monkeypatch.setattr("groq.Groq", mock_groq_class)
 
         cards = enrich_text("こんにちは")
         assert len(cards) == 1
@@ -190,6 +219,15 @@ class TestExtractCards:
         assert all(isinstance(card, CardItem) for card in cards)
         mock_manga_ocr.assert_called_once()
 
+    def test_extract_cards_labels_ocr_mode(self, sample_image_bytes, mock_manga_ocr, mock_groq_client):
+        """Test that OCR in this worker is timed under the same labels as shared OCR."""
+        extract_cards(sample_image_bytes, "image/png")
+
+        assert metrics.histogram_count("kioku_stage_duration_seconds", stage="ocr") == 0
+        assert (
+            metrics.histogram_count("kioku_stage_duration_seconds", stage="ocr", mode="inline") == 1
+        )
+
     def test_extract_cards_empty_ocr_result(self, sample_image_bytes, mock_manga_ocr):
         """Test extraction with empty OCR result raises error."""
         mock_manga_ocr.return_value = ""
@@ -0,0 +1,37 @@
+"""Unit tests for the import-time profile report."""
+
+from kioku.importtime import by_package, format_report, heavy_imports, parse
+
+SAMPLE = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   groq._types
+import time:       300 |        420 | groq
+import time:       200 |        200 |     fastapi.params
+import time:       100 |        300 |   fastapi
+import time:        50 |        770 | kioku.main
+"""
+
+
+class TestImportTime:
+    """Tests for parsing and summarising -X importtime output."""
+
+    def test_parse_skips_header(self):
+        """Test that each module line becomes a record."""
+        records = parse(SAMPLE)
+
+        assert [r.module for r in records] == [
+            "groq._types", "groq", "fastapi.params", "fastapi", "kioku.main"
+        ]
+        assert records[-1].cumulative_us == 770
+
+    def test_group_by_package(self):
+        """Test that self times are summed per top-level package."""
+        assert by_package(parse(SAMPLE)) == [("groq", 420, 2), ("fastapi", 300, 2), ("kioku", 50, 1)]
+
+    def test_heavy_modules_reported(self):
+        """Test that eagerly imported heavy dependencies are named."""
+        records = parse(SAMPLE)
+
+        assert heavy_imports(records) == ["groq"]
+        assert "heavy modules imported: groq" in format_report("kioku.main", records)
+        assert format_report("kioku.main", records).startswith("import kioku.main: 1 ms")
@@ -0,0 +1,307 @@
+"""Unit tests for bulk subtitle ingestion."""
+
+import threading
+import time
+import tracemalloc
+import zipfile
+
+import pytest
+
+from kioku.ingest import (
+    IngestHistory,
+    batch_lines,
+    estimate_tokens,
+    ingest_lines,
+    ingest_pages,
+    ingest_subtitles,
+)
+from kioku.journal import Journal
+from kioku.models import CardItem
+from kioku.services.image_processor import GroqAuthenticationError, NoTextError
+from kioku.services.subtitle_parser import Cue
+
+
+def _srt(lines: list[str]) -> str:
+    blocks = []
+    for i, text in enumerate(lines):
+        start, end = 2 * i, 2 * i + 1
+        blocks.append(f"{i + 1}\n00:00:{start:02d},000 --> 00:00:{end:02d},000\n{text}\n")
+    return "\n".join(blocks)
+
+
+def _long_srt(count: int) -> str:
+    blocks = []
+    for i in range(count):
+        start = i * 3
+        stamp = f"{start // 3600:02d}:{start // 60 % 60:02d}:{start % 60:02d},000"
+        end = f"{start // 3600:02d}:{start // 60 % 60:02d}:{start % 60:02d},900"
+        blocks.append(f"{i + 1}\n{stamp} --> {end}\n台詞番号{i}です\n")
+    return "\n".join(blocks)
+
+
+def _volume(path, texts: list[str]):
+    """A CBZ whose page "images" are their own text, for a fake OCR to read back."""
+    with zipfile.ZipFile(path, "w") as archive:
+        for i, text in enumerate(texts):
+            archive.writestr(f"page{i + 1}.png", text.encode("utf-8"))
+    return path
+
+
+@pytest.fixture
+def ocr_calls(monkeypatch):
+    """Fake ocr_image: the page bytes are the text; an empty page has none."""
+    calls = []
+
+    def fake_ocr(data):
+        calls.append(data.decode("utf-8"))
+        if not data:
+            raise NoTextError("Manga OCR returned no text.")
+        return data.decode("utf-8")
+
+    monkeypatch.setattr("kioku.ingest.ocr_image", fake_ocr)
+    return calls
+
+
+@pytest.fixture
+def enriched(monkeypatch):
+    """Fake enrich_text: one sentence card per line, recording each call's text."""
+    calls = []
+
+    def fake_enrich(text):
+        calls.append(text)
+        return [
+            CardItem(
+                japanese=line,
+                reading="よみ",
+                meaning="meaning",
+                example_sentence=line,
+                example_translation="translation",
+            )
+            for line in text.splitlines()
+        ]
+
+    monkeypatch.setattr("kioku.ingest.enrich_text", fake_enrich)
+    return calls
+
+
+class TestBatching:
+    """Tests for token estimates and batches."""
+
+    def test_estimate_tokens(self):
+        """Test that Japanese counts per character and Latin text per four."""
+        assert estimate_tokens("日本語") == 4
+        assert estimate_tokens("abcdefgh") == 3
+
+    def test_batches_fit_budget(self):
+        """Test that batches stay within the budget and an oversized line goes alone."""
+        cues = [Cue(0, 1, "あ" * 9), Cue(1, 2, "い" * 9), Cue(2, 3, "う" * 50), Cue(3, 4, "え")]
+
+        batches = [[cue.text[0] for cue in batch] for batch in batch_lines(cues, 20)]
+
+        assert batches == [["あ", "い"], ["う"], ["え"]]
+
+
+class TestIngestSubtitles:
+    """Tests for ingest_subtitles."""
+
+    def test_cards_carry_cue_times(self, tmp_path, enriched):
+        """Test that cards get their cue's start and end and repeats are dropped."""
+        path = tmp_path / "ep01.srt"
+        path.write_text(_srt(["おはよう", "元気？", "おはよう！"]), encoding="utf-8")
+
+        result = ingest_subtitles(path)
+
+        assert [(c["japanese"], c["cue_start"], c["cue_end"]) for c in result["cards"]] == [
+            ("おはよう", 0.0, 1.0),
+            ("元気？", 2.0, 3.0),
+        ]
+        assert (result["cues"], result["lines"], result["repeated"]) == (3, 2, 1)
+
+    def test_history_skips_earlier_lines(self, tmp_path, enriched):
+        """Test that a second file only sends lines no earlier ingest enriched."""
+        history = IngestHistory(tmp_path / "history.sqlite3")
+        first = tmp_path / "ep01.srt"
+        first.write_text(_srt(["おはよう", "元気？"]), encoding="utf-8")
+        second = tmp_path / "ep02.srt"
+        second.write_text(_srt(["おはよう", "またね"]), encoding="utf-8")
+
+        ingest_subtitles(first, history=history)
+        result = ingest_subtitles(second, history=history)
+
+        assert [c["japanese"] for c in result["cards"]] == ["またね"]
+        assert result["known"] == 1
+        assert enriched[-1] == "またね"
+        assert ingest_subtitles(second, history=None)["known"] == 0
+
+    def test_failed_batch_is_retried_next_time(self, tmp_path, monkeypatch):
+        """Test that lines of a failed batch are counted and not recorded as ingested."""
+        history = IngestHistory(tmp_path / "history.sqlite3")
+        path = tmp_path / "ep01.srt"
+        path.write_text(_srt(["おはよう"]), encoding="utf-8")
+
+        def fail(text):
+            raise RuntimeError("No valid cards extracted.")
+
+        monkeypatch.setattr("kioku.ingest.enrich_text", fail)
+        assert ingest_subtitles(path, history=history)["failed"] == 1
+        assert history.known([]) == set()
+        assert ingest_subtitles(path, history=history)["known"] == 0
+
+    def test_bad_key_stops_the_run(self, tmp_path, monkeypatch):
+        """Test that an authentication failure is raised rather than counted."""
+        path = tmp_path / "ep01.srt"
+        path.write_text(_srt(["おはよう"]), encoding="utf-8")
+
+        def reject(text):
+            raise GroqAuthenticationError("invalid key")
+
+        monkeypatch.setattr("kioku.ingest.enrich_text", reject)
+        with pytest.raises(GroqAuthenticationError):
+            ingest_subtitles(path)
+
+    def test_progress_and_stop(self, tmp_path, enriched):
+        """Test that progress reaches the end of the file and stop abandons the run."""
+        path = tmp_path / "ep01.srt"
+        path.write_text(_long_srt(50), encoding="utf-8")
+        events = []
+
+        ingest_subtitles(path, progress=lambda *event: events.append(event), max_tokens=40)
+
+        size = path.stat().st_size
+        assert ("parse", size, size) in events
+        assert events[-1][0] == "enrich" and events[-1][1] == events[-1][2]
+
+        stop = threading.Event()
+        stop.set()
+        assert ingest_subtitles(path, history=None, stop=stop)["batches"] == 0
+
+    def test_large_file_in_bounded_memory(self, tmp_path, enriched):
+        """Test that a 5,000-cue file streamed to on_cards keeps peak memory small."""
+        path = tmp_path / "long.srt"
+        path.write_text(_long_srt(5000), encoding="utf-8")
+        received = 0
+
+        def count(cards):
+            nonlocal received
+            received += len(cards)
+
+        tracemalloc.start()
+        try:
+            result = ingest_subtitles(path, on_cards=count, history=None, max_tokens=200)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert received == result["cards"] == 5000
+        # Far below the file's cues and cards held at once
+        assert peak < 3 * 1024 * 1024
+
+
+class TestIngestPages:
+    """Tests for ingest_pages."""
+
+    def test_pages_become_cards(self, tmp_path, ocr_calls, enriched):
+        """Test that every page with text is OCR'd, enriched and reported."""
+        path = _volume(tmp_path / "vol01.cbz", ["一ページ", "", "三ページ", "一ページ"])
+        events = []
+
+        result = ingest_pages(path, progress=lambda *event: events.append(event))
+
+        assert [card["japanese"] for card in result["cards"]] == ["一ページ", "三ページ"]
+        assert (result["pages"], result["read"], result["blank"]) == (4, 4, 1)
+        assert [event for event in events if event[0] == "ocr"][-1] == ("ocr", 4, 4)
+
+    def test_resume_skips_finished_pages(self, tmp_path, ocr_calls, enriched):
+        """Test that a run resumed from its journal only redoes unfinished pages."""
+        texts = [f"{i}ページです" for i in range(12)]
+        path = _volume(tmp_path / "vol01.cbz", texts)
+        stop = threading.Event()
+
+        def interrupt(stage, done, total):
+            if stage == "enrich" and done == 3:
+                stop.set()
+
+        with Journal(tmp_path / "vol01.journal") as journal:
+            first = ingest_pages(
+                path, interrupt, journal, max_tokens=1, concurrency=1, stop=stop
+            )
+            recorded = journal.count("ocr")
+            read_before = len(ocr_calls)
+            second = ingest_pages(path, journal=journal, max_tokens=1)
+
+        assert len(first["cards"]) == 3
+        assert [card["japanese"] for card in second["cards"]] == texts
+        assert 3 <= recorded < 12
+        assert second["resumed"] == recorded
+        assert len(ocr_calls) - read_before == 12 - recorded
+        # The three enriched pages were not sent to Groq again
+        assert len(enriched) == 12
+
+    def test_failed_page_is_retried(self, tmp_path, monkeypatch, enriched):
+        """Test that a page OCR failed on is counted and read again by the next run."""
+        path = _volume(tmp_path / "vol01.cbz", ["一ページ", "二ページ"])
+        calls = []
+
+        def flaky_ocr(data):
+            calls.append(data.decode("utf-8"))
+            if len(calls) == 2:
+                raise RuntimeError("OCR process is unavailable")
+            return data.decode("utf-8")
+
+        monkeypatch.setattr("kioku.ingest.ocr_image", flaky_ocr)
+        with Journal(tmp_path / "vol01.journal") as journal:
+            first = ingest_pages(path, journal=journal, ocr_workers=1)
+            second = ingest_pages(path, journal=journal)
+
+        assert first["failed"] == 1
+        assert calls == ["一ページ", "二ページ", "二ページ"]
+        assert [card["japanese"] for card in second["cards"]] == ["一ページ", "二ページ"]
+
+    def test_prefetch_bounds_pages_read_ahead(self, tmp_path, monkeypatch, enriched):
+        """Test that no more than `prefetch` pages are read ahead of the OCR."""
+        path = _volume(tmp_path / "vol01.cbz", [f"{i}ページ" for i in range(20)])
+        read = 0
+        recognised = 0
+        ahead = []
+        original = zipfile.ZipFile.read
+
+        def counting_read(self, name, pwd=None):
+            nonlocal read
+            read += 1
+            return original(self, name, pwd)
+
+        def slow_ocr(data):
+            nonlocal recognised
+            ahead.append(read - recognised)
+            time.sleep(0.002)
+            recognised += 1
+            return data.decode("utf-8")
+
+        monkeypatch.setattr(zipfile.ZipFile, "read", counting_read)
+        monkeypatch.setattr("kioku.ingest.ocr_image", slow_ocr)
+
+        result = ingest_pages(path, ocr_workers=2, prefetch=3)
+
+        assert result["read"] == 20
+        assert max(ahead) <= 3
+
+
+class TestIngestLines:
+    """Tests for ingest_lines."""
+
+    def test_lines_resume_from_journal(self, tmp_path, enriched):
+        """Test that repeats are dropped and a resumed run sends only new lines."""
+        path = tmp_path / "lines.txt"
+        path.write_text("おはよう\n\n元気？\nおはよう！\n", encoding="utf-8")
+
+        with Journal(tmp_path / "lines.journal") as journal:
+            first = ingest_lines(path, journal=journal)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("またね\n")
+            second = ingest_lines(path, journal=journal)
+
+        assert [card["japanese"] for card in first["cards"]] == ["おはよう", "元気？"]
+        assert (first["lines"], first["repeated"]) == (2, 1)
+        assert second["resumed"] == 2
+        assert enriched[-1] == "またね"
+        assert [card["japanese"] for card in second["cards"]] == ["おはよう", "元気？", "またね"]
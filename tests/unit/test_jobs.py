@@ -0,0 +1,345 @@
+"""Unit tests for the background job manager."""
+
+import asyncio
+import time
+
+import pytest
+
+from kioku import admission, jobs
+from kioku.jobs import JobManager, JobStore
+from kioku.serving import PrimaryLock
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Job store backed by a temporary SQLite file."""
+    return JobStore(tmp_path / "jobs.sqlite3")
+
+
+async def _wait_for_status(manager, job_id, statuses, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job stayed {manager.get(job_id)['status']}")
+
+
+class TestJobManager:
+    """Tests for JobManager."""
+
+    @pytest.mark.asyncio
+    async def test_job_runs_and_records_progress(self, store):
+        """Test that a job runs, reports stage progress and stores its result."""
+
+        async def handler(payload, progress):
+            progress("tts", 1, 2)
+            progress("tts", 2, 2)
+            return {"echo": payload["value"]}
+
+        manager = JobManager(store, workers=1)
+        manager.register("echo", handler)
+        manager.start()
+        job = await manager.submit("echo", {"value": 42})
+
+        done = await _wait_for_status(manager, job["id"], {"succeeded"})
+        await manager.stop()
+
+        assert done["result"] == {"echo": 42}
+        assert done["stage"] == "tts"
+        assert done["progress"] == {"tts": {"done": 2, "total": 2}}
+
+    @pytest.mark.asyncio
+    async def test_failed_job_records_error(self, store):
+        """Test that an exception marks the job failed."""
+
+        async def handler(payload, progress):
+            raise RuntimeError("VOICEVOX request failed")
+
+        manager = JobManager(store, workers=1)
+        manager.register("boom", handler)
+        manager.start()
+        job = await manager.submit("boom", {})
+
+        done = await _wait_for_status(manager, job["id"], {"failed"})
+        await manager.stop()
+
+        assert "VOICEVOX" in done["error"]
+
+    @pytest.mark.asyncio
+    async def test_cancel_running_job(self, store):
+        """Test that cancelling a running job stops it."""
+        started = asyncio.Event()
+
+        async def handler(payload, progress):
+            started.set()
+            await asyncio.sleep(10)
+            return {}
+
+        manager = JobManager(store, workers=1)
+        manager.register("slow", handler)
+        manager.start()
+        job = await manager.submit("slow", {})
+        await asyncio.wait_for(started.wait(), 1)
+
+        await manager.cancel(job["id"])
+        done = await _wait_for_status(manager, job["id"], {"cancelled"})
+        await manager.stop()
+
+        assert done["status"] == "cancelled"
+
+    @pytest.mark.asyncio
+    async def test_cancel_after_anki_stage_started_is_refused(self, store):
+        """Test that a job already writing to Anki is not reported cancelled."""
+        writing = asyncio.Event()
+        release = asyncio.Event()
+
+        async def handler(payload, progress):
+            progress("tts", 1, 1)
+            progress("anki", 0, 1)
+            writing.set()
+            await release.wait()
+            return {"added": 1}
+
+        manager = JobManager(store, workers=1)
+        manager.register("write", handler)
+        manager.start()
+        job = await manager.submit("write", {})
+        await asyncio.wait_for(writing.wait(), 1)
+
+        assert (await manager.cancel(job["id"]))["status"] == "running"
+        release.set()
+        done = await _wait_for_status(manager, job["id"], {"succeeded", "cancelled"})
+        await manager.stop()
+
+        assert done["status"] == "succeeded"
+        assert done["result"] == {"added": 1}
+
+    @pytest.mark.asyncio
+    async def test_cancel_deletes_kept_files_but_shutdown_keeps_them(self, store):
+        """Test that a user cancel runs the kind's cleanup and a shutdown does not."""
+        started = asyncio.Event()
+        removed = []
+
+        async def handler(payload, progress):
+            started.set()
+            await asyncio.sleep(10)
+            return {}
+
+        manager = JobManager(store, workers=1)
+        manager.register("slow", handler, cleanup=lambda payload: removed.append(payload["path"]))
+        manager.start()
+        cancelled = await manager.submit("slow", {"path": "cancelled"})
+        await asyncio.wait_for(started.wait(), 1)
+        await manager.cancel(cancelled["id"])
+        await _wait_for_status(manager, cancelled["id"], {"cancelled"})
+        started.clear()
+        interrupted = await manager.submit("slow", {"path": "interrupted"})
+        await asyncio.wait_for(started.wait(), 1)
+        await manager.stop()
+
+        assert removed == ["cancelled"]
+        assert store.get(interrupted["id"])["status"] == "queued"
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_job_deletes_its_audio(self, store, tmp_path):
+        """Test that cancelling a generate job before it runs deletes its uploaded audio."""
+        audio = tmp_path / "sentence.webm"
+        audio.write_bytes(b"webm")
+        manager = JobManager(store)
+        job = await manager.submit("generate", {"cards": [], "sentence_audio_path": str(audio)})
+
+        assert (await manager.cancel(job["id"]))["status"] == "cancelled"
+        assert not audio.exists()
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_job(self, store):
+        """Test that a queued job can be cancelled before it starts."""
+        manager = JobManager(store)
+        job = await manager.submit("generate", {"cards": []})
+
+        assert (await manager.cancel(job["id"]))["status"] == "cancelled"
+
+    @pytest.mark.asyncio
+    async def test_unknown_kind_rejected(self, store):
+        """Test that submitting an unregistered kind raises."""
+        with pytest.raises(ValueError, match="Unknown job kind"):
+            await JobManager(store).submit("nope", {})
+
+    @pytest.mark.asyncio
+    async def test_unfinished_jobs_resume_after_restart(self, store):
+        """Test that jobs queued before a restart run on the next start."""
+
+        async def handler(payload, progress):
+            return {"echo": payload["value"]}
+
+        before_restart = JobManager(store)
+        before_restart.register("echo", handler)
+        await before_restart.submit("echo", {"value": 1})
+
+        manager = JobManager(store, workers=1)
+        manager.register("echo", handler)
+        [job] = store.recent()
+        manager.start()
+
+        done = await _wait_for_status(manager, job["id"], {"succeeded"})
+        await manager.stop()
+
+        assert done["result"] == {"echo": 1}
+
+    @pytest.mark.asyncio
+    async def test_events_stream_until_finished(self, store):
+        """Test that events yield updates and stop at a terminal status."""
+        release = asyncio.Event()
+
+        async def handler(payload, progress):
+            await release.wait()
+            progress("anki", 1, 1)
+            return {"added": 1}
+
+        manager = JobManager(store, workers=1)
+        manager.register("wait", handler)
+        manager.start()
+        job = await manager.submit("wait", {})
+
+        async def collect():
+            return [event["status"] async for event in manager.events(job["id"])]
+
+        collector = asyncio.create_task(collect())
+        await asyncio.sleep(0.05)
+        release.set()
+        statuses = await asyncio.wait_for(collector, 2)
+        await manager.stop()
+
+        assert statuses[-1] == "succeeded"
+        assert "running" in statuses
+
+
+class TestPriority:
+    """Tests for the priority class jobs run in."""
+
+    @pytest.mark.asyncio
+    async def test_jobs_run_as_bulk(self, store):
+        """Test that job handlers queue behind interactive requests."""
+        seen = []
+
+        async def handler(payload, progress):
+            seen.append(admission.current_priority())
+            seen.append(await asyncio.to_thread(admission.current_priority))
+            return {}
+
+        manager = JobManager(store, workers=1)
+        manager.register("probe", handler)
+        manager.start()
+        job = await manager.submit("probe", {})
+        await _wait_for_status(manager, job["id"], {"succeeded"})
+        await manager.stop()
+
+        assert seen == [admission.BULK, admission.BULK]
+
+
+class TestMultipleWorkers:
+    """Tests for sharing one job store between worker processes."""
+
+    @pytest.mark.asyncio
+    async def test_secondary_does_not_resume(self, store):
+        """Test that only the primary worker picks up unfinished jobs."""
+        job = store.create("echo", {})
+        manager = JobManager(store, workers=1)
+        manager.register("echo", lambda payload, progress: asyncio.sleep(0, {}))
+
+        manager.start(resume=False)
+        await asyncio.sleep(0.05)
+        await manager.stop()
+
+        assert store.get(job["id"])["status"] == "queued"
+
+    @pytest.mark.asyncio
+    async def test_events_follow_job_in_other_worker(self, store, monkeypatch):
+        """Test that SSE subscribers see progress made by another process."""
+        monkeypatch.setattr(jobs, "EVENTS_POLL_INTERVAL", 0.01)
+        job = store.create("echo", {})
+        observer = JobManager(store)
+
+        async def collect():
+            return [event["status"] async for event in observer.events(job["id"])]
+
+        collector = asyncio.create_task(collect())
+        await asyncio.sleep(0.05)
+        store.update(job["id"], status="running")
+        await asyncio.sleep(0.05)
+        store.update(job["id"], status="succeeded", result={"added": 1})
+
+        assert await asyncio.wait_for(collector, 2) == ["queued", "running", "succeeded"]
+
+    @pytest.mark.asyncio
+    async def test_restart_leaves_jobs_of_live_workers(self, store, monkeypatch):
+        """Test that a restarted primary requeues only running jobs whose heartbeat went stale."""
+        monkeypatch.setattr(jobs, "JOB_HEARTBEAT_INTERVAL", 0.01)
+        live = store.create("echo", {})
+        store.claim(live["id"], "live-worker")
+        abandoned = store.create("echo", {})
+        store.claim(abandoned["id"], "crashed-worker")
+        store.update(abandoned["id"], heartbeat_at=time.time() - jobs.JOB_STALE_AFTER - 1)
+        manager = JobManager(store, workers=1)
+        manager.register("echo", lambda payload, progress: asyncio.sleep(0, {}))
+
+        manager.start()
+        done = await _wait_for_status(manager, abandoned["id"], {"succeeded"})
+        await asyncio.sleep(0.05)
+        await manager.stop()
+
+        assert done["status"] == "succeeded"
+        assert store.get(live["id"])["status"] == "running"
+
+    @pytest.mark.asyncio
+    async def test_cancel_from_other_worker(self, store, monkeypatch):
+        """Test that a cancel reaching a worker not running the job stops it in its owner."""
+        monkeypatch.setattr(jobs, "EVENTS_POLL_INTERVAL", 0.01)
+        started = asyncio.Event()
+
+        async def handler(payload, progress):
+            started.set()
+            await asyncio.sleep(10)
+            return {}
+
+        owner = JobManager(store, workers=1)
+        owner.register("slow", handler)
+        owner.start()
+        job = await owner.submit("slow", {})
+        await asyncio.wait_for(started.wait(), 1)
+
+        flagged = await JobManager(store).cancel(job["id"])
+        done = await _wait_for_status(owner, job["id"], {"cancelled", "succeeded"})
+        await owner.stop()
+
+        assert (flagged["status"], flagged["cancel_requested"]) == ("running", True)
+        assert done["status"] == "cancelled"
+
+    @pytest.mark.asyncio
+    async def test_flagged_job_is_not_started(self, store):
+        """Test that a job flagged for cancel while queued is cancelled, not run."""
+        ran = []
+        job = store.create("echo", {})
+        store.request_cancel(job["id"])
+        manager = JobManager(store, workers=1)
+        manager.register("echo", lambda payload, progress: asyncio.sleep(0, ran.append(1)))
+
+        manager.start()
+        done = await _wait_for_status(manager, job["id"], {"cancelled", "succeeded"})
+        await manager.stop()
+
+        assert done["status"] == "cancelled"
+        assert ran == []
+
+    def test_primary_lock_is_exclusive(self, tmp_path):
+        """Test that one holder at a time gets the primary role."""
+        first = PrimaryLock(tmp_path / "primary.lock")
+        second = PrimaryLock(tmp_path / "primary.lock")
+
+        assert first.acquire()
+        assert not second.acquire()
+        first.release()
+        assert second.acquire()
+        second.release()
@@ -0,0 +1,31 @@
+"""Unit tests for the checkpoint journal."""
+
+from kioku.journal import Journal
+
+
+class TestJournal:
+    """Tests for recording and replaying checkpoints."""
+
+    def test_records_survive_reopening(self, tmp_path):
+        """Test that a reopened journal knows what an earlier run finished."""
+        path = tmp_path / "run.journal"
+        with Journal(path) as journal:
+            journal.record("ocr", "000002", "二ページ")
+            journal.record_many("ocr", [("000001", ""), ("000000", None)])
+
+        with Journal(path) as journal:
+            assert journal.done("ocr", "000000")
+            assert not journal.done("enrich", "000000")
+            assert journal.get("ocr", "000002") == "二ページ"
+            assert journal.get("ocr", "000009", "missing") == "missing"
+            assert [item for item, _ in journal.items("ocr")] == ["000000", "000001", "000002"]
+            assert journal.count("ocr") == 3
+
+    def test_remove_deletes_files(self, tmp_path):
+        """Test that removing a finished journal leaves nothing behind."""
+        journal = Journal(tmp_path / "run.journal")
+        journal.record("tts", "a", {"ok": True})
+
+        journal.remove()
+
+        assert list(tmp_path.iterdir()) == []
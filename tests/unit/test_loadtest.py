@@ -0,0 +1,148 @@
+"""Unit tests for the load-testing stubs and driver helpers."""
+
+import io
+import json
+import urllib.error
+import urllib.request
+import zipfile
+
+import httpx
+import pytest
+from groq import Groq
+
+from kioku.models import GenerateRequest
+from kioku.pipeline import run_generate
+from kioku.services.anki_builder import MODEL_NAME, find_new_cards
+from kioku.services.card_parser import parse_cards
+from loadtest.driver import Stats, parse_mix, percentile
+from loadtest.stubs import Latency, RateLimiter, StubBehaviour, running_stubs, server_url, stub_env
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """All three stubs, with Kioku pointed at them."""
+    with running_stubs() as servers:
+        for name, value in stub_env(servers).items():
+            monkeypatch.setenv(name, value)
+        yield servers
+
+
+class TestStubs:
+    """Tests that Kioku's real clients work against the stubs."""
+
+    def test_groq_stub_is_openai_compatible(self, stubs):
+        """Test that the Groq SDK gets a parseable card list back."""
+        client = Groq(api_key="stub", base_url=server_url(stubs["groq"]))
+
+        response = client.chat.completions.create(
+            model="stub",
+            messages=[{"role": "user", "content": "Japanese text:\n今日は天気がいい。"}],
+        )
+
+        cards = parse_cards(response.choices[0].message.content)
+        assert cards[0].japanese == "今日は天気がいい。"
+        assert response.usage.total_tokens > 0
+
+    @pytest.mark.asyncio
+    async def test_generate_against_stubs(self, stubs, sample_cards, monkeypatch):
+        """Test a full generate through the VOICEVOX and AnkiConnect stubs."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+        collection = stubs["anki"].RequestHandlerClass.collection
+
+        result = await run_generate(GenerateRequest(cards=sample_cards, deck_name="Load"))
+
+        assert result == {"added": 2, "queued": 0, "skipped": []}
+        assert MODEL_NAME in collection.models
+        assert len(collection.media) == 4
+        # The stub enforces first-field duplicates like Anki does
+        assert find_new_cards(sample_cards, "Load") == ([], sample_cards)
+
+    def test_voicevox_multi_synthesis(self, stubs):
+        """Test that multi_synthesis returns a zip with one WAV per query."""
+        queries = [{"kana": "あ"}, {"kana": "いい"}]
+        response = httpx.post(
+            f"{server_url(stubs['voicevox'])}/multi_synthesis", params={"speaker": 0}, json=queries
+        )
+
+        names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+        assert names == ["001.wav", "002.wav"]
+
+    def test_rate_limit_returns_429(self):
+        """Test that requests beyond the bucket get 429 with Retry-After."""
+        behaviours = {"anki": StubBehaviour(rate_limit="0.5/1")}
+        with running_stubs(behaviours) as servers:
+            url = server_url(servers["anki"])
+            body = json.dumps({"action": "version", "version": 6}).encode()
+            urllib.request.urlopen(urllib.request.Request(url, data=body)).read()
+            with pytest.raises(urllib.error.HTTPError) as err:
+                urllib.request.urlopen(urllib.request.Request(url, data=body))
+
+        assert err.value.code == 429
+        assert err.value.headers["Retry-After"] == "2"
+
+    def test_error_rate(self):
+        """Test that injected failures use the dependency's error status."""
+        behaviours = {"voicevox": StubBehaviour(error_rate=1.0)}
+        with running_stubs(behaviours) as servers:
+            response = httpx.post(
+                f"{server_url(servers['voicevox'])}/audio_query", params={"text": "あ", "speaker": 0}
+            )
+
+        assert response.status_code == 503
+        assert behaviours["voicevox"].failures == 1
+
+
+class TestBehaviour:
+    """Tests for latency specs and the token bucket."""
+
+    def test_latency_specs(self):
+        """Test parsing of fixed, uniform and lognormal latency specs."""
+        import random
+
+        rng = random.Random(1)
+        assert Latency("fixed:20").sample(rng) == 0.02
+        assert 0.01 <= Latency("uniform:10-30").sample(rng) <= 0.03
+        assert Latency("lognormal:100,0.5").sample(rng) > 0
+        with pytest.raises(ValueError):
+            Latency("gamma:1")
+
+    def test_token_bucket(self):
+        """Test that the bucket allows a burst and then asks callers to wait."""
+        limiter = RateLimiter.parse("10/2")
+
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == 0
+        assert limiter.acquire() > 0
+
+
+class TestDriver:
+    """Tests for the load driver's reporting."""
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        samples = [i / 100 for i in range(1, 101)]
+
+        assert percentile(samples, 50) == 0.5
+        assert percentile(samples, 99) == 0.99
+        assert percentile([], 50) is None
+
+    def test_report(self):
+        """Test per-endpoint throughput, failures and status counts."""
+        stats = Stats()
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            stats.record("generate", latency, 200)
+        stats.record("generate", 1.0, 429)
+
+        row = stats.report(elapsed=2.0)["endpoints"]["generate"]
+
+        assert row["requests"] == 5
+        assert row["failed"] == 1
+        assert row["throughput"] == 2.5
+        assert row["p50_ms"] == pytest.approx(300)
+        assert row["statuses"] == {"200": 4, "429": 1}
+
+    def test_parse_mix(self):
+        """Test that the mix spec is validated."""
+        assert parse_mix("generate=3,extract-text") == {"generate": 3.0, "extract-text": 1.0}
+        with pytest.raises(ValueError):
+            parse_mix("bogus=1")
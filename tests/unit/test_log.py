@@ -0,0 +1,47 @@
+"""Unit tests for structured logging."""
+
+import io
+import json
+import logging
+
+from kioku import tracing
+from kioku.log import JsonFormatter, configure_logging
+
+
+class TestJsonLogging:
+    """Tests for the JSON log format."""
+
+    def test_record_carries_trace_ids_and_fields(self):
+        """Test that log lines are JSON with the current trace and extra fields."""
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        log = logging.getLogger("kioku.test_log")
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        try:
+            with tracing.start_trace() as trace:
+                with tracing.span("stage") as current:
+                    log.info("converted %d bytes", 10, extra={"fields": {"wav_bytes": 10}})
+        finally:
+            log.removeHandler(handler)
+
+        entry = json.loads(stream.getvalue())
+        assert entry["message"] == "converted 10 bytes"
+        assert entry["level"] == "info"
+        assert entry["trace_id"] == trace.trace_id
+        assert entry["span_id"] == current.span_id
+        assert entry["wav_bytes"] == 10
+
+    def test_configure_logging_is_idempotent(self, monkeypatch):
+        """Test that configuring twice installs a single JSON handler."""
+        root = logging.getLogger("kioku")
+        monkeypatch.setattr(root, "handlers", [])
+        monkeypatch.setattr(root, "propagate", True)
+        monkeypatch.setenv("LOG_LEVEL", "warning")
+
+        configure_logging()
+        configure_logging()
+
+        assert len(root.handlers) == 1
+        assert root.level == logging.WARNING
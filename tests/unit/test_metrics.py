@@ -0,0 +1,86 @@
+"""Unit tests for the metrics module."""
+
+import pytest
+
+from kioku import metrics
+
+
+class TestCounters:
+    """Tests for counter recording and rendering."""
+
+    def test_inc_accumulates(self):
+        """Test that increments add up per label set."""
+        metrics.inc("kioku_test_total")
+        metrics.inc("kioku_test_total", 2)
+        metrics.inc("kioku_test_total", stage="tts")
+
+        assert metrics.counter_value("kioku_test_total") == 3
+        assert metrics.counter_value("kioku_test_total", stage="tts") == 1
+
+    def test_counter_value_unknown(self):
+        """Test that an unknown counter reads as zero."""
+        assert metrics.counter_value("kioku_missing_total") == 0
+
+    def test_render_prometheus_text(self):
+        """Test rendering in the Prometheus text format."""
+        metrics.describe("kioku_test_total", "A test counter.")
+        metrics.inc("kioku_test_total", 5, stage='say "hi"')
+
+        text = metrics.render()
+
+        assert "# HELP kioku_test_total A test counter." in text
+        assert "# TYPE kioku_test_total counter" in text
+        assert 'kioku_test_total{stage="say \\"hi\\""} 5' in text
+
+
+class TestGaugesAndHistograms:
+    """Tests for gauges, histograms and stage tracking."""
+
+    def test_gauges(self):
+        """Test that gauges can be set and moved."""
+        metrics.set_gauge("kioku_test_depth", 4)
+        metrics.add_gauge("kioku_test_depth", -1)
+
+        assert metrics.gauge_value("kioku_test_depth") == 3
+        assert "# TYPE kioku_test_depth gauge" in metrics.render()
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that histogram buckets, sum and count are rendered."""
+        metrics.observe("kioku_test_seconds", 0.003, stage="ocr")
+        metrics.observe("kioku_test_seconds", 0.3, stage="ocr")
+        metrics.observe("kioku_test_seconds", 120, stage="ocr")
+
+        text = metrics.render()
+
+        assert "# TYPE kioku_test_seconds histogram" in text
+        assert 'kioku_test_seconds_bucket{stage="ocr",le="0.005"} 1' in text
+        assert 'kioku_test_seconds_bucket{stage="ocr",le="0.5"} 2' in text
+        assert 'kioku_test_seconds_bucket{stage="ocr",le="60"} 2' in text
+        assert 'kioku_test_seconds_bucket{stage="ocr",le="+Inf"} 3' in text
+        assert 'kioku_test_seconds_count{stage="ocr"} 3' in text
+        assert metrics.histogram_count("kioku_test_seconds", stage="ocr") == 3
+
+    def test_track_records_latency_and_errors(self):
+        """Test that track times the block, counts it in flight and counts errors."""
+        with metrics.track("groq"):
+            assert metrics.gauge_value("kioku_stage_in_flight", stage="groq") == 1
+
+        with pytest.raises(ValueError):
+            with metrics.track("groq"):
+                raise ValueError("boom")
+
+        assert metrics.gauge_value("kioku_stage_in_flight", stage="groq") == 0
+        assert metrics.histogram_count("kioku_stage_duration_seconds", stage="groq") == 2
+        assert metrics.counter_value("kioku_stage_errors_total", stage="groq", error="ValueError") == 1
+
+    def test_cache_hit_ratio(self):
+        """Test that the hit ratio is derived from the lookup counters."""
+        metrics.record_cache("anki_media", True)
+        metrics.record_cache("anki_media", True)
+        metrics.record_cache("anki_media", True)
+        metrics.record_cache("anki_media", False)
+
+        text = metrics.render()
+
+        assert 'kioku_cache_requests_total{cache="anki_media",result="hit"} 3' in text
+        assert 'kioku_cache_hit_ratio{cache="anki_media"} 0.75' in text
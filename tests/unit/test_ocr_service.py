@@ -0,0 +1,87 @@
+"""Unit tests for the shared OCR process protocol."""
+
+import threading
+
+import pytest
+
+from kioku.services import image_processor
+from kioku.services.ocr_service import OcrClient, OcrServer
+
+
+@pytest.fixture
+def ocr_server(tmp_path):
+    """OCR server on a temporary socket that 'reads' UTF-8 image bytes."""
+    calls = []
+
+    def recognize(image_bytes):
+        calls.append(image_bytes)
+        if image_bytes == b"broken":
+            raise ValueError("cannot identify image file")
+        return image_bytes.decode("utf-8")
+
+    server = OcrServer(tmp_path / "ocr.sock", recognize)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, calls
+    server.shutdown()
+    server.server_close()
+
+
+class TestOcrService:
+    """Tests for OcrServer and OcrClient."""
+
+    def test_round_trip(self, ocr_server):
+        """Test that the client gets the server's OCR text back."""
+        server, calls = ocr_server
+
+        text = OcrClient(server.server_address).recognize("こんにちは".encode())
+
+        assert text == "こんにちは"
+        assert calls == ["こんにちは".encode()]
+
+    def test_large_image(self, ocr_server):
+        """Test that multi-megabyte frames arrive intact."""
+        server, calls = ocr_server
+        image = b"a" * (5 * 1024 * 1024)
+
+        assert len(OcrClient(server.server_address).recognize(image)) == len(image)
+
+    def test_error_is_raised_in_client(self, ocr_server):
+        """Test that a failed inference becomes a RuntimeError in the worker."""
+        server, _ = ocr_server
+
+        with pytest.raises(RuntimeError, match="cannot identify image file"):
+            OcrClient(server.server_address).recognize(b"broken")
+
+    def test_unavailable_process(self, tmp_path):
+        """Test that a missing OCR process is reported, not hung on."""
+        with pytest.raises(RuntimeError, match="unavailable"):
+            OcrClient(tmp_path / "missing.sock", timeout=1).recognize(b"x")
+
+    def test_concurrent_clients(self, ocr_server):
+        """Test that requests from several workers are all answered."""
+        server, _ = ocr_server
+        results = {}
+
+        def send(n):
+            results[n] = OcrClient(server.server_address).recognize(f"文{n}".encode())
+
+        threads = [threading.Thread(target=send, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == {n: f"文{n}" for n in range(8)}
+
+    def test_ocr_image_uses_socket(self, ocr_server, monkeypatch):
+        """Test that OCR_SOCKET sends images to the shared process, not a local model."""
+        server, _ = ocr_server
+        monkeypatch.setenv("OCR_SOCKET", str(server.server_address))
+
+        def no_local_model():
+            raise AssertionError("worker loaded the OCR model")
+
+        monkeypatch.setattr(image_processor, "load_ocr_model", no_local_model)
+
+        assert image_processor.ocr_image("日本語".encode()) == "日本語"
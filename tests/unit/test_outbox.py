@@ -0,0 +1,165 @@
+"""Unit tests for the Anki outbox."""
+
+import sqlite3
+import time
+
+import pytest
+
+from kioku.services.outbox import Outbox, OutboxDrainer, backoff_delay, drain
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    """Outbox backed by a temporary SQLite file."""
+    return Outbox(tmp_path / "outbox.sqlite3")
+
+
+class TestOutbox:
+    """Tests for Outbox storage."""
+
+    def test_enqueue_and_load(self, outbox, sample_cards):
+        """Test that notes and audio round-trip through SQLite."""
+        entry_id = outbox.enqueue(sample_cards, {"word_a.wav": b"abc"}, "Mining")
+
+        cards, audio_map, deck_name = outbox.load(entry_id)
+
+        assert cards == sample_cards
+        assert audio_map == {"word_a.wav": b"abc"}
+        assert deck_name == "Mining"
+        assert outbox.depth() == 1
+
+    def test_entries_summary(self, outbox, sample_cards):
+        """Test that entry summaries report card counts and attempts."""
+        outbox.enqueue(sample_cards, {}, "Mining")
+
+        [entry] = outbox.entries()
+
+        assert entry["cards"] == 2
+        assert entry["attempts"] == 0
+        assert entry["last_error"] is None
+
+    def test_record_failure_backs_off(self, outbox, sample_cards):
+        """Test that a failure pushes the entry into the future."""
+        entry_id = outbox.enqueue(sample_cards, {}, "Mining")
+
+        outbox.record_failure(entry_id, "boom")
+
+        assert outbox.due(10) == []
+        [entry] = outbox.entries()
+        assert entry["attempts"] == 1
+        assert entry["last_error"] == "boom"
+        assert entry["next_attempt_at"] > time.time()
+
+    def test_retry_makes_entry_due(self, outbox, sample_cards):
+        """Test that retry clears the backoff."""
+        entry_id = outbox.enqueue(sample_cards, {}, "Mining")
+        outbox.record_failure(entry_id, "boom")
+
+        assert outbox.retry(entry_id) == 1
+        assert outbox.due(10) == [entry_id]
+        assert outbox.retry(9999) == 0
+
+    def test_rejected_entry_dies_after_max_attempts(self, outbox, sample_cards, monkeypatch):
+        """Test that repeated rejections mark an entry dead, while unreachable Anki does not."""
+        monkeypatch.setenv("OUTBOX_MAX_ATTEMPTS", "2")
+        entry_id = outbox.enqueue(sample_cards, {"word_a.wav": b"abc"}, "Mining")
+
+        assert outbox.record_failure(entry_id, "unreachable") is False
+        assert outbox.record_failure(entry_id, "model was not found", rejected=True) is False
+        assert outbox.record_failure(entry_id, "model was not found", rejected=True) is True
+
+        [entry] = outbox.entries()
+        assert (entry["status"], entry["attempts"], entry["failures"]) == ("dead", 3, 2)
+        assert outbox.depth() == 0
+        assert outbox.due(10, now=time.time() + 3600) == []
+        # Flushing leaves it alone; retrying it by id revives it
+        assert outbox.retry() == 0
+        assert outbox.retry(entry_id) == 1
+        assert outbox.due(10) == [entry_id]
+        assert outbox.entries()[0]["failures"] == 0
+
+    def test_old_outbox_gains_status_columns(self, tmp_path, sample_cards):
+        """Test that an outbox created before dead-lettering is upgraded in place."""
+        path = tmp_path / "old.sqlite3"
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "CREATE TABLE entries (id INTEGER PRIMARY KEY AUTOINCREMENT, deck_name TEXT NOT NULL,"
+            " cards TEXT NOT NULL, created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL, last_error TEXT);"
+            "INSERT INTO entries (deck_name, cards, created_at, next_attempt_at)"
+            " VALUES ('Mining', '[]', 0, 0);"
+        )
+        conn.commit()
+        conn.close()
+
+        [entry] = Outbox(path).entries()
+
+        assert (entry["status"], entry["failures"]) == ("pending", 0)
+
+    def test_backoff_is_exponential_and_capped(self):
+        """Test the backoff schedule."""
+        assert backoff_delay(1) == 5
+        assert backoff_delay(2) == 10
+        assert backoff_delay(3) == 20
+        assert backoff_delay(50) == 600
+
+
+class TestDrain:
+    """Tests for draining the outbox into AnkiConnect."""
+
+    def test_drain_delivers_entries(self, outbox, sample_cards, mock_anki_connect):
+        """Test that due entries are added to Anki and removed."""
+        outbox.enqueue(sample_cards, {"word_a.wav": b"abc"}, "Mining")
+
+        result = drain(outbox)
+
+        assert result["added"] == 2
+        assert result["entries"] == 1
+        assert outbox.depth() == 0
+
+    def test_drain_keeps_entries_when_anki_unreachable(self, outbox, sample_cards, anki_unreachable):
+        """Test that unreachable Anki leaves entries queued with backoff."""
+        outbox.enqueue(sample_cards, {}, "Mining")
+        outbox.enqueue(sample_cards, {}, "Mining")
+
+        result = drain(outbox)
+
+        assert result["failed"] == 1
+        assert outbox.depth() == 2
+        assert [e["attempts"] for e in outbox.entries()] == [1, 0]
+
+    def test_drain_skips_notes_already_in_anki(self, outbox, sample_cards, mock_anki_connect):
+        """Test that notes Anki already has are dropped while draining."""
+        mock_anki_connect["canAddNotes"] = lambda params: [False] * len(params["notes"])
+        outbox.enqueue(sample_cards, {}, "Mining")
+
+        result = drain(outbox)
+
+        assert result == {"entries": 1, "added": 0, "skipped": 2, "failed": 0, "dead": 0}
+        assert outbox.depth() == 0
+
+    def test_drain_marks_rejected_entries_dead(
+        self, outbox, sample_cards, mock_anki_connect, monkeypatch
+    ):
+        """Test that an entry Anki keeps refusing stops being retried."""
+        monkeypatch.setenv("OUTBOX_MAX_ATTEMPTS", "1")
+        mock_anki_connect["canAddNotes"] = lambda params: None
+        outbox.enqueue(sample_cards, {}, "Mining")
+
+        result = drain(outbox)
+
+        assert (result["failed"], result["dead"]) == (1, 1)
+        assert outbox.entries()[0]["status"] == "dead"
+
+    @pytest.mark.asyncio
+    async def test_drainer_notifies_on_added(self, outbox, sample_cards, mock_anki_connect):
+        """Test that the drainer calls back after delivering notes."""
+        calls = []
+        drainer = OutboxDrainer(outbox, on_added=lambda: calls.append(1))
+        outbox.enqueue(sample_cards, {}, "Mining")
+
+        result = await drainer.drain_now()
+
+        assert result["added"] == 2
+        assert calls == [1]
+        assert drainer.last_result == result
@@ -0,0 +1,103 @@
+"""Unit tests for reading pages out of archives, PDFs and directories."""
+
+import sys
+import zipfile
+
+import pytest
+
+from kioku.services.page_reader import iter_pages, page_names
+
+
+def _cbz(path, entries: dict[str, bytes]):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return path
+
+
+class TestArchives:
+    """Tests for ZIP/CBZ volumes."""
+
+    def test_pages_in_natural_order(self, tmp_path):
+        """Test that page10 follows page9 and non-page entries are left out."""
+        path = _cbz(
+            tmp_path / "vol01.cbz",
+            {
+                "vol01/page10.png": b"ten",
+                "vol01/page2.png": b"two",
+                "vol01/page9.jpg": b"nine",
+                "vol01/ComicInfo.xml": b"<xml/>",
+                "__MACOSX/vol01/._page2.png": b"fork",
+                "vol01/.thumbs/page2.png": b"hidden",
+            },
+        )
+
+        assert page_names(path) == ["vol01/page2.png", "vol01/page9.jpg", "vol01/page10.png"]
+        assert [(page.index, page.data) for page in iter_pages(path)] == [
+            (0, b"two"),
+            (1, b"nine"),
+            (2, b"ten"),
+        ]
+
+    def test_skipped_pages_keep_numbering(self, tmp_path):
+        """Test that skipped pages are yielded without being read."""
+        path = _cbz(tmp_path / "vol.zip", {f"{i}.png": f"p{i}".encode() for i in range(3)})
+
+        pages = list(iter_pages(path, skip=lambda index: index == 1))
+
+        assert [(page.index, page.data) for page in pages] == [(0, b"p0"), (1, None), (2, b"p2")]
+
+    def test_entries_read_lazily(self, tmp_path, monkeypatch):
+        """Test that an entry is decompressed only when its page is reached."""
+        path = _cbz(tmp_path / "vol.cbz", {f"{i}.png": b"x" for i in range(5)})
+        reads = []
+        original = zipfile.ZipFile.read
+        monkeypatch.setattr(
+            zipfile.ZipFile,
+            "read",
+            lambda self, name, pwd=None: reads.append(name) or original(self, name, pwd),
+        )
+
+        pages = iter_pages(path)
+        next(pages)
+
+        assert len(reads) == 1
+
+    def test_not_an_archive(self, tmp_path):
+        """Test that a broken archive is a ValueError."""
+        path = tmp_path / "broken.cbz"
+        path.write_bytes(b"not a zip")
+
+        with pytest.raises(ValueError):
+            page_names(path)
+
+
+class TestOtherSources:
+    """Tests for directories, single images and PDFs."""
+
+    def test_directory_of_images(self, tmp_path):
+        """Test that a directory yields its images recursively in natural order."""
+        (tmp_path / "ch2").mkdir()
+        (tmp_path / "ch2" / "1.png").write_bytes(b"c2p1")
+        (tmp_path / "ch1-10.png").write_bytes(b"c1p10")
+        (tmp_path / "ch1-2.png").write_bytes(b"c1p2")
+        (tmp_path / "notes.txt").write_text("skip")
+
+        assert [page.data for page in iter_pages(tmp_path)] == [b"c1p2", b"c1p10", b"c2p1"]
+
+    def test_pdf_needs_pypdfium2(self, tmp_path, monkeypatch):
+        """Test that PDFs explain the missing optional dependency."""
+        path = tmp_path / "vol.pdf"
+        path.write_bytes(b"%PDF-1.4")
+        monkeypatch.setitem(sys.modules, "pypdfium2", None)
+
+        with pytest.raises(RuntimeError, match="pypdfium2"):
+            page_names(path)
+
+    def test_unknown_file(self, tmp_path):
+        """Test that other files are rejected."""
+        path = tmp_path / "notes.txt"
+        path.write_text("hello")
+
+        with pytest.raises(ValueError):
+            list(iter_pages(path))
@@ -0,0 +1,295 @@
+"""Unit tests for the shared card pipeline."""
+
+import asyncio
+import io
+import sys
+import threading
+
+import pytest
+
+from kioku.models import GenerateRequest
+from kioku.pipeline import (
+    StageTimings,
+    build_audio_map,
+    run_capture,
+    run_generate,
+    webm_to_wav,
+)
+from kioku.utils import audio_filename
+
+
+# Stands in for the ffmpeg binary so the piping can be tested without it
+CAT = [sys.executable, "-c", "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)"]
+
+
+class TestWebmToWav:
+    """Tests for webm_to_wav."""
+
+    def test_streams_file_objects(self, monkeypatch):
+        """Test that a file object is piped through the transcoder in chunks."""
+        monkeypatch.setattr("kioku.pipeline.FFMPEG_TO_WAV", CAT)
+        monkeypatch.setattr("kioku.pipeline.FFMPEG_CHUNK_SIZE", 1024)
+        data = bytes(range(256)) * 1000
+
+        assert webm_to_wav(io.BytesIO(data)) == data
+
+    def test_stream_failure_raises(self, monkeypatch):
+        """Test that a failing transcoder surfaces its stderr."""
+        monkeypatch.setattr(
+            "kioku.pipeline.FFMPEG_TO_WAV",
+            [sys.executable, "-c", "import sys; sys.stderr.write('bad input'); sys.exit(1)"],
+        )
+
+        with pytest.raises(RuntimeError, match="bad input"):
+            webm_to_wav(io.BytesIO(b"x" * 500_000))
+
+
+class TestBuildAudioMap:
+    """Tests for build_audio_map."""
+
+    @pytest.mark.asyncio
+    async def test_each_text_synthesized_once(self, sample_cards, monkeypatch):
+        """Test that shared texts are only sent to TTS once and progress is reported."""
+        spoken = []
+        progress = []
+
+        async def fake_generate_audio(text):
+            spoken.append(text)
+            return text.encode()
+
+        monkeypatch.setattr("kioku.pipeline.generate_audio", fake_generate_audio)
+        cards = sample_cards + [sample_cards[0]]
+
+        audio_map = await build_audio_map(cards, progress=lambda *p: progress.append(p))
+
+        assert len(spoken) == len(set(spoken)) == 4
+        assert audio_map[audio_filename("元気", "word")] == "元気".encode()
+        assert progress[-1] == ("tts", 4, 4)
+
+    @pytest.mark.asyncio
+    async def test_audio_past_the_budget_is_spilled(self, sample_cards, monkeypatch):
+        """Test that audio beyond AUDIO_MEMORY_BYTES is kept on disk, not in memory."""
+        monkeypatch.setenv("AUDIO_MEMORY_BYTES", "10")
+
+        async def fake_audio(text):
+            return b"RIFF" + text.encode("utf-8")
+
+        monkeypatch.setattr("kioku.pipeline.generate_audio", fake_audio)
+
+        with await build_audio_map(sample_cards) as audio_map:
+            assert audio_map.memory_bytes <= 10 and audio_map.spilled_bytes > 0
+            word = audio_filename(sample_cards[1].japanese, "word")
+            assert audio_map[word] == "RIFF元気".encode("utf-8")
+
+    @pytest.mark.asyncio
+    async def test_captured_audio_replaces_sentence_tts(self, sample_cards, monkeypatch):
+        """Test that captured audio is used for every example sentence."""
+        spoken = []
+
+        async def fake_generate_audio(text):
+            spoken.append(text)
+            return b"tts"
+
+        monkeypatch.setattr("kioku.pipeline.generate_audio", fake_generate_audio)
+
+        audio_map = await build_audio_map(sample_cards, captured_sentence_audio=b"captured")
+
+        assert sorted(spoken) == sorted(["こんにちは", "元気"])
+        assert audio_map[audio_filename("元気です。", "sentence")] == b"captured"
+
+    @pytest.mark.asyncio
+    async def test_sentence_clips_replace_tts(self, sample_cards, monkeypatch):
+        """Test that clipped audio is used for the sentences it covers and TTS for the rest."""
+        spoken = []
+
+        async def fake_generate_audio(text):
+            spoken.append(text)
+            return b"tts"
+
+        monkeypatch.setattr("kioku.pipeline.generate_audio", fake_generate_audio)
+        clipped = sample_cards[0].example_sentence
+
+        audio_map = await build_audio_map(sample_cards, sentence_clips={clipped: b"clip"})
+
+        assert audio_map[audio_filename(clipped, "sentence")] == b"clip"
+        assert clipped not in spoken
+        assert sample_cards[1].example_sentence in spoken
+
+
+class TestRunGenerate:
+    """Tests for run_generate."""
+
+    @pytest.mark.asyncio
+    async def test_reports_stage_progress(self, sample_cards, mock_voicevox, mock_anki_connect, monkeypatch):
+        """Test that every stage reports progress."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+        stages = []
+
+        result = await run_generate(
+            GenerateRequest(cards=sample_cards), lambda stage, done, total: stages.append(stage)
+        )
+
+        assert result == {"added": 2, "queued": 0, "skipped": []}
+        assert {"dedupe", "tts", "anki"} <= set(stages)
+
+    @pytest.mark.asyncio
+    async def test_known_words_skipped(self, sample_cards, mock_voicevox, monkeypatch):
+        """Test that cards for known words are skipped before Anki or VOICEVOX see them."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+        monkeypatch.setattr(
+            "kioku.pipeline.vocab_index.prune",
+            lambda cards: ([card for card in cards if card.japanese != "元気"], [cards[1]]),
+        )
+        checked = []
+        monkeypatch.setattr(
+            "kioku.pipeline.find_new_cards", lambda cards, deck: checked.extend(cards) or (cards, [])
+        )
+        monkeypatch.setattr("kioku.pipeline.add_cards", lambda cards, audio_map, deck: len(cards))
+
+        result = await run_generate(GenerateRequest(cards=sample_cards))
+
+        assert result == {"added": 1, "queued": 0, "skipped": ["元気"]}
+        assert [card.japanese for card in checked] == ["こんにちは"]
+
+    @pytest.mark.asyncio
+    async def test_uploaded_audio_used_for_sentences(self, sample_cards, mock_voicevox, monkeypatch):
+        """Test that a raw audio upload is transcoded and stored as sentence audio."""
+        monkeypatch.setattr("kioku.pipeline.FFMPEG_TO_WAV", CAT)
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+        monkeypatch.setattr("kioku.pipeline.find_new_cards", lambda cards, deck: (cards, []))
+        stored = {}
+        monkeypatch.setattr(
+            "kioku.pipeline.add_cards", lambda cards, audio_map, deck: stored.update(audio_map) or len(cards)
+        )
+
+        result = await run_generate(
+            GenerateRequest(cards=sample_cards), sentence_audio=io.BytesIO(b"captured")
+        )
+
+        assert result["added"] == 2
+        assert stored[audio_filename(sample_cards[0].example_sentence, "sentence")] == b"captured"
+
+    @pytest.mark.asyncio
+    async def test_cancel_waits_for_anki_write(self, sample_cards, mock_voicevox, monkeypatch):
+        """Test that a cancel during the Anki stage keeps the audio until the write returns."""
+        monkeypatch.setattr("kioku.pipeline.find_new_cards", lambda cards, deck: (cards, []))
+        writing = threading.Event()
+        release = threading.Event()
+        uploaded = []
+
+        def slow_add(cards, audio_map, deck):
+            writing.set()
+            release.wait(2)
+            uploaded.extend(audio_map[name] for name in audio_map)
+            return len(cards)
+
+        monkeypatch.setattr("kioku.pipeline.add_cards", slow_add)
+        task = asyncio.create_task(run_generate(GenerateRequest(cards=sample_cards)))
+        await asyncio.to_thread(writing.wait, 2)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert len(uploaded) == 4 and all(uploaded)
+
+
+class TestStageTimings:
+    """Tests for StageTimings."""
+
+    @pytest.mark.asyncio
+    async def test_overlapping_calls(self):
+        """Test that concurrent calls accumulate busy time but share one window."""
+        timings = StageTimings()
+
+        async def work():
+            async with timings.stage("tts"):
+                await asyncio.sleep(0.05)
+
+        await asyncio.gather(work(), work())
+        report = timings.report()
+
+        assert report["stages"]["tts"]["calls"] == 2
+        assert report["stages"]["tts"]["busy"] >= 0.09
+        assert report["stages"]["tts"]["end"] - report["stages"]["tts"]["start"] < 0.09
+
+
+class TestRunCapture:
+    """Tests for the one-shot capture pipeline."""
+
+    @pytest.mark.asyncio
+    async def test_capture_from_text(self, mock_groq_client, mock_voicevox, mock_anki_connect, monkeypatch):
+        """Test that text is enriched, voiced and added with stage timings."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+
+        result = await run_capture(text="こんにちは", deck_name="TestDeck")
+
+        assert result["added"] == 1
+        assert {"enrich", "dedupe", "tts", "anki"} <= set(result["timings"]["stages"])
+        assert "ocr" not in result["timings"]["stages"]
+
+    @pytest.mark.asyncio
+    async def test_capture_from_image(self, sample_image_bytes, mock_manga_ocr, mock_groq_client, mock_voicevox, mock_anki_connect, monkeypatch):
+        """Test that images go through OCR first."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+
+        result = await run_capture(image_bytes=sample_image_bytes)
+
+        assert result["added"] == 1
+        assert "ocr" in result["timings"]["stages"]
+        mock_manga_ocr.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_capture_batches_anki_writes(self, sample_cards, mock_voicevox, mock_anki_connect, monkeypatch):
+        """Test that cards ready together are added with one media listing, not one per card."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+        cards = sample_cards + [
+            card.model_copy(update={"japanese": card.japanese + "!"}) for card in sample_cards
+        ]
+        monkeypatch.setattr("kioku.services.image_processor.enrich_text", lambda text: cards)
+        listings = []
+        mock_anki_connect["getMediaFilesNames"] = lambda params: listings.append(1) or []
+
+        result = await run_capture(text="こんにちは")
+
+        assert result["added"] == 4
+        assert len(listings) < 4
+
+    @pytest.mark.asyncio
+    async def test_capture_skips_known_words(self, sample_cards, mock_voicevox, monkeypatch):
+        """Test that a capture drops cards for known words before asking Anki about them."""
+        monkeypatch.setattr("kioku.pipeline.sync_scheduler.request", lambda: None)
+        monkeypatch.setattr("kioku.services.image_processor.enrich_text", lambda text: sample_cards)
+        monkeypatch.setattr(
+            "kioku.pipeline.vocab_index.prune",
+            lambda cards: ([card for card in cards if card.japanese != "元気"], [cards[1]]),
+        )
+        checked = []
+        monkeypatch.setattr(
+            "kioku.pipeline.find_new_cards", lambda cards, deck: checked.extend(cards) or (cards, [])
+        )
+        monkeypatch.setattr("kioku.pipeline.add_cards", lambda cards, audio_map, deck: len(cards))
+
+        result = await run_capture(text="こんにちは")
+
+        assert (result["added"], result["skipped"]) == (1, ["元気"])
+        assert [card.japanese for card in checked] == ["こんにちは"]
+
+    @pytest.mark.asyncio
+    async def test_capture_queues_when_anki_unreachable(self, sample_cards, mock_voicevox, anki_unreachable, monkeypatch):
+        """Test that notes go to the outbox when Anki is closed."""
+        from kioku.services.outbox import outbox
+
+        monkeypatch.setattr("kioku.services.image_processor.enrich_text", lambda text: sample_cards)
+
+        result = await run_capture(text="こんにちは")
+
+        assert (result["added"], result["queued"]) == (0, 2)
+        assert sum(entry["cards"] for entry in outbox.entries()) == 2
+
+    @pytest.mark.asyncio
+    async def test_capture_requires_input(self):
+        """Test that a capture without text or image is rejected."""
+        with pytest.raises(ValueError, match="Provide either text or an image"):
+            await run_capture()
@@ -0,0 +1,140 @@
+"""Unit tests for the subtitle parsers."""
+
+import io
+import itertools
+
+from kioku.services.subtitle_parser import (
+    Cue,
+    clean_text,
+    detect_format,
+    merge_split_cues,
+    open_text,
+    parse_cues,
+)
+
+SRT = """1
+00:00:01,000 --> 00:00:02,500
+<i>今日は</i>、
+
+2
+00:00:02,800 --> 00:00:04,000
+いい天気ですね（笑）
+
+3
+00:00:05,000 --> 00:00:06,000
+♪～
+
+4
+00:00:07,000 --> 00:00:08,000
+-行こう
+-うん
+"""
+
+VTT = """WEBVTT
+
+NOTE translated by hand
+
+intro
+00:01.000 --> 00:02.250 align:start position:10%
+<v 田中><ruby>漢字<rt>かんじ</rt></ruby>を<c.yellow>書く</c>
+"""
+
+ASS = """[Script Info]
+Title: test
+
+[V4+ Styles]
+Format: Name, Fontname
+Style: Default,Arial
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Dialogue: 0,0:00:01.50,0:00:03.20,Default,,0,0,0,,{\\an8}そうだね、\\Nわかった
+Comment: 0,0:00:04.00,0:00:05.00,Default,,0,0,0,,これは読まない
+"""
+
+
+class TestParseCues:
+    """Tests for parse_cues."""
+
+    def test_srt(self):
+        """Test timings, tag and annotation stripping, and dash-split speakers."""
+        cues = list(parse_cues(io.StringIO(SRT), "srt"))
+
+        assert cues == [
+            Cue(1.0, 2.5, "今日は、"),
+            Cue(2.8, 4.0, "いい天気ですね"),
+            Cue(7.0, 8.0, "行こう"),
+            Cue(7.0, 8.0, "うん"),
+        ]
+
+    def test_vtt(self):
+        """Test short timestamps, cue ids, NOTE blocks, voice tags and ruby."""
+        assert list(parse_cues(io.StringIO(VTT), "vtt")) == [Cue(1.0, 2.25, "漢字を書く")]
+
+    def test_ass(self):
+        """Test the Format-driven Dialogue fields, override tags and \\N breaks."""
+        assert list(parse_cues(io.StringIO(ASS), "ass")) == [Cue(1.5, 3.2, "そうだね、わかった")]
+
+    def test_missing_blank_line(self):
+        """Test that a cue number run into the previous cue's text is dropped."""
+        text = "1\n00:00:01,000 --> 00:00:02,000\nはい\n2\n00:00:03,000 --> 00:00:04,000\nいいえ\n"
+
+        assert [cue.text for cue in parse_cues(io.StringIO(text))] == ["はい", "いいえ"]
+
+    def test_streams_lazily(self):
+        """Test that cues are yielded before the input is exhausted."""
+        block = "1\n00:00:01,000 --> 00:00:02,000\nこんにちは\n\n"
+        consumed = []
+
+        def lines():
+            for line in itertools.cycle(block.splitlines(keepends=True)):
+                consumed.append(line)
+                yield line
+
+        first = next(parse_cues(lines()))
+
+        assert first.text == "こんにちは"
+        assert len(consumed) <= 5
+
+
+class TestCleaning:
+    """Tests for clean_text and merge_split_cues."""
+
+    def test_clean_text(self):
+        """Test that markup, music marks and sound annotations are removed."""
+        assert clean_text("<b>♪ 走れ ♪</b>\n[ドアの音]") == ["走れ"]
+        assert clean_text("Hello\nworld") == ["Hello world"]
+
+    def test_merges_continued_sentences(self):
+        """Test that lines ending in a comma or ellipsis join the next cue."""
+        cues = [
+            Cue(1.0, 2.0, "明日は…"),
+            Cue(2.2, 3.0, "…雨かな"),
+            Cue(3.5, 4.0, "でも、"),
+            Cue(9.0, 10.0, "まあいいか"),
+        ]
+
+        assert list(merge_split_cues(cues)) == [
+            Cue(1.0, 3.0, "明日は雨かな"),
+            Cue(3.5, 4.0, "でも、"),
+            Cue(9.0, 10.0, "まあいいか"),
+        ]
+
+
+class TestFiles:
+    """Tests for format detection and decoding."""
+
+    def test_detect_format(self):
+        """Test the suffix first, then the header line."""
+        assert detect_format("ep01.ASS") == "ass"
+        assert detect_format("ep01.vtt") == "vtt"
+        assert detect_format("ep01.txt", "WEBVTT") == "vtt"
+        assert detect_format("ep01", "1") == "srt"
+
+    def test_open_shift_jis(self, tmp_path):
+        """Test that a Shift_JIS file is decoded as such."""
+        path = tmp_path / "sjis.srt"
+        path.write_bytes("1\n00:00:01,000 --> 00:00:02,000\n日本語です\n".encode("cp932"))
+
+        with open_text(path) as f:
+            assert [cue.text for cue in parse_cues(f)] == ["日本語です"]
@@ -0,0 +1,129 @@
+"""Unit tests for the background AnkiWeb sync scheduler."""
+
+import asyncio
+
+import pytest
+
+from kioku import admission
+from kioku.services.sync_scheduler import SyncScheduler
+
+
+@pytest.fixture
+def fast_sync_env(monkeypatch):
+    """Use short debounce windows so tests run quickly."""
+    monkeypatch.setenv("SYNC_DEBOUNCE", "0.05")
+    monkeypatch.setenv("SYNC_MIN_INTERVAL", "0")
+
+
+class TestSyncScheduler:
+    """Tests for SyncScheduler."""
+
+    @pytest.mark.asyncio
+    async def test_request_does_not_block(self, fast_sync_env):
+        """Test that request() returns before the sync runs."""
+        calls = []
+        scheduler = SyncScheduler(sync=lambda: calls.append(1))
+
+        scheduler.request()
+
+        assert calls == []
+        assert scheduler.status()["pending"] is True
+        await scheduler.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_overlapping_requests_merge(self, fast_sync_env):
+        """Test that a burst of requests results in a single sync."""
+        calls = []
+        scheduler = SyncScheduler(sync=lambda: calls.append(1))
+
+        for _ in range(5):
+            scheduler.request()
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+
+        assert len(calls) == 1
+        status = scheduler.status()
+        assert status["last_status"] == "ok"
+        assert status["pending"] is False
+        assert status["last_duration"] is not None
+
+    @pytest.mark.asyncio
+    async def test_min_interval_limits_rate(self, monkeypatch):
+        """Test that a request right after a sync waits for the minimum interval."""
+        monkeypatch.setenv("SYNC_DEBOUNCE", "0")
+        monkeypatch.setenv("SYNC_MIN_INTERVAL", "60")
+        calls = []
+        scheduler = SyncScheduler(sync=lambda: calls.append(1))
+
+        scheduler.request()
+        await asyncio.sleep(0.05)
+        scheduler.request()
+        await asyncio.sleep(0.05)
+
+        assert len(calls) == 1
+        assert scheduler.status()["pending"] is True
+        await scheduler.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_sync_failure_is_recorded(self, fast_sync_env):
+        """Test that a failing sync is reported in the status."""
+
+        def failing_sync():
+            raise RuntimeError("AnkiConnect error: sync failed")
+
+        scheduler = SyncScheduler(sync=failing_sync)
+        scheduler.request()
+        await asyncio.sleep(0.2)
+
+        status = scheduler.status()
+        assert status["last_status"] == "error"
+        assert "sync failed" in status["last_error"]
+        assert status["sync_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_sync_leaves_write_gate_free(self, fast_sync_env):
+        """Test that a running sync holds the anki_sync gate, not the anki_write one."""
+        seen = []
+
+        def sync():
+            seen.append((admission.gate("anki_write").active, admission.gate("anki_sync").active))
+            seen.append(admission.current_priority())
+
+        scheduler = SyncScheduler(sync=sync)
+        scheduler.request()
+        await asyncio.sleep(0.2)
+
+        assert seen == [(0, 1), admission.BULK]
+
+    @pytest.mark.asyncio
+    async def test_shutdown_runs_pending_sync(self, monkeypatch):
+        """Test that a sync still waiting out its debounce runs on shutdown."""
+        monkeypatch.setenv("SYNC_DEBOUNCE", "60")
+        calls = []
+        scheduler = SyncScheduler(sync=lambda: calls.append(1))
+
+        scheduler.request()
+        await asyncio.sleep(0.05)
+        await scheduler.shutdown()
+
+        assert calls == [1]
+        assert scheduler.status()["pending"] is False
+
+    @pytest.mark.asyncio
+    async def test_other_workers_hand_requests_to_primary(self, fast_sync_env, monkeypatch, tmp_path):
+        """Test that only the primary syncs, including for requests made on other workers."""
+        monkeypatch.setenv("SYNC_REQUEST_POLL_INTERVAL", "0.01")
+        calls = []
+        path = tmp_path / "sync.requested"
+        primary = SyncScheduler(sync=lambda: calls.append("primary"), request_path=path)
+        worker = SyncScheduler(sync=lambda: calls.append("worker"), request_path=path)
+        primary.start(primary=True)
+        worker.start(primary=False)
+
+        worker.request()
+        await asyncio.sleep(0.3)
+
+        assert calls == ["primary"]
+        assert not path.exists()
+        await worker.shutdown()
+        await primary.shutdown()
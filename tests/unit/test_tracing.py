@@ -0,0 +1,153 @@
+"""Unit tests for request tracing and the OTLP exporter."""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from kioku import tracing
+
+
+@pytest.fixture
+def otlp_collector():
+    """Local stand-in for an OTLP/HTTP collector that records each export."""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((self.path, self.headers["Content-Type"], json.loads(body)))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", received
+    server.shutdown()
+    server.server_close()
+
+
+class TestSpans:
+    """Tests for span nesting and Server-Timing."""
+
+    def test_nested_spans_share_trace(self):
+        """Test that child spans point at their parent within one trace."""
+        with tracing.start_trace() as trace:
+            with tracing.span("outer") as outer:
+                with tracing.span("inner") as inner:
+                    pass
+
+        assert inner.parent_id == outer.span_id
+        assert outer.parent_id is None
+        assert inner.trace_id == outer.trace_id == trace.trace_id
+        assert [s.name for s in trace.spans] == ["inner", "outer"]
+
+    def test_continues_traceparent(self):
+        """Test that a W3C traceparent header sets the trace and parent ids."""
+        header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+        with tracing.start_trace(header) as trace:
+            with tracing.span("handler") as handler:
+                pass
+
+        assert trace.trace_id == "0af7651916cd43dd8448eb211c80319c"
+        assert handler.parent_id == "b7ad6b7169203331"
+
+    def test_error_recorded(self):
+        """Test that an exception marks the span as failed."""
+        with tracing.start_trace() as trace:
+            with pytest.raises(ValueError):
+                with tracing.span("boom"):
+                    raise ValueError("bad")
+
+        assert trace.spans[0].error == "ValueError: bad"
+        assert trace.spans[0].to_dict()["status"] == "error"
+
+    def test_server_timing_sums_repeated_spans(self):
+        """Test that Server-Timing has one entry per span name."""
+        with tracing.start_trace() as trace:
+            for _ in range(3):
+                with tracing.span("anki.addNote"):
+                    pass
+            with tracing.span("enrich text"):
+                pass
+
+        header = trace.server_timing()
+
+        assert header.startswith("anki.addNote;dur=")
+        assert ';desc="x3"' in header
+        assert "enrich_text;dur=" in header
+
+    @pytest.mark.asyncio
+    async def test_traced_functions_and_threads(self):
+        """Test that traced sync functions run in threads nest under the caller."""
+
+        @tracing.traced("work")
+        def work():
+            return tracing.current_span_id()
+
+        @tracing.traced("request")
+        async def handle():
+            return await asyncio.to_thread(work)
+
+        with tracing.start_trace() as trace:
+            await handle()
+
+        work_span, request_span = trace.spans
+        assert work_span.name == "work"
+        assert work_span.parent_id == request_span.span_id
+
+
+class TestOtlpExporter:
+    """Tests for the OTLP/HTTP JSON exporter."""
+
+    def test_exports_spans_to_collector(self, otlp_collector, monkeypatch):
+        """Test that finished spans reach the collector on shutdown."""
+        endpoint, received = otlp_collector
+        monkeypatch.setenv("OTEL_EXPORTER_OTLP_ENDPOINT", endpoint)
+        monkeypatch.setenv("OTEL_EXPORT_INTERVAL", "60")
+        exporter = tracing.configure_exporter()
+        try:
+            with tracing.start_trace():
+                with tracing.span("generate_audio", chars=3):
+                    with tracing.span("anki.addNote"):
+                        pass
+        finally:
+            tracing.shutdown_exporter()
+
+        assert exporter.exported == 2
+        path, content_type, body = received[0]
+        assert path == "/v1/traces"
+        assert content_type == "application/json"
+        resource = body["resourceSpans"][0]
+        assert resource["resource"]["attributes"][0]["value"] == {"stringValue": "kioku"}
+        spans = {s["name"]: s for s in resource["scopeSpans"][0]["spans"]}
+        assert spans["anki.addNote"]["parentSpanId"] == spans["generate_audio"]["spanId"]
+        assert spans["generate_audio"]["attributes"] == [{"key": "chars", "value": {"intValue": "3"}}]
+        assert len(spans["generate_audio"]["traceId"]) == 32
+
+    def test_collector_down_counts_failures(self, monkeypatch):
+        """Test that an unreachable collector doesn't raise into the app."""
+        monkeypatch.setenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://127.0.0.1:9")
+        exporter = tracing.configure_exporter()
+        try:
+            with tracing.span("lonely"):
+                pass
+        finally:
+            tracing.shutdown_exporter()
+
+        assert exporter.failed == 1
+
+    def test_disabled_without_endpoint(self, monkeypatch):
+        """Test that no exporter starts unless an endpoint is configured."""
+        monkeypatch.delenv("OTEL_EXPORTER_OTLP_ENDPOINT", raising=False)
+
+        assert tracing.configure_exporter() is None
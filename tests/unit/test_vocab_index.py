@@ -0,0 +1,172 @@
+"""Unit tests for the known-vocabulary index."""
+
+import pytest
+
+from kioku.models import CardItem
+from kioku.services.vocab_index import (
+    CompactSet,
+    VocabIndex,
+    VocabSource,
+    configured_sources,
+    word_key,
+)
+
+SOURCE = VocabSource('"note:Japanese Vocab (ankiGen)"', "Japanese")
+
+
+class FakeAnki:
+    """AnkiConnect stand-in holding notes as ``{note_id: (mod, japanese)}``."""
+
+    def __init__(self, notes: dict[int, tuple[int, str]]):
+        self.notes = notes
+        self.edited: set[int] = set()
+        self.read: list[int] = []
+
+    def __call__(self, action, **params):
+        if action == "findNotes":
+            if "edited:" in params["query"]:
+                return sorted(self.edited & self.notes.keys())
+            return sorted(self.notes)
+        if action == "notesInfo":
+            self.read.extend(params["notes"])
+            return [
+                {
+                    "noteId": note_id,
+                    "mod": self.notes[note_id][0],
+                    "fields": {"Japanese": {"value": self.notes[note_id][1], "order": 0}},
+                }
+                for note_id in params["notes"]
+            ]
+        raise AssertionError(f"unexpected action {action}")
+
+
+@pytest.fixture
+def anki(monkeypatch):
+    fake = FakeAnki({1: (100, "元気"), 2: (100, "<b>日本語</b>"), 3: (100, "食[た]べる")})
+    monkeypatch.setattr("kioku.services.vocab_index._anki_request", fake)
+    return fake
+
+
+@pytest.fixture
+def index(tmp_path):
+    return VocabIndex(tmp_path / "vocab.sqlite3")
+
+
+def _card(japanese: str, sentence: str = "元気です。") -> CardItem:
+    return CardItem(
+        japanese=japanese,
+        reading="よみ",
+        meaning="meaning",
+        example_sentence=sentence,
+        example_translation="translation",
+    )
+
+
+class TestCompactSet:
+    """Tests for CompactSet."""
+
+    def test_membership(self):
+        """Test that members are found, others are not, and each costs eight bytes."""
+        words = CompactSet(["元気", "日本語", "元気", ""])
+
+        assert "元気" in words and "日本語" in words
+        assert "元" not in words
+        assert len(words) == 2 and words.nbytes == 16
+
+
+class TestWordKey:
+    """Tests for word_key."""
+
+    def test_strips_markup(self):
+        """Test that HTML, furigana, width and punctuation do not matter."""
+        assert word_key("<b>食[た]べる</b>") == word_key("食べる")
+        assert word_key("ＡＢＣ！") == word_key("ABC")
+
+
+class TestSync:
+    """Tests for incremental syncing."""
+
+    def test_first_sync_reads_everything(self, index, anki):
+        """Test that the first sync loads every note of the source."""
+        stats = index.sync([SOURCE])
+
+        assert stats == {"added": 3, "updated": 0, "removed": 0, "words": 3}
+        assert {"元気", "日本語", "食べる"} <= set(index.known_in("元気な日本語を食べる"))
+
+    def test_later_sync_reads_only_changes(self, index, anki):
+        """Test that only new and edited notes are read again, and deleted ones dropped."""
+        index.sync([SOURCE])
+        anki.read.clear()
+        anki.notes[1] = (200, "勉強")
+        anki.edited = {1, 2}  # 2 was touched but its mod is unchanged
+        del anki.notes[3]
+        anki.notes[4] = (200, "猫")
+
+        stats = index.sync([SOURCE])
+
+        assert sorted(anki.read) == [1, 2, 4]
+        assert stats == {"added": 1, "updated": 1, "removed": 1, "words": 3}
+        words = index.words()
+        assert "勉強" in words and "猫" in words
+        assert "元気" not in words and "食べる" not in words
+
+    def test_unchanged_sync_keeps_the_set(self, index, anki):
+        """Test that the in-memory set is only rebuilt when a sync changed something."""
+        index.sync([SOURCE])
+        before = index.words()
+
+        index.sync([SOURCE])
+
+        assert index.words() is before
+
+    def test_lookups_reuse_one_connection(self, index, anki, monkeypatch):
+        """Test that repeated lookups neither reconnect nor reload the set."""
+        index.sync([SOURCE])
+        before = index.words()
+        monkeypatch.setattr(index, "_connect", lambda **kwargs: pytest.fail("reconnected"))
+
+        assert index.words() is before
+
+    def test_sync_by_another_worker_is_seen(self, index, anki, tmp_path):
+        """Test that a sync written through another connection reloads the set."""
+        index.sync([SOURCE])
+        assert "猫" not in index.words()
+        anki.notes[4] = (200, "猫")
+
+        VocabIndex(tmp_path / "vocab.sqlite3").sync([SOURCE])
+
+        assert "猫" in index.words()
+
+
+class TestPrune:
+    """Tests for dropping cards of known words."""
+
+    def test_word_cards_dropped_sentences_kept(self, index, anki):
+        """Test that word cards for known words go and sentence cards stay."""
+        index.sync([SOURCE])
+        cards = [_card("元気"), _card("元気です。"), _card("勉強")]
+
+        kept, known = index.prune(cards)
+
+        assert [card.japanese for card in kept] == ["元気です。", "勉強"]
+        assert [card.japanese for card in known] == ["元気"]
+
+    def test_disabled(self, index, anki, monkeypatch):
+        """Test that KNOWN_VOCAB=false turns pruning and prompt hints off."""
+        index.sync([SOURCE])
+        monkeypatch.setenv("KNOWN_VOCAB", "false")
+
+        assert index.prune([_card("元気")]) == ([_card("元気")], [])
+        assert index.known_in("元気") == []
+
+
+def test_configured_sources(monkeypatch):
+    """Test that KNOWN_VOCAB_DECKS adds a deck query per entry, Japanese field by default."""
+    monkeypatch.setenv("KNOWN_VOCAB_DECKS", "Core 2k:Vocab; Mining ;")
+
+    sources = configured_sources()
+
+    assert sources[1:] == [
+        VocabSource('"deck:Core 2k"', "Vocab"),
+        VocabSource('"deck:Mining"', "Japanese"),
+    ]